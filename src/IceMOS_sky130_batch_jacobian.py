@@ -0,0 +1,254 @@
+"""
+IceMOS_sky130_batch_jacobian.py
+
+This module computes the finite-difference Jacobian of a fit in a single ngspice launch.
+
+A forward-difference Jacobian over N parameters needs N + 1 simulations; run one by one, each
+of them pays the ngspice start-up and the parse of the PDK corner files. BatchedJacobian instead
+rewrites the sweep netlist of the SimulatorModel so that it holds N + 1 copies of the device:
+the first uses the model card at the current point, copy j a card where parameter j is stepped.
+Every copy gets its own drain node and measurement source, and the wrdata lines write all the
+measured currents side by side, so one run of the sweep gives the curves of every perturbation.
+
+The copies share the (ideal) gate, source and bulk supplies, so they do not disturb each other.
+Their model cards are written into one '_jacobian.lib' file, copy j's model being renamed
+'<model>_jacobian<j>.<bin>'.
+
+Steps are relative to the parameter scale: h_j = rel_step * max(|x_j|, min_scale * (max_j - min_j)),
+taken inwards at the upper bound.
+
+    model = SimulatorModel(original_model_file, "nch", 40, lib_file_path, "iv", sweep)
+    residuals = CurveResiduals(targets)
+    jacobian = BatchedJacobian(model, residuals, names)
+    result = fit_parameters(model, residuals, parameters, names=names, jacobian=jacobian)
+    print(jacobian.launches, "ngspice launches for", result.njev, "Jacobians")
+"""
+
+import os
+import re
+
+import numpy as np
+
+from IceMOS_sky130_param_handler import write_model_cards
+
+
+def batch_netlist(netlist_text, copies, card_file, tag="jacobian"):
+    """
+    Rewrite a generated sweep netlist so that it also simulates `copies` copies of its device.
+
+    Copy k (1..copies) of the device uses the model '<model>_<tag><k>' (the bin suffix is kept),
+    drain node '<drain>_<tag><k>' and measurement source '<source>_<tag><k>'. The wrdata lines
+    write the measured current of every device (base device first) to '<file>_<tag>.csv', and the
+    raw file writes are dropped.
+
+    :param netlist_text: Text of a netlist generated by NetlistGeneratorSky130.
+    :param copies: Number of device copies to add.
+    :param card_file: Model card file name the netlist includes instead of its own.
+    :param tag: Suffix of the copy names and output files.
+    :return: Tuple (netlist text, list of the measured source names, list of the model names),
+             the base device first.
+    :raises ValueError: If the device or its measurement source cannot be found.
+    """
+    lines = netlist_text.splitlines()
+    device = None
+    for i, line in enumerate(lines):
+        if line[:1] in ("M", "m"):
+            device = i
+            break
+    if device is None:
+        raise ValueError("No MOSFET instance in the netlist.")
+    block = device + 1
+    while block < len(lines) and lines[block].lstrip().startswith("+"):
+        block += 1
+    m = re.match(r"(\S+)(\s+)(\S+)(\s+\S+\s+\S+\s+\S+\s+)(\S+)(.*)$", lines[device])
+    if m is None:
+        raise ValueError(f"Cannot parse the MOSFET instance '{lines[device]}'.")
+    name, drain, model = m.group(1), m.group(3), m.group(5)
+    m_bin = re.match(r"(.+)(\.\d+)$", model)
+    prefix, suffix = (m_bin.group(1), m_bin.group(2)) if m_bin else (model, "")
+    models = [model] + [f"{prefix}_{tag}{k}{suffix}" for k in range(1, copies + 1)]
+
+    m_save = re.search(r"^\.save\s+i\((\S+?)\)", netlist_text, re.MULTILINE | re.IGNORECASE)
+    if m_save is None:
+        raise ValueError("The netlist saves no measured current.")
+    source = m_save.group(1)
+    meas = None
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if len(fields) >= 3 and fields[0].lower() == source.lower():
+            if drain.lower() in (fields[1].lower(), fields[2].lower()):
+                meas = i
+            break
+    if meas is None:
+        raise ValueError(f"No measurement source '{source}' on the drain node '{drain}'.")
+    sources = [lines[meas].split()[0]] + [f"{lines[meas].split()[0]}_{tag}{k}" for k in range(1, copies + 1)]
+
+    added = []
+    for k in range(1, copies + 1):
+        added.append(f"{name}_{tag}{k}{m.group(2)}{drain}_{tag}{k}{m.group(4)}{models[k]}{m.group(6)}")
+        added.extend(lines[device + 1:block])
+        fields = lines[meas].split()
+        fields[0] = sources[k]
+        fields[1:3] = [f"{node}_{tag}{k}" if node.lower() == drain.lower() else node for node in fields[1:3]]
+        added.append(" ".join(fields))
+
+    out = []
+    vectors = " ".join(f"I({s})" for s in sources)
+    for line in lines:
+        stripped = line.strip()
+        lower = stripped.lower()
+        if lower.startswith(".include") and re.search(r'"?\./\S+?\.lib"?', stripped) and card_file is not None:
+            out.append(re.sub(r'"?\./\S+?\.lib"?', f'"./{card_file}"', line, count=1))
+            card_file = None
+        elif lower.startswith(".save") and source.lower() in lower:
+            out.append(".save " + " ".join(f"i({s.lower()})" for s in sources))
+        elif lower.startswith(".control"):
+            out.extend(added)
+            out.append("")
+            out.append(line)
+        elif lower.startswith("wrdata"):
+            path = stripped.split()[1]
+            root, ext = os.path.splitext(path)
+            indent = line[:len(line) - len(line.lstrip())]
+            out.append(f"{indent}wrdata {root}_{tag}{ext} {vectors}")
+        elif lower.startswith("write "):
+            continue
+        else:
+            out.append(line)
+    return "\n".join(out) + "\n", sources, models
+
+
+def rename_model(card_text, model):
+    """Give the '.model' statement of a single-bin card a new name."""
+    return re.sub(r"^(\.model\s+)\S+", lambda m: m.group(1) + model, card_text, count=1,
+                  flags=re.MULTILINE | re.IGNORECASE)
+
+
+class BatchedJacobian:
+    """
+    Forward-difference Jacobian of a SimulatorModel fit, all perturbations simulated in one launch.
+
+    Called by least_squares_fit like FiniteDifferenceJacobian. Its `nfev` attribute counts the
+    perturbed parameter sets (as FiniteDifferenceJacobian does), `launches` the ngspice runs.
+    """
+
+    def __init__(self, model, residuals, names, rel_step=1e-3, min_scale=1e-2, tag="jacobian"):
+        """
+        :param model: SimulatorModel of the fit.
+        :param residuals: Residual function of the simulated curves (e.g. CurveResiduals).
+        :param names: Names of the fitted parameters, in the order of the parameter vector.
+        :param rel_step: Step relative to the parameter scale.
+        :param min_scale: Smallest parameter scale, as a fraction of its (max - min) range (for
+                          parameters near zero).
+        :param tag: Suffix of the batch netlist, model card and output files.
+        """
+        self.model = model
+        self.residuals = residuals
+        self.names = list(names)
+        self.rel_step = rel_step
+        self.min_scale = min_scale
+        self.tag = tag
+        self.nfev = 0
+        self.launches = 0
+
+    def steps(self, x, lower, upper):
+        """Per-parameter steps at x, pointing inwards at the upper bound."""
+        x = np.asarray(x, dtype=float)
+        h = self.rel_step * np.maximum(np.abs(x), self.min_scale * (np.asarray(upper) - np.asarray(lower)))
+        return np.where(x + h > upper, -h, h)
+
+    def __call__(self, fun, x, r0, lower, upper):
+        """
+        :param fun: Residual function of the parameter vector (used for the columns the batch could not
+                    give, and when the netlist cannot be batched).
+        :param x: Point (inside the bounds).
+        :param r0: Residuals at x.
+        :return: Jacobian matrix (len(r0) x len(x)) with respect to x.
+        """
+        x = np.asarray(x, dtype=float)
+        h = self.steps(x, lower, upper)
+        points = [x] + [x + h[j] * np.eye(len(x))[j] for j in range(len(x))]
+        try:
+            curves = self.simulate(points)
+        except ValueError as e:
+            print(f"Batched Jacobian not available ({e}); simulating the perturbations one by one.")
+            jacobian = np.empty((len(r0), len(x)))
+            for j in range(len(x)):
+                self.nfev += 1
+                jacobian[:, j] = (fun(points[j + 1]) - r0) / h[j]
+            return jacobian
+        self.nfev += len(x)
+        rs = [np.asarray(self.residuals(c), dtype=float) for c in curves]
+        # The differences are taken against the base copy of the same run when it could be simulated.
+        base = rs[0] if np.all(np.isfinite(rs[0])) else np.asarray(r0, dtype=float)
+        jacobian = np.empty((len(r0), len(x)))
+        for j in range(len(x)):
+            column = (rs[j + 1] - base) / h[j]
+            if not np.all(np.isfinite(column)) and lower[j] <= x[j] - h[j] <= upper[j]:
+                # The copy failed on that side: try the other one on its own.
+                xj = x.copy()
+                xj[j] -= h[j]
+                self.nfev += 1
+                column = (fun(xj) - r0) / -h[j]
+            jacobian[:, j] = column
+        return jacobian
+
+    def simulate(self, points):
+        """
+        Simulate the model at several parameter vectors in one ngspice run.
+
+        :param points: List of parameter vectors (in the order of `names`).
+        :return: List of simulated curves per point, as SimulatorModel returns them.
+        :raises ValueError: If the sweep netlist cannot be batched.
+        """
+        model = self.model
+        simulator = model.simulator
+        parameter_sets = [dict(model.base_parameters, **dict(zip(self.names, p))) for p in points]
+        cards = []
+        # The base card is written last, so that the folder's modified card is the one at the current point.
+        for k in list(range(1, len(points))) + [0]:
+            path = write_model_cards(model.sandbox_root, model.device_type, model.bin_number,
+                                     model.lib_file_path, parameter_sets[k])
+            with open(path, "r") as f:
+                cards.append((k, f.read()))
+        cards.sort(key=lambda card: card[0])
+
+        sweep = dict(model.sweep)
+        W, L = sweep.pop("W", None), sweep.pop("L", None)
+        if model.kind == "iv":
+            netlists = simulator.generator.generate_iv_netlists(device_type=model.device_type,
+                                                                bin_number=model.bin_number, W=W, L=L, **sweep)
+            outputs = [(None, os.path.join("results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"),
+                        simulator.sweep_values(sweep.get("vgate_start", 0), sweep.get("vgate_stop", 1.8),
+                                               sweep.get("vgate_step", 0.1)))]
+        else:
+            netlists, pattern = simulator.generate_family_netlists(model.device_type, model.bin_number, W, L,
+                                                                   **sweep)
+            vd_sweep = simulator.sweep_values(sweep["vd_start"], sweep["vd_stop"], sweep["vd_step"])
+            outputs = [(vg, pattern.format(vg), vd_sweep)
+                       for vg in simulator.sweep_values(sweep["vg_start"], sweep["vg_stop"], sweep["vg_step"],
+                                                        loop=True)]
+        netlist_path = os.path.abspath(netlists["modified"])
+        netlist_dir = os.path.dirname(netlist_path)
+        with open(netlist_path, "r") as f:
+            netlist_text = f.read()
+        card_file = f"bin_{model.bin_number}_{model.device_type}_{self.tag}.lib"
+        text, _, models = batch_netlist(netlist_text, len(points) - 1, card_file, tag=self.tag)
+        with open(os.path.join(netlist_dir, card_file), "w") as f:
+            for (k, card), name in zip(cards, models):
+                f.write(card if k == 0 else rename_model(card, name))
+                f.write("\n")
+        batch_path = os.path.splitext(netlist_path)[0] + f"_{self.tag}.spice"
+        with open(batch_path, "w") as f:
+            f.write(text)
+
+        expected_outputs = []
+        for _, path, x_values in outputs:
+            root, ext = os.path.splitext(path)
+            expected_outputs.append({"path": f"{root}_{self.tag}{ext}", "sweep": x_values, "columns": len(points)})
+        self.launches += 1
+        simulator.simulate_netlist(batch_path, expected_outputs)
+        data = [simulator.load_wrdata(os.path.join(netlist_dir, output["path"])) for output in expected_outputs]
+        # wrdata columns: sweep, current of the base device, sweep, current of copy 1, ...
+        return [[(vg, d[:, 0], d[:, 2 * k + 1]) for (vg, _, _), d in zip(outputs, data)]
+                for k in range(len(points))]
@@ -0,0 +1,738 @@
+"""
+IceMOS_sky130_bsim4.py
+
+This module evaluates the DC drain current of a BSIM4.5 (level 54) model card in-process, with NumPy,
+over whole bias grids at once, so that previews and optimizers need not launch ngspice for every
+parameter tweak.
+
+The equations follow the BSIM4.5 DC model as ngspice implements it (size and temperature dependence of
+the parameters, threshold voltage with short-channel, narrow-width, DIBL and pocket-implant terms,
+effective Vgs across subthreshold and inversion, poly depletion, mobility degradation, velocity
+saturation, the internal source/drain resistance (rdsmod = 0), channel length modulation, DIBL,
+DITS and SCBE output conductance, impact ionization, GIDL and the junction diodes with ngspice's
+gmin), including ngspice's exponent clamps, which set the subthreshold current at 4 K. Not modelled:
+gate tunnelling currents (igcmod/igbmod = 1), the external resistances of rdsmod = 1, the stress
+(LOD) and well proximity effects, the source-end velocity limit (vtl) and mobmod 1/2.
+
+The pieces:
+  - parse_model_card / load_model_card: the .model card of a bin as a dict of parameters.
+  - BSIM4Device: one device (card, W, L, temperature). current(vgs, vds, vbs) broadcasts over arrays
+    of biases given in the repository's convention: VGS/VDS/VBS and the current into the drain for
+    NMOS, VSG/VSD/VSB and the current out of the drain for PMOS.
+  - iv_curve / iv_vds_curves: the sweeps of the IV and IV_VDS netlists for a device.
+  - BSIM4Simulator: iv_curve() and iv_vds_curves() with the signatures and SweepResult results of
+    IceMOS_simulator_sky130, from the cards in a circuit root (27 °C for the original card, 4 K for the
+    modified one).
+  - BSIM4Model: drop-in for IceMOS_sky130_fitting.SimulatorModel (parameters -> curves) for fits,
+    global searches and surrogates.
+
+Validated against the ngspice-44 results in test/circuits (modified cards at -269 °C): the ID vs VG
+curves agree within 0.1 % from the gmin/GIDL leakage floor to strong inversion; the ISD vs VSD family
+within 4 %, the accuracy of that reference itself (see test/test_bsim4_sky130.py).
+
+    device = BSIM4Device(load_model_card("circuits/nch/bin_40/bin_40_nch_modified.lib"), W=0.42, L=0.15,
+                         temperature=-269)
+    vg, vd = np.meshgrid(np.linspace(0, 1.8, 181), np.linspace(0, 1.8, 19))
+    current = device.current(vg, vd)
+"""
+
+import math
+import os
+import re
+
+import numpy as np
+
+from IceMOS_sky130_circuit_model_extractor import ModelExtractor
+from IceMOS_sky130_result_store import model_hash
+from IceMOS_sky130_results import make_family_result, make_iv_result
+
+# Constants of the ngspice BSIM4 code.
+EPS0 = 8.85418e-12
+EPSSI = 1.03594e-10
+KBOQ = 8.617087e-5
+CHARGE_Q = 1.60219e-19
+MAX_EXP = 5.834617425e14
+MIN_EXP = 1.713908431e-15
+EXP_THRESHOLD = 34.0
+KELVIN = 273.15
+
+# Temperatures of the netlists (°C) for each model card.
+TEMPERATURES = {"original": 27.0, "modified": -269.0}
+# Fixed drain (NMOS) or source-drain (PMOS) voltage of the ID vs VG netlists.
+IV_DRAIN_VOLTAGE = 1.8
+
+# BSIM4.5 defaults of the parameters the DC equations use ({n, p} for type-dependent ones).
+DEFAULTS = {
+    "tnom": 27.0, "version": 4.5, "binunit": 1.0, "mobmod": 0.0, "rdsmod": 0.0, "tempmod": 0.0, "diomod": 1.0,
+    "permod": 1.0, "toxe": 30.0e-10, "epsrox": 3.9, "dtox": 0.0, "toxref": 30.0e-10, "ados": 1.0, "bdos": 1.0,
+    "xl": 0.0, "xw": 0.0, "lint": 0.0, "ll": 0.0, "lw": 0.0, "lwl": 0.0, "lln": 1.0, "lwn": 1.0,
+    "wint": 0.0, "wl": 0.0, "ww": 0.0, "wwl": 0.0, "wln": 1.0, "wwn": 1.0, "wlc": 0.0, "wwc": 0.0, "wwlc": 0.0,
+    "cdsc": 2.4e-4, "cdscb": 0.0, "cdscd": 0.0, "cit": 0.0, "nfactor": 1.0, "xj": 0.15e-6, "vsat": 8.0e4,
+    "at": 3.3e4, "a0": 1.0, "ags": 0.0, "a1": 0.0, "a2": 1.0, "keta": -0.047, "nsub": 6.0e16, "ndep": 1.7e17,
+    "nsd": 1.0e20, "phin": 0.0, "ngate": 0.0, "vbm": -3.0, "xt": 1.55e-7, "kt1": -0.11, "kt1l": 0.0,
+    "kt2": 0.022, "k3": 80.0, "k3b": 0.0, "w0": 2.5e-6, "lpe0": 1.74e-7, "lpeb": 0.0, "dvtp0": 0.0,
+    "dvtp1": 0.0, "dvt0": 2.2, "dvt1": 0.53, "dvt2": -0.032, "dvt0w": 0.0, "dvt1w": 5.3e6, "dvt2w": -0.032,
+    "drout": 0.56, "vth0": {"n": 0.7, "p": -0.7}, "ua": 1.0e-9, "ua1": 1.0e-9, "ub": 1.0e-19, "ub1": -1.0e-18,
+    "uc": -0.0465e-9, "uc1": -0.056e-9, "ud": 0.0, "ud1": 0.0, "up": 0.0, "lp": 1.0e-8,
+    "eu": {"n": 1.67, "p": 1.0}, "u0": {"n": 0.067, "p": 0.025}, "ute": -1.5, "voff": -0.08, "voffl": 0.0,
+    "minv": 0.0, "delta": 0.01, "rdsw": 200.0, "rdswmin": 0.0, "prwg": 1.0, "prwb": 0.0, "prt": 0.0,
+    "eta0": 0.08, "etab": -0.07, "pclm": 1.3, "pdiblc1": 0.39, "pdiblc2": 0.0086, "pdiblcb": 0.0,
+    "fprout": 0.0, "pdits": 0.0, "pditsd": 0.0, "pditsl": 0.0, "pscbe1": 4.24e8, "pscbe2": 1.0e-5,
+    "pvag": 0.0, "wr": 1.0, "dwg": 0.0, "dwb": 0.0, "b0": 0.0, "b1": 0.0, "alpha0": 0.0, "alpha1": 0.0,
+    "beta0": 0.0, "agidl": 0.0, "bgidl": 2.3e9, "cgidl": 0.5, "egidl": 0.8, "jss": 1.0e-4, "jsws": 0.0,
+    "jswgs": 0.0, "njs": 1.0, "xtis": 3.0,
+}
+
+# Parameters with length/width binning (l<name>, w<name> and p<name> in the card).
+BINNED = (
+    "cdsc", "cdscb", "cdscd", "cit", "nfactor", "xj", "vsat", "at", "a0", "ags", "a1", "a2", "keta", "nsub",
+    "ndep", "nsd", "phin", "ngate", "gamma1", "gamma2", "vbx", "vbm", "xt", "vfb", "k1", "kt1", "kt1l", "k2",
+    "kt2", "k3", "k3b", "w0", "dvtp0", "dvtp1", "lpe0", "lpeb", "dvt0", "dvt1", "dvt2", "dvt0w", "dvt1w",
+    "dvt2w", "drout", "dsub", "vth0", "ua", "ua1", "ub", "ub1", "uc", "uc1", "ud", "ud1", "up", "lp", "eu",
+    "u0", "ute", "voff", "minv", "delta", "rdsw", "prwg", "prwb", "prt", "eta0", "etab", "pclm", "pdiblc1",
+    "pdiblc2", "pdiblcb", "fprout", "pdits", "pditsd", "pscbe1", "pscbe2", "pvag", "wr", "dwg", "dwb", "b0",
+    "b1", "alpha0", "alpha1", "beta0", "agidl", "bgidl", "cgidl", "egidl",
+)
+
+_SUFFIXES = {"t": 1e12, "g": 1e9, "meg": 1e6, "k": 1e3, "m": 1e-3, "u": 1e-6, "n": 1e-9, "p": 1e-12, "f": 1e-15}
+
+
+def spice_number(text):
+    """Value of a SPICE number ('1.5e-9', '10n', '2meg', ...)."""
+    m = re.match(r"^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(meg|[tgkmunpf])?", text.strip().lower())
+    if not m:
+        raise ValueError(f"'{text}' is not a number.")
+    return float(m.group(1)) * _SUFFIXES.get(m.group(2), 1.0)
+
+
+def parse_model_card(text):
+    """
+    Parse a '.model <name> nmos|pmos (...)' card.
+
+    :return: Tuple (model name, 'nmos' or 'pmos', {parameter name (lower case): value}).
+    :raises ValueError: If there is no model card or a value is not a number.
+    """
+    m = re.search(r"(?im)^\s*\.model\s+(\S+)\s+(nmos|pmos)", text)
+    if not m:
+        raise ValueError("No .model card found.")
+    body = []
+    for line in text[m.end():].splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("*"):
+            continue
+        if body and not stripped.startswith("+"):
+            break
+        body.append(stripped.lstrip("+"))
+    parameters = {}
+    for name, value in re.findall(r"([A-Za-z_]\w*)\s*=\s*([^\s()]+)", " ".join(body)):
+        parameters[name.lower()] = spice_number(value)
+    return m.group(1), m.group(2).lower(), parameters
+
+
+def load_model_card(lib_file_path):
+    """
+    :return: Dict of the parameters of the model card in a .lib file, with its polarity under 'type'
+             (1 for NMOS, -1 for PMOS).
+    """
+    with open(lib_file_path, "r") as f:
+        _, polarity, parameters = parse_model_card(f.read())
+    parameters["type"] = 1.0 if polarity == "nmos" else -1.0
+    return parameters
+
+
+def _exp_ratio(T0):
+    """exp(T0) / ((exp(T0) - 1)^2 + 2 exp(T0) MIN_EXP), as BSIM4 evaluates its short-channel factors."""
+    T0 = np.asarray(T0, dtype=float)
+    with np.errstate(over="ignore", invalid="ignore"):
+        T1 = np.exp(np.minimum(T0, EXP_THRESHOLD))
+        value = T1 / ((T1 - 1.0) ** 2 + 2.0 * T1 * MIN_EXP)
+    return np.where(T0 < EXP_THRESHOLD, value, 1.0 / (MAX_EXP - 2.0))
+
+
+def _clamped_exp(T0):
+    return np.exp(np.clip(T0, -EXP_THRESHOLD, EXP_THRESHOLD))
+
+
+class BSIM4Device:
+    """
+    DC model of one BSIM4.5 device.
+    """
+
+    def __init__(self, parameters, W, L, nf=1, temperature=27.0, diffusion_length=0.29, gmin=1e-12):
+        """
+        :param parameters: Model card parameters (load_model_card()); 'type' is 1 for NMOS, -1 for PMOS.
+        :param W: Total width in µm.
+        :param L: Length in µm.
+        :param nf: Number of fingers.
+        :param temperature: Device temperature in °C.
+        :param diffusion_length: Source/drain diffusion length in µm (the generated netlists use 0.29 µm
+                                 for the junction areas and perimeters).
+        :param gmin: Conductance ngspice puts across every junction (S).
+        :raises ValueError: If the effective length or width is not positive.
+        """
+        self.parameters = dict(parameters)
+        self.W = float(W)
+        self.L = float(L)
+        self.nf = nf
+        self.temperature = float(temperature)
+        self.diffusion_length = diffusion_length
+        self.gmin = gmin
+        self._setup()
+
+    def _value(self, name):
+        value = self.parameters.get(name, DEFAULTS.get(name, 0.0))
+        if isinstance(value, dict):
+            value = value["n" if self.type > 0 else "p"]
+        return float(value)
+
+    def _setup(self):
+        """Size- and temperature-dependent parameters (ngspice's b4temp)."""
+        given = self.parameters
+        self.type = 1.0 if float(given.get("type", 1.0)) > 0 else -1.0
+        v = self._value
+
+        toxe, toxp, dtox = v("toxe"), given.get("toxp"), v("dtox")
+        if toxp is None:
+            toxp = toxe - dtox
+        self.toxe, self.toxp = toxe, float(toxp)
+        toxm = float(given.get("toxm", toxe))
+        epsrox = v("epsrox")
+        self.coxe = epsrox * EPS0 / toxe
+        self.coxp = epsrox * EPS0 / self.toxp
+        self.factor1 = math.sqrt(EPSSI / (epsrox * EPS0) * toxe)
+
+        Tnom = v("tnom") + KELVIN
+        T = self.temperature + KELVIN
+        TRatio = T / Tnom
+        dT = TRatio - 1.0
+        self.temp_ratio = dT
+        Vtm0 = KBOQ * Tnom
+        Eg0 = 1.16 - 7.02e-4 * Tnom * Tnom / (Tnom + 1108.0)
+        ni = 1.45e10 * (Tnom / 300.15) * math.sqrt(Tnom / 300.15) * math.exp(21.5565981 - Eg0 / (2.0 * Vtm0))
+        self.vtm = KBOQ * T
+        Eg = 1.16 - 7.02e-4 * T * T / (T + 1108.0)
+
+        # Geometry and binning
+        Lnew = self.L * 1e-6 + v("xl")
+        Wnew = self.W * 1e-6 / self.nf + v("xw")
+        T0, T1 = Lnew ** v("lln"), Wnew ** v("lwn")
+        dl = v("lint") + v("ll") / T0 + v("lw") / T1 + v("lwl") / (T0 * T1)
+        T2, T3 = Lnew ** v("wln"), Wnew ** v("wwn")
+        dw = v("wint") + v("wl") / T2 + v("ww") / T3 + v("wwl") / (T2 * T3)
+        dwc = float(given.get("dwc", v("wint")))
+        dwj = float(given.get("dwj", dwc)) + v("wlc") / T2 + v("wwc") / T3 + v("wwlc") / (T2 * T3)
+        self.leff = Lnew - 2.0 * dl
+        self.weff = Wnew - 2.0 * dw
+        self.weffcj = Wnew - 2.0 * dwj
+        if self.leff <= 0.0 or self.weff <= 0.0 or self.weffcj <= 0.0:
+            raise ValueError(f"Non-positive effective length or width for W = {self.W} µm, L = {self.L} µm.")
+        if v("binunit") == 1.0:
+            inv_l, inv_w, inv_lw = 1e-6 / self.leff, 1e-6 / self.weff, 1e-12 / (self.leff * self.weff)
+        else:
+            inv_l, inv_w, inv_lw = 1.0 / self.leff, 1.0 / self.weff, 1.0 / (self.leff * self.weff)
+        p = {}
+        for name in BINNED:
+            if name not in given and name not in DEFAULTS:
+                continue
+            p[name] = (v(name) + float(given.get("l" + name, 0.0)) * inv_l + float(given.get("w" + name, 0.0)) * inv_w
+                       + float(given.get("p" + name, 0.0)) * inv_lw)
+        p.setdefault("dsub", p["drout"])
+        self.p = p
+
+        # Temperature dependence (tempmod = 0)
+        if p["u0"] > 1.0:
+            p["u0"] /= 1.0e4
+        for name in ("ua", "ub", "uc", "ud"):
+            p[name] += p[name + "1"] * dT
+        self.u0temp = p["u0"] * (1.0 - p["up"] * math.exp(-self.leff / p["lp"])) * TRatio ** p["ute"]
+        self.vsattemp = p["vsat"] - p["at"] * dT
+        pow_weff_wr = (self.weffcj * 1e6) ** p["wr"]
+        self.rds0 = max((p["rdsw"] + p["prt"] * dT) / pow_weff_wr, 0.0)
+        self.rdswmin = max((v("rdswmin") + p["prt"] * dT) / pow_weff_wr, 0.0)
+
+        # Threshold voltage parameters
+        if p["ndep"] > 1.0e20:
+            p["ndep"] *= 1.0e-6
+        if p["nsd"] > 1.0e23:
+            p["nsd"] *= 1.0e-6
+        self.phi = Vtm0 * math.log(p["ndep"] / ni) + p["phin"] + 0.4
+        self.sqrt_phi = math.sqrt(self.phi)
+        self.xdep0 = math.sqrt(2.0 * EPSSI / (CHARGE_Q * p["ndep"] * 1.0e6)) * self.sqrt_phi
+        self.litl = math.sqrt(3.0 * p["xj"] * toxe)
+        self.vbi = Vtm0 * math.log(p["nsd"] * p["ndep"] / (ni * ni))
+        self.cdep0 = math.sqrt(CHARGE_Q * EPSSI * p["ndep"] * 1.0e6 / 2.0 / self.phi)
+        if "k1" not in given and "k2" not in given:
+            vbx = p["vbx"] if "vbx" in given else self.phi - 7.7348e-4 * p["ndep"] * p["xt"] ** 2
+            vbx, vbm = -abs(vbx), -abs(p["vbm"])
+            gamma1 = p["gamma1"] if "gamma1" in given else 5.753e-12 * math.sqrt(p["ndep"]) / self.coxe
+            gamma2 = p["gamma2"] if "gamma2" in given else 5.753e-12 * math.sqrt(p["nsub"]) / self.coxe
+            T1 = math.sqrt(self.phi - vbx) - self.sqrt_phi
+            T2 = math.sqrt(self.phi * (self.phi - vbm)) - self.phi
+            p["k2"] = (gamma1 - gamma2) * T1 / (2.0 * T2 + vbm)
+            p["k1"] = gamma2 - 2.0 * p["k2"] * math.sqrt(self.phi - vbm)
+        else:
+            p.setdefault("k1", 0.53)
+            p.setdefault("k2", -0.0186)
+        if p["k2"] < 0.0:
+            T0 = 0.5 * p["k1"] / p["k2"]
+            self.vbsc = min(max(0.9 * (self.phi - T0 * T0), -30.0), -3.0)
+        else:
+            self.vbsc = -30.0
+        self.vbsc = min(self.vbsc, -abs(p["vbm"]))
+        if "vfb" not in given:
+            p["vfb"] = self.type * p["vth0"] - self.phi - p["k1"] * self.sqrt_phi
+        self.k1ox = p["k1"] * toxe / toxm
+        self.k2ox = p["k2"] * toxe / toxm
+        self.vtfbphi2 = max(4.0 * (self.type * p["vth0"] - p["vfb"] - self.phi), 0.0)
+
+        tmp = math.sqrt(EPSSI / (epsrox * EPS0) * toxe * self.xdep0)
+        self.theta0vb0 = float(_exp_ratio(p["dsub"] * self.leff / tmp))
+        self.theta_rout = p["pdiblc1"] * float(_exp_ratio(p["drout"] * self.leff / tmp)) + p["pdiblc2"]
+        self.mstar = 0.5 + math.atan(p["minv"]) / math.pi
+        self.voffcbn = p["voff"] + v("voffl") / self.leff
+
+        # Junction saturation currents (the drain side takes the source parameters)
+        T0 = Eg0 / Vtm0 - Eg / self.vtm + v("xtis") * math.log(T / Tnom)
+        with np.errstate(over="ignore", under="ignore"):
+            factor = float(np.exp(T0 / v("njs")))
+        width = self.W * 1e-6
+        length = self.diffusion_length * 1e-6
+        area = width * length
+        perimeter = 2.0 * (width + length)
+        if v("permod") != 0.0:
+            perimeter -= self.weffcj * self.nf
+        self.drain_saturation_current = factor * (area * v("jss") + max(perimeter, 0.0) * v("jsws")
+                                                  + self.weffcj * self.nf * v("jswgs"))
+        self.nvtm = self.vtm * v("njs")
+
+    def current(self, vgs, vds, vbs=0.0):
+        """
+        DC drain current over arrays of biases (broadcast against each other).
+
+        :param vgs: VGS for NMOS, VSG for PMOS (V).
+        :param vds: VDS for NMOS, VSD for PMOS (V).
+        :param vbs: VBS for NMOS, VSB for PMOS (V).
+        :return: Current into the drain for NMOS, out of the drain for PMOS (A).
+        """
+        vgs, vds, vbs = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (vgs, vds, vbs)))
+        with np.errstate(all="ignore"):
+            # Source and drain swap roles for negative VDS.
+            reverse = vds < 0.0
+            Vds = np.abs(vds)
+            Vgs = np.where(reverse, vgs - vds, vgs)
+            Vbs = np.where(reverse, vbs - vds, vbs)
+            ids, isub = self._channel(Vgs, Vds, Vbs)
+            # The impact ionization current enters the terminal acting as the drain (the source when reversed).
+            vbd = vbs - vds
+            current = (np.where(reverse, -ids, ids + isub) + self._gidl(vds, self._poly_depletion(vgs), vbd)
+                       - self._junction(vbd))
+        return current
+
+    def _poly_depletion(self, vgs):
+        """Gate voltage after the poly depletion drop."""
+        ngate = self.p["ngate"]
+        if not 1.0e18 < ngate < 1.0e25:
+            return vgs
+        phi = self.p["vfb"] + self.phi
+        T1 = 1.0e6 * CHARGE_Q * EPSSI * ngate / (self.coxe * self.coxe)
+        T8 = np.maximum(vgs - phi, 0.0)
+        T4 = np.sqrt(1.0 + 2.0 * T8 / T1)
+        T2 = 2.0 * T8 / (T4 + 1.0)
+        T3 = 0.5 * T2 * T2 / T1
+        T7 = 1.12 - T3 - 0.05
+        T6 = np.sqrt(T7 * T7 + 0.224)
+        T5 = 1.12 - 0.5 * (T7 + T6)
+        return np.where(vgs > phi, vgs - T5, vgs)
+
+    def _gidl(self, vds, vgs_eff, vbd):
+        """Gate-induced drain leakage (drain to bulk)."""
+        p = self.p
+        if p["agidl"] <= 0.0 or p["bgidl"] <= 0.0 or p["cgidl"] <= 0.0:
+            return np.zeros_like(vds)
+        T1 = (vds - vgs_eff - p["egidl"]) / (3.0 * self.toxe)
+        T2 = p["bgidl"] / np.where(T1 > 0.0, T1, 1.0)
+        igidl = p["agidl"] * self.weffcj * self.nf * T1 * np.where(T2 < 100.0, np.exp(-np.minimum(T2, 100.0)),
+                                                                   3.720075976e-44)
+        T5 = -vbd * vbd * vbd
+        igidl = igidl * T5 / (p["cgidl"] + T5)
+        return np.where((T1 > 0.0) & (vbd <= 0.0), igidl, 0.0)
+
+    def _junction(self, vbd):
+        """Bulk-drain diode current (bulk to drain), with gmin (diomod = 1)."""
+        T2 = vbd / self.nvtm
+        current = self.drain_saturation_current * (np.exp(np.clip(T2, -EXP_THRESHOLD, EXP_THRESHOLD)) - 1.0)
+        current = np.where(T2 < -EXP_THRESHOLD, self.drain_saturation_current * (MIN_EXP - 1.0), current)
+        return self.nf * current + self.gmin * vbd
+
+    def _channel(self, Vgs, Vds, Vbs):
+        """
+        Channel and impact ionization currents of the device in normal mode (Vds >= 0).
+
+        :return: Tuple (channel current, substrate current).
+        """
+        p = self.p
+        Leff = self.leff
+        Vtm = self.vtm
+
+        # Effective body bias
+        T0 = Vbs - self.vbsc - 0.001
+        T1 = np.sqrt(T0 * T0 - 0.004 * self.vbsc)
+        Vbseff = np.where(T0 >= 0.0, self.vbsc + 0.5 * (T0 + T1), self.vbsc * (1.0 - 0.002 / (T1 - T0)))
+        T9 = 0.95 * self.phi
+        T0 = T9 - Vbseff - 0.001
+        Vbseff = T9 - 0.5 * (T0 + np.sqrt(T0 * T0 + 0.004 * T9))
+        Phis = self.phi - Vbseff
+        sqrtPhis = np.sqrt(Phis)
+        Xdep = self.xdep0 * sqrtPhis / self.sqrt_phi
+
+        # Threshold voltage
+        T3 = np.sqrt(Xdep)
+        V0 = self.vbi - self.phi
+        T0 = p["dvt2"] * Vbseff
+        lt1 = self.factor1 * T3 * np.where(T0 >= -0.5, 1.0 + T0, (1.0 + 3.0 * T0) / (3.0 + 8.0 * T0))
+        T0 = p["dvt2w"] * Vbseff
+        ltw = self.factor1 * T3 * np.where(T0 >= -0.5, 1.0 + T0, (1.0 + 3.0 * T0) / (3.0 + 8.0 * T0))
+        Theta0 = _exp_ratio(p["dvt1"] * Leff / lt1)
+        Delt_vth = p["dvt0"] * Theta0 * V0
+        T2 = p["dvt0w"] * _exp_ratio(p["dvt1w"] * self.weff * Leff / ltw) * V0
+        T0 = math.sqrt(1.0 + p["lpe0"] / Leff)
+        T1 = (self.k1ox * (T0 - 1.0) * self.sqrt_phi
+              + (p["kt1"] + p["kt1l"] / Leff + p["kt2"] * Vbseff) * self.temp_ratio)
+        Vth_NarrowW = self.toxe * self.phi / (self.weff + p["w0"])
+        T3 = p["eta0"] + p["etab"] * Vbseff
+        T3 = np.where(T3 < 1.0e-4, (2.0e-4 - T3) / (3.0 - 2.0e4 * T3), T3)
+        DIBL_Sft = T3 * self.theta0vb0 * Vds
+        Lpe_Vb = math.sqrt(1.0 + p["lpeb"] / Leff)
+        Vth = (self.type * p["vth0"] + (self.k1ox * sqrtPhis - p["k1"] * self.sqrt_phi) * Lpe_Vb
+               - self.k2ox * Vbseff - Delt_vth - T2 + (p["k3"] + p["k3b"] * Vbseff) * Vth_NarrowW + T1 - DIBL_Sft)
+
+        # Subthreshold swing factor
+        tmp1 = EPSSI / Xdep
+        tmp3 = p["cdsc"] + p["cdscb"] * Vbseff + p["cdscd"] * Vds
+        tmp4 = (p["nfactor"] * tmp1 + tmp3 * Theta0 + p["cit"]) / self.coxe
+        n = np.where(tmp4 >= -0.5, 1.0 + tmp4, (1.0 + 3.0 * tmp4) / (3.0 + 8.0 * tmp4))
+
+        # Pocket implant
+        if p["dvtp0"] > 0.0:
+            T2 = np.where(-p["dvtp1"] * Vds < -EXP_THRESHOLD, MIN_EXP, np.exp(-p["dvtp1"] * Vds))
+            Vth = Vth - n * Vtm * np.log(Leff / (Leff + p["dvtp0"] * (1.0 + T2)))
+
+        vgs_eff = self._poly_depletion(Vgs)
+        Vgst = vgs_eff - Vth
+
+        # Effective Vgs - Vth from subthreshold to strong inversion
+        T0 = n * Vtm
+        T1 = self.mstar * Vgst
+        T2 = T1 / T0
+        T10 = np.where(T2 > EXP_THRESHOLD, T1,
+                       np.where(T2 < -EXP_THRESHOLD, Vtm * np.log(1.0 + MIN_EXP),
+                                T0 * np.log1p(np.exp(np.clip(T2, -EXP_THRESHOLD, EXP_THRESHOLD)))))
+        T2 = (self.voffcbn - (1.0 - self.mstar) * Vgst) / T0
+        ExpVgst = np.where(T2 < -EXP_THRESHOLD, MIN_EXP,
+                           np.where(T2 > EXP_THRESHOLD, MAX_EXP, _clamped_exp(T2)))
+        T9 = self.mstar + n * self.coxe / self.cdep0 * ExpVgst
+        Vgsteff = T10 / T9
+
+        # Effective width and source/drain resistance
+        T9 = sqrtPhis - self.sqrt_phi
+        Weff = self.weff - 2.0 * (p["dwg"] * Vgsteff + p["dwb"] * T9)
+        Weff = np.where(Weff < 2.0e-8, 2.0e-8 * (4.0e-8 - Weff) / (6.0e-8 - 2.0 * Weff), Weff)
+        T2 = 1.0 / (1.0 + p["prwg"] * Vgsteff) + p["prwb"] * T9
+        Rds = self.rdswmin + (T2 + np.sqrt(T2 * T2 + 0.01)) * 0.5 * self.rds0
+
+        # Bulk charge factor
+        T9 = 0.5 * self.k1ox * Lpe_Vb / sqrtPhis
+        T1 = T9 + self.k2ox - p["k3b"] * Vth_NarrowW
+        T9 = np.sqrt(p["xj"] * Xdep)
+        T5 = Leff / (Leff + 2.0 * T9)
+        T2 = p["a0"] * T5 + p["b0"] / (self.weff + p["b1"])
+        Abulk0 = 1.0 + T1 * T2
+        Abulk = Abulk0 - T1 * p["ags"] * p["a0"] * T5 ** 3 * Vgsteff
+        Abulk0 = np.where(Abulk0 < 0.1, (0.2 - Abulk0) / (3.0 - 20.0 * Abulk0), Abulk0)
+        Abulk = np.where(Abulk < 0.1, (0.2 - Abulk) / (3.0 - 20.0 * Abulk), Abulk)
+        T2 = p["keta"] * Vbseff
+        T0 = np.where(T2 >= -0.9, 1.0 / (1.0 + T2), (17.0 + 20.0 * T2) / (0.8 + T2))
+        Abulk = Abulk * T0
+
+        # Mobility (mobmod = 0)
+        T0 = Vgsteff + Vth + Vth
+        T2 = p["ua"] + p["uc"] * Vbseff
+        T3 = T0 / self.toxe
+        T10 = self.toxe / (Vgsteff + 2.0 * np.sqrt(Vth * Vth + 0.0001))
+        T5 = T3 * (T2 + p["ub"] * T3) + p["ud"] * T10 * T10 * Vth * Vth
+        Denomi = np.where(T5 >= -0.8, 1.0 + T5, (0.6 + T5) / (7.0 + 10.0 * T5))
+        ueff = self.u0temp / Denomi
+
+        # Saturation voltage
+        WVCox = Weff * self.vsattemp * self.coxe
+        WVCoxRds = WVCox * Rds
+        Esat = 2.0 * self.vsattemp / ueff
+        EsatL = Esat * Leff
+        a1, a2 = p["a1"], p["a2"]
+        if a1 == 0.0:
+            Lambda = a2 + 0.0 * Vgsteff
+        elif a1 > 0.0:
+            T0 = 1.0 - a2
+            T1 = T0 - a1 * Vgsteff - 0.0001
+            Lambda = a2 + T0 - 0.5 * (T1 + np.sqrt(T1 * T1 + 0.0004 * T0))
+        else:
+            T1 = a2 + a1 * Vgsteff - 0.0001
+            Lambda = 0.5 * (T1 + np.sqrt(T1 * T1 + 0.0004 * a2))
+        Vgst2Vtm = Vgsteff + 2.0 * Vtm
+        T9 = Abulk * WVCoxRds
+        T7 = Vgst2Vtm * T9
+        T6 = Vgst2Vtm * WVCoxRds
+        T0 = 2.0 * Abulk * (T9 - 1.0 + 1.0 / Lambda)
+        T1 = Vgst2Vtm * (2.0 / Lambda - 1.0) + Abulk * EsatL + 3.0 * T7
+        T2 = Vgst2Vtm * (EsatL + 2.0 * T6)
+        Vdsat = np.where((Rds == 0.0) & (Lambda == 1.0), EsatL * Vgst2Vtm / (Abulk * EsatL + Vgst2Vtm),
+                         (T1 - np.sqrt(T1 * T1 - 2.0 * T0 * T2)) / T0)
+
+        # Effective Vds
+        delta = p["delta"]
+        T1 = Vdsat - Vds - delta
+        T2 = np.sqrt(T1 * T1 + 4.0 * delta * Vdsat)
+        Vdseff = np.where(T1 >= 0.0, Vdsat - 0.5 * (T1 + T2), Vdsat * (1.0 - 2.0 * delta / (T2 - T1)))
+        Vdseff = np.where(Vds == 0.0, 0.0, np.minimum(Vdseff, Vds))
+        diffVds = Vds - Vdseff
+
+        # Early voltage of velocity saturation
+        tmp4 = 1.0 - 0.5 * Abulk * Vdsat / Vgst2Vtm
+        T0 = EsatL + Vdsat + 2.0 * WVCoxRds * Vgsteff * tmp4
+        Vasat = T0 / (2.0 / Lambda - 1.0 + WVCoxRds * Abulk)
+
+        # Linear region conductance with the oxide charge centroid
+        T0 = (Vgsteff + self.vtfbphi2) / (2.0e8 * self.toxp)
+        Tcen = self._value("ados") * 1.9e-9 / (1.0 + T0 ** (self._value("bdos") * 0.7))
+        Coxeff = EPSSI * self.coxp / (EPSSI + self.coxp * Tcen)
+        beta = ueff * Coxeff * Weff / Leff
+        fgche1 = Vgsteff * (1.0 - 0.5 * Vdseff * Abulk / Vgst2Vtm)
+        fgche2 = 1.0 + Vdseff / EsatL
+        gche = beta * fgche1 / fgche2
+        Idl = gche / (1.0 + gche * Rds)
+
+        # Output conductance: pocket implant, CLM, DIBL, DITS and SCBE
+        FP = 1.0 / (1.0 + p["fprout"] * math.sqrt(Leff) / Vgst2Vtm) if p["fprout"] > 0.0 else 1.0
+        T9 = p["pvag"] / EsatL * Vgsteff
+        PvagTerm = np.where(T9 > -0.9, 1.0 + T9, (0.8 + T9) / (17.0 + 20.0 * T9))
+        if p["pclm"] > MIN_EXP:
+            Cclm = FP * PvagTerm * (1.0 + Rds * Idl) * (Leff + Vdsat / Esat) / (p["pclm"] * self.litl)
+            clm = diffVds > 1.0e-10
+            VACLM = np.where(clm, Cclm * diffVds, MAX_EXP)
+            Cclm = np.where(clm, Cclm, MAX_EXP)
+        else:
+            VACLM = Cclm = MAX_EXP
+        if self.theta_rout > MIN_EXP:
+            T8 = Abulk * Vdsat
+            VADIBL = (Vgst2Vtm - Vgst2Vtm * T8 / (Vgst2Vtm + T8)) / self.theta_rout
+            T7 = p["pdiblcb"] * Vbseff
+            VADIBL = VADIBL * np.where(T7 >= -0.9, 1.0 / (1.0 + T7), (17.0 + 20.0 * T7) / (0.8 + T7)) * PvagTerm
+        else:
+            VADIBL = MAX_EXP
+        Va = Vasat + VACLM
+        if p["pdits"] > MIN_EXP:
+            T1 = np.where(p["pditsd"] * Vds > EXP_THRESHOLD, MAX_EXP,
+                          np.exp(np.minimum(p["pditsd"] * Vds, EXP_THRESHOLD)))
+            VADITS = (1.0 + (1.0 + self._value("pditsl") * Leff) * T1) / p["pdits"] * FP
+        else:
+            VADITS = MAX_EXP
+        if p["pscbe2"] > 0.0:
+            limit = p["pscbe1"] * self.litl / EXP_THRESHOLD
+            T0 = p["pscbe1"] * self.litl / np.where(diffVds > limit, diffVds, 1.0)
+            VASCBE = np.where(diffVds > limit, Leff * np.exp(np.minimum(T0, EXP_THRESHOLD)) / p["pscbe2"],
+                              MAX_EXP * Leff / p["pscbe2"])
+        else:
+            VASCBE = MAX_EXP
+
+        Idsa = Idl * (1.0 + diffVds / VADIBL)
+        Idsa = Idsa * (1.0 + np.log(Va / Vasat) / Cclm)
+        Idsa = Idsa * (1.0 + diffVds / VADITS)
+        Ids = Idsa * (1.0 + diffVds / VASCBE)
+
+        # Impact ionization
+        tmp = p["alpha0"] + p["alpha1"] * Leff
+        if tmp <= 0.0 or p["beta0"] <= 0.0:
+            Isub = np.zeros_like(Vds)
+        else:
+            T2 = tmp / Leff
+            high = diffVds > p["beta0"] / EXP_THRESHOLD
+            T1 = np.where(high, T2 * diffVds * np.exp(-p["beta0"] / np.where(high, diffVds, 1.0)),
+                          T2 * MIN_EXP * diffVds)
+            Isub = T1 * Idsa * Vdseff
+        return self.nf * Ids * Vdseff, self.nf * Isub
+
+
+def bin_dimensions(device_type, bin_number):
+    """
+    :return: Tuple (W, L) in µm of a bin.
+    :raises ValueError: If the bin is unknown.
+    """
+    dims = ModelExtractor.nmos_bins if device_type.lower() == "nch" else ModelExtractor.pmos_bins
+    if bin_number not in dims:
+        raise ValueError(f"No dimensions found for bin {bin_number}.")
+    return dims[bin_number]
+
+
+def _sweep_values(start, stop, step, loop=False):
+    from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+    return np.asarray(IceMOS_simulator_sky130.sweep_values(start, stop, step, loop=loop), dtype=float)
+
+
+def iv_curve(device, vgate_start=0, vgate_stop=1.8, vgate_step=0.1):
+    """
+    ID vs VG of a device, biased as in the IV netlists (VD = 1.8 V for NMOS, VSD = 1.8 V for PMOS).
+
+    :return: Tuple (vgate, current) of NumPy arrays.
+    """
+    vg = _sweep_values(vgate_start, vgate_stop, vgate_step)
+    return vg, device.current(vg, IV_DRAIN_VOLTAGE)
+
+
+def iv_vds_curves(device, vg_start=0, vg_stop=1.8, vg_step=0.6, vd_start=0, vd_stop=1.8, vd_step=0.1):
+    """
+    Output characteristics of a device for a gate sweep, in one vectorized evaluation.
+
+    :return: List of (vg, vd, current) tuples, one per gate voltage.
+    """
+    vg = _sweep_values(vg_start, vg_stop, vg_step, loop=True)
+    vd = _sweep_values(vd_start, vd_stop, vd_step)
+    current = device.current(vg[:, None], vd[None, :])
+    return [(float(v), vd, row) for v, row in zip(vg, current)]
+
+
+class BSIM4Simulator:
+    """
+    Drop-in for the curve methods of IceMOS_simulator_sky130 that evaluates the model cards of a circuit
+    root with BSIM4Device instead of running ngspice.
+    """
+
+    def __init__(self, circuit_root="circuits", gmin=1e-12):
+        """
+        :param circuit_root: Folder holding the cards of each bin (<device>/bin_<n>/bin_<n>_<device>_<type>.lib).
+        :param gmin: Conductance ngspice puts across every junction (S).
+        """
+        self.circuit_root = circuit_root
+        self.gmin = gmin
+
+    def resolve(self, device_type, bin_number=None, W=None, L=None, model_type="modified"):
+        """
+        :return: Tuple (bin_number, W, L, lib_file_path) of a bin's card.
+        :raises ValueError: If neither the bin nor both W and L are given, or no bin has these dimensions.
+        """
+        device_type = device_type.lower()
+        dims = ModelExtractor.nmos_bins if device_type == "nch" else ModelExtractor.pmos_bins
+        if bin_number is None:
+            if W is None or L is None:
+                raise ValueError("Either bin_number or both W and L must be provided.")
+            bin_number = next((b for b, (w, l) in dims.items() if abs(w - W) < 1e-6 and abs(l - L) < 1e-6), None)
+            if bin_number is None:
+                raise ValueError(f"No bin found for dimensions W={W} µm, L={L} µm for device {device_type}.")
+        if W is None or L is None:
+            W, L = bin_dimensions(device_type, bin_number)
+        lib_file_path = os.path.join(self.circuit_root, device_type, f"bin_{bin_number}",
+                                     f"bin_{bin_number}_{device_type}_{model_type}.lib")
+        return bin_number, W, L, lib_file_path
+
+    def device(self, device_type, bin_number=None, W=None, L=None, model_type="modified"):
+        """
+        :return: BSIM4Device of a bin's card at the temperature of its netlists.
+        :raises ValueError: If neither the bin nor both W and L are given, or no bin has these dimensions.
+        """
+        _, W, L, lib_file_path = self.resolve(device_type, bin_number, W, L, model_type)
+        return BSIM4Device(load_model_card(lib_file_path), W, L, temperature=TEMPERATURES[model_type],
+                           gmin=self.gmin)
+
+    def _metadata(self, device_type, bin_number, W, L, model_type):
+        """Metadata of a result, with the keys of IceMOS_simulator_sky130's results."""
+        bin_number, W, L, lib_file_path = self.resolve(device_type, bin_number, W, L, model_type)
+        return {"bin": bin_number, "W": W, "L": L, "model_type": model_type,
+                "temperature": TEMPERATURES[model_type], "model_card": lib_file_path,
+                "model_hash": model_hash(lib_file_path), "simulator": "bsim4-numpy", "status": "ok",
+                "cache_hit": False}
+
+    def iv_curve(self, device_type, bin_number=None, W=None, L=None,
+                 vgate_start=0, vgate_stop=1.8, vgate_step=0.1, model_type="modified"):
+        """
+        Return the IV curve (IDRAIN vs. VGATE).
+
+        :return: SweepResult of kind 'iv'.
+        """
+        vg, current = iv_curve(self.device(device_type, bin_number, W, L, model_type),
+                               vgate_start, vgate_stop, vgate_step)
+        return make_iv_result(device_type, vg, current,
+                              metadata=self._metadata(device_type, bin_number, W, L, model_type))
+
+    def iv_vds_curves(self, device_type, bin_number=None, W=None, L=None,
+                      vg_start=0, vg_stop=1.8, vg_step=0.6,
+                      vd_start=0, vd_stop=1.8, vd_step=0.1, model_type="modified"):
+        """
+        Return the output characteristics (IDS vs. VDS for NMOS, ISD vs. VSD for PMOS) for a gate sweep.
+
+        :return: SweepResult of kind 'iv_vds' with one current row per gate voltage.
+        """
+        curves = iv_vds_curves(self.device(device_type, bin_number, W, L, model_type),
+                               vg_start, vg_stop, vg_step, vd_start, vd_stop, vd_step)
+        vd = curves[0][1] if curves else _sweep_values(vd_start, vd_stop, vd_step)
+        return make_family_result(device_type, [vg for vg, _, _ in curves], vd, [y for _, _, y in curves],
+                                  metadata=self._metadata(device_type, bin_number, W, L, model_type))
+
+
+class BSIM4Model:
+    """
+    Model evaluator with the interface of IceMOS_sky130_fitting.SimulatorModel, evaluated in-process.
+    """
+
+    def __init__(self, device_type, bin_number, lib_file_path, kind, sweep, base_parameters=None,
+                 temperature=TEMPERATURES["modified"], gmin=1e-12):
+        """
+        :param device_type: 'nch' or 'pch'.
+        :param bin_number: Bin being fitted.
+        :param lib_file_path: Path of the bin's '_original.lib' model card.
+        :param kind: 'iv' (iv_curve sweep arguments) or 'iv_vds' (iv_vds_curves sweep arguments).
+        :param sweep: Dict of the sweep arguments (W and L default to the bin's dimensions).
+        :param base_parameters: (Optional) Values of the parameters that are not fitted but differ from
+                                the original card ({name: value}).
+        :param temperature: Device temperature in °C (the modified netlists run at 4 K).
+        :param gmin: Conductance ngspice puts across every junction (S).
+        """
+        if kind not in ("iv", "iv_vds"):
+            raise ValueError(f"Unknown sweep kind '{kind}'; expected 'iv' or 'iv_vds'.")
+        self.device_type = device_type.lower()
+        self.bin_number = bin_number
+        self.lib_file_path = lib_file_path
+        self.kind = kind
+        self.sweep = dict(sweep)
+        self.W = self.sweep.pop("W", None)
+        self.L = self.sweep.pop("L", None)
+        if self.W is None or self.L is None:
+            self.W, self.L = bin_dimensions(self.device_type, bin_number)
+        self.sweep.pop("model_type", None)
+        self.base_parameters = dict(base_parameters or {})
+        self.temperature = temperature
+        self.gmin = gmin
+        self.card = load_model_card(lib_file_path)
+        self.evaluations = 0
+
+    def device(self, parameters):
+        """
+        :return: BSIM4Device of the card with the base and given parameter values.
+        """
+        card = dict(self.card)
+        for name, value in dict(self.base_parameters, **parameters).items():
+            if value is not None:
+                card[name.lower()] = spice_number(value) if isinstance(value, str) else float(value)
+        return BSIM4Device(card, self.W, self.L, temperature=self.temperature, gmin=self.gmin)
+
+    def __call__(self, parameters):
+        """
+        Evaluate the sweep for a parameter set.
+
+        :param parameters: Dict {name: value} of the fitted parameters.
+        :return: List of (vg, x, y) tuples; vg is None for an 'iv' sweep.
+        """
+        device = self.device(parameters)
+        self.evaluations += 1
+        if self.kind == "iv":
+            x, y = iv_curve(device, **self.sweep)
+            return [(None, x, y)]
+        return iv_vds_curves(device, **self.sweep)
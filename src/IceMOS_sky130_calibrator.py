@@ -20,7 +20,7 @@ Note: This code uses placeholder functions for simulation and file updating. You
 your actual simulation code (e.g. from IceMOS_sky130_simulator and model modifier modules) as needed.
 """
 
-import sys, os, json, re
+import sys, os, json, re, hashlib
 from PyQt5 import QtWidgets, QtCore, QtGui
 
 
@@ -75,6 +75,50 @@ class ParameterSelectionDialog(QtWidgets.QDialog):
     def get_selected_parameters(self):
         return [item.text() for item in self.list_widget.selectedItems()]
 
+
+class SensitivityDialog(QtWidgets.QDialog):
+    """
+    Sensitivity ranking of the parameters of a bin, per operating region; accepting it adds the
+    top-k parameters to the tuner.
+    """
+    def __init__(self, result, top=8, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Parameter Sensitivity ({result.describe()})")
+        self.resize(700, 500)
+        self.result = result
+        layout = QtWidgets.QVBoxLayout(self)
+        ranking = result.ranking()
+        columns = [f"{region} ({result.measure})" for region in result.regions]
+        self.table = QtWidgets.QTableWidget(len(ranking), len(columns) + 1)
+        self.table.setHorizontalHeaderLabels(["Parameter"] + columns)
+        values = result.indices[result.measure]
+        for row, name in enumerate(ranking):
+            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(name))
+            for column, value in enumerate(values[result.names.index(name)]):
+                text = "-" if not np.isfinite(value) else f"{value:.4g}"
+                self.table.setItem(row, column + 1, QtWidgets.QTableWidgetItem(text))
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        form = QtWidgets.QHBoxLayout()
+        form.addWidget(QtWidgets.QLabel("Parameters to add to the tuner:"))
+        self.top_spin = QtWidgets.QSpinBox()
+        self.top_spin.setRange(1, max(len(ranking), 1))
+        self.top_spin.setValue(min(top, max(len(ranking), 1)))
+        form.addWidget(self.top_spin)
+        layout.addLayout(form)
+        btn_layout = QtWidgets.QHBoxLayout()
+        self.ok_button = QtWidgets.QPushButton("Add to Tuner")
+        self.cancel_button = QtWidgets.QPushButton("Close")
+        btn_layout.addWidget(self.ok_button)
+        btn_layout.addWidget(self.cancel_button)
+        layout.addLayout(btn_layout)
+        self.ok_button.clicked.connect(self.accept)
+        self.cancel_button.clicked.connect(self.reject)
+
+    def get_selected_parameters(self):
+        return self.result.ranking(top=self.top_spin.value())
+
 class ParameterTunerWindow(QtWidgets.QWidget):
     """
     Widget for tuning parameters.
@@ -90,6 +134,11 @@ class ParameterTunerWindow(QtWidgets.QWidget):
         self.parameters = current_params
         self.default_parameters = default_params
         self.available_parameters = available_parameters.copy()
+        # Optional hook called as callback(param, value, scale, min, max) on every slider move.
+        self.parameter_changed_callback = None
+        self.slider_scales = {}
+        # Calibration session file last saved or loaded (global search checkpoints go next to it).
+        self.session_file = None
         self.setup_ui()
 
     def setup_ui(self):
@@ -426,6 +475,7 @@ class ParameterTunerWindow(QtWidgets.QWidget):
             # Compute scale for slider mapping.
             range_width = max_val - min_val
             scale = 1e6 if range_width == 0 else desired_int_range / range_width
+            self.slider_scales[param] = scale
 
             slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
             slider.setMinimum(round(min_val * scale))
@@ -581,6 +631,9 @@ class ParameterTunerWindow(QtWidgets.QWidget):
                                   "min": self.parameters[param].get("min", value * 0.5),
                                   "max": self.parameters[param].get("max", value * 1.5)}
         print(f"{param} updated to {value}")
+        if self.parameter_changed_callback is not None:
+            self.parameter_changed_callback(param, value, self.slider_scales.get(param),
+                                            self.parameters[param]["min"], self.parameters[param]["max"])
 
     def update_parameter_from_text(self, param, text):
         try:
@@ -632,6 +685,7 @@ class ParameterTunerWindow(QtWidgets.QWidget):
         if filename:
             with open(filename, "w") as f:
                 json.dump(self.parameters, f, indent=4)
+            self.session_file = filename
             QtWidgets.QMessageBox.information(self, "Saved", "Calibration session saved successfully.")
 
     def load_calibration(self):
@@ -641,6 +695,7 @@ class ParameterTunerWindow(QtWidgets.QWidget):
         if filename:
             with open(filename, "r") as f:
                 loaded_data = json.load(f)
+            self.session_file = filename
 
             # Clear the existing dictionary instead of reassigning a new dict.
             self.parameters.clear()
@@ -665,6 +720,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self.available_parameters = extract_parameters_with_values(self.lib_file_path)
         self.default_parameters = {}  # start empty
         self.current_parameters = {}  # start empty
+        from IceMOS_sky130_result_cache import SimulationResultCache
+        from IceMOS_sky130_speculative import SpeculativeExecutor
+        # One cache for the interactive simulator and the speculative sandboxes, so pre-simulated values hit.
+        self.result_cache = SimulationResultCache(os.path.join("circuits", ".sim_cache"))
+        self.speculator = SpeculativeExecutor(self.lib_file_path, self.device_type, self.bin_number,
+                                              self.lib_file_path, result_cache=self.result_cache)
+        from IceMOS_sky130_surrogate import SurrogatePreview
+        self.surrogate = SurrogatePreview(self.lib_file_path, self.device_type, self.bin_number, self.lib_file_path)
+        self._confirm_job = None
+        self.simulation_window = None
+        self._fit_cancelled = False
         self.init_ui()
 
     def init_ui(self):
@@ -673,25 +739,132 @@ class MainWindow(QtWidgets.QMainWindow):
         # Remove the left pane; we rely on the tuner.
         self.tuner = ParameterTunerWindow(self.current_parameters, self.default_parameters, self.available_parameters)
         self.run_button = QtWidgets.QPushButton("Run Calibration Loop")
+        self.globalButton = QtWidgets.QPushButton("Global Search...")
+        self.sensitivityButton = QtWidgets.QPushButton("Sensitivity...")
         self.updateLibButton = QtWidgets.QPushButton("Update Modified LIB")
         self.simulationButton = QtWidgets.QPushButton("Open Simulation Window")
+        self.liveUpdateCheck = QtWidgets.QCheckBox("Live LIB update (pre-simulate next slider values)")
+        self.surrogateCheck = QtWidgets.QCheckBox("Surrogate preview")
+        self.surrogateCheck.setToolTip("Draw slider moves from a surrogate trained over the slider ranges; "
+                                       "ngspice confirms the curves in the background.")
+        # The real simulation starts once the slider has rested for a moment.
+        self.confirmTimer = QtCore.QTimer(self)
+        self.confirmTimer.setSingleShot(True)
+        self.confirmTimer.setInterval(300)
+        self.confirmPollTimer = QtCore.QTimer(self)
+        self.confirmPollTimer.setInterval(50)
+        self.tuner.parameter_changed_callback = self.on_parameter_changed
 
         central_widget = QtWidgets.QWidget()
         main_layout = QtWidgets.QVBoxLayout(central_widget)
         # Place buttons on a horizontal toolbar.
         toolbarLayout = QtWidgets.QHBoxLayout()
         toolbarLayout.addWidget(self.run_button)
+        toolbarLayout.addWidget(self.globalButton)
+        toolbarLayout.addWidget(self.sensitivityButton)
         toolbarLayout.addWidget(self.updateLibButton)
         toolbarLayout.addWidget(self.simulationButton)
+        toolbarLayout.addWidget(self.liveUpdateCheck)
+        toolbarLayout.addWidget(self.surrogateCheck)
         main_layout.addLayout(toolbarLayout)
         main_layout.addWidget(self.tuner)
         self.setCentralWidget(central_widget)
 
         self.run_button.clicked.connect(self.run_calibration)
+        self.globalButton.clicked.connect(self.run_global_search)
+        self.sensitivityButton.clicked.connect(self.run_sensitivity)
         self.updateLibButton.clicked.connect(self.update_modified_lib)
         self.simulationButton.clicked.connect(self.open_simulation_window)
+        self.surrogateCheck.toggled.connect(self.toggle_surrogate)
+        self.confirmTimer.timeout.connect(self.confirm_preview)
+        self.confirmPollTimer.timeout.connect(self.poll_confirmation)
+
+    def on_parameter_changed(self, param, value, scale, minimum, maximum):
+        """
+        With live update on, rewrite the modified LIB on every slider move (so the simulation window's
+        continuous run picks it up) and pre-simulate the values the slider is heading to.
+        """
+        if self.surrogateCheck.isChecked():
+            self.preview_surrogate()
+        if not self.liveUpdateCheck.isChecked():
+            return
+        self.write_modified_lib()
+        self.speculator.set_parameters(self.current_parameters)
+        self.speculator.on_parameter_changed(param, value, scale=scale, minimum=minimum, maximum=maximum)
+
+    def sync_surrogate(self):
+        """
+        Give the surrogate the tuner state and the sweep of the simulation window.
+
+        :return: True if there is a simulation window with a valid sweep.
+        """
+        simWin = self.simulation_window
+        if simWin is None:
+            return False
+        try:
+            kind, sweep = simWin.sweep_arguments(simWin.simTypeCombo.currentText())
+        except ValueError:
+            return False
+        self.surrogate.set_parameters(self.current_parameters)
+        self.surrogate.set_sweep(kind, **sweep)
+        return True
+
+    def toggle_surrogate(self, checked):
+        if not checked:
+            self.confirmTimer.stop()
+            self.confirmPollTimer.stop()
+            self.surrogate.cancel()
+            return
+        if not self.sync_surrogate():
+            QtWidgets.QMessageBox.warning(self, "Surrogate Preview",
+                                          "Open the simulation window and set its sweep first.")
+            self.surrogateCheck.setChecked(False)
+            return
+        if self.surrogate.train() is not None:
+            self.simulation_window.statusLabel.setText("Training the surrogate over the slider ranges...")
+
+    def preview_surrogate(self):
+        """Slider hook: draw the surrogate curves now and schedule their confirmation by ngspice."""
+        if not self.sync_surrogate():
+            return
+        curves = self.surrogate.preview()
+        if curves is None:
+            # New parameters, ranges or sweep: (re)train, and draw from the surrogate once it is ready.
+            self.surrogate.train()
+        else:
+            self.simulation_window.show_surrogate_curves(curves)
+        self.confirmTimer.start()
+
+    def confirm_preview(self):
+        self._confirm_job = self.surrogate.confirm()
+        if self._confirm_job is not None:
+            self.confirmPollTimer.start()
+
+    def poll_confirmation(self):
+        """Replace the preview with the confirmed curves (the surrogate has been refined with them)."""
+        job = self._confirm_job
+        if job is None or job.cancelled:
+            self.confirmPollTimer.stop()
+            return
+        if not job.done():
+            return
+        self.confirmPollTimer.stop()
+        self._confirm_job = None
+        from concurrent.futures import CancelledError
+        try:
+            curves, error = job.result()
+        except (CancelledError, RuntimeError, ValueError) as e:
+            # The next slider move schedules a new confirmation.
+            print(f"Surrogate confirmation failed: {e}")
+            return
+        if self.simulation_window is not None:
+            self.simulation_window.show_surrogate_curves(curves, confirmed=True, error=error)
 
     def update_modified_lib(self):
+        self.write_modified_lib()
+        QtWidgets.QMessageBox.information(self, "LIB Update", "Modified LIB file has been updated.")
+
+    def write_modified_lib(self):
         # Import ModelModifier from the param handler module.
         from IceMOS_sky130_param_handler import ModelModifier
         # Construct the modified file path (assumes _original.lib is in self.lib_file_path)
@@ -707,19 +880,276 @@ class MainWindow(QtWidgets.QMainWindow):
                 if new_val is not None:
                     # Modify the parameter in the given bin.
                     modifier.modify_parameter(self.bin_number, param, str(new_val))
-        QtWidgets.QMessageBox.information(self, "LIB Update", "Modified LIB file has been updated.")
 
     def open_simulation_window(self):
-        simWin = SimulationWindow(self.device_type, self.bin_number, self.lib_file_path)
+        simWin = SimulationWindow(self.device_type, self.bin_number, self.lib_file_path,
+                                  speculator=self.speculator, result_cache=self.result_cache)
         simWin.resize(800, 600)
         simWin.show()
+        # The calibration loop fits the lab curves and sweep of this window.
+        self.simulation_window = simWin
+
+    def fit_problem(self, require_parameters=True):
+        """
+        The model and residuals of a fit of the selected parameters to the lab curves loaded in the
+        simulation window, over its current sweep (a warning is shown when something is missing).
+
+        :param require_parameters: Warn and return None when no parameter is selected.
+        :return: Tuple (SimulatorModel, CurveResiduals), or None.
+        """
+        from IceMOS_sky130_fitting import CurveResiduals, SimulatorModel
+        if require_parameters and not self.current_parameters:
+            QtWidgets.QMessageBox.warning(self, "Calibration", "Add the parameters to fit first.")
+            return None
+        simWin = self.simulation_window
+        sim_type = simWin.simTypeCombo.currentText() if simWin is not None else None
+        targets = simWin.fit_targets(sim_type) if simWin is not None else []
+        if not targets:
+            QtWidgets.QMessageBox.warning(self, "Calibration",
+                                          "Open the simulation window and load lab data for the sweep to fit.")
+            return None
+        try:
+            kind, sweep = simWin.sweep_arguments(sim_type)
+        except ValueError:
+            QtWidgets.QMessageBox.warning(self, "Calibration", "Check the sweep values of the simulation window.")
+            return None
+        model = SimulatorModel(self.lib_file_path, self.device_type, self.bin_number, self.lib_file_path,
+                               kind, sweep)
+        return model, CurveResiduals(targets)
+
+    def apply_fit(self, result):
+        """Set the fitted values in the tuner, write the modified LIB and re-run the simulation window."""
+        print(f"Calibration: {result.describe()}")
+        for name, value in result.parameters.items():
+            print(f"  {name}: {value}")
+            self.current_parameters[name]["value"] = value
+        self.tuner.populate_parameters()
+        self.write_modified_lib()
+        self.simulation_window.run_simulation()
+        QtWidgets.QMessageBox.information(self, "Calibration", f"Calibration finished: {result.describe()}.")
 
     def run_calibration(self):
-        print("Running calibration with parameters:")
-        for k, v in self.current_parameters.items():
-            print(f"  {k}: {v}")
-        QtWidgets.QMessageBox.information(self, "Calibration", "Calibration loop executed (placeholder).")
+        """
+        Fit the selected parameters (within their min/max) to the lab curves loaded in the simulation
+        window, over its current sweep, then write the fitted values to the modified LIB.
+        """
+        from IceMOS_sky130_fitting import fit_parameters
+        from IceMOS_sky130_scheduler import default_scheduler
+        from IceMOS_sky130_sens_jacobian import SensitivityJacobian
+        problem = self.fit_problem()
+        if problem is None:
+            return
+        max_nfev, ok = QtWidgets.QInputDialog.getInt(self, "Calibration", "Maximum number of simulations:",
+                                                     100, 1, 100000)
+        if not ok:
+            return
 
+        model, residuals = problem
+        names = list(self.current_parameters)
+        progress_dialog = QtWidgets.QProgressDialog("Fitting...", "Cancel", 0, max_nfev, self)
+        progress_dialog.setWindowTitle("Calibration")
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.show()
+        self._fit_cancelled = False
+        progress_dialog.canceled.connect(lambda: setattr(self, "_fit_cancelled", True))
+        latest = {}
+
+        def on_progress(progress):
+            # Called from the scheduler's worker thread; the dialog is updated by the loop below.
+            latest["progress"] = progress
+            return self._fit_cancelled
+
+        # The Jacobian comes from ngspice DC sensitivities, checked against (and otherwise replaced by)
+        # finite differences simulated together in one ngspice launch per iteration.
+        jacobian = SensitivityJacobian(model, residuals, names)
+        job = default_scheduler().submit(fit_parameters, model, residuals, self.current_parameters, names=names,
+                                         max_nfev=max_nfev, jacobian=jacobian, jacobian_update="broyden",
+                                         progress=on_progress, priority="optimizer", owner="calibration",
+                                         resource=("calibration", self.device_type, self.bin_number))
+        while not job.wait(0.1):
+            if "progress" in latest:
+                progress_dialog.setValue(latest["progress"].nfev)
+                progress_dialog.setLabelText(f"Fitting... {latest['progress'].describe()}")
+            QtWidgets.QApplication.processEvents()
+        progress_dialog.close()
+        try:
+            result = job.result()
+        except (RuntimeError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self, "Calibration", f"Calibration failed: {e}")
+            return
+        self.apply_fit(result)
+
+    def run_global_search(self):
+        """
+        Search the whole min/max box of the selected parameters with CMA-ES or differential evolution,
+        every generation simulated in parallel on the scheduler and checkpointed next to the calibration
+        session, then write the best values to the modified LIB.
+        """
+        import threading
+        from concurrent.futures import CancelledError
+        from IceMOS_sky130_global_opt import PoolEvaluator, global_fit, session_checkpoint
+        problem = self.fit_problem()
+        if problem is None:
+            return
+        methods = {"CMA-ES": "cmaes", "Differential evolution": "de"}
+        method, ok = QtWidgets.QInputDialog.getItem(self, "Global Search", "Optimizer:", list(methods), 0, False)
+        if not ok:
+            return
+        max_evaluations, ok = QtWidgets.QInputDialog.getInt(self, "Global Search", "Maximum number of simulations:",
+                                                            500, 10, 1000000)
+        if not ok:
+            return
+        minutes, ok = QtWidgets.QInputDialog.getInt(self, "Global Search", "Time budget (minutes):", 60, 1, 100000)
+        if not ok:
+            return
+        session_file = self.tuner.session_file or os.path.join(
+            os.path.dirname(self.lib_file_path), f"bin_{self.bin_number}_{self.device_type}_session.json")
+        checkpoint = session_checkpoint(session_file)
+        resume = False
+        if os.path.exists(checkpoint):
+            resume = QtWidgets.QMessageBox.question(
+                self, "Global Search", f"Resume the search checkpointed in {checkpoint}?",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No) == QtWidgets.QMessageBox.Yes
+
+        model, residuals = problem
+        names = list(self.current_parameters)
+        lower = [float(self.current_parameters[name]["min"]) for name in names]
+        upper = [float(self.current_parameters[name]["max"]) for name in names]
+        x0 = [float(self.current_parameters[name]["value"]) for name in names]
+        evaluator = PoolEvaluator(model, residuals, names, owner="global-search")
+        progress_dialog = QtWidgets.QProgressDialog("Searching...", "Stop", 0, max_evaluations, self)
+        progress_dialog.setWindowTitle("Global Search")
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.show()
+        self._fit_cancelled = False
+        progress_dialog.canceled.connect(lambda: setattr(self, "_fit_cancelled", True))
+        latest = {}
+
+        def on_progress(progress):
+            latest["progress"] = progress
+            return self._fit_cancelled
+
+        def search():
+            # The driver only waits for the generations' scheduler jobs, so it runs on its own thread
+            # rather than holding a scheduler slot.
+            try:
+                latest["result"] = global_fit(evaluator, lower, upper, method=methods[method], names=names, x0=x0,
+                                              max_evaluations=max_evaluations, max_seconds=60.0 * minutes,
+                                              checkpoint=checkpoint, resume=resume, progress=on_progress)
+            except (RuntimeError, ValueError, OSError, CancelledError) as e:
+                latest["error"] = e
+
+        thread = threading.Thread(target=search, name="GlobalSearch", daemon=True)
+        thread.start()
+        while thread.is_alive():
+            thread.join(0.1)
+            if "progress" in latest:
+                progress_dialog.setValue(min(latest["progress"].nfev, max_evaluations))
+                progress_dialog.setLabelText(f"Searching... generation {latest['progress'].iteration}, "
+                                             f"{latest['progress'].nfev} simulations, "
+                                             f"best cost {latest['progress'].cost:.4g}")
+            QtWidgets.QApplication.processEvents()
+        progress_dialog.close()
+        if "result" not in latest:
+            error = latest.get("error", "the search ended without a result")
+            QtWidgets.QMessageBox.warning(self, "Global Search", f"Global search failed: {error!r}")
+            return
+        if not np.isfinite(latest["result"].cost):
+            QtWidgets.QMessageBox.warning(self, "Global Search", "No candidate could be simulated.")
+            return
+        self.apply_fit(latest["result"])
+
+    def run_sensitivity(self):
+        """
+        Rank every parameter of the bin by its effect on the error against the lab curves of the simulation
+        window, per operating region (Morris screening or Sobol indices, simulated in parallel batches),
+        around the tuner values, and add the top-ranked parameters to the tuner.
+        """
+        import threading
+        from IceMOS_sky130_circuit_model_extractor import ModelExtractor
+        from IceMOS_sky130_sensitivity import RegionErrors, morris, operating_regions, parameter_box, sobol
+        problem = self.fit_problem(require_parameters=False)
+        if problem is None:
+            return
+        methods = ["Morris screening", "Sobol indices"]
+        method, ok = QtWidgets.QInputDialog.getItem(self, "Sensitivity", "Method:", methods, 0, False)
+        if not ok:
+            return
+        if method == methods[0]:
+            budget, ok = QtWidgets.QInputDialog.getInt(self, "Sensitivity", "Number of trajectories:", 10, 2, 1000)
+        else:
+            budget, ok = QtWidgets.QInputDialog.getInt(self, "Sensitivity", "Number of base samples:", 32, 4, 100000)
+        if not ok:
+            return
+
+        model, residuals = problem
+        values = dict(self.available_parameters)
+        values.update({name: float(entry["value"]) for name, entry in self.current_parameters.items()})
+        names, lower, upper = parameter_box(values)
+        for name, entry in self.current_parameters.items():
+            if name in names and "min" in entry and "max" in entry and float(entry["max"]) > float(entry["min"]):
+                lower[names.index(name)] = float(entry["min"])
+                upper[names.index(name)] = float(entry["max"])
+        evaluations = budget * (len(names) + 1) if method == methods[0] else budget * (len(names) + 2)
+        if QtWidgets.QMessageBox.question(
+                self, "Sensitivity", f"{len(names)} parameters: {evaluations} simulations. Continue?",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No) != QtWidgets.QMessageBox.Yes:
+            return
+        # The analysis is centred on the tuner values.
+        model.base_parameters = {name: float(entry["value"]) for name, entry in self.current_parameters.items()}
+        dims = ModelExtractor.nmos_bins if self.device_type == "nch" else ModelExtractor.pmos_bins
+        W, L = model.sweep.get("W"), model.sweep.get("L")
+        if W is None or L is None:
+            W, L = dims[self.bin_number]
+        evaluator = RegionErrors(model, residuals, names, operating_regions(residuals.targets, W, L),
+                                 owner="sensitivity")
+        progress_dialog = QtWidgets.QProgressDialog("Simulating...", "Cancel", 0, evaluations, self)
+        progress_dialog.setWindowTitle("Sensitivity")
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.show()
+        self._fit_cancelled = False
+        progress_dialog.canceled.connect(lambda: setattr(self, "_fit_cancelled", True))
+        latest = {}
+
+        def on_progress(done, total):
+            latest["done"] = done
+            return self._fit_cancelled
+
+        def analyse():
+            try:
+                if method == methods[0]:
+                    latest["result"] = morris(evaluator, lower, upper, trajectories=budget, progress=on_progress)
+                else:
+                    latest["result"] = sobol(evaluator, lower, upper, samples=budget, progress=on_progress)
+            except (RuntimeError, ValueError) as e:
+                latest["error"] = e
+
+        thread = threading.Thread(target=analyse, name="Sensitivity", daemon=True)
+        thread.start()
+        while thread.is_alive():
+            thread.join(0.1)
+            if "done" in latest:
+                progress_dialog.setValue(latest["done"])
+                progress_dialog.setLabelText(f"Simulating... {latest['done']} of {evaluations} parameter sets")
+            QtWidgets.QApplication.processEvents()
+        progress_dialog.close()
+        if "error" in latest:
+            QtWidgets.QMessageBox.warning(self, "Sensitivity", f"Sensitivity analysis failed: {latest['error']}")
+            return
+        result = latest["result"]
+        print(f"Sensitivity: {result.describe()}")
+        for region in result.regions:
+            print(f"  {region}: {', '.join(result.ranking(region, top=10))}")
+        dialog = SensitivityDialog(result, parent=self)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return
+        for name in dialog.get_selected_parameters():
+            if name in self.current_parameters:
+                continue
+            j = names.index(name)
+            self.current_parameters[name] = {"value": values[name], "min": float(lower[j]), "max": float(upper[j])}
+            self.default_parameters[name] = dict(self.current_parameters[name])
+        self.tuner.populate_parameters()
 
 
 def get_plot_labels(device_type, sim_type):
@@ -741,7 +1171,9 @@ from PyQt5 import QtWidgets, QtCore, QtGui
 import pyqtgraph as pg
 pg.setConfigOption('useOpenGL', False)
 import pandas as pd
-import os, re
+import os, re, time
+import numpy as np
+from IceMOS_sky130_lab_catalog import parse_measurement_name
 
 class ColumnSelectionDialog(QtWidgets.QDialog):
     def __init__(self, columns, title="Select Columns", parent=None):
@@ -792,17 +1224,157 @@ class PlotWindow(pg.GraphicsLayoutWidget):
             self.plotItem.plot(x, y, pen=pen, symbol='o', symbolSize=5, name=label)
 
 
+class RunHistoryDialog(QtWidgets.QDialog):
+    """
+    Picker for the recorded runs to overlay on the simulation plot.
+    """
+
+    def __init__(self, history, device_type, bin_number, kind, selected=(), parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Run History")
+        self.history = history
+        self.device_type = device_type
+        self.bin_number = bin_number
+        self.kind = kind
+        self.selected = set(selected)
+        layout = QtWidgets.QVBoxLayout(self)
+        self.allBinsCheck = QtWidgets.QCheckBox("Show runs of every bin")
+        self.runList = QtWidgets.QListWidget()
+        self.runList.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        layout.addWidget(QtWidgets.QLabel("Select the runs to overlay (newest first):"))
+        layout.addWidget(self.allBinsCheck)
+        layout.addWidget(self.runList)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        layout.addWidget(buttons)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.allBinsCheck.toggled.connect(self.populate)
+        self.populate()
+
+    def populate(self):
+        self.runList.clear()
+        bin_number = None if self.allBinsCheck.isChecked() else self.bin_number
+        for snapshot in self.history.runs(device=self.device_type, bin=bin_number, kind=self.kind):
+            item = QtWidgets.QListWidgetItem(snapshot.describe())
+            item.setData(QtCore.Qt.UserRole, snapshot.run_id)
+            self.runList.addItem(item)
+            item.setSelected(snapshot.run_id in self.selected)
+
+    def get_selected_runs(self):
+        return [item.data(QtCore.Qt.UserRole) for item in self.runList.selectedItems()]
+
+
+class LabCatalogDialog(QtWidgets.QDialog):
+    """
+    Picker for measured curves from a lab catalog, filtered by the fixed biases.
+    """
+
+    def __init__(self, catalog, device_type, sweep, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Lab Catalog")
+        self.catalog = catalog
+        self.device_type = device_type
+        self.sweep = sweep
+        layout = QtWidgets.QVBoxLayout(self)
+        formLayout = QtWidgets.QFormLayout()
+        self.biasCombos = {}
+        for bias in ("VB", "VS", "VD" if sweep == "IDVG" else "VG"):
+            combo = QtWidgets.QComboBox()
+            combo.addItem("Any")
+            for value in catalog.values(bias, sweep=sweep, device=device_type):
+                combo.addItem(f"{value:g}", value)
+            combo.currentIndexChanged.connect(self.populate)
+            formLayout.addRow(f"{bias}:", combo)
+            self.biasCombos[bias] = combo
+        layout.addLayout(formLayout)
+        self.aggregateCheck = QtWidgets.QCheckBox("Aggregate all devices (median with P10-P90 band)")
+        layout.addWidget(self.aggregateCheck)
+        self.curveList = QtWidgets.QListWidget()
+        self.curveList.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        layout.addWidget(self.curveList)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        layout.addWidget(buttons)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.populate()
+
+    def conditions(self):
+        return {bias: combo.currentData() for bias, combo in self.biasCombos.items()
+                if combo.currentIndex() > 0}
+
+    def populate(self):
+        self.curveList.clear()
+        self.records = self.catalog.query(sweep=self.sweep, device=self.device_type, **self.conditions())
+        for record in self.records:
+            item = QtWidgets.QListWidgetItem(f"{record}  [{record.attrs['die']}, "
+                                             f"W={record.attrs['W']:g} L={record.attrs['L']:g}]")
+            self.curveList.addItem(item)
+            item.setSelected(True)
+
+    def get_selected_records(self):
+        return [self.records[self.curveList.row(item)] for item in self.curveList.selectedItems()]
+
+
+class DeviceFiguresDialog(QtWidgets.QDialog):
+    """
+    Derived device figures (threshold, subthreshold slope, DIBL, gm, gds, on/off) of the simulated and
+    measured curves of a bin, one row per device condition.
+    """
+
+    def __init__(self, table, parent=None):
+        super().__init__(parent)
+        from IceMOS_sky130_device_figures import FIGURES
+        self.setWindowTitle("Device Figures")
+        self.resize(1000, 300)
+        self.table = table
+        layout = QtWidgets.QVBoxLayout(self)
+        conditions = ["source", "temperature", "W", "L", "die", "vb"]
+        figures = [(name, f"{name} ({unit})" if unit else name) for name, unit in FIGURES]
+        self.grid = QtWidgets.QTableWidget(len(table), len(conditions) + len(figures))
+        self.grid.setHorizontalHeaderLabels(conditions + [label for _, label in figures])
+        for row, values in enumerate(table):
+            for column, name in enumerate(conditions + [name for name, _ in figures]):
+                value = values.get(name)
+                if value is None or (isinstance(value, float) and not np.isfinite(value)):
+                    text = "-"
+                else:
+                    text = f"{value:.4g}" if isinstance(value, float) else str(value)
+                self.grid.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+        self.grid.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.grid)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+
 class SimulationWindow(QtWidgets.QDialog):
-    def __init__(self, device_type, bin_number, lib_file_path, parent=None):
+    # New lab curves reported by the folder watcher (emitted from its thread, handled in the GUI thread).
+    labCurvesArrived = QtCore.pyqtSignal(list)
+
+    def __init__(self, device_type, bin_number, lib_file_path, parent=None, speculator=None, result_cache=None):
         super().__init__(parent)
         self.device_type = device_type.lower()
         self.bin_number = bin_number
         self.lib_file_path = lib_file_path
+        self.speculator = speculator
+        self.result_cache = result_cache
         self.setWindowTitle("Simulation Configuration")
 
         # Variables to store lab data
+        self.lab_root = None  # Last measurement folder indexed with the lab catalog
         self.lab_data_iv_vs_vg = None  # For IV vs VG (a single curve)
         self.lab_data_iv_vs_vds = []  # For IV vs VDS/VSD (list of curves)
+        self.lab_catalog = None
+        self.lab_watcher = None
+        self.lab_reference = None  # ReferenceSet aggregated over devices, if selected in the lab catalog
+        # Error of each watched lab curve against the latest simulation, per simulation type and curve label
+        self.lab_errors = {"IV vs VG": {}, "IV vs VDS": {}}
+
+        # Latest simulated curves and the recorded runs overlaid on them, per simulation type
+        self.sim_curves = {}
+        self.history_overlays = {"IV vs VG": [], "IV vs VDS": []}
+        # Metric engine per simulation type, with the lab curves it was built for
+        self.metric_engines = {}
 
         # Timer for continuous simulation
         self.timer = QtCore.QTimer(self)
@@ -810,7 +1382,34 @@ class SimulationWindow(QtWidgets.QDialog):
 
         self.setup_ui()
         from IceMOS_sky130_simulator import IceMOS_simulator_sky130
-        self.simulator = IceMOS_simulator_sky130(self.lib_file_path)
+        from IceMOS_sky130_scheduler import default_scheduler
+        from IceMOS_sky130_run_history import RunHistory
+        self.history = RunHistory()
+        self.simulator = IceMOS_simulator_sky130(self.lib_file_path,
+                                                 progress_callback=self.on_simulation_progress,
+                                                 result_cache=self.result_cache,
+                                                 run_history=self.history)
+        self.scheduler = default_scheduler()
+        self._latest_progress = None
+        self._simulation_busy = False
+
+    def on_simulation_progress(self, progress):
+        """Remember the progress parsed from the ngspice output (called from the scheduler's worker thread)."""
+        self._latest_progress = progress
+
+    def run_interactive(self, fn, *args, **kwargs):
+        """
+        Run a simulator call as an interactive job, so that it jumps ahead of optimizer and batch
+        work, and keep the window responsive while waiting for it.
+        """
+        job = self.scheduler.submit(fn, *args, priority="interactive", owner="gui",
+                                    resource=(self.device_type, self.bin_number), **kwargs)
+        while not job.wait(0.05):
+            if self._latest_progress is not None:
+                self.statusLabel.setText(f"Simulating... {self._latest_progress.describe()}")
+            QtWidgets.QApplication.processEvents()
+        self._latest_progress = None
+        return job.result()
 
     def setup_ui(self):
         layout = QtWidgets.QVBoxLayout(self)
@@ -843,13 +1442,25 @@ class SimulationWindow(QtWidgets.QDialog):
         self.stopBtn = QtWidgets.QPushButton("Stop Continuous Simulation")
         # New button to load lab data
         self.loadLabDataBtn = QtWidgets.QPushButton("Load Lab Data")
+        self.labCatalogBtn = QtWidgets.QPushButton("Lab Catalog...")
+        self.historyBtn = QtWidgets.QPushButton("Compare with History...")
+        self.watchBtn = QtWidgets.QPushButton("Watch Folder...")
+        self.watchBtn.setCheckable(True)
+        self.figuresBtn = QtWidgets.QPushButton("Device Figures...")
         btnLayout = QtWidgets.QHBoxLayout()
         btnLayout.addWidget(self.runOnceBtn)
         btnLayout.addWidget(self.runContinuousBtn)
         btnLayout.addWidget(self.stopBtn)
         btnLayout.addWidget(self.loadLabDataBtn)
+        btnLayout.addWidget(self.labCatalogBtn)
+        btnLayout.addWidget(self.historyBtn)
+        btnLayout.addWidget(self.watchBtn)
+        btnLayout.addWidget(self.figuresBtn)
         layout.addLayout(btnLayout)
 
+        self.showReferenceCheck = QtWidgets.QCheckBox("Overlay original model (27 C) reference")
+        layout.addWidget(self.showReferenceCheck)
+
         self.statusLabel = QtWidgets.QLabel("")
         layout.addWidget(self.statusLabel)
 
@@ -857,6 +1468,11 @@ class SimulationWindow(QtWidgets.QDialog):
         self.runContinuousBtn.clicked.connect(lambda: self.timer.start(5000))
         self.stopBtn.clicked.connect(self.timer.stop)
         self.loadLabDataBtn.clicked.connect(self.load_lab_data)
+        self.labCatalogBtn.clicked.connect(self.load_lab_catalog)
+        self.historyBtn.clicked.connect(self.open_history)
+        self.watchBtn.toggled.connect(self.toggle_lab_watch)
+        self.figuresBtn.clicked.connect(self.show_device_figures)
+        self.labCurvesArrived.connect(self.on_lab_curves_arrived)
 
         self.setLayout(layout)
 
@@ -910,15 +1526,13 @@ class SimulationWindow(QtWidgets.QDialog):
                                 df_i = pd.read_csv(path)
                                 x_data = df_i[x_col].values *-1  #just to adapt lab data to our netlist sim
                                 y_data = df_i[y_col].values *-1
-                            # Extract the VG value from the file name (expects 'VG_<value>.csv')
+                            # Extract the VG value from the file name (expects '..._VG_<value>...')
+                            conditions = parse_measurement_name(path) or {}
                             m = re.search(r'VG_(-?\d+\.?\d*)', path)
-                            if m:
-                                vg_val = float(m.group(1))
-                                # For PMOS, multiply by -1
-                                if self.device_type == "pch":
-                                    vg_val = -vg_val
-                            else:
-                                vg_val = None
+                            vg_val = conditions.get("VG", float(m.group(1)) if m else None)
+                            # For PMOS, multiply by -1
+                            if vg_val is not None and self.device_type == "pch":
+                                vg_val = -vg_val
                             label = f"VGS = {vg_val}" if vg_val is not None and self.device_type == "nch" else (
                                 f"VSG = {vg_val}" if vg_val is not None else "Lab")
                             lab_curves.append((x_data, y_data, label, "b"))
@@ -927,7 +1541,333 @@ class SimulationWindow(QtWidgets.QDialog):
                     self.lab_data_iv_vs_vds = lab_curves
                     QtWidgets.QMessageBox.information(self, "Data Loaded", "Lab data loaded for IV vs VDS.")
 
+    def load_lab_catalog(self):
+        """
+        Index a measurement folder (only new or changed files are read) and pick curves by condition.
+        """
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Measurement Folder", self.lab_root or "")
+        if not folder:
+            return
+        from IceMOS_sky130_lab_catalog import LabCatalog
+        self.lab_root = folder
+        catalog = LabCatalog(folder)
+        imported, skipped = catalog.scan()
+        self.statusLabel.setText(f"Lab catalog: {imported} new or changed file(s), {skipped} skipped.")
+        sim_type = self.simTypeCombo.currentText()
+        sweep = "IDVG" if sim_type == "IV vs VG" else "IDVD"
+        dlg = LabCatalogDialog(catalog, self.device_type, sweep, parent=self)
+        if dlg.exec_() != QtWidgets.QDialog.Accepted:
+            return
+        if dlg.aggregateCheck.isChecked():
+            lab_curves = self.reference_curves(catalog, sweep, dlg.conditions())
+        else:
+            lab_curves = [self.lab_curve(record, x, y) for record, x, y in catalog.load(dlg.get_selected_records())]
+        if sweep == "IDVG":
+            self.lab_data_iv_vs_vg = lab_curves or None
+        else:
+            self.lab_data_iv_vs_vds = lab_curves
+        self.show_curves(sim_type)
+
+    def show_device_figures(self):
+        """
+        Extract the device figures of the bin from the calibrated model (and the original model if its
+        overlay is enabled) and from the measurements of the last lab folder, and show them side by side.
+        """
+        from IceMOS_sky130_device_figures import extract_figures, simulated_curves
+        from IceMOS_sky130_lab_catalog import LabCatalog
+        model_types = ["modified", "original"] if self.showReferenceCheck.isChecked() else ["modified"]
+        curves = []
+        for model_type in model_types:
+            curves += self.run_interactive(simulated_curves, self.simulator, self.device_type, self.bin_number,
+                                           model_type)
+        if self.lab_root:
+            catalog = LabCatalog(self.lab_root)
+            catalog.scan()
+            curves += [(record, x, y) for sweep in ("IDVG", "IDVD")
+                       for record, x, y in catalog.load(sweep=sweep, device=self.device_type)
+                       if record.bin is None or record.bin == self.bin_number]
+        table = extract_figures(curves)
+        self.statusLabel.setText(f"Device figures of {len(table)} condition(s).")
+        DeviceFiguresDialog(table, parent=self).exec_()
+
+    def lab_label(self, sweep, vg, vd, vb, prefix="Lab"):
+        """Legend label of a lab curve from its fixed biases (terminal convention)."""
+        if sweep == "VG":
+            return f"{prefix} VD={vd:g} VB={vb:g}" if vd is not None else f"{prefix} Data (IV vs VG)"
+        vg_label = "VGS" if self.device_type == "nch" else "VSG"
+        sign = -1.0 if self.device_type == "pch" else 1.0
+        return f"{prefix} {vg_label} = {sign * vg:g}, VB={vb:g}"
+
+    def lab_curve(self, record, x, y):
+        """Plot curve (x, y, label, color) of a cataloged lab curve."""
+        # The GUI plots PMOS curves source-referenced (VSG, VSD, ISD); the lab files are terminal-referenced.
+        sign = -1.0 if self.device_type == "pch" else 1.0
+        return sign * x, sign * y, self.lab_label(record.sweep, record.vg, record.vd, record.vb), "b"
+
+    def reference_curves(self, catalog, sweep, conditions):
+        """
+        Median and P10/P90 curves of every device measured at the selected conditions, used as the
+        reference the simulation is compared with.
+        """
+        from IceMOS_sky130_lab_aggregate import aggregate_catalog
+        reference = aggregate_catalog(catalog, sweep, device=self.device_type, **conditions)
+        self.lab_reference = reference
+        sign = -1.0 if self.device_type == "pch" else 1.0
+        curves = []
+        for curve in reference:
+            biases = (reference.sweep, curve.biases["vg"], curve.biases["vd"], curve.biases["vb"])
+            curves.append((sign * curve.grid, sign * curve.median,
+                           self.lab_label(*biases, prefix=f"Median ({curve.devices} devices)"), "b"))
+            for p in (10, 90):
+                curves.append((sign * curve.grid, sign * curve.percentiles[p], self.lab_label(*biases, prefix=f"P{p}"),
+                               (100, 100, 255)))
+        self.statusLabel.setText(f"Reference curves: {len(reference)} bias point(s) aggregated over "
+                                 f"{max((curve.devices for curve in reference), default=0)} device(s).")
+        return curves
+
+    def toggle_lab_watch(self, checked):
+        """Start or stop watching a measurement folder; new curves are added to the plots as they arrive."""
+        from IceMOS_sky130_lab_catalog import LabCatalog
+        from IceMOS_sky130_lab_watcher import LabFolderWatcher
+        if self.lab_watcher is not None:
+            self.lab_watcher.stop()
+            self.lab_watcher = None
+        if not checked:
+            self.watchBtn.setText("Watch Folder...")
+            self.statusLabel.setText("Stopped watching the measurement folder.")
+            return
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Measurement Folder to Watch",
+                                                            self.lab_root or "")
+        if not folder:
+            self.watchBtn.setChecked(False)
+            return
+        self.lab_root = folder
+        self.lab_catalog = LabCatalog(folder)
+        # Curves already in the catalog are picked with the Lab Catalog dialog; only new ones are added here.
+        self.lab_catalog.scan()
+        self.lab_watcher = LabFolderWatcher(self.lab_catalog, self.labCurvesArrived.emit)
+        self.lab_watcher.start()
+        self.watchBtn.setText("Stop Watching")
+        self.statusLabel.setText(f"Watching {folder} for new measurements ({self.lab_watcher.mode}).")
+
+    def on_lab_curves_arrived(self, records):
+        """
+        Add the curves found by the folder watcher: only their error against the latest simulation is
+        computed, and only the plots of their sweep type are redrawn.
+        """
+        records = [record for record in records if record.device == self.device_type
+                   and record.attrs.get("quantity") == "ID" and record.sweep in ("VG", "VD")
+                   and (record.bin is None or record.bin == self.bin_number)]
+        if not records:
+            return
+        updated = []
+        errors = []
+        for record, x, y in self.lab_catalog.load(records):
+            curve = self.lab_curve(record, x, y)
+            if record.sweep == "VG":
+                sim_type = "IV vs VG"
+                self.lab_data_iv_vs_vg = (self.lab_data_iv_vs_vg or []) + [curve]
+            else:
+                sim_type = "IV vs VDS"
+                self.lab_data_iv_vs_vds = self.lab_data_iv_vs_vds + [curve]
+            gate_bias = None if record.vg is None else (-record.vg if self.device_type == "pch" else record.vg)
+            error = self.lab_curve_error(sim_type, curve, gate_bias)
+            if error is not None:
+                self.lab_errors[sim_type][curve[2]] = error
+                errors.append(f"{curve[2]}: {error:.3f} dec")
+            if sim_type not in updated:
+                updated.append(sim_type)
+        for sim_type in updated:
+            attribute = 'plotWin_IV_vs_VG' if sim_type == "IV vs VG" else 'plotWin_IV_vs_VDS'
+            plot_win = getattr(self, attribute, None)
+            if sim_type == self.simTypeCombo.currentText() or (plot_win is not None and plot_win.isVisible()):
+                self.show_curves(sim_type)
+        self.statusLabel.setText(f"{len(records)} new lab curve(s) from {self.lab_root}."
+                                 + (f" RMS log error: {'; '.join(errors[-3:])}" if errors else ""))
+
+    def lab_curve_error(self, sim_type, lab_curve, gate_bias=None):
+        """
+        RMS error (decades) of a lab curve against the latest simulated curve of the same type.
+
+        For a family, the simulated curve at the lab gate bias is used. Returns None if there is no
+        simulation to compare with.
+        """
+        # Modified-model curves are drawn in white; family labels end with '=<gate bias> V'.
+        candidates = [curve for curve in self.sim_curves.get(sim_type, []) if curve[3] == "w"]
+        if sim_type == "IV vs VDS" and gate_bias is not None:
+            matches = [(curve, re.search(r"=(-?[\d.]+) V$", curve[2])) for curve in candidates]
+            candidates = [curve for curve, m in matches if m and abs(float(m.group(1)) - gate_bias) < 1e-6]
+        if not candidates:
+            return None
+        x_sim, y_sim = np.asarray(candidates[0][0], dtype=float), np.asarray(candidates[0][1], dtype=float)
+        x_lab, y_lab = np.asarray(lab_curve[0], dtype=float), np.asarray(lab_curve[1], dtype=float)
+        order = np.argsort(x_sim)
+        inside = (x_lab >= x_sim.min()) & (x_lab <= x_sim.max()) & (np.abs(y_lab) > 0)
+        if not inside.any():
+            return None
+        y_interp = np.interp(x_lab[inside], x_sim[order], y_sim[order])
+        floor = 1e-15
+        ratio = np.log10(np.maximum(np.abs(y_interp), floor) / np.maximum(np.abs(y_lab[inside]), floor))
+        return float(np.sqrt(np.mean(ratio ** 2)))
+
+    def closeEvent(self, event):
+        if self.lab_watcher is not None:
+            self.lab_watcher.stop()
+            self.lab_watcher = None
+        super().closeEvent(event)
+
+    def sweep_arguments(self, sim_type):
+        """
+        Sweep of a simulation type from the input fields.
+
+        :return: Tuple (kind, sweep arguments) for iv_curve ('iv') or iv_vds_curves ('iv_vds').
+        :raises ValueError: If a field is not a number.
+        """
+        vg_start = float(self.vgStartEdit.text())
+        vg_stop = float(self.vgStopEdit.text())
+        vg_step = float(self.vgStepEdit.text())
+        if sim_type == "IV vs VG":
+            return "iv", dict(vgate_start=vg_start, vgate_stop=vg_stop, vgate_step=vg_step)
+        return "iv_vds", dict(vg_start=vg_start, vg_stop=vg_stop, vg_step=vg_step,
+                              vd_start=float(self.vdsStartEdit.text()), vd_stop=float(self.vdsStopEdit.text()),
+                              vd_step=float(self.vdsStepEdit.text()))
+
+    def fit_targets(self, sim_type):
+        """
+        Lab curves of a simulation type as fit targets [(gate bias or None, x, y), ...], in the plot
+        convention (source-referenced for PMOS). Percentile bands are not fitted.
+        """
+        curves = (self.lab_data_iv_vs_vg or []) if sim_type == "IV vs VG" else self.lab_data_iv_vs_vds
+        targets = []
+        for x, y, label, color in curves:
+            if color != "b":
+                continue
+            if sim_type == "IV vs VG":
+                targets.append((None, x, y))
+                continue
+            m = re.search(r"(?:VGS|VSG) ?= ?(-?\d+\.?\d*)", label)
+            if m:
+                targets.append((float(m.group(1)), x, y))
+        return targets
+
+    def fit_metrics(self, sim_type, curves):
+        """
+        Per-region errors of simulated curves against the lab curves of a simulation type, or None
+        without lab curves. The engine, and its interpolation operators, is kept while the content of
+        the lab curves stays the same.
+
+        :param curves: List of (vg, x, y) tuples; vg is None for the IV vs VG sweep.
+        """
+        targets = self.fit_targets(sim_type)
+        if not targets:
+            return None
+        digest = hashlib.sha256()
+        for vg, x, y in targets:
+            digest.update(repr(vg).encode())
+            digest.update(np.ascontiguousarray(x, dtype=float).tobytes())
+            digest.update(np.ascontiguousarray(y, dtype=float).tobytes())
+        key = digest.hexdigest()
+        cached = self.metric_engines.get(sim_type)
+        if cached is None or cached[0] != key:
+            from IceMOS_sky130_circuit_model_extractor import ModelExtractor
+            from IceMOS_sky130_metrics import MetricEngine
+            from IceMOS_sky130_sensitivity import operating_regions
+            dims = ModelExtractor.nmos_bins if self.device_type == "nch" else ModelExtractor.pmos_bins
+            W, L = dims[self.bin_number]
+            cached = (key, MetricEngine(targets, operating_regions(targets, W, L)))
+            self.metric_engines[sim_type] = cached
+        return cached[1].evaluate(curves)
+
+    def open_history(self):
+        """Pick recorded runs to overlay; the plot is redrawn from the history, without simulating."""
+        sim_type = self.simTypeCombo.currentText()
+        kind = "iv" if sim_type == "IV vs VG" else "iv_vds"
+        dlg = RunHistoryDialog(self.history, self.device_type, self.bin_number, kind,
+                               selected=self.history_overlays[sim_type], parent=self)
+        if dlg.exec_() == QtWidgets.QDialog.Accepted:
+            self.history_overlays[sim_type] = dlg.get_selected_runs()
+            self.show_curves(sim_type)
+
+    def history_curves(self, sim_type):
+        """Curves of the runs selected in the history picker, one color per run."""
+        colors = ["y", "c", "m", "r", (255, 128, 0), (128, 128, 255)]
+        label_prefix = "VGS=" if self.device_type == "nch" else "VSG="
+        curves = []
+        for i, run_id in enumerate(self.history_overlays[sim_type]):
+            snapshot = self.history.get(run_id)
+            when = time.strftime("%m-%d %H:%M", time.localtime(snapshot.created))
+            color = colors[i % len(colors)]
+            for vg, x, y in self.history.load(snapshot):
+                label = f"{when} ({snapshot.model_type})" if vg is None else f"{when} {label_prefix}{vg:g} V"
+                curves.append((np.asarray(x), np.asarray(y), label, color))
+        return curves
+
+    def show_curves(self, sim_type):
+        """Plot the latest simulation of a type together with the lab data and the selected history runs."""
+        curves = list(self.sim_curves.get(sim_type, []))
+        if sim_type == "IV vs VG":
+            # Combine simulation data with lab data if available
+            if self.lab_data_iv_vs_vg is not None:
+                curves += self.lab_data_iv_vs_vg
+            attribute = 'plotWin_IV_vs_VG'
+        else:
+            # Combine simulation curves with lab data if available
+            if self.lab_data_iv_vs_vds:
+                curves += self.lab_data_iv_vs_vds
+            attribute = 'plotWin_IV_vs_VDS'
+        curves += self.history_curves(sim_type)
+
+        title, x_label, y_label = get_plot_labels(self.device_type, sim_type)
+        plot_win = getattr(self, attribute, None)
+        if plot_win is not None and plot_win.isVisible():
+            plot_win.setWindowTitle(title)
+            plot_win.plotItem.setTitle(title)
+            plot_win.plotItem.setLabel('bottom', x_label)
+            plot_win.plotItem.setLabel('left', y_label)
+        else:
+            plot_win = PlotWindow(title, x_label, y_label)
+            setattr(self, attribute, plot_win)
+        plot_win.update_data(curves)
+        plot_win.show()
+
+    def show_surrogate_curves(self, curves, confirmed=False, error=None):
+        """
+        Plot surrogate (or confirmed) curves of the current slider values in place of the latest simulation.
+
+        :param curves: List of (vg, x, y) tuples; vg is None for the IV vs VG sweep.
+        :param confirmed: True for curves simulated by ngspice, False for a surrogate preview.
+        :param error: (Optional) Error of the surrogate at these values, in decades.
+        """
+        label_prefix = "VGS=" if self.device_type == "nch" else "VSG="
+        color = "w" if confirmed else "c"
+        if curves and curves[0][0] is None:
+            sim_type = "IV vs VG"
+            sim_curves = [(x, y, "Simulation (IV vs VG)" if confirmed else "Surrogate preview (IV vs VG)", color)
+                          for _, x, y in curves]
+        else:
+            sim_type = "IV vs VDS"
+            prefix = "" if confirmed else "Surrogate "
+            sim_curves = [(x, y, f"{prefix}{label_prefix}{vg:g} V", color) for vg, x, y in curves]
+        self.sim_curves[sim_type] = sim_curves
+        self.show_curves(sim_type)
+        if not confirmed:
+            self.statusLabel.setText("Surrogate preview; confirming with ngspice...")
+        elif error is not None:
+            self.statusLabel.setText(f"Confirmed by ngspice; surrogate was off by {error:.3f} decades (refined).")
+        else:
+            self.statusLabel.setText("Confirmed by ngspice.")
+
     def run_simulation(self):
+        # The continuous-simulation timer can fire while run_interactive() processes events.
+        if self._simulation_busy:
+            return
+        self._simulation_busy = True
+        try:
+            self._run_simulation()
+        finally:
+            self._simulation_busy = False
+
+    def _run_simulation(self):
         sim_type = self.simTypeCombo.currentText()
         if sim_type == "IV vs VG":
             try:
@@ -938,44 +1878,23 @@ class SimulationWindow(QtWidgets.QDialog):
                 QtWidgets.QMessageBox.warning(self, "Invalid Input", "Check VG simulation values.")
                 return
 
-            output = self.simulator.simulate_iv(
-                self.device_type, bin_number=self.bin_number,
+            if self.speculator is not None:
+                self.speculator.set_sweep("iv", vgate_start=vg_start, vgate_stop=vg_stop, vgate_step=vg_step)
+            # Served from the result cache when nothing changed since the last tick.
+            result = self.run_interactive(
+                self.simulator.iv_curve, self.device_type, bin_number=self.bin_number,
                 vgate_start=vg_start, vgate_stop=vg_stop, vgate_step=vg_step
             )
-            folder = os.path.join("circuits", self.device_type, f"bin_{self.bin_number}", "results_IV_ID_vs_VG")
-            csv_file = "IV_ID_vs_VG.csv"
-            csv_path = os.path.join(folder, csv_file)
-            if not os.path.exists(csv_path):
-                QtWidgets.QMessageBox.warning(self, "File Not Found", f"{csv_path} not found.")
-                return
-            try:
-                df = pd.read_csv(csv_path, sep=r'\s+', header=None)
-                df.columns = ["X", "Y"]
-                sim_curve = (df["X"].values, df["Y"].values, "Simulation (IV vs VG)", "w")
-            except Exception as e:
-                QtWidgets.QMessageBox.warning(self, "Error", f"Error reading CSV: {e}")
-                return
-
-            # Combine simulation data with lab data if available
-            if self.lab_data_iv_vs_vg is not None:
-                curves = [sim_curve] + self.lab_data_iv_vs_vg
-            else:
-                curves = [sim_curve]
-
-            # Assume get_plot_labels is defined elsewhere as in the original code.
-            title, x_label, y_label = get_plot_labels(self.device_type, sim_type)
-            if hasattr(self,
-                       'plotWin_IV_vs_VG') and self.plotWin_IV_vs_VG is not None and self.plotWin_IV_vs_VG.isVisible():
-                plot_win = self.plotWin_IV_vs_VG
-                plot_win.setWindowTitle(title)
-                plot_win.plotItem.setTitle(title)
-                plot_win.plotItem.setLabel('bottom', x_label)
-                plot_win.plotItem.setLabel('left', y_label)
-            else:
-                plot_win = PlotWindow(title, x_label, y_label)
-                self.plotWin_IV_vs_VG = plot_win
-            plot_win.update_data(curves)
-            plot_win.show()
+            sim_curves = [(result.sweep.values, result.current.values, "Simulation (IV vs VG)", "w")]
+            metrics = self.fit_metrics(sim_type, result.curves())
+            if self.showReferenceCheck.isChecked():
+                reference = self.run_interactive(
+                    self.simulator.iv_curve, self.device_type, bin_number=self.bin_number,
+                    vgate_start=vg_start, vgate_stop=vg_stop, vgate_step=vg_step, model_type="original"
+                )
+                sim_curves.append((reference.sweep.values, reference.current.values, "Original model (27 C)", "g"))
+            self.sim_curves[sim_type] = sim_curves
+            self.show_curves(sim_type)
 
         else:  # For IV vs VDS/VSD
             try:
@@ -989,101 +1908,29 @@ class SimulationWindow(QtWidgets.QDialog):
                 QtWidgets.QMessageBox.warning(self, "Invalid Input", "Check simulation values.")
                 return
 
-            if self.device_type == "nch":
-
-                # Remove old CSV files from the results folder
-                folder = os.path.join("circuits", self.device_type, f"bin_{self.bin_number}",
-                                      "results_IV_IDS_vs_VDS_for_VG_sweep")
-
-                # be sure that folder exist
-                if not os.path.exists(folder):
-                    os.makedirs(folder)
-                    
-                for fname in os.listdir(folder):
-                    if fname.endswith(".csv") or fname.endswith(".raw"):
-                        os.remove(os.path.join(folder, fname))
-
-                # Run sim
-                output = self.simulator.simulate_id_vs_vds_sweep_vg(
-                    self.device_type, bin_number=self.bin_number,
-                    vgs_start=vg_start, vgs_stop=vg_stop, vgs_step=vg_step,
-                    vds_start=vds_start, vds_stop=vds_stop, vds_step=vds_step
-                )
-                folder = os.path.join("circuits", self.device_type, f"bin_{self.bin_number}",
-                                      "results_IV_IDS_vs_VDS_for_VG_sweep")
-
-
-                col_names = ["V(VDS)", "V(VGS)", "V(VDS)_dup", "I(IDS)", "V(VDS)_dup2", "I(VDSM)"]
-                x_col, y_col = "V(VDS)", "I(VDSM)"
-                label_prefix = "VGS="
-            else:
-                # Remove old CSV files from the results folder
-                folder = os.path.join("circuits", self.device_type, f"bin_{self.bin_number}",
-                                      "results_IV_ISD_vs_VSD_for_VG_sweep")
-
-                # be sure that folder exist
-                if not os.path.exists(folder):
-                    os.makedirs(folder)
-
-                for fname in os.listdir(folder):
-                    if fname.endswith(".csv") or fname.endswith(".raw"):
-                        os.remove(os.path.join(folder, fname))
-
-                # Run sim
-                output = self.simulator.simulate_is_vs_vsd_sweep_vg(
-                    self.device_type, bin_number=self.bin_number,
-                    vsg_start=vg_start, vsg_stop=vg_stop, vsg_step=vg_step,
-                    vsd_start=vds_start, vsd_stop=vds_stop, vsd_step=vds_step
-                )
-                folder = os.path.join("circuits", self.device_type, f"bin_{self.bin_number}",
-                                      "results_IV_ISD_vs_VSD_for_VG_sweep")
-                col_names = ["V(VSD)", "V(VG)", "V(VSD)_dup", "I(ISD)", "V(VSD)_dup", "I(VSDM)"]
-                x_col, y_col = "V(VSD)", "I(VSDM)"
-                label_prefix = "VSG="
-
-            csv_files = [f for f in os.listdir(folder) if f.endswith(".csv")]
-            if not csv_files:
-                QtWidgets.QMessageBox.warning(self, "No Data", "No CSV files found in the sweep folder.")
-                return
-            csv_files.sort()
-
-            sim_curves = []
-            for fname in csv_files:
-                path = os.path.join(folder, fname)
-                try:
-                    df_ = pd.read_csv(path, sep=r'\s+', header=None)
-                    df_.columns = col_names
-                    try:
-                        v_str = fname.rsplit('_', 1)[-1].replace('.csv', '')
-                    except Exception:
-                        v_str = fname
-                    label = f"{label_prefix}{v_str} V"
-                    sim_curves.append((df_[x_col].values, df_[y_col].values, label, "w"))
-                except Exception as e:
-                    print(f"Error reading {fname}: {e}")
-                    continue
-
-            # Combine simulation curves with lab data if available
-            if self.lab_data_iv_vs_vds:
-                curves = sim_curves + self.lab_data_iv_vs_vds
-            else:
-                curves = sim_curves
-
-            title, x_label, y_label = get_plot_labels(self.device_type, sim_type)
-            if hasattr(self,
-                       'plotWin_IV_vs_VDS') and self.plotWin_IV_vs_VDS is not None and self.plotWin_IV_vs_VDS.isVisible():
-                plot_win = self.plotWin_IV_vs_VDS
-                plot_win.setWindowTitle(title)
-                plot_win.plotItem.setTitle(title)
-                plot_win.plotItem.setLabel('bottom', x_label)
-                plot_win.plotItem.setLabel('left', y_label)
-            else:
-                plot_win = PlotWindow(title, x_label, y_label)
-                self.plotWin_IV_vs_VDS = plot_win
-            plot_win.update_data(curves)
-            plot_win.show()
-
-        self.statusLabel.setText(f"Simulation {sim_type} run; plot updated.")
+            # Served from the result cache when nothing changed since the last tick.
+            sweep_args = dict(bin_number=self.bin_number,
+                              vg_start=vg_start, vg_stop=vg_stop, vg_step=vg_step,
+                              vd_start=vds_start, vd_stop=vds_stop, vd_step=vds_step)
+            if self.speculator is not None:
+                self.speculator.set_sweep("iv_vds", **sweep_args)
+            family = self.run_interactive(self.simulator.iv_vds_curves, self.device_type, **sweep_args)
+            # Gate labels follow the axis names of the result (VGS for NMOS, VSG for PMOS).
+            label_prefix = f"{family.bias.name}="
+            sim_curves = [(vd, current, f"{label_prefix}{vg:g} V", "w") for vg, vd, current in family.curves()]
+            metrics = self.fit_metrics(sim_type, family.curves())
+            if self.showReferenceCheck.isChecked():
+                reference = self.run_interactive(self.simulator.iv_vds_curves, self.device_type,
+                                                 model_type="original", **sweep_args)
+                sim_curves += [(vd, current, f"Original {label_prefix}{vg:g} V", "g")
+                               for vg, vd, current in reference.curves()]
+            self.sim_curves[sim_type] = sim_curves
+            self.show_curves(sim_type)
+
+        if metrics is None:
+            self.statusLabel.setText(f"Simulation {sim_type} run; plot updated.")
+        else:
+            self.statusLabel.setText(f"Simulation {sim_type} run; RMS error vs lab: {metrics.describe()}.")
         print("Simulation run complete; plot window updated.")
 
 
@@ -0,0 +1,475 @@
+"""
+IceMOS_sky130_device_figures.py
+
+This module extracts the figures a (4 K) fit is judged by from ID-VG and output curves: threshold
+voltage (constant-current and maximum-gm extrapolation), subthreshold slope, DIBL, transconductance,
+output conductance and on/off currents, for simulated and measured curves alike.
+
+Curves are processed in stacks: the curves sharing a sweep grid form one 2-D array and every figure is
+computed for all of them at once. Derivatives are Savitzky-Golay derivatives (local polynomial fits over
+a few points), which follow the curve while averaging out the measurement noise that finite differences
+amplify. Voltages and currents are taken as magnitudes, so NMOS and PMOS curves, in the simulator's
+source-referenced convention (VSG, VSD, ISD) or in the lab's terminal convention, give positive figures.
+
+The figures of a device condition (source, device, bin, temperature, geometry, die, body bias, model):
+  - vth_lin, vth_sat: constant-current threshold (ID = 100 nA * W / L) of the ID-VG curves at the lowest
+    drain bias (at most 0.2 V) and at the highest one.
+  - vth_gm_lin: extrapolation of ID at maximum gm on the low-drain curve, minus VD / 2.
+  - vth_gm_sat: extrapolation of sqrt(ID) at its maximum slope on the high-drain curve.
+  - ss: steepest subthreshold slope of the high-drain curve between the noise floor and the threshold
+    criterion, in mV/decade.
+  - dibl: (vth_lin - vth_sat) / (VD_sat - VD_lin), in mV/V.
+  - gm_lin, gm_sat: maximum transconductance of the low- and high-drain curves.
+  - gds: output conductance at the end of the output curve with the highest gate bias.
+  - ion, ioff, on_off: current of the high-drain curve at its highest and lowest gate bias, and their ratio.
+Figures whose curves are missing are NaN (e.g. DIBL of a simulation that has no low-drain ID-VG curve).
+
+The pieces:
+  - derivative_matrix: Savitzky-Golay derivative operator of a uniform grid.
+  - stack_curves: groups (x, y) curves into 2-D stacks on uniform grids.
+  - threshold_constant_current, threshold_max_gm, subthreshold_slope, max_gm, output_conductance:
+    one figure for every curve (row) of a stack.
+  - extract_figures: the figures of Curves or (record, x, y) tuples, e.g. from LabCatalog.load() or
+    ResultStore.load(), as a FigureTable.
+  - simulated_curves: ID-VG and output curves of a bin from a simulator (ngspice or BSIM4Simulator).
+  - FigureTable: rows of figures, text tables and comparison tables (a figure by bin and temperature).
+
+    catalog = LabCatalog("test/mdm_proc_pch_bin_1")
+    catalog.scan()
+    curves = catalog.load(sweep="IDVG") + catalog.load(sweep="IDVD")
+    for model_type in ("modified", "original"):
+        curves += simulated_curves(simulator, "pch", 1, model_type)
+    table = extract_figures(curves)
+    print(table.format())
+    print(table.compare("vth_sat", rows=("source", "bin"), columns="temperature", vb=(None, 0.0)))
+"""
+
+import functools
+import warnings
+
+import numpy as np
+
+from IceMOS_sky130_bsim4 import IV_DRAIN_VOLTAGE, TEMPERATURES, bin_dimensions
+from IceMOS_sky130_result_store import Curve
+
+
+# Conditions identifying a row, and the figures with their units.
+CONDITIONS = ("source", "device", "bin", "temperature", "W", "L", "die", "vb", "model_hash")
+FIGURES = (("vth_lin", "V"), ("vth_sat", "V"), ("vth_gm_lin", "V"), ("vth_gm_sat", "V"), ("ss", "mV/dec"),
+           ("dibl", "mV/V"), ("gm_lin", "S"), ("gm_sat", "S"), ("gds", "S"), ("ion", "A"), ("ioff", "A"),
+           ("on_off", ""))
+_TINY = 1e-30
+
+
+@functools.lru_cache(maxsize=64)
+def _derivative_weights(n, window, order):
+    window = min(window, n if n % 2 else n - 1)
+    weights = np.zeros((n, n))
+    if window < 2:
+        return weights
+    order = min(order, window - 1)
+    half = window // 2
+    fit = np.linalg.pinv((np.arange(window) - half)[:, None] ** np.arange(order + 1))
+    powers = np.arange(1, order + 1)
+    for i in range(n):
+        start = min(max(i - half, 0), n - window)
+        offset = i - start - half
+        weights[i, start:start + window] = (powers * float(offset) ** (powers - 1)) @ fit[1:]
+    weights.setflags(write=False)
+    return weights
+
+
+def derivative_matrix(n, step, window=5, order=2):
+    """
+    Savitzky-Golay first-derivative operator of a uniform grid: the derivative at every point is the
+    slope of a polynomial fitted over `window` neighbouring points (windows are shifted inwards at the
+    ends of the grid).
+
+    :param n: Number of grid points.
+    :param step: Grid step.
+    :param window: Odd number of points of each fit (reduced for short grids).
+    :param order: Polynomial order of the fits.
+    :return: (n, n) array D; D @ y is the derivative of y.
+    """
+    return _derivative_weights(int(n), int(window), int(order)) / step
+
+
+def smooth_derivative(grid, values, window=5, order=2):
+    """
+    Derivative of every row of a stack along a uniform grid (see derivative_matrix).
+
+    :param grid: Uniform grid (1-D array).
+    :param values: Array (..., len(grid)).
+    """
+    grid = np.asarray(grid, dtype=float)
+    step = grid[1] - grid[0] if len(grid) > 1 else 1.0
+    return np.asarray(values, dtype=float) @ derivative_matrix(len(grid), step, window, order).T
+
+
+def stack_curves(curves, tolerance=1e-6):
+    """
+    Group curves into stacks sharing a uniform grid. Voltages and currents become magnitudes; curves on
+    non-uniform grids are resampled onto a uniform grid of their median step.
+
+    :param curves: List of (x, y) pairs.
+    :return: List of (grid, values, indices) tuples: values is (len(indices), len(grid)), one row per
+             curve, indices the positions of the curves in `curves`.
+    """
+    stacks = {}
+    for index, (x, y) in enumerate(curves):
+        x = np.abs(np.asarray(x, dtype=float))
+        y = np.abs(np.asarray(y, dtype=float))
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+        steps = np.diff(x)
+        if len(x) > 1 and not np.allclose(steps, steps[0], atol=tolerance):
+            step = np.median(steps[steps > 0])
+            grid = x[0] + step * np.arange(int(round((x[-1] - x[0]) / step)) + 1)
+            y = np.interp(grid, x, y)
+            x = grid
+        key = (len(x), round(x[0] / tolerance), round((x[-1] - x[0]) / tolerance)) if len(x) else (0,)
+        grid, rows, indices = stacks.setdefault(key, (x, [], []))
+        rows.append(y)
+        indices.append(index)
+    return [(grid, np.vstack(rows), indices) for grid, rows, indices in stacks.values()]
+
+
+def _row_argmax(values, valid=None):
+    """Index and value of the largest valid entry of every row (value NaN for rows without one)."""
+    values = np.where(np.isnan(values) if valid is None else ~valid | np.isnan(values), -np.inf, values)
+    index = np.argmax(values, axis=1)
+    best = values[np.arange(len(values)), index]
+    return index, np.where(np.isfinite(best), best, np.nan)
+
+
+def threshold_constant_current(grid, current, criterion):
+    """
+    Gate voltage at which the current first reaches a criterion, interpolated in log10(ID).
+
+    :param grid: Uniform gate voltage grid (magnitudes).
+    :param current: Stack of current magnitudes (rows).
+    :param criterion: Criterion current, scalar or one per row.
+    :return: Threshold voltage of every row (NaN if the row never crosses the criterion from below).
+    """
+    criterion = np.broadcast_to(np.asarray(criterion, dtype=float), (len(current),))
+    rows = np.arange(len(current))
+    above = current >= criterion[:, None]
+    index = np.argmax(above, axis=1)
+    found = above[rows, index] & (index > 0)
+    below = np.maximum(index - 1, 0)
+    log_below = np.log10(np.maximum(current[rows, below], _TINY))
+    log_above = np.log10(np.maximum(current[rows, index], _TINY))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = (np.log10(criterion) - log_below) / (log_above - log_below)
+    vth = grid[below] + np.clip(fraction, 0.0, 1.0) * (grid[index] - grid[below])
+    return np.where(found, vth, np.nan)
+
+
+def max_gm(grid, current, window=5, order=2):
+    """
+    :return: Tuple (gm_max, index) of the largest smoothed transconductance of every row.
+    """
+    index, gm = _row_argmax(smooth_derivative(grid, current, window, order))
+    return gm, index
+
+
+def threshold_max_gm(grid, current, vd=None, saturation=False, window=5, order=2):
+    """
+    Threshold by extrapolation at maximum transconductance: the tangent of ID (linear region) or of
+    sqrt(ID) (saturation) at its steepest point, intersected with zero current.
+
+    :param vd: (Optional) Drain bias magnitude, scalar or one per row; VD / 2 is subtracted in the linear
+               region.
+    :param saturation: Extrapolate sqrt(ID) instead of ID.
+    :return: Threshold voltage of every row.
+    """
+    values = np.sqrt(current) if saturation else current
+    slope, index = max_gm(grid, values, window, order)
+    rows = np.arange(len(current))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vth = grid[index] - values[rows, index] / slope
+    if vd is not None and not saturation:
+        vth = vth - np.asarray(vd, dtype=float) / 2
+    return np.where(slope > 0, vth, np.nan)
+
+
+def subthreshold_slope(grid, current, criterion, noise_floor=1e-11, window=3, order=2):
+    """
+    Steepest subthreshold slope, in mV/decade, over the points whose whole derivative window lies
+    between the noise floor and the threshold criterion. The default window is short: at 4 K the
+    subthreshold region spans only a few points of a 10 mV sweep.
+
+    :param criterion: Upper current bound, scalar or one per row.
+    :return: Subthreshold slope of every row (NaN without subthreshold points above the noise floor).
+    """
+    criterion = np.broadcast_to(np.asarray(criterion, dtype=float), (len(current),))
+    slope = smooth_derivative(grid, np.log10(np.maximum(current, _TINY)), window, order)
+    inside = (current > noise_floor) & (current < criterion[:, None])
+    valid = inside & (slope > 0)
+    for shift in range(1, window // 2 + 1):
+        valid[:, shift:] &= inside[:, :-shift]
+        valid[:, :-shift] &= inside[:, shift:]
+    _, steepest = _row_argmax(slope, valid)
+    return 1e3 / steepest
+
+
+def output_conductance(grid, current, window=5, order=2):
+    """
+    :return: Smoothed output conductance at the last measured point of every row.
+    """
+    gds = smooth_derivative(grid, current, window, order)
+    index = len(grid) - 1 - np.argmax(~np.isnan(current[:, ::-1]), axis=1)
+    return gds[np.arange(len(current)), index]
+
+
+def _end_values(current):
+    """Current at the first and at the last measured point of every row."""
+    rows = np.arange(len(current))
+    measured = ~np.isnan(current)
+    first = np.argmax(measured, axis=1)
+    last = current.shape[1] - 1 - np.argmax(measured[:, ::-1], axis=1)
+    return current[rows, first], current[rows, last]
+
+
+def _entry(curve):
+    """(metadata, x, y) of a Curve or of a (record, x, y) tuple."""
+    if isinstance(curve, Curve):
+        return curve, curve.x, curve.y
+    return curve
+
+
+def _conditions(meta):
+    attrs = getattr(meta, "attrs", None) or {}
+    device = meta.device
+    W, L = attrs.get("W"), attrs.get("L")
+    if (W is None or L is None) and meta.bin is not None:
+        try:
+            W, L = bin_dimensions(device, meta.bin)
+        except ValueError:
+            pass
+    vb = None if meta.vb is None else abs(meta.vb)
+    return dict(source=meta.source, device=device, bin=meta.bin, temperature=meta.temperature, W=W, L=L,
+                die=attrs.get("die"), vb=vb, model_hash=meta.model_hash)
+
+
+def _sort_key(key):
+    return tuple((value is None, value if value is not None else 0) for value in key)
+
+
+def extract_figures(curves, current_criterion=1e-7, noise_floor=1e-11, linear_vd=0.2, window=5, order=2,
+                    default_vd=IV_DRAIN_VOLTAGE):
+    """
+    Extract the figures of every device condition of a set of curves.
+
+    :param curves: Curves (e.g. from simulated_curves) or (record, x, y) tuples (LabCatalog.load(),
+                   ResultStore.load()); ID-VG curves sweep 'VG', output curves 'VD'. Curves of other
+                   currents than ID (attribute 'quantity') are ignored.
+    :param current_criterion: Constant-current threshold criterion per square, in A (times W / L).
+    :param noise_floor: Current below which subthreshold points are ignored, in A.
+    :param linear_vd: Largest drain bias of a linear-region ID-VG curve, in V.
+    :param window: Points of the Savitzky-Golay fits (the subthreshold slope uses 3).
+    :param order: Polynomial order of the Savitzky-Golay fits.
+    :param default_vd: Drain bias of ID-VG curves that do not record it (simulated ID-VG netlists).
+    :return: FigureTable, one row per device condition.
+    """
+    groups = {}
+    idvg, idvd = [], []
+    for curve in curves:
+        meta, x, y = _entry(curve)
+        if (getattr(meta, "attrs", None) or {}).get("quantity", "ID") != "ID":
+            continue
+        conditions = _conditions(meta)
+        key = tuple(conditions[name] for name in CONDITIONS)
+        groups.setdefault(key, conditions)
+        if meta.sweep == "VG":
+            vd = default_vd if meta.vd is None else abs(meta.vd)
+            idvg.append((key, vd, x, y))
+        elif meta.sweep == "VD":
+            idvd.append((key, None if meta.vg is None else abs(meta.vg), x, y))
+
+    # Figures of every ID-VG curve, one stack at a time.
+    per_curve = [None] * len(idvg)
+    for grid, current, indices in stack_curves([(x, y) for _, _, x, y in idvg]):
+        conditions = [groups[idvg[i][0]] for i in indices]
+        area = np.array([np.nan if c["W"] is None or c["L"] is None else c["W"] / c["L"] for c in conditions])
+        criterion = current_criterion * area
+        vd = np.array([idvg[i][1] for i in indices])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            columns = dict(
+                vth=threshold_constant_current(grid, current, criterion),
+                vth_gm_lin=threshold_max_gm(grid, current, vd, window=window, order=order),
+                vth_gm_sat=threshold_max_gm(grid, current, saturation=True, window=window, order=order),
+                ss=subthreshold_slope(grid, current, criterion, noise_floor, order=order),
+                gm=max_gm(grid, current, window, order)[0])
+        ioff, ion = _end_values(current)
+        columns.update(ion=ion, ioff=ioff)
+        for row, i in enumerate(indices):
+            per_curve[i] = {name: float(values[row]) for name, values in columns.items()}
+
+    # Output conductance at the end of every output curve.
+    gds = [np.nan] * len(idvd)
+    for grid, current, indices in stack_curves([(x, y) for _, _, x, y in idvd]):
+        values = output_conductance(grid, current, window, order)
+        for row, i in enumerate(indices):
+            gds[i] = float(values[row])
+
+    rows = []
+    for key in sorted(groups, key=_sort_key):
+        row = dict(groups[key])
+        row.update({name: np.nan for name, _ in FIGURES})
+        transfer = sorted((vd, figures) for (k, vd, _, _), figures in zip(idvg, per_curve) if k == key)
+        linear = transfer[0] if transfer and transfer[0][0] <= linear_vd else None
+        saturated = transfer[-1] if transfer and transfer[-1][0] > linear_vd else None
+        if linear is not None:
+            row.update(vth_lin=linear[1]["vth"], vth_gm_lin=linear[1]["vth_gm_lin"], gm_lin=linear[1]["gm"])
+        if saturated is not None:
+            figures = saturated[1]
+            row.update(vth_sat=figures["vth"], vth_gm_sat=figures["vth_gm_sat"], ss=figures["ss"],
+                       gm_sat=figures["gm"], ion=figures["ion"], ioff=figures["ioff"])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                row["on_off"] = float(np.float64(figures["ion"]) / figures["ioff"])
+        if linear is not None and saturated is not None:
+            row["dibl"] = 1e3 * (row["vth_lin"] - row["vth_sat"]) / (saturated[0] - linear[0])
+        output = [(-np.inf if vg is None else vg, value) for (k, vg, _, _), value in zip(idvd, gds) if k == key]
+        if output:
+            row["gds"] = max(output, key=lambda item: item[0])[1]
+        rows.append(row)
+    return FigureTable(rows)
+
+
+def simulated_curves(simulator, device_type, bin_number, model_type="modified", vg_stop=1.8, vgate_step=0.01,
+                     vd_step=0.01):
+    """
+    Simulate the curves extract_figures needs for a bin: ID-VG with the drain at 1.8 V and the output curve
+    at the highest gate bias.
+
+    :param simulator: IceMOS_simulator_sky130 or BSIM4Simulator.
+    :param model_type: 'modified' (calibrated model at 4 K) or 'original' (reference model at 27 °C).
+    :return: List of Curves (source 'simulation', attributes W, L and model_type).
+    """
+    W, L = bin_dimensions(device_type, bin_number)
+    fields = dict(bin=bin_number, temperature=TEMPERATURES[model_type], source="simulation",
+                  attrs={"W": W, "L": L, "model_type": model_type})
+    transfer = simulator.iv_curve(device_type, bin_number, vgate_start=0, vgate_stop=vg_stop,
+                                  vgate_step=vgate_step, model_type=model_type)
+    curves = [Curve(transfer.sweep.values, transfer.current.values, device_type, sweep="VG", vd=IV_DRAIN_VOLTAGE,
+                    **fields)]
+    family = simulator.iv_vds_curves(device_type, bin_number, vg_start=vg_stop, vg_stop=vg_stop, vg_step=0.1,
+                                     vd_start=0, vd_stop=vg_stop, vd_step=vd_step, model_type=model_type)
+    for vg, vd, current in family.curves():
+        curves.append(Curve(vd, current, device_type, sweep="VD", vg=float(vg), **fields))
+    return curves
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "-" if np.isnan(value) else f"{value:.4g}"
+    return str(value)
+
+
+def _format_rows(header, lines):
+    widths = [max(len(cell) for cell in column) for column in zip(header, *lines)]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(line, widths))
+                     for line in [header] + lines)
+
+
+class FigureTable:
+    """
+    Figures of a set of device conditions: one dict per row with the CONDITIONS and the FIGURES.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def select(self, **conditions):
+        """
+        Rows matching conditions (e.g. source='lab', bin=1, vb=0.0). A tuple matches any of its values;
+        temperatures match to the degree.
+        """
+        def matches(row, name, wanted):
+            wanted = wanted if isinstance(wanted, tuple) else (wanted,)
+            if name == "temperature":
+                return any(row[name] is not None and w is not None and abs(row[name] - w) < 0.5 for w in wanted)
+            return row.get(name) in wanted
+        return FigureTable([row for row in self.rows
+                            if all(matches(row, name, value) for name, value in conditions.items())])
+
+    def column(self, name):
+        """Values of a figure or condition, one per row."""
+        return [row.get(name) for row in self.rows]
+
+    def format(self, figures=None, conditions=("source", "device", "bin", "temperature", "die", "vb")):
+        """
+        Text table of the rows.
+
+        :param figures: (Optional) Figures to show; defaults to all.
+        :param conditions: Conditions to show.
+        """
+        units = dict(FIGURES)
+        figures = list(figures or units)
+        header = list(conditions) + [f"{name} ({units[name]})" if units[name] else name for name in figures]
+        lines = [[_format_value(row.get(name)) for name in list(conditions) + figures] for row in self.rows]
+        return _format_rows(header, lines)
+
+    def comparison(self, figure, rows="bin", columns="temperature", **conditions):
+        """
+        A figure by one set of conditions against another, e.g. by bin and temperature. Cells hold the
+        median over the matching rows (dies, body biases, ...); temperatures are rounded to the degree.
+
+        :param rows: Condition name or tuple of names of the table rows.
+        :param columns: Condition name or tuple of names of the table columns.
+        :param conditions: select() conditions applied first.
+        :return: Tuple (row keys, column keys, values array of shape (rows, columns)).
+        """
+        rows = rows if isinstance(rows, tuple) else (rows,)
+        columns = columns if isinstance(columns, tuple) else (columns,)
+
+        def key(row, names):
+            return tuple(round(row[name]) if name == "temperature" and row[name] is not None else row[name]
+                         for name in names)
+
+        selected = self.select(**conditions).rows
+        row_keys = sorted({key(row, rows) for row in selected}, key=_sort_key)
+        column_keys = sorted({key(row, columns) for row in selected}, key=_sort_key)
+        cells = {}
+        for row in selected:
+            cells.setdefault((key(row, rows), key(row, columns)), []).append(row[figure])
+        values = np.full((len(row_keys), len(column_keys)), np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for i, row_key in enumerate(row_keys):
+                for j, column_key in enumerate(column_keys):
+                    if (row_key, column_key) in cells:
+                        values[i, j] = np.nanmedian(np.array(cells[row_key, column_key], dtype=float))
+        return row_keys, column_keys, values
+
+    def compare(self, figure, rows="bin", columns="temperature", **conditions):
+        """Text table of comparison()."""
+        row_keys, column_keys, values = self.comparison(figure, rows, columns, **conditions)
+        rows = rows if isinstance(rows, tuple) else (rows,)
+        columns = columns if isinstance(columns, tuple) else (columns,)
+        unit = dict(FIGURES)[figure]
+        corner = f"{figure} ({unit})" if unit else figure
+        header = [corner if len(rows) == 1 else f"{corner}: {' '.join(rows)}"] + [
+            " ".join(f"{name}={_format_value(value)}" for name, value in zip(columns, column_key))
+            for column_key in column_keys]
+        lines = [[" ".join(_format_value(value) for value in row_key)] + [_format_value(float(v)) for v in line]
+                 for row_key, line in zip(row_keys, values)]
+        return _format_rows(header, lines)
+
+    def to_frame(self):
+        """The rows as a pandas DataFrame."""
+        import pandas as pd
+        return pd.DataFrame(self.rows, columns=list(CONDITIONS) + [name for name, _ in FIGURES])
+
+    def __repr__(self):
+        return f"FigureTable({len(self.rows)} rows)"
@@ -0,0 +1,475 @@
+"""
+IceMOS_sky130_fitting.py
+
+This module fits BSIM model parameters to measured curves with a bounded Levenberg-Marquardt
+(trust-region) least-squares solver written in NumPy, using the simulator as the model.
+
+The pieces:
+  - SimulatorModel: evaluates a parameter set by writing the bin's model card with those values
+    into a sandbox circuit folder (the card 'Update Modified LIB' would write) and simulating
+    the sweep there. Returns the simulated curves [(vg, x, y), ...].
+  - CurveResiduals: compares simulated curves with target (lab) curves at the measured sweep
+    points. By default the residuals are log10 current ratios, so that subthreshold and
+    above-threshold points weigh alike.
+  - least_squares_fit: the solver. Parameters are normalised to [0, 1] between their min and max
+    so that steps are comparable across parameters of very different magnitudes; steps are
+    projected onto the bounds. The total number of simulator evaluations (residuals and
+    Jacobian) is capped by max_nfev. With jacobian_update="broyden" the Jacobian is carried
+    from one iteration to the next by Broyden rank-one updates, and only recomputed when a step
+    makes poor progress or is rejected (the trust region shrinks).
+  - fit_parameters: fits the parameters of a ParameterTunerWindow-style dict
+    {name: {"value", "min", "max"}} and returns the fitted values.
+
+    model = SimulatorModel(original_model_file, "nch", 40, lib_file_path, "iv",
+                           {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.05})
+    residuals = CurveResiduals([(None, vg_lab, id_lab)])
+    result = fit_parameters(model, residuals, parameters, max_nfev=60, progress=print)
+    print(result.describe(), result.parameters)
+"""
+
+import os
+
+import numpy as np
+
+from IceMOS_sky130_param_handler import write_model_cards
+
+
+class SimulatorModel:
+    """
+    Model evaluator: simulated curves for a parameter set.
+    """
+
+    def __init__(self, original_model_file, device_type, bin_number, lib_file_path, kind, sweep,
+                 base_parameters=None, sandbox_root=os.path.join("circuits", ".fitting"), simulator_options=None):
+        """
+        :param original_model_file: Path to the original SPICE model file (used by the netlist generator).
+        :param device_type: 'nch' or 'pch'.
+        :param bin_number: Bin being fitted.
+        :param lib_file_path: Path of the bin's '_original.lib' model card.
+        :param kind: 'iv' (iv_curve sweep arguments) or 'iv_vds' (iv_vds_curves sweep arguments).
+        :param sweep: Dict of the sweep arguments.
+        :param base_parameters: (Optional) Values of the parameters that are not fitted but differ from
+                                the original card ({name: value}).
+        :param sandbox_root: Circuit root where the trial model cards are written and simulated.
+        :param simulator_options: (Optional) Extra keyword arguments for IceMOS_simulator_sky130.
+        """
+        self.original_model_file = original_model_file
+        self.device_type = device_type.lower()
+        self.bin_number = bin_number
+        self.lib_file_path = lib_file_path
+        if kind not in ("iv", "iv_vds"):
+            raise ValueError(f"Unknown sweep kind '{kind}'; expected 'iv' or 'iv_vds'.")
+        self.kind = kind
+        self.sweep = dict(sweep)
+        self.base_parameters = dict(base_parameters or {})
+        self.sandbox_root = sandbox_root
+        self.simulator_options = simulator_options or {}
+        self.evaluations = 0
+        self._simulator = None
+
+    @property
+    def simulator(self):
+        if self._simulator is None:
+            from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+            self._simulator = IceMOS_simulator_sky130(self.original_model_file, circuit_root=self.sandbox_root,
+                                                      **self.simulator_options)
+            self._simulator.runner.verbose = False
+        return self._simulator
+
+    def __call__(self, parameters):
+        """
+        Simulate the sweep for a parameter set.
+
+        :param parameters: Dict {name: value} of the fitted parameters.
+        :return: List of (vg, x, y) tuples; vg is None for an 'iv' sweep.
+        """
+        write_model_cards(self.sandbox_root, self.device_type, self.bin_number, self.lib_file_path,
+                          dict(self.base_parameters, **parameters))
+        self.evaluations += 1
+        simulate = self.simulator.iv_curve if self.kind == "iv" else self.simulator.iv_vds_curves
+        return simulate(self.device_type, bin_number=self.bin_number, **self.sweep).curves()
+
+
+class CurveResiduals:
+    """
+    Residuals between simulated curves and target curves, at the target sweep points.
+    """
+
+    def __init__(self, targets, mode="log", floor=1e-12, weights=None, tolerance=1e-6):
+        """
+        :param targets: List of (vg, x, y) target curves; vg selects the simulated family curve
+                        (None for an 'iv' sweep).
+        :param mode: 'log' (log10 of the current ratio) or 'relative' (difference relative to the
+                     largest target current of the curve).
+        :param floor: Currents are clipped to this magnitude before taking logarithms (A).
+        :param weights: (Optional) One weight per target curve.
+        :param tolerance: Tolerance on the gate bias when matching family curves (V).
+        """
+        if mode not in ("log", "relative"):
+            raise ValueError(f"Unknown residual mode '{mode}'; expected 'log' or 'relative'.")
+        self.targets = [(vg, np.asarray(x, dtype=float), np.asarray(y, dtype=float)) for vg, x, y in targets]
+        if not self.targets:
+            raise ValueError("No target curves to fit.")
+        self.mode = mode
+        self.floor = floor
+        self.weights = np.ones(len(self.targets)) if weights is None else np.asarray(weights, dtype=float)
+        self.tolerance = tolerance
+        self._masks = None
+
+    def _simulated_curve(self, curves, vg):
+        if vg is None:
+            return curves[0][1], curves[0][2]
+        for sim_vg, x, y in curves:
+            if sim_vg is not None and abs(sim_vg - vg) <= self.tolerance:
+                return x, y
+        raise ValueError(f"No simulated curve at gate bias {vg:g} V; check the sweep of the fit.")
+
+    def target_masks(self, curves=None):
+        """
+        Masks of the target points that enter the residual vector, one boolean array per target curve;
+        the residual vector holds the selected points curve by curve.
+
+        Only the target points inside the simulated sweep range are compared. The masks are fixed by the
+        first simulated curves (so that the residual vector keeps its length) and reused afterwards.
+
+        :param curves: Simulated curves, needed only before the first residuals were computed.
+        :return: List of boolean arrays, one per target curve.
+        :raises ValueError: If the masks are not fixed yet and no curves are given.
+        """
+        if self._masks is None:
+            if curves is None:
+                raise ValueError("The target masks are fixed by the first simulated curves; none were given.")
+            simulated = [self._simulated_curve(curves, vg) for vg, _, _ in self.targets]
+            self._masks = [(x >= np.min(sim_x) - 1e-12) & (x <= np.max(sim_x) + 1e-12) & ~np.isnan(y)
+                           for (_, x, y), (sim_x, _) in zip(self.targets, simulated)]
+        return list(self._masks)
+
+    def __call__(self, curves):
+        """
+        :param curves: Simulated curves, as returned by SimulatorModel.
+        :return: 1-D residual vector (NaN where the simulation failed).
+        """
+        simulated = [self._simulated_curve(curves, vg) for vg, _, _ in self.targets]
+        masks = self.target_masks(curves)
+        residuals = []
+        for (vg, x, y), (sim_x, sim_y), mask, weight in zip(self.targets, simulated, masks, self.weights):
+            order = np.argsort(sim_x)
+            sim_at_x = np.interp(x[mask], np.asarray(sim_x, dtype=float)[order], np.asarray(sim_y, dtype=float)[order])
+            if self.mode == "log":
+                r = (np.log10(np.maximum(np.abs(sim_at_x), self.floor))
+                     - np.log10(np.maximum(np.abs(y[mask]), self.floor)))
+            else:
+                r = (sim_at_x - y[mask]) / max(np.max(np.abs(y[mask])) if mask.any() else 0.0, self.floor)
+            residuals.append(weight * r)
+        return np.concatenate(residuals)
+
+    def jacobian(self, curves, derivatives):
+        """
+        Jacobian of the residuals from the derivatives of the simulated currents (chain rule through
+        the interpolation onto the target points and the logarithm).
+
+        :param curves: Simulated curves, as returned by SimulatorModel.
+        :param derivatives: List of (vg, x, dy) matching the curves, dy of shape (len(x), n) holding the
+                            derivatives of the current with respect to n parameters.
+        :return: Matrix (number of residuals x n); rows of points clipped to the floor are zero.
+        """
+        rows = []
+        for (vg, x, y), mask, weight in zip(self.targets, self.target_masks(curves), self.weights):
+            sim_x, sim_y = self._simulated_curve(curves, vg)
+            _, dy = self._simulated_curve(derivatives, vg)
+            order = np.argsort(sim_x)
+            sim_x = np.asarray(sim_x, dtype=float)[order]
+            dy = np.asarray(dy, dtype=float)[order]
+            sim_at_x = np.interp(x[mask], sim_x, np.asarray(sim_y, dtype=float)[order])
+            d_at_x = np.column_stack([np.interp(x[mask], sim_x, dy[:, j]) for j in range(dy.shape[1])])
+            if self.mode == "log":
+                active = np.abs(sim_at_x) > self.floor
+                scale = np.where(active, 1.0 / (np.where(active, sim_at_x, 1.0) * np.log(10.0)), 0.0)
+            else:
+                scale = np.full(len(sim_at_x),
+                                1.0 / max(np.max(np.abs(y[mask])) if mask.any() else 0.0, self.floor))
+            rows.append(weight * scale[:, None] * d_at_x)
+        return np.vstack(rows)
+
+
+class FitProgress:
+    """
+    Progress of a fit, passed to the progress callback after every iteration.
+    """
+
+    def __init__(self, iteration, nfev, max_nfev, cost, x, names):
+        self.iteration = iteration
+        self.nfev = nfev
+        self.max_nfev = max_nfev
+        self.cost = cost
+        self.x = x
+        self.names = names
+
+    def describe(self):
+        return (f"iteration {self.iteration}, {self.nfev}/{self.max_nfev} simulations, "
+                f"cost {self.cost:.4g}")
+
+    def __repr__(self):
+        return f"FitProgress({self.describe()})"
+
+
+class FitResult:
+    """
+    Outcome of a fit.
+
+    :ivar x: Fitted values (array, in the order of `names`).
+    :ivar parameters: Dict {name: fitted value}.
+    :ivar cost: Half the sum of squared residuals at x.
+    :ivar residuals: Residual vector at x.
+    :ivar nfev: Number of simulator evaluations (residual and Jacobian evaluations).
+    :ivar njev: Number of Jacobian evaluations.
+    :ivar jacobian_updates: Number of Broyden updates used instead of a Jacobian evaluation.
+    :ivar iterations: Number of solver iterations.
+    :ivar success: True if a convergence criterion was met (False if the budget ran out or the fit
+                   was cancelled).
+    :ivar message: Why the solver stopped.
+    :ivar history: List of (nfev, cost) after every accepted step.
+    """
+
+    def __init__(self, x, names, cost, residuals, nfev, njev, iterations, success, message, history,
+                 jacobian_updates=0):
+        self.x = x
+        self.names = names
+        self.parameters = {name: float(value) for name, value in zip(names, x)}
+        self.cost = cost
+        self.residuals = residuals
+        self.nfev = nfev
+        self.njev = njev
+        self.iterations = iterations
+        self.success = success
+        self.message = message
+        self.history = history
+        self.jacobian_updates = jacobian_updates
+
+    @property
+    def rms(self):
+        """Root-mean-square residual (decades for log residuals)."""
+        return float(np.sqrt(2.0 * self.cost / max(len(self.residuals), 1)))
+
+    def describe(self):
+        jacobians = f"{self.njev} Jacobians"
+        if self.jacobian_updates:
+            jacobians += f", {self.jacobian_updates} Broyden updates"
+        return (f"{self.message} after {self.iterations} iterations and {self.nfev} simulations "
+                f"({jacobians}); RMS residual {self.rms:.4g}")
+
+    def __repr__(self):
+        return f"FitResult({self.describe()})"
+
+
+class FiniteDifferenceJacobian:
+    """
+    Forward-difference Jacobian, one residual evaluation per parameter.
+    """
+
+    def __init__(self, step=1e-3):
+        """
+        :param step: Step as a fraction of each parameter's (max - min) range.
+        """
+        self.step = step
+        self.nfev = 0
+
+    def __call__(self, fun, x, r0, lower, upper):
+        """
+        :param fun: Residual function of the parameter vector.
+        :param x: Point (inside the bounds).
+        :param r0: Residuals at x.
+        :return: Jacobian matrix (len(r0) x len(x)) with respect to x.
+        """
+        jacobian = np.empty((len(r0), len(x)))
+        for j in range(len(x)):
+            h = self.step * (upper[j] - lower[j])
+            if x[j] + h > upper[j]:
+                # Step inwards at the upper bound.
+                h = -h
+            column = self._difference(fun, x, r0, j, h)
+            if not np.all(np.isfinite(column)) and x[j] - h >= lower[j] and x[j] - h <= upper[j]:
+                # The model failed on that side: try the other one.
+                column = self._difference(fun, x, r0, j, -h)
+            jacobian[:, j] = column
+        return jacobian
+
+    def _difference(self, fun, x, r0, j, h):
+        xj = x.copy()
+        xj[j] += h
+        self.nfev += 1
+        return (fun(xj) - r0) / h
+
+
+def least_squares_fit(fun, x0, lower, upper, max_nfev=100, jacobian=None, ftol=1e-6, xtol=1e-6, gtol=1e-8,
+                      names=None, progress=None, jacobian_update="full"):
+    """
+    Minimise 0.5 * ||fun(x)||^2 within lower <= x <= upper with a Levenberg-Marquardt solver.
+
+    :param fun: Residual function, 1-D parameter array -> 1-D residual array (NaN marks a failed
+                evaluation; such steps are rejected).
+    :param x0: Starting point (clipped to the bounds).
+    :param lower: Lower bounds.
+    :param upper: Upper bounds (each larger than its lower bound).
+    :param max_nfev: Cap on the number of residual evaluations, Jacobian evaluations included.
+    :param jacobian: (Optional) Jacobian provider called as jacobian(fun, x, r, lower, upper); its `nfev`
+                     attribute counts its residual evaluations. Defaults to FiniteDifferenceJacobian().
+    :param ftol: Stop when an accepted step reduces the cost by less than this fraction.
+    :param xtol: Stop when the step is smaller than this fraction of the bound range.
+    :param gtol: Stop when the projected gradient (in normalised units) is smaller than this.
+    :param names: (Optional) Parameter names, for the result and the progress reports.
+    :param progress: (Optional) Called with a FitProgress after every iteration; returning True cancels
+                     the fit (the best point so far is returned).
+    :param jacobian_update: 'full' (a new Jacobian after every accepted step) or 'broyden' (rank-one
+                            updates from the evaluated steps; a new Jacobian only when an accepted step
+                            reduces the cost by less than a quarter of the predicted reduction, when a
+                            step is rejected, or before stopping on the gradient or step tolerance).
+    :return: FitResult.
+    """
+    if jacobian_update not in ("full", "broyden"):
+        raise ValueError(f"Unknown Jacobian update '{jacobian_update}'; expected 'full' or 'broyden'.")
+    broyden = jacobian_update == "broyden"
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    if np.any(upper <= lower):
+        raise ValueError("Every parameter needs a max larger than its min.")
+    names = list(names) if names is not None else [f"x{i}" for i in range(len(lower))]
+    span = upper - lower
+    jacobian = jacobian or FiniteDifferenceJacobian()
+    jacobian_nfev0 = getattr(jacobian, "nfev", 0)
+    counter = {"nfev": 0}
+
+    def evaluate(x):
+        try:
+            r = np.asarray(fun(x), dtype=float)
+        except RuntimeError as e:
+            # A simulation that fails past the first point is treated like NaN residuals (step rejected).
+            if counter.get("size") is None:
+                raise
+            print(f"Model evaluation failed: {e}")
+            return np.full(counter["size"], np.nan)
+        counter["size"] = len(r)
+        return r
+
+    def residuals(x):
+        counter["nfev"] += 1
+        return evaluate(x)
+
+    def used():
+        return counter["nfev"] + getattr(jacobian, "nfev", 0) - jacobian_nfev0
+
+    def cost_of(r):
+        return np.inf if np.any(~np.isfinite(r)) else 0.5 * float(r @ r)
+
+    z = np.clip((np.asarray(x0, dtype=float) - lower) / span, 0.0, 1.0)
+    r = residuals(lower + z * span)
+    cost = cost_of(r)
+    if not np.isfinite(cost):
+        raise RuntimeError("The model could not be evaluated at the starting point.")
+    history = [(used(), cost)]
+    iterations = 0
+    njev = 0
+    message = "Maximum number of simulations reached"
+    success = False
+    J = None
+    fresh = False
+    updates = 0
+    mu = None
+    nu = 2.0
+    while True:
+        if J is None:
+            if used() + len(z) > max_nfev:
+                break
+            # Jacobian with respect to the normalised parameters.
+            J = jacobian(evaluate, lower + z * span, r, lower, upper) * span
+            J[~np.isfinite(J)] = 0.0
+            fresh = True
+            njev += 1
+        g = J.T @ r
+        projected = g.copy()
+        projected[(z <= 0.0) & (g > 0)] = 0.0
+        projected[(z >= 1.0) & (g < 0)] = 0.0
+        if np.max(np.abs(projected)) < gtol:
+            if not fresh:
+                # Only stop on an evaluated Jacobian.
+                J = None
+                continue
+            message, success = "Gradient below tolerance", True
+            break
+        A = J.T @ J
+        diagonal = np.maximum(np.diag(A), 1e-12 * max(np.max(np.diag(A)), 1e-300))
+        if mu is None:
+            mu = 1e-3 * np.max(diagonal)
+        if used() >= max_nfev:
+            break
+        try:
+            delta = np.linalg.solve(A + mu * np.diag(diagonal), -g)
+        except np.linalg.LinAlgError:
+            delta = -g / (mu * diagonal)
+        step = np.clip(z + delta, 0.0, 1.0) - z
+        if np.max(np.abs(step)) < xtol:
+            if not fresh:
+                J = None
+                continue
+            message, success = "Step below tolerance", True
+            break
+        r_new = residuals(lower + (z + step) * span)
+        cost_new = cost_of(r_new)
+        predicted = -(g @ step + 0.5 * step @ A @ step)
+        actual = cost - cost_new
+        rho = actual / predicted if predicted > 0 and np.isfinite(cost_new) else -1.0
+        iterations += 1
+        if rho > 0:
+            if broyden and rho >= 0.25:
+                # Broyden rank-one update: the new Jacobian reproduces the residual change along the step.
+                J = J + np.outer(r_new - r - J @ step, step) / (step @ step)
+                fresh = False
+                updates += 1
+            else:
+                J = None
+            z = z + step
+            r, cost_old, cost = r_new, cost, cost_new
+            mu *= max(1.0 / 3.0, 1.0 - (2.0 * rho - 1.0) ** 3)
+            nu = 2.0
+            history.append((used(), cost))
+            if actual < ftol * cost_old:
+                message, success = "Cost reduction below tolerance", True
+                break
+        else:
+            mu *= nu
+            nu *= 2.0
+            if not fresh:
+                # The trust region shrinks on an updated Jacobian: evaluate it again.
+                J = None
+        if progress is not None and progress(FitProgress(iterations, used(), max_nfev, cost,
+                                                         lower + z * span, names)):
+            message = "Cancelled"
+            break
+    return FitResult(lower + z * span, names, cost, r, used(), njev, iterations, success, message, history,
+                     jacobian_updates=updates)
+
+
+def fit_parameters(model, residuals, parameters, names=None, max_nfev=100, jacobian=None, progress=None,
+                   **options):
+    """
+    Fit model parameters to target curves.
+
+    :param model: Callable {name: value} -> simulated curves (e.g. SimulatorModel).
+    :param residuals: Callable simulated curves -> residual vector (e.g. CurveResiduals).
+    :param parameters: Dict {name: {"value": ..., "min": ..., "max": ...}} as kept by ParameterTunerWindow.
+    :param names: (Optional) Names of the parameters to fit; defaults to all of them.
+    :param options: Extra least_squares_fit arguments (ftol, xtol, gtol, jacobian_update).
+    :return: FitResult.
+    """
+    names = list(parameters) if names is None else list(names)
+    if not names:
+        raise ValueError("Select at least one parameter to fit.")
+    x0 = [float(parameters[name]["value"]) for name in names]
+    lower = [float(parameters[name]["min"]) for name in names]
+    upper = [float(parameters[name]["max"]) for name in names]
+
+    def fun(x):
+        return residuals(model(dict(zip(names, x))))
+
+    return least_squares_fit(fun, x0, lower, upper, max_nfev=max_nfev, jacobian=jacobian, names=names,
+                             progress=progress, **options)
@@ -0,0 +1,487 @@
+"""
+IceMOS_sky130_global_opt.py
+
+This module searches the whole parameter box for a fit with population-based optimizers, for the
+cryogenic parameters (ute, kt1, ua1, at, ...) whose interactions trap the local solver of
+IceMOS_sky130_fitting in poor minima.
+
+The pieces:
+  - CMAES and DifferentialEvolution: ask/tell optimizers working on parameters normalised to
+    [0, 1] between their min and max. ask() returns a generation of candidates, tell() takes
+    their costs. Their state (including the random generator) can be saved and restored.
+  - PoolEvaluator: simulates every candidate of a generation as its own scheduler job, each job
+    in its own sandbox circuit folder, so a generation runs on all the scheduler's slots.
+  - PopulationNetlistEvaluator: simulates the whole generation in one ngspice launch, as one
+    netlist holding a device copy per candidate (see IceMOS_sky130_batch_jacobian).
+  - global_fit: the generation loop. It stops on an evaluation budget, a wall-clock budget,
+    convergence of the optimizer, or cancellation from the progress callback, and checkpoints
+    every generation to a JSON file (counters, best point, optimizer scalars and random state)
+    plus an NPZ file (optimizer arrays). Called again with the same checkpoint it resumes where
+    the previous run stopped.
+
+    evaluator = PoolEvaluator(model, residuals, names)
+    result = global_fit(evaluator, lower, upper, method="cmaes", names=names, max_evaluations=2000,
+                        max_seconds=3600, checkpoint=session_checkpoint("bin_40.json"))
+    print(result.describe(), result.parameters)
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+from IceMOS_sky130_batch_jacobian import BatchedJacobian
+from IceMOS_sky130_fitting import FitProgress, SimulatorModel
+
+
+def latin_hypercube(samples, dimension, rng):
+    """
+    Latin hypercube sample of the unit cube: every parameter range is cut into `samples` strata and
+    each stratum is sampled once.
+
+    :return: Array of shape (samples, dimension).
+    """
+    strata = np.argsort(rng.random((dimension, samples)), axis=1).T
+    return (strata + rng.random((samples, dimension))) / samples
+
+
+def _costs(values):
+    """Costs as floats, NaN (failed evaluations) replaced by +inf."""
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), np.inf, values)
+
+
+class CMAES:
+    """
+    Covariance matrix adaptation evolution strategy on the unit cube.
+
+    Candidates falling outside the cube are clipped onto it, and the clipped points are used in the
+    update.
+    """
+
+    method = "cmaes"
+
+    def __init__(self, dimension, x0=None, sigma0=0.3, popsize=None, seed=None):
+        """
+        :param dimension: Number of parameters.
+        :param x0: (Optional) Initial mean (normalised); defaults to the centre of the cube.
+        :param sigma0: Initial step size (normalised units).
+        :param popsize: Candidates per generation; defaults to 4 + 3 ln(dimension).
+        :param seed: Seed of the random generator.
+        """
+        n = dimension
+        self.dimension = n
+        self.popsize = popsize or 4 + int(3 * np.log(n))
+        self.rng = np.random.default_rng(seed)
+        self.mean = np.full(n, 0.5) if x0 is None else np.clip(np.asarray(x0, dtype=float), 0.0, 1.0)
+        self.sigma = sigma0
+        self.C = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.generation = 0
+        self._constants()
+
+    def _constants(self):
+        n = self.dimension
+        self.mu = self.popsize // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+    def _eigen(self):
+        eigenvalues, B = np.linalg.eigh(self.C)
+        return np.sqrt(np.maximum(eigenvalues, 1e-20)), B
+
+    def ask(self):
+        """:return: The candidates of the next generation, shape (popsize, dimension), in [0, 1]."""
+        D, B = self._eigen()
+        z = self.rng.standard_normal((self.popsize, self.dimension))
+        return np.clip(self.mean + self.sigma * (z * D) @ B.T, 0.0, 1.0)
+
+    def tell(self, X, costs):
+        """Update the distribution from the costs of the candidates returned by ask()."""
+        X = np.asarray(X, dtype=float)
+        order = np.argsort(_costs(costs), kind="stable")
+        selected = X[order[:self.mu]]
+        old = self.mean
+        self.mean = self.weights @ selected
+        y = (self.mean - old) / self.sigma
+        D, B = self._eigen()
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * (B @ ((B.T @ y) / D))
+        self.generation += 1
+        hsig = (np.linalg.norm(self.ps) / np.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi_n
+                < 1.4 + 2 / (self.dimension + 1))
+        self.pc = (1 - self.cc) * self.pc + hsig * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * y
+        steps = (selected - old) / self.sigma
+        self.C = ((1 - self.c1 - self.cmu) * self.C
+                  + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.C)
+                  + self.cmu * (steps.T * self.weights) @ steps)
+        self.C = (self.C + self.C.T) / 2
+        self.sigma = min(self.sigma * np.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1)),
+                         1.0)
+
+    def spread(self):
+        """Largest standard deviation of the search distribution (normalised units)."""
+        return float(self.sigma * np.max(self._eigen()[0]))
+
+    def state(self):
+        """:return: Tuple (JSON-serialisable dict, dict of arrays)."""
+        return ({"method": self.method, "dimension": self.dimension, "popsize": self.popsize,
+                 "sigma": self.sigma, "generation": self.generation, "rng": self.rng.bit_generator.state},
+                {"mean": self.mean, "C": self.C, "pc": self.pc, "ps": self.ps})
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        optimizer = cls(meta["dimension"], popsize=meta["popsize"])
+        optimizer.sigma = meta["sigma"]
+        optimizer.generation = meta["generation"]
+        optimizer.rng.bit_generator.state = meta["rng"]
+        optimizer.mean, optimizer.C = np.array(arrays["mean"]), np.array(arrays["C"])
+        optimizer.pc, optimizer.ps = np.array(arrays["pc"]), np.array(arrays["ps"])
+        return optimizer
+
+
+class DifferentialEvolution:
+    """
+    Differential evolution (rand/1/bin) on the unit cube.
+
+    The first generation is a Latin hypercube sample of the cube (with x0 as its first member);
+    mutants falling outside the cube are clipped onto it.
+    """
+
+    method = "de"
+
+    def __init__(self, dimension, x0=None, popsize=None, F=0.7, CR=0.9, seed=None):
+        """
+        :param dimension: Number of parameters.
+        :param x0: (Optional) A starting point (normalised) included in the first generation.
+        :param popsize: Population size; defaults to max(8, 5 * dimension).
+        :param F: Differential weight.
+        :param CR: Crossover probability.
+        :param seed: Seed of the random generator.
+        """
+        self.dimension = dimension
+        self.popsize = popsize or max(8, 5 * dimension)
+        self.F = F
+        self.CR = CR
+        self.rng = np.random.default_rng(seed)
+        self.x0 = None if x0 is None else np.clip(np.asarray(x0, dtype=float), 0.0, 1.0)
+        self.population = None
+        self.costs = None
+        self.generation = 0
+
+    def ask(self):
+        """:return: The candidates of the next generation, shape (popsize, dimension), in [0, 1]."""
+        if self.population is None:
+            X = latin_hypercube(self.popsize, self.dimension, self.rng)
+            if self.x0 is not None:
+                X[0] = self.x0
+            return X
+        P = self.population
+        trials = np.empty_like(P)
+        for i in range(self.popsize):
+            r1, r2, r3 = self.rng.choice([k for k in range(self.popsize) if k != i], 3, replace=False)
+            mutant = np.clip(P[r1] + self.F * (P[r2] - P[r3]), 0.0, 1.0)
+            cross = self.rng.random(self.dimension) < self.CR
+            cross[self.rng.integers(self.dimension)] = True
+            trials[i] = np.where(cross, mutant, P[i])
+        return trials
+
+    def tell(self, X, costs):
+        """Keep every candidate that does at least as well as the member it was derived from."""
+        X = np.asarray(X, dtype=float)
+        costs = _costs(costs)
+        if self.population is None:
+            self.population, self.costs = X.copy(), costs.copy()
+        else:
+            better = costs <= self.costs
+            self.population[better] = X[better]
+            self.costs[better] = costs[better]
+        self.generation += 1
+
+    def spread(self):
+        """Largest extent of the population along a parameter (normalised units)."""
+        return float(np.max(np.ptp(self.population, axis=0))) if self.population is not None else 1.0
+
+    def state(self):
+        meta = {"method": self.method, "dimension": self.dimension, "popsize": self.popsize, "F": self.F,
+                "CR": self.CR, "generation": self.generation, "rng": self.rng.bit_generator.state}
+        arrays = {} if self.population is None else {"population": self.population, "costs": self.costs}
+        if self.x0 is not None:
+            arrays["x0"] = self.x0
+        return meta, arrays
+
+    @classmethod
+    def from_state(cls, meta, arrays):
+        optimizer = cls(meta["dimension"], x0=arrays.get("x0"), popsize=meta["popsize"], F=meta["F"],
+                        CR=meta["CR"])
+        optimizer.generation = meta["generation"]
+        optimizer.rng.bit_generator.state = meta["rng"]
+        if "population" in arrays:
+            optimizer.population = np.array(arrays["population"])
+            optimizer.costs = np.array(arrays["costs"])
+        return optimizer
+
+
+OPTIMIZERS = {CMAES.method: CMAES, DifferentialEvolution.method: DifferentialEvolution}
+
+
+class PoolEvaluator:
+    """
+    Costs of a generation, every candidate simulated as its own scheduler job.
+
+    Each slot has its own sandbox circuit folder (<sandbox_root>/slot_<k>) declared as the job's
+    resource, so candidates run concurrently up to the number of slots and scheduler workers.
+    """
+
+    def __init__(self, model, residuals, names, scheduler=None, slots=None, priority="optimizer", owner=None):
+        """
+        :param model: SimulatorModel of the fit (its settings are copied for every slot).
+        :param residuals: Residual function of the simulated curves (e.g. CurveResiduals).
+        :param names: Names of the parameters, in the order of the candidate vectors.
+        :param scheduler: (Optional) SimulationScheduler; defaults to the shared one.
+        :param slots: Number of sandbox folders; defaults to the scheduler's number of workers.
+        :param priority: Scheduler priority class of the jobs.
+        :param owner: Scheduler owner of the jobs (one per optimizer run by default).
+        """
+        from IceMOS_sky130_scheduler import default_scheduler
+        self.scheduler = scheduler or default_scheduler()
+        self.residuals = residuals
+        self.names = list(names)
+        self.priority = priority
+        self.owner = owner or f"global-{id(self)}"
+        slots = slots or self.scheduler.max_workers
+        self.models = [SimulatorModel(model.original_model_file, model.device_type, model.bin_number,
+                                      model.lib_file_path, model.kind, model.sweep,
+                                      base_parameters=model.base_parameters,
+                                      sandbox_root=os.path.join(model.sandbox_root, f"slot_{k}"),
+                                      simulator_options=model.simulator_options)
+                       for k in range(slots)]
+        self.evaluations = 0
+        self._lock = threading.Lock()
+
+    def _evaluate(self, slot, x):
+        curves = self.models[slot](dict(zip(self.names, x)))
+        # The residual function keeps state (the target masks) set on its first call.
+        with self._lock:
+            r = np.asarray(self.residuals(curves), dtype=float)
+        return np.inf if np.any(~np.isfinite(r)) else 0.5 * float(r @ r)
+
+    def __call__(self, points):
+        """
+        :param points: Candidate parameter vectors (parameter units).
+        :return: Array of costs (half the sum of squared residuals; inf where the simulation failed).
+        """
+        jobs = [self.scheduler.submit(self._evaluate, k % len(self.models), np.asarray(x, dtype=float),
+                                      priority=self.priority, owner=self.owner,
+                                      resource=(self.owner, k % len(self.models)))
+                for k, x in enumerate(points)]
+        costs = []
+        for job in jobs:
+            try:
+                costs.append(job.result())
+            except (RuntimeError, ValueError, OSError, CancelledError) as e:
+                # A failed, malformed or cancelled candidate costs inf; the search goes on.
+                print(f"Candidate evaluation failed: {e!r}")
+                costs.append(np.inf)
+        self.evaluations += len(jobs)
+        return np.array(costs)
+
+
+class PopulationNetlistEvaluator:
+    """
+    Costs of a generation simulated in one ngspice launch, as one netlist with a device copy (and model
+    card) per candidate.
+    """
+
+    def __init__(self, model, residuals, names):
+        """
+        :param model: SimulatorModel of the fit.
+        :param residuals: Residual function of the simulated curves (e.g. CurveResiduals).
+        :param names: Names of the parameters, in the order of the candidate vectors.
+        """
+        self.batch = BatchedJacobian(model, residuals, names, tag="population")
+        self.residuals = residuals
+        self.evaluations = 0
+
+    @property
+    def launches(self):
+        return self.batch.launches
+
+    def __call__(self, points):
+        curves = self.batch.simulate([np.asarray(x, dtype=float) for x in points])
+        self.evaluations += len(curves)
+        costs = []
+        for candidate in curves:
+            r = np.asarray(self.residuals(candidate), dtype=float)
+            costs.append(np.inf if np.any(~np.isfinite(r)) else 0.5 * float(r @ r))
+        return np.array(costs)
+
+
+def session_checkpoint(session_file):
+    """Checkpoint path of the global search of a calibration session file ('<session>_global.json')."""
+    return f"{os.path.splitext(session_file)[0]}_global.json"
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_checkpoint(path, optimizer, progress):
+    """
+    Write a checkpoint: the JSON file at `path` and the optimizer arrays in the NPZ file next to it.
+
+    :param progress: Dict of the run's counters (names, bounds, evaluations, elapsed, best point, history).
+    """
+    meta, arrays = optimizer.state()
+    npz_path = os.path.splitext(path)[0] + ".npz"
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    # The arrays are written first: the JSON file, written last, marks a complete checkpoint.
+    _write_atomic(npz_path, lambda f: np.savez(f, generation=optimizer.generation, **arrays))
+    document = dict(progress, optimizer=meta)
+    _write_atomic(path, lambda f: f.write(json.dumps(document, indent=1).encode("utf-8")))
+
+
+def load_checkpoint(path):
+    """
+    :return: Tuple (optimizer, progress dict) of a checkpoint written by save_checkpoint().
+    :raises ValueError: If the NPZ file does not belong to the JSON file.
+    """
+    with open(path, "r") as f:
+        document = json.load(f)
+    meta = document.pop("optimizer")
+    with np.load(os.path.splitext(path)[0] + ".npz") as data:
+        arrays = {key: data[key] for key in data.files}
+    if int(arrays.pop("generation")) != meta["generation"]:
+        raise ValueError(f"The arrays of checkpoint {path} are from another generation.")
+    return OPTIMIZERS[meta["method"]].from_state(meta, arrays), document
+
+
+class GlobalFitResult:
+    """
+    Outcome of a global search.
+
+    :ivar x: Best point found (array, in the order of `names`).
+    :ivar parameters: Dict {name: best value}.
+    :ivar cost: Cost at x.
+    :ivar evaluations: Number of candidates evaluated (over every resumed run).
+    :ivar generations: Number of generations.
+    :ivar elapsed: Wall-clock time spent (s, over every resumed run).
+    :ivar message: Why the search stopped.
+    :ivar history: List of (evaluations, best cost) after every generation.
+    """
+
+    def __init__(self, x, names, cost, evaluations, generations, elapsed, message, history):
+        self.x = x
+        self.names = names
+        self.parameters = {name: float(value) for name, value in zip(names, x)}
+        self.cost = cost
+        self.evaluations = evaluations
+        self.generations = generations
+        self.elapsed = elapsed
+        self.message = message
+        self.history = history
+
+    def describe(self):
+        return (f"{self.message} after {self.generations} generations, {self.evaluations} simulations "
+                f"and {self.elapsed:.0f} s; cost {self.cost:.4g}")
+
+    def __repr__(self):
+        return f"GlobalFitResult({self.describe()})"
+
+
+def global_fit(evaluator, lower, upper, method="cmaes", names=None, x0=None, max_evaluations=1000,
+               max_seconds=None, xtol=1e-6, checkpoint=None, resume=True, seed=None, progress=None, **options):
+    """
+    Minimise a cost over the box lower <= x <= upper with a population-based optimizer.
+
+    :param evaluator: Callable list of parameter vectors -> array of costs (e.g. PoolEvaluator); inf or NaN
+                      marks a failed evaluation.
+    :param lower: Lower bounds.
+    :param upper: Upper bounds (each larger than its lower bound).
+    :param method: 'cmaes' or 'de'.
+    :param names: (Optional) Parameter names.
+    :param x0: (Optional) Starting point (CMA-ES mean, member of the first DE generation).
+    :param max_evaluations: Evaluation budget; a generation that would exceed it is not started.
+    :param max_seconds: (Optional) Wall-clock budget, checked between generations.
+    :param xtol: Stop when the optimizer's spread falls below this fraction of the bound ranges.
+    :param checkpoint: (Optional) JSON checkpoint path, written after every generation.
+    :param resume: Continue from the checkpoint when it exists (the budgets count the earlier runs).
+    :param seed: Seed of the optimizer's random generator.
+    :param progress: (Optional) Called with a FitProgress (iteration = generation) after every generation;
+                     returning True stops the search.
+    :param options: Extra optimizer arguments (sigma0, popsize, F, CR).
+    :return: GlobalFitResult.
+    :raises ValueError: If the checkpoint was written for other parameters or bounds.
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    if np.any(upper <= lower):
+        raise ValueError("Every parameter needs a max larger than its min.")
+    names = list(names) if names is not None else [f"x{i}" for i in range(len(lower))]
+    span = upper - lower
+    if method not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer '{method}'; expected one of {sorted(OPTIMIZERS)}.")
+
+    if checkpoint is not None and resume and os.path.exists(checkpoint):
+        optimizer, state = load_checkpoint(checkpoint)
+        if (state["names"] != names or not np.allclose(state["lower"], lower)
+                or not np.allclose(state["upper"], upper) or optimizer.method != method):
+            raise ValueError(f"Checkpoint {checkpoint} was written for another search; remove it to start over.")
+        print(f"Resuming {method} from generation {optimizer.generation} ({state['evaluations']} simulations).")
+    else:
+        z0 = None if x0 is None else (np.asarray(x0, dtype=float) - lower) / span
+        optimizer = OPTIMIZERS[method](len(lower), x0=z0, seed=seed, **options)
+        state = {"names": names, "lower": lower.tolist(), "upper": upper.tolist(), "evaluations": 0,
+                 "elapsed": 0.0, "best_x": None, "best_cost": None, "history": []}
+
+    started = time.monotonic()
+    elapsed0 = state["elapsed"]
+    message = "Evaluation budget reached"
+    while True:
+        state["elapsed"] = elapsed0 + time.monotonic() - started
+        if state["evaluations"] + optimizer.popsize > max_evaluations:
+            break
+        if max_seconds is not None and state["elapsed"] >= max_seconds:
+            message = "Time budget reached"
+            break
+        if optimizer.generation > 0 and optimizer.spread() < xtol:
+            message = "Population converged"
+            break
+        Z = optimizer.ask()
+        costs = _costs(evaluator([lower + z * span for z in Z]))
+        optimizer.tell(Z, costs)
+        state["evaluations"] += len(Z)
+        best = int(np.argmin(costs))
+        if state["best_cost"] is None or costs[best] < state["best_cost"]:
+            state["best_x"] = (lower + Z[best] * span).tolist()
+            state["best_cost"] = float(costs[best])
+        state["history"].append((state["evaluations"], state["best_cost"]))
+        state["elapsed"] = elapsed0 + time.monotonic() - started
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, optimizer, state)
+        if progress is not None and progress(FitProgress(optimizer.generation, state["evaluations"], max_evaluations,
+                                                         state["best_cost"], np.array(state["best_x"]), names)):
+            message = "Cancelled"
+            break
+
+    if state["best_x"] is None:
+        return GlobalFitResult(np.clip(x0, lower, upper) if x0 is not None else lower + 0.5 * span, names,
+                               np.inf, state["evaluations"], optimizer.generation, state["elapsed"], message,
+                               state["history"])
+    return GlobalFitResult(np.array(state["best_x"]), names, state["best_cost"], state["evaluations"],
+                           optimizer.generation, state["elapsed"], message,
+                           [tuple(entry) for entry in state["history"]])
@@ -0,0 +1,292 @@
+"""
+IceMOS_sky130_lab_aggregate.py
+
+This module turns the curves of many measured devices (e.g. all the dies of a wafer for one
+geometry) into statistical reference curves: for each bias point, the curves are interpolated
+onto a common grid and reduced to their count, mean, standard deviation, median and percentiles.
+
+Curves are streamed: the mean and variance are accumulated with Welford's algorithm, and the
+percentiles are computed from a fixed-size reservoir sample of curves per bias point (exact as
+long as there are no more devices than the reservoir size, a uniform random sample beyond). Memory
+use therefore depends on the number of bias points and grid points, not on the number of devices.
+
+    catalog = LabCatalog("wafer_8397/pch_w1p68_l0p15")
+    catalog.scan()
+    reference = aggregate_catalog(catalog, sweep="IDVD", VB=0.0)
+    for curve in reference:
+        print(curve.biases, curve.count, curve.median[-1], curve.percentiles[90][-1])
+    reference.save("reference_pch_idvd.npz")
+"""
+
+import numpy as np
+
+from IceMOS_sky130_result_store import Curve
+
+
+class RunningStats:
+    """
+    Streaming statistics of curves sampled on a common grid.
+
+    NaN points (outside a curve's sweep range, failed measurements) are ignored point by point.
+    """
+
+    def __init__(self, grid, reservoir_size=256, seed=0):
+        """
+        :param grid: Common sweep grid (1-D array).
+        :param reservoir_size: Number of curves kept for the percentiles.
+        :param seed: Seed of the reservoir sampling (results are reproducible).
+        """
+        self.grid = np.asarray(grid, dtype=float)
+        self.curves = 0
+        self.count = np.zeros(len(self.grid), dtype=np.int64)
+        self.mean = np.zeros(len(self.grid))
+        self._m2 = np.zeros(len(self.grid))
+        self.minimum = np.full(len(self.grid), np.inf)
+        self.maximum = np.full(len(self.grid), -np.inf)
+        self.reservoir = np.full((reservoir_size, len(self.grid)), np.nan)
+        self._random = np.random.default_rng(seed)
+
+    def update(self, y):
+        """
+        Add one curve.
+
+        :param y: Values on the grid (NaN where not measured).
+        """
+        y = np.asarray(y, dtype=float)
+        valid = ~np.isnan(y)
+        self.count[valid] += 1
+        delta = y[valid] - self.mean[valid]
+        self.mean[valid] += delta / self.count[valid]
+        self._m2[valid] += delta * (y[valid] - self.mean[valid])
+        self.minimum[valid] = np.minimum(self.minimum[valid], y[valid])
+        self.maximum[valid] = np.maximum(self.maximum[valid], y[valid])
+        # Reservoir sampling (algorithm R): every curve seen so far is kept with the same probability.
+        if self.curves < len(self.reservoir):
+            self.reservoir[self.curves] = y
+        else:
+            slot = self._random.integers(0, self.curves + 1)
+            if slot < len(self.reservoir):
+                self.reservoir[slot] = y
+        self.curves += 1
+
+    @property
+    def variance(self):
+        """Sample variance per grid point (NaN with fewer than two values)."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 1, self._m2 / np.maximum(self.count - 1, 1), np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def percentiles(self, percentiles):
+        """
+        :param percentiles: Percentiles in [0, 100].
+        :return: Dict {percentile: array on the grid}.
+        """
+        sample = self.reservoir[:min(self.curves, len(self.reservoir))]
+        result = {}
+        for p in percentiles:
+            values = np.full(len(self.grid), np.nan)
+            measured = (~np.isnan(sample)).any(axis=0) if len(sample) else np.zeros(len(self.grid), dtype=bool)
+            if measured.any():
+                values[measured] = np.nanpercentile(sample[:, measured], p, axis=0)
+            result[p] = values
+        return result
+
+
+class ReferenceCurve:
+    """
+    Statistical reference curve of one bias point.
+
+    :ivar biases: Dict of the fixed biases {'vg': ..., 'vd': ..., 'vs': ..., 'vb': ...} (None if swept).
+    :ivar grid: Common sweep grid.
+    :ivar count: Number of devices per grid point.
+    :ivar mean, std, median, minimum, maximum: Arrays on the grid.
+    :ivar percentiles: Dict {percentile: array on the grid}.
+    """
+
+    def __init__(self, biases, grid, count, mean, std, median, percentiles, minimum, maximum, devices):
+        self.biases = biases
+        self.grid = grid
+        self.count = count
+        self.mean = mean
+        self.std = std
+        self.median = median
+        self.percentiles = percentiles
+        self.minimum = minimum
+        self.maximum = maximum
+        self.devices = devices
+
+    def __repr__(self):
+        biases = ", ".join(f"{name.upper()}={value:g}" for name, value in self.biases.items() if value is not None)
+        return f"ReferenceCurve({biases}, devices={self.devices}, points={len(self.grid)})"
+
+
+class ReferenceSet:
+    """
+    Reference curves of a sweep, one per bias point.
+
+    :ivar sweep: Swept bias ('VD', 'VG').
+    :ivar metadata: Dict describing the selection (device, quantity, conditions).
+    """
+
+    def __init__(self, sweep, curves, metadata=None):
+        self.sweep = sweep
+        self.curves = curves
+        self.metadata = dict(metadata or {})
+
+    def __iter__(self):
+        return iter(self.curves)
+
+    def __len__(self):
+        return len(self.curves)
+
+    def find(self, tolerance=1e-6, **biases):
+        """
+        Return the reference curve at the given biases (e.g. vg=-1.2, vb=0).
+
+        :raises KeyError: If no curve matches.
+        """
+        for curve in self.curves:
+            if all(curve.biases.get(name.lower()) is not None
+                   and abs(curve.biases[name.lower()] - value) <= tolerance for name, value in biases.items()):
+                return curve
+        raise KeyError(f"No reference curve at {biases}.")
+
+    def to_curves(self, statistic="median", device=None, **curve_fields):
+        """
+        Convert one statistic into result-store curves (source 'reference'), e.g. to store it next to
+        the measurements.
+
+        :param statistic: 'median', 'mean', 'std', 'minimum', 'maximum' or a percentile (e.g. 90).
+        :param curve_fields: Extra Curve arguments (bin, temperature, ...).
+        """
+        device = device or self.metadata.get("device")
+        curves = []
+        for curve in self.curves:
+            values = curve.percentiles[statistic] if isinstance(statistic, (int, float)) else getattr(curve, statistic)
+            keep = ~np.isnan(values)
+            attrs = {"statistic": str(statistic), "devices": curve.devices,
+                     "key": f"reference:{self.sweep}:{statistic}:{sorted(curve.biases.items())}"}
+            curves.append(Curve(curve.grid[keep], values[keep], device, sweep=self.sweep, source="reference",
+                                attrs=attrs, **dict(curve.biases, **curve_fields)))
+        return curves
+
+    def save(self, path):
+        """Save the set to a .npz file."""
+        arrays = {"sweep": np.array(self.sweep), "n_curves": np.array(len(self.curves))}
+        for i, curve in enumerate(self.curves):
+            prefix = f"c{i}_"
+            arrays[prefix + "biases"] = np.array([np.nan if curve.biases[name] is None else curve.biases[name]
+                                                  for name in ("vg", "vd", "vs", "vb")])
+            for name in ("grid", "count", "mean", "std", "median", "minimum", "maximum"):
+                arrays[prefix + name] = getattr(curve, name)
+            arrays[prefix + "devices"] = np.array(curve.devices)
+            arrays[prefix + "percentile_levels"] = np.array(sorted(curve.percentiles), dtype=float)
+            arrays[prefix + "percentiles"] = np.array([curve.percentiles[p] for p in sorted(curve.percentiles)])
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a set saved with save()."""
+        with np.load(path) as data:
+            curves = []
+            for i in range(int(data["n_curves"])):
+                prefix = f"c{i}_"
+                biases = {name: None if np.isnan(value) else float(value)
+                          for name, value in zip(("vg", "vd", "vs", "vb"), data[prefix + "biases"])}
+                levels = [p.item() for p in data[prefix + "percentile_levels"]]
+                percentiles = {(int(p) if float(p).is_integer() else p): values
+                               for p, values in zip(levels, data[prefix + "percentiles"])}
+                curves.append(ReferenceCurve(biases, data[prefix + "grid"], data[prefix + "count"],
+                                             data[prefix + "mean"], data[prefix + "std"], data[prefix + "median"],
+                                             percentiles, data[prefix + "minimum"], data[prefix + "maximum"],
+                                             int(data[prefix + "devices"])))
+            return cls(str(data["sweep"]), curves)
+
+
+def interpolate_to_grid(x, y, grid):
+    """Interpolate a measured curve onto a grid (NaN outside the measured range)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    if len(x) < 2:
+        return np.full(len(grid), np.nan)
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    values = np.interp(grid, x, y)
+    values[(grid < x[0]) | (grid > x[-1])] = np.nan
+    return values
+
+
+def aggregate_curves(curves, grid=None, percentiles=(10, 50, 90), reservoir_size=256, seed=0):
+    """
+    Aggregate a stream of curves measured at the same bias point.
+
+    :param curves: Iterable of (x, y) pairs (consumed once).
+    :param grid: Common grid; defaults to the sweep points of the first curve.
+    :return: ReferenceCurve with empty biases, or None if the stream is empty.
+    """
+    stats = None
+    for x, y in curves:
+        if stats is None:
+            stats = RunningStats(np.sort(np.asarray(x, dtype=float)) if grid is None else grid,
+                                 reservoir_size, seed)
+        stats.update(interpolate_to_grid(x, y, stats.grid))
+    if stats is None:
+        return None
+    return _reference_curve({}, stats, percentiles)
+
+
+def _reference_curve(biases, stats, percentiles):
+    levels = stats.percentiles(sorted(set(percentiles) | {50}))
+    with np.errstate(invalid="ignore"):
+        minimum = np.where(stats.count > 0, stats.minimum, np.nan)
+        maximum = np.where(stats.count > 0, stats.maximum, np.nan)
+        mean = np.where(stats.count > 0, stats.mean, np.nan)
+    return ReferenceCurve(biases, stats.grid, stats.count.copy(), mean, stats.std, levels[50],
+                          {p: levels[p] for p in percentiles}, minimum, maximum, stats.curves)
+
+
+def aggregate_catalog(catalog, sweep, quantity="ID", grid=None, percentiles=(10, 50, 90), reservoir_size=256,
+                      batch_size=256, seed=0, **conditions):
+    """
+    Build the reference curves of a measurement selection, one per bias point, across devices.
+
+    The matching curves are loaded in batches of `batch_size`, following the storage order so that
+    each store chunk is read once per batch.
+
+    :param catalog: LabCatalog.
+    :param sweep: Sweep type ('IDVD', 'IDVG') or swept bias.
+    :param quantity: Current column ('ID', 'IB', 'IG').
+    :param grid: (Optional) Common grid for every bias point; defaults to the sweep points of the longest
+                 curve of each bias point.
+    :param conditions: LabCatalog.query conditions (device, bin, temperature, W, L, VB, ...).
+    :return: ReferenceSet.
+    """
+    records = sorted(catalog.query(sweep, quantity, **conditions), key=lambda record: (record.chunk, record.start))
+    key_of = lambda record: (record.vg, record.vd, record.vs, record.vb)
+    stats = {}
+    if grid is None:
+        # The default grid of a bias point is the sweep of its longest curve (found from the index alone).
+        longest = {}
+        for record in records:
+            if key_of(record) not in longest or record.length > longest[key_of(record)].length:
+                longest[key_of(record)] = record
+        for record, x, _ in catalog.load(list(longest.values())):
+            stats[key_of(record)] = RunningStats(np.unique(np.asarray(x, dtype=float)), reservoir_size, seed)
+    for start in range(0, len(records), batch_size):
+        for record, x, y in catalog.load(records[start:start + batch_size]):
+            key = key_of(record)
+            if key not in stats:
+                stats[key] = RunningStats(grid, reservoir_size, seed)
+            stats[key].update(interpolate_to_grid(x, y, stats[key].grid))
+    curves = [_reference_curve(dict(zip(("vg", "vd", "vs", "vb"), key)), stats[key], percentiles)
+              for key in sorted(stats, key=lambda key: tuple(-np.inf if v is None else v for v in key))]
+    swept = records[0].sweep if records else sweep
+    devices = {record.device for record in records}
+    metadata = dict(conditions, quantity=quantity, sweep_type=sweep,
+                    device=devices.pop() if len(devices) == 1 else None)
+    return ReferenceSet(swept, curves, metadata)
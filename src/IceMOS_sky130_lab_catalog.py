@@ -0,0 +1,330 @@
+"""
+IceMOS_sky130_lab_catalog.py
+
+This module indexes a tree of lab measurement files (e.g. test/mdm_proc_pch_bin_1) once and
+keeps their curves in a ResultStore, so that measured curves can be selected by condition
+instead of through file dialogs.
+
+Measurement file names encode the device and the bias conditions:
+
+    sky130_fd_pr__pfet_01v8_w1p68u_l0p15u_m1(8397_4_3_IDVD)_4K_VS_0.0_VB_1.5_VG_-1.2.csv
+    <device name>_w<W>u_l<L>u_m<multiplier>(<die>_<sweep type>)_<T>K_<bias>_<value>_...
+
+with 'p' as the decimal point in W and L. The sweep type gives the swept bias (IDVD sweeps VD,
+IDVG sweeps VG); the other biases are fixed. Each file is a CSV with a header row: the swept
+voltage column, then current columns (ID, IB, IG) and possibly derived columns. Every current
+column is stored as its own curve ('quantity' attribute), in the lab's sign convention.
+
+IC-CAP .mdm files following the same naming (without the per-point biases) are read directly:
+each outer bias combination of each measured current becomes one curve.
+
+Scanning is incremental: files whose size and modification time did not change since the last
+scan are not read again. ingest() indexes a given list of files without walking the tree (used by
+the folder watcher of IceMOS_sky130_lab_watcher).
+
+    catalog = LabCatalog("test/mdm_proc_pch_bin_1")
+    catalog.scan()
+    for record, vd, ids in catalog.load(sweep="IDVD", VB=1.5):
+        print(record.vg, ids[-1])
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+from IceMOS_sky130_mdm_reader import read_mdm
+from IceMOS_sky130_result_store import Curve, ResultStore
+
+
+# Swept bias of each sweep type.
+SWEEP_TYPES = {"IDVD": "VD", "IDVG": "VG", "IGVG": "VG", "IBVB": "VB", "IDVB": "VB"}
+
+_NAME_PATTERN = re.compile(
+    r"^(?P<device_name>.+?)_w(?P<W>[\dp.]+)u_l(?P<L>[\dp.]+)u_m(?P<m>\d+)"
+    r"\((?P<die>.*)_(?P<sweep_type>[A-Z]+)\)"
+    r"_(?P<temperature>-?[\dp.]+)(?P<unit>[KC])"
+    r"(?P<biases>(?:_V[A-Z]+_-?[\d.]+(?:e-?\d+)?)*)$")
+_BIAS_PATTERN = re.compile(r"_(V[A-Z]+)_(-?[\d.]+(?:e-?\d+)?)")
+_CURRENT_COLUMN = re.compile(r"^I[A-Z]*$")
+
+
+def _dimension(text):
+    return float(text.replace("p", "."))
+
+
+def parse_measurement_name(path):
+    """
+    Parse the conditions encoded in a measurement file name.
+
+    :param path: File path or name.
+    :return: Dict with device_name, device ('nch'/'pch'), W and L in µm, m, die, sweep_type, sweep
+             (swept bias), temperature (°C), temperature_k and one entry per fixed bias (VS, VB, VG, VD),
+             or None if the name does not follow the convention.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    m = _NAME_PATTERN.match(stem)
+    if not m:
+        return None
+    temperature = float(m.group("temperature").replace("p", "."))
+    temperature_k = temperature if m.group("unit") == "K" else temperature + 273.15
+    device_name = m.group("device_name")
+    conditions = {
+        "device_name": device_name,
+        "device": "pch" if "pfet" in device_name else "nch",
+        "W": _dimension(m.group("W")),
+        "L": _dimension(m.group("L")),
+        "m": int(m.group("m")),
+        "die": m.group("die"),
+        "sweep_type": m.group("sweep_type"),
+        "sweep": SWEEP_TYPES.get(m.group("sweep_type"), m.group("sweep_type")[2:]),
+        "temperature_k": temperature_k,
+        "temperature": round(temperature_k - 273.15, 2),
+    }
+    for name, value in _BIAS_PATTERN.findall(m.group("biases")):
+        conditions[name] = float(value)
+    return conditions
+
+
+def _split_header(line):
+    """Split a CSV header on the commas that are not inside parentheses (e.g. 'R:beta(1,1)')."""
+    names = []
+    depth = 0
+    current = ""
+    for char in line.strip():
+        if char == "," and depth == 0:
+            names.append(current.strip())
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    names.append(current.strip())
+    return names
+
+
+def read_measurement(path):
+    """
+    Read a measurement CSV file.
+
+    :return: Dict {column name: 1-D array}.
+    """
+    with open(path, "r") as f:
+        header = _split_header(f.readline())
+        data = np.loadtxt(f, delimiter=",", ndmin=2)
+    if data.size and data.shape[1] != len(header):
+        raise ValueError(f"{path}: {len(header)} column names for {data.shape[1]} data columns.")
+    return {name: data[:, i] for i, name in enumerate(header)}
+
+
+class LabCatalog:
+    """
+    Catalog of the measurement files under a root folder, backed by a ResultStore (source 'lab').
+    """
+
+    def __init__(self, root, store_folder=None):
+        """
+        :param root: Measurement tree to index.
+        :param store_folder: (Optional) Folder of the cached store; defaults to <root>/.lab_catalog.
+        """
+        self.root = root
+        self.store_folder = store_folder or os.path.join(root, ".lab_catalog")
+        self.store = ResultStore(self.store_folder)
+        self._files_path = os.path.join(self.store_folder, "files.json")
+        self.files = {}
+        if os.path.exists(self._files_path):
+            with open(self._files_path, "r") as f:
+                self.files = json.load(f)
+
+    def _save_files(self):
+        tmp_path = self._files_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._files_path)
+
+    @staticmethod
+    def _bin_of(path):
+        """Bin number from the closest 'bin_<n>' folder of a file (e.g. mdm_proc_pch_bin_1), if any."""
+        found = re.findall(r"bin_(\d+)", os.path.dirname(os.path.abspath(path)))
+        return int(found[-1]) if found else None
+
+    def scan(self):
+        """
+        Index new and changed measurement files (and forget the deleted ones).
+
+        :return: Tuple (number of files imported, number of files skipped because their name or content
+                 could not be parsed).
+        """
+        seen = set()
+        paths = []
+        for folder, dirs, names in os.walk(self.root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(names):
+                if name.lower().endswith((".csv", ".mdm")):
+                    path = os.path.join(folder, name)
+                    seen.add(os.path.relpath(path, self.root))
+                    paths.append(path)
+        for relpath in sorted(set(self.files) - seen):
+            self._forget(relpath)
+            del self.files[relpath]
+        imported, skipped = self._import(paths)
+        return len(imported), skipped
+
+    def ingest(self, paths):
+        """
+        Index the given files only (e.g. the ones a folder watcher reported), without walking the tree.
+
+        Files that did not change since they were indexed are ignored; files that no longer exist are
+        forgotten.
+
+        :param paths: Paths of measurement files under the root.
+        :return: List of the CurveRecords added for the new and changed files.
+        """
+        existing = []
+        for path in paths:
+            relpath = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+            if os.path.exists(path):
+                existing.append(path)
+            elif relpath in self.files:
+                self._forget(relpath)
+                del self.files[relpath]
+        imported, _ = self._import(existing)
+        if not imported:
+            return []
+        return [record for record in self.store.query(source="lab") if record.attrs.get("file") in imported]
+
+    def _import(self, paths):
+        """
+        Read the files whose size or modification time changed and append their curves to the store.
+
+        :return: Tuple (set of the imported relative paths, number of files skipped).
+        """
+        curves = []
+        imported = set()
+        skipped = 0
+        for path in paths:
+            if not path.lower().endswith((".csv", ".mdm")):
+                continue
+            relpath = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+            status = os.stat(path)
+            signature = [status.st_size, status.st_mtime]
+            if self.files.get(relpath) == signature:
+                continue
+            file_curves = self._file_curves(path, relpath)
+            if file_curves is None:
+                skipped += 1
+                continue
+            if relpath in self.files:
+                self._forget(relpath)
+            curves.extend(file_curves)
+            self.files[relpath] = signature
+            imported.add(relpath)
+        self.store.append(curves)
+        self._save_files()
+        return imported, skipped
+
+    def _forget(self, relpath):
+        records = [record for record in self.store.query(source="lab") if record.attrs.get("file") == relpath]
+        if records:
+            self.store.delete(records)
+
+    def _file_curves(self, path, relpath):
+        """Build the curves of one file (None if its name or content cannot be parsed)."""
+        conditions = parse_measurement_name(path)
+        if conditions is None:
+            print(f"Skipping {relpath}: the file name does not encode the measurement conditions.")
+            return None
+        try:
+            if path.lower().endswith(".mdm"):
+                return self._mdm_curves(path, relpath, conditions)
+            return self._csv_curves(path, relpath, conditions)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {relpath}: {e}")
+            return None
+
+    def _curve(self, path, relpath, conditions, biases, x, y, quantity, key):
+        """Build a lab Curve; biases (VG, VD, VS, VB) override the ones parsed from the file name."""
+        biases = dict({name: conditions.get(name) for name in ("VG", "VD", "VS", "VB")}, **biases)
+        attrs = {name: conditions[name] for name in ("device_name", "W", "L", "m", "die", "sweep_type",
+                                                      "temperature_k")}
+        attrs.update(file=relpath, quantity=quantity, key=key)
+        return Curve(x, y, conditions["device"], bin=self._bin_of(path), temperature=conditions["temperature"],
+                     sweep=conditions["sweep"], vg=biases["VG"], vd=biases["VD"], vs=biases["VS"],
+                     vb=biases["VB"], source="lab", attrs=attrs)
+
+    def _csv_curves(self, path, relpath, conditions):
+        """One curve per current column of a CSV file (one bias point per file)."""
+        columns = read_measurement(path)
+        sweep = conditions["sweep"]
+        if sweep not in columns:
+            raise ValueError(f"no '{sweep}' column for a {conditions['sweep_type']} sweep")
+        return [self._curve(path, relpath, conditions, {}, columns[sweep], values, quantity, f"{relpath}:{quantity}")
+                for quantity, values in columns.items() if _CURRENT_COLUMN.match(quantity)]
+
+    def _mdm_curves(self, path, relpath, conditions):
+        """One curve per measured current and outer bias combination of an MDM file."""
+        data = read_mdm(path)
+        conditions = dict(conditions, sweep=data.sweep.upper())
+        curves = []
+        for output in data.outputs:
+            if output.mode.upper() != "I" or output.name not in data.arrays:
+                continue
+            quantity = output.name.upper()
+            for biases, x, y in data.curves(output.name):
+                biases = {name.upper(): value for name, value in biases.items()}
+                key = f"{relpath}:{quantity}:" + ",".join(f"{name}={value:g}" for name, value in sorted(biases.items()))
+                curves.append(self._curve(path, relpath, conditions, biases, x, y, quantity, key))
+        return curves
+
+    @staticmethod
+    def _filters(sweep=None, quantity="ID", **conditions):
+        """Translate catalog conditions (sweep type, VG/VD/VS/VB, attributes) into ResultStore filters."""
+        filters = {"source": "lab"}
+        if sweep is not None:
+            filters["sweep"] = SWEEP_TYPES.get(sweep.upper(), sweep.upper())
+        if quantity is not None:
+            filters["quantity"] = quantity
+        for name, value in conditions.items():
+            if name.upper() in ("VG", "VD", "VS", "VB"):
+                filters[name.lower()] = value
+            else:
+                filters[name] = value
+        return filters
+
+    def query(self, sweep=None, quantity="ID", **conditions):
+        """
+        Find measured curves.
+
+        :param sweep: (Optional) Sweep type ('IDVD', 'IDVG') or swept bias ('VD', 'VG').
+        :param quantity: Current column ('ID', 'IB', 'IG'); None for all.
+        :param conditions: Fixed biases (VG=-1.2, VB=(0, 1)), index columns (device, bin, temperature)
+                           or attributes (W, L, die, device_name, file, ...). Tuples are inclusive
+                           ranges (biases and index columns only).
+        :return: List of CurveRecord.
+        """
+        return self.store.query(**self._filters(sweep, quantity, **conditions))
+
+    def load(self, records=None, sweep=None, quantity="ID", **conditions):
+        """
+        Load measured curves.
+
+        :return: List of (record, x, y) tuples.
+        """
+        if records is None:
+            records = self.query(sweep, quantity, **conditions)
+        return self.store.load(records)
+
+    def values(self, name, sweep=None, quantity="ID", **conditions):
+        """
+        Distinct values of a bias or attribute among the matching curves (for condition pickers).
+
+        :param name: 'VG', 'VD', 'VS', 'VB', an index column or an attribute name.
+        """
+        field = name.lower() if name.upper() in ("VG", "VD", "VS", "VB") else name
+        found = set()
+        for record in self.query(sweep, quantity, **conditions):
+            value = getattr(record, field, None) if hasattr(record, field) else record.attrs.get(field)
+            if value is not None:
+                found.add(value)
+        return sorted(found)
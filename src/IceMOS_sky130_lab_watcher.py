@@ -0,0 +1,273 @@
+"""
+IceMOS_sky130_lab_watcher.py
+
+This module watches a measurement folder and adds new lab files to a LabCatalog as they arrive,
+so that curves measured over hours in the cryostat show up without re-opening file dialogs.
+
+On Linux the folder tree is watched with inotify (through ctypes, no extra dependency); elsewhere,
+or if inotify is unavailable, the tree is polled. In both modes a file is only read once its size
+and modification time have been stable for `settle` seconds, since the measurement software
+writes a sweep while it is running.
+
+Only the files that appeared or changed are parsed (LabCatalog.ingest), and the callback receives
+the CurveRecords that were added, so that callers can refresh just the plots and error metrics
+those curves belong to.
+
+    def on_new_curves(records):
+        for record, x, y in catalog.load(records):
+            ...
+
+    watcher = LabFolderWatcher(LabCatalog("measurements/mdm_proc_pch_bin_1"), on_new_curves)
+    watcher.start()
+    ...
+    watcher.stop()
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+_EVENT_HEADER = struct.Struct("iIII")
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+MEASUREMENT_EXTENSIONS = (".csv", ".mdm")
+
+
+class _Inotify:
+    """Minimal recursive inotify wrapper (Linux only)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}  # watch descriptor -> folder
+
+    def add_watch(self, folder):
+        wd = self._add_watch(self.fd, os.fsencode(folder), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+        self.folders[wd] = folder
+
+    def read(self, timeout):
+        """
+        Wait for events.
+
+        :return: List of (path, mask) tuples; a path of None with IN_Q_OVERFLOW means events were lost.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if mask & IN_Q_OVERFLOW or folder is None:
+                events.append((None, mask))
+            else:
+                events.append((os.path.join(folder, os.fsdecode(name)), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LabFolderWatcher:
+    """
+    Background watcher that ingests new and changed measurement files into a LabCatalog.
+    """
+
+    def __init__(self, catalog, callback=None, settle=2.0, poll_interval=2.0, use_inotify=True):
+        """
+        :param catalog: LabCatalog whose root folder is watched.
+        :param callback: (Optional) Called from the watcher thread with the list of CurveRecords added
+                         by each ingestion (never with an empty list).
+        :param settle: Seconds a file must stay unchanged before it is read.
+        :param poll_interval: Seconds between two scans of the tree in polling mode.
+        :param use_inotify: Use inotify when available; False forces polling.
+        """
+        self.catalog = catalog
+        self.callback = callback
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.mode = None
+        self._pending = {}  # path -> (signature, time the signature was first seen)
+        self._unreadable = {}  # path -> signature of the files the catalog skipped
+        self._inotify = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_poll = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching (a first scan of the tree picks up the files added while nobody watched)."""
+        if self.running:
+            return
+        self._stop.clear()
+        self.mode = "polling"
+        if self.use_inotify:
+            try:
+                self._inotify = _Inotify()
+                self._watch_tree(os.path.abspath(self.catalog.root))
+                self.mode = "inotify"
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}); polling {self.catalog.root} every {self.poll_interval:g} s.")
+                self._close_inotify()
+        self._queue_changed_files()
+        self._thread = threading.Thread(target=self._run, name="lab-folder-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.catalog.root} for new measurements ({self.mode}).")
+
+    def stop(self, timeout=5.0):
+        """Stop watching and wait for the watcher thread to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._close_inotify()
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _watch_tree(self, folder):
+        """Watch a folder and its sub-folders (hidden folders such as the catalog store are skipped)."""
+        for path, dirs, _ in os.walk(folder):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            self._inotify.add_watch(path)
+
+    @staticmethod
+    def _is_measurement(path):
+        return path.lower().endswith(MEASUREMENT_EXTENSIONS)
+
+    def _queue(self, path):
+        if path not in self._pending:
+            self._pending[path] = (None, time.monotonic())
+
+    def _queue_changed_files(self):
+        """Queue the files of the tree that are new or changed since they were cataloged."""
+        root = os.path.abspath(self.catalog.root)
+        for folder, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                path = os.path.join(folder, name)
+                if not self._is_measurement(path):
+                    continue
+                try:
+                    status = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                signature = [status.st_size, status.st_mtime]
+                if self.catalog.files.get(os.path.relpath(path, root)) != signature and \
+                        self._unreadable.get(path) != signature:
+                    self._queue(path)
+        for relpath in self.catalog.files:
+            path = os.path.join(root, relpath)
+            if not os.path.exists(path):
+                self._queue(path)
+
+    def _handle_events(self, events):
+        for path, mask in events:
+            if path is None:
+                # The kernel queue overflowed: fall back to a scan of the tree.
+                self._queue_changed_files()
+            elif mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not os.path.basename(path).startswith("."):
+                    # Files may have been written before the new folder was watched.
+                    self._watch_tree(path)
+                    self._queue_changed_files()
+            elif self._is_measurement(path):
+                self._queue(path)
+
+    def _ready_files(self):
+        """Pending files whose size and modification time did not change for `settle` seconds."""
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                status = os.stat(path)
+                current = (status.st_size, status.st_mtime)
+            except FileNotFoundError:
+                current = None
+            if current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                ready.append(path)
+                del self._pending[path]
+        return ready
+
+    def poll(self):
+        """
+        Ingest the pending files that are ready (called by the watcher thread; can also be called
+        directly to drive the watcher without a thread).
+
+        :return: List of the CurveRecords added.
+        """
+        ready = self._ready_files()
+        if not ready:
+            return []
+        records = self.catalog.ingest(ready)
+        root = os.path.abspath(self.catalog.root)
+        for path in ready:
+            if os.path.exists(path) and os.path.relpath(path, root) not in self.catalog.files:
+                # Not a measurement the catalog can read; look at it again only once it changes.
+                status = os.stat(path)
+                self._unreadable[path] = [status.st_size, status.st_mtime]
+        if records and self.callback is not None:
+            try:
+                self.callback(records)
+            except Exception as e:
+                print(f"Lab watcher callback failed: {e}")
+        return records
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = min(self.settle, self.poll_interval) / 2 or 0.05
+            try:
+                if self._inotify is not None:
+                    self._handle_events(self._inotify.read(wait))
+                else:
+                    if time.monotonic() - self._last_poll >= self.poll_interval:
+                        self._last_poll = time.monotonic()
+                        self._queue_changed_files()
+                    self._stop.wait(wait)
+                self.poll()
+            except Exception as e:
+                # Keep watching: a file that cannot be read now is retried when it changes again.
+                print(f"Lab watcher error: {e}")
+                self._stop.wait(self.poll_interval)
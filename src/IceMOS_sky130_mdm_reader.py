@@ -0,0 +1,309 @@
+"""
+IceMOS_sky130_mdm_reader.py
+
+This module reads IC-CAP / B1500 measurement data files (.mdm) directly into NumPy arrays,
+without converting them to one CSV per bias point first.
+
+An MDM file has a header describing the instrument inputs (swept or constant sources) and
+outputs, followed by one data block per combination of the outer sweep values:
+
+    BEGIN_HEADER
+     ICCAP_INPUTS
+      vd  V  D GROUND SMU1 0.1 LIN 1 0 1.8 73 0.025
+      vg  V  G GROUND SMU2 0.1 LIN 2 0 1.8 7 0.3
+      vb  V  B GROUND SMU3 0.1 LIST 3 2 0 1.5
+      vs  V  S GROUND SMU4 0.1 CON 0
+     ICCAP_OUTPUTS
+      id  I  D GROUND SMU1 B
+     ICCAP_VALUES
+      W  "1.68u"
+    END_HEADER
+    BEGIN_DB
+     ICCAP_VAR vg 0
+     ICCAP_VAR vb 0
+     #vd            id
+      0             1.2e-12
+      ...
+    END_DB
+
+Sweep orders: 1 is the innermost sweep (the rows of a block), higher orders are the outer
+sweeps whose values are given by the ICCAP_VAR lines of each block. The file is read line by
+line in a single pass and each block is converted as soon as it is complete, so memory use is
+bounded by the size of the output arrays (which can be memory-mapped files for wafer dumps).
+
+    data = read_mdm("die_8397_4_3_IDVD.mdm")
+    data.axes            # [('vb', array([0., 1.5])), ('vg', array([...])), ('vd', array([...]))]
+    data["id"].shape     # (2, 7, 73)
+"""
+
+import os
+
+import numpy as np
+
+
+class MdmInput:
+    """
+    An instrument input (source) of the header.
+
+    :ivar name: Input name (e.g. 'vd').
+    :ivar mode: 'V' or 'I'.
+    :ivar sweep_type: 'LIN', 'LOG', 'LIST', 'CON' or 'SYNC'.
+    :ivar order: Sweep order (1 = innermost); None for constant and synchronised inputs.
+    :ivar values: Sweep values (a single value for CON; None for SYNC).
+    :ivar sync: For SYNC inputs, (ratio, offset, master input name).
+    """
+
+    def __init__(self, fields):
+        self.name = fields[0]
+        self.mode = fields[1]
+        self.nodes = (fields[2], fields[3])
+        self.unit = fields[4]
+        self.compliance = float(fields[5])
+        self.sweep_type = fields[6].upper()
+        self.order = None
+        self.values = None
+        self.sync = None
+        args = fields[7:]
+        if self.sweep_type == "CON":
+            self.values = np.array([float(args[0])])
+        elif self.sweep_type == "LIN":
+            self.order = int(args[0])
+            start, stop, points = float(args[1]), float(args[2]), int(args[3])
+            self.values = np.linspace(start, stop, points)
+        elif self.sweep_type == "LOG":
+            self.order = int(args[0])
+            start, stop, points = float(args[1]), float(args[2]), int(args[-1])
+            self.values = np.geomspace(start, stop, points)
+        elif self.sweep_type == "LIST":
+            self.order = int(args[0])
+            points = int(args[1])
+            self.values = np.array([float(value) for value in args[2:2 + points]])
+        elif self.sweep_type == "SYNC":
+            self.sync = (float(args[0]), float(args[1]), args[2] if len(args) > 2 else None)
+        else:
+            raise ValueError(f"Unknown sweep type '{self.sweep_type}' for input '{self.name}'.")
+
+    def __repr__(self):
+        return f"MdmInput({self.name}, {self.sweep_type}, order={self.order})"
+
+
+class MdmOutput:
+    """An instrument output (measured quantity) of the header."""
+
+    def __init__(self, fields):
+        self.name = fields[0]
+        self.mode = fields[1]
+        self.nodes = tuple(fields[2:4])
+        self.unit = fields[4] if len(fields) > 4 else None
+
+    def __repr__(self):
+        return f"MdmOutput({self.name}, {self.mode})"
+
+
+class MdmData:
+    """
+    Content of an MDM file as N-D arrays.
+
+    :ivar header: Dict of the ICCAP_VALUES entries (quotes removed).
+    :ivar inputs: List of MdmInput in file order.
+    :ivar outputs: List of MdmOutput in file order.
+    :ivar axes: List of (input name, values) for the swept inputs, outermost first.
+    :ivar constants: Dict {input name: value} of the constant inputs.
+    :ivar arrays: Dict {column name: array of shape [len(values) for _, values in axes]}.
+    :ivar measured: Boolean array (shape of the outer axes) marking the blocks found in the file.
+    """
+
+    def __init__(self, header, inputs, outputs, axes, constants, arrays, measured):
+        self.header = header
+        self.inputs = inputs
+        self.outputs = outputs
+        self.axes = axes
+        self.constants = constants
+        self.arrays = arrays
+        self.measured = measured
+
+    @property
+    def shape(self):
+        return tuple(len(values) for _, values in self.axes)
+
+    @property
+    def sweep(self):
+        """Name of the innermost swept input."""
+        return self.axes[-1][0]
+
+    def __getitem__(self, name):
+        """Return a column (output or swept input) by name, case-insensitive."""
+        for key, values in self.arrays.items():
+            if key.lower() == name.lower():
+                return values
+        raise KeyError(f"No column '{name}'. Available columns: {', '.join(self.arrays)}")
+
+    def curves(self, column):
+        """
+        Iterate over the innermost curves of a column.
+
+        :return: Iterator of (conditions dict {input name: value, ...}, x, y) for every measured block;
+                 the conditions include the constant inputs.
+        """
+        # Prefer the swept values as recorded in the blocks over the nominal header values.
+        x = self.arrays.get(self.sweep)
+        y = self[column]
+        for index in np.ndindex(*self.shape[:-1]):
+            if not self.measured[index]:
+                continue
+            conditions = dict(self.constants)
+            conditions.update({name: float(values[i]) for (name, values), i in zip(self.axes[:-1], index)})
+            yield conditions, (x[index] if x is not None else self.axes[-1][1]), y[index]
+
+    def __repr__(self):
+        return f"MdmData(axes={[name for name, _ in self.axes]}, shape={self.shape}, columns={list(self.arrays)})"
+
+
+def _parse_header(lines):
+    """Parse the header lines (between BEGIN_HEADER and END_HEADER)."""
+    inputs = []
+    outputs = []
+    values = {}
+    section = None
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        keyword = fields[0].upper()
+        if keyword in ("ICCAP_INPUTS", "ICCAP_OUTPUTS", "ICCAP_VALUES"):
+            section = keyword
+        elif section == "ICCAP_INPUTS":
+            inputs.append(MdmInput(fields))
+        elif section == "ICCAP_OUTPUTS":
+            outputs.append(MdmOutput(fields))
+        elif section == "ICCAP_VALUES":
+            values[fields[0]] = " ".join(fields[1:]).strip('"')
+    return values, inputs, outputs
+
+
+def _block_array(rows, n_columns):
+    """Convert the text rows of a block into a 2-D array (an incomplete last row is dropped)."""
+    values = np.array(" ".join(rows).split(), dtype=float)
+    return values[:len(values) - len(values) % n_columns].reshape(-1, n_columns)
+
+
+def iter_mdm(path):
+    """
+    Stream an MDM file.
+
+    :return: Tuple (header values, inputs, outputs, block iterator). The iterator yields
+             (outer values dict {input name: value}, column names, 2-D array of the block rows).
+    """
+    f = open(path, "r")
+    try:
+        header_lines = []
+        in_header = False
+        for line in f:
+            stripped = line.strip()
+            if stripped.upper() == "BEGIN_HEADER":
+                in_header = True
+            elif stripped.upper() == "END_HEADER":
+                break
+            elif in_header:
+                header_lines.append(line)
+        else:
+            raise ValueError(f"{path}: no END_HEADER line found.")
+        header, inputs, outputs = _parse_header(header_lines)
+    except Exception:
+        f.close()
+        raise
+
+    def blocks():
+        with f:
+            in_block = False
+            outer = {}
+            columns = None
+            rows = []
+            for line in f:
+                stripped = line.strip()
+                if not stripped or stripped.startswith("!"):
+                    continue
+                keyword = stripped.split(None, 1)[0].upper()
+                if keyword == "BEGIN_DB":
+                    in_block, outer, columns, rows = True, {}, None, []
+                elif keyword == "END_DB":
+                    if in_block and columns is not None:
+                        yield outer, columns, _block_array(rows, len(columns))
+                    in_block = False
+                elif not in_block:
+                    continue
+                elif keyword == "ICCAP_VAR":
+                    _, name, value = stripped.split()[:3]
+                    outer[name] = float(value)
+                elif stripped.startswith("#"):
+                    columns = stripped[1:].split()
+                else:
+                    rows.append(stripped)
+            if in_block and columns is not None and rows:
+                # A dump cut short inside its last block.
+                yield outer, columns, _block_array(rows, len(columns))
+
+    return header, inputs, outputs, blocks()
+
+
+def _axis_index(values, value):
+    matches = np.flatnonzero(np.isclose(values, value, rtol=1e-9, atol=1e-12))
+    return int(matches[0]) if len(matches) else None
+
+
+def read_mdm(path, memmap_folder=None):
+    """
+    Read an MDM file into N-D arrays in a single pass.
+
+    :param path: Path to the .mdm file.
+    :param memmap_folder: (Optional) Write the arrays as .npy files in this folder and return them
+                          memory-mapped, for dumps larger than memory.
+    :return: MdmData. Points of blocks that are missing from the file are NaN.
+    """
+    header, inputs, outputs, blocks = iter_mdm(path)
+    swept = sorted((i for i in inputs if i.order is not None), key=lambda i: i.order, reverse=True)
+    if not swept:
+        raise ValueError(f"{path}: no swept input in the header.")
+    axes = [(i.name, i.values) for i in swept]
+    constants = {i.name: float(i.values[0]) for i in inputs if i.sweep_type == "CON"}
+    shape = tuple(len(values) for _, values in axes)
+    outer_shape = shape[:-1]
+
+    arrays = {}
+    measured = np.zeros(outer_shape, dtype=bool)
+    sequence = 0
+    for outer, columns, data in blocks:
+        if not arrays:
+            for column in columns:
+                if memmap_folder is not None:
+                    os.makedirs(memmap_folder, exist_ok=True)
+                    array = np.lib.format.open_memmap(os.path.join(memmap_folder, f"{column}.npy"), mode="w+",
+                                                      dtype=float, shape=shape)
+                    array[...] = np.nan
+                else:
+                    array = np.full(shape, np.nan)
+                arrays[column] = array
+        # Locate the block from its ICCAP_VAR values; fall back to the file order.
+        index = []
+        for name, values in axes[:-1]:
+            position = _axis_index(values, outer[name]) if name in outer else None
+            if position is None:
+                index = None
+                break
+            index.append(position)
+        if index is None:
+            if sequence >= measured.size:
+                print(f"Warning: {path} has more data blocks than its sweeps describe; ignoring the rest.")
+                break
+            index = np.unravel_index(sequence, outer_shape)
+        index = tuple(index)
+        sequence += 1
+        rows = min(len(data), shape[-1])
+        for i, column in enumerate(columns):
+            if column in arrays:
+                arrays[column][index][:rows] = data[:rows, i]
+        measured[index] = True
+    if memmap_folder is not None:
+        for array in arrays.values():
+            array.flush()
+    return MdmData(header, inputs, outputs, axes, constants, arrays, measured)
@@ -0,0 +1,280 @@
+"""
+IceMOS_sky130_metrics.py
+
+This module measures how well simulated curves match lab curves, on the lab grid (e.g. 10 mV steps)
+whatever the simulation grid (e.g. 0.1 V steps), per operating region.
+
+Every lab point gets a residual against the simulation interpolated onto it: in subthreshold, log10 of
+the current ratio (decades, interpolating log10 of the simulated current); elsewhere, the current
+difference relative to the lab current (the denominator is kept above a fraction of the curve's largest
+current, so that points near zero current do not dominate). Residuals are weighted per curve and per
+region and go through a squared or Huber loss. Errors are reported as the square root of the weighted
+mean loss, i.e. an RMS error in the units of the residuals (decades in subthreshold, fractions
+elsewhere) that, with Huber, grows only linearly with outliers.
+
+The pieces:
+  - InterpolationMatrix: sparse linear interpolation from a simulation grid onto a lab grid (two
+    entries per row), applied to one curve or to stacks of curves.
+  - MetricEngine: the lab curves, their regions and weights, and one cached InterpolationMatrix per
+    curve and simulation grid. evaluate() compares all the simulated curves in one vectorized gather;
+    curves identical to the previous call are not recomputed, and update() replaces a single curve.
+  - MetricResult: residuals of every lab point, errors per curve, per region and in total.
+
+    engine = MetricEngine(lab_targets, operating_regions(lab_targets, W, L), huber=0.5)
+    result = engine.evaluate(simulator.iv_vds_curves("pch", bin_number=1, vg_step=0.2).curves())
+    print(result.describe())
+"""
+
+import numpy as np
+
+from IceMOS_sky130_sensitivity import REGIONS
+
+
+class InterpolationMatrix:
+    """
+    Linear interpolation from the points of a simulation grid onto the points of a lab grid, as a sparse
+    matrix with two entries per row. Lab points outside the simulated range give NaN.
+    """
+
+    def __init__(self, sim_x, lab_x, tolerance=1e-12):
+        """
+        :param sim_x: Simulation grid (any order, at least one point).
+        :param lab_x: Lab grid.
+        :param tolerance: Lab points this close outside the simulated range are clamped onto it.
+        """
+        sim_x = np.asarray(sim_x, dtype=float)
+        lab_x = np.asarray(lab_x, dtype=float)
+        if sim_x.size == 0:
+            raise ValueError("Empty simulation grid.")
+        self.shape = (len(lab_x), len(sim_x))
+        order = np.argsort(sim_x, kind="stable")
+        sorted_x = sim_x[order]
+        self.inside = (lab_x >= sorted_x[0] - tolerance) & (lab_x <= sorted_x[-1] + tolerance) & ~np.isnan(lab_x)
+        x = np.clip(lab_x[self.inside], sorted_x[0], sorted_x[-1])
+        right = np.clip(np.searchsorted(sorted_x, x, side="right"), 1, max(len(sorted_x) - 1, 1))
+        left = right - 1
+        if len(sorted_x) == 1:
+            left = right = np.zeros(len(x), dtype=int)
+        span = sorted_x[right] - sorted_x[left]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(span > 0, (x - sorted_x[left]) / np.where(span > 0, span, 1.0), 0.0)
+        self.rows = np.flatnonzero(self.inside)
+        self.left = order[left]
+        self.right = order[right]
+        self.weight = weight
+
+    def __matmul__(self, values):
+        """
+        :param values: Simulated values, shape (simulation points,) or (simulation points, curves).
+        :return: Values on the lab grid, shape (lab points,) or (lab points, curves).
+        """
+        values = np.asarray(values, dtype=float)
+        result = np.full((self.shape[0],) + values.shape[1:], np.nan)
+        w = self.weight.reshape((-1,) + (1,) * (values.ndim - 1))
+        result[self.rows] = (1.0 - w) * values[self.left] + w * values[self.right]
+        return result
+
+    def toarray(self):
+        """Dense matrix (lab points x simulation points); rows of lab points outside the range are zero."""
+        dense = np.zeros(self.shape)
+        np.add.at(dense, (self.rows, self.left), 1.0 - self.weight)
+        np.add.at(dense, (self.rows, self.right), self.weight)
+        return dense
+
+
+class MetricResult:
+    """
+    Errors of a simulation against the lab curves.
+
+    :ivar residuals: Residual of every lab point, curve after curve (NaN where there is no simulation).
+    :ivar curve_errors: Error of every lab curve (NaN without simulated points).
+    :ivar region_errors: Dict {region: error} (NaN for a region without simulated points).
+    :ivar total: Error over all the lab points.
+    """
+
+    def __init__(self, residuals, curve_errors, region_errors, total, recomputed):
+        self.residuals = residuals
+        self.curve_errors = curve_errors
+        self.region_errors = region_errors
+        self.total = total
+        # Indices of the curves whose residuals were recomputed by the call.
+        self.recomputed = recomputed
+
+    def describe(self):
+        parts = []
+        for region, error in self.region_errors.items():
+            if not np.isfinite(error):
+                continue
+            parts.append(f"{region} {error:.3f} dec" if region == "subthreshold" else f"{region} {100 * error:.1f} %")
+        return ", ".join(parts) if parts else "no overlap with the lab curves"
+
+    def __repr__(self):
+        return f"MetricResult({self.describe()})"
+
+
+class MetricEngine:
+    """
+    Weighted, region-aware errors of simulated curves against fixed lab curves.
+    """
+
+    def __init__(self, targets, regions, weights=None, region_weights=None, huber=None, floor=1e-15,
+                 relative_floor=1e-3, tolerance=1e-6):
+        """
+        :param targets: List of (vg, x, y) lab curves; vg selects the simulated family curve (None for an
+                        ID vs VG curve).
+        :param regions: Region names of the lab points, one array per curve (see
+                        IceMOS_sky130_sensitivity.operating_regions()). Subthreshold points get log residuals.
+        :param weights: (Optional) One weight per lab curve.
+        :param region_weights: (Optional) Dict {region: weight}; regions default to 1.
+        :param huber: (Optional) Huber threshold (in residual units); None for a squared loss.
+        :param floor: Currents are clipped to this magnitude before taking logarithms (A).
+        :param relative_floor: Smallest denominator of relative residuals, as a fraction of the curve's
+                               largest lab current.
+        :param tolerance: Tolerance on the gate bias when matching family curves (V).
+        """
+        if not targets:
+            raise ValueError("No lab curves to compare with.")
+        if len(regions) != len(targets) or any(len(labels) != len(x) for labels, (_, x, _) in zip(regions, targets)):
+            raise ValueError("The regions must label every point of every lab curve.")
+        self.targets = [(vg, np.asarray(x, dtype=float), np.asarray(y, dtype=float)) for vg, x, y in targets]
+        self.huber = huber
+        self.floor = floor
+        self.tolerance = tolerance
+        sizes = [len(x) for _, x, _ in self.targets]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.curve_of_point = np.repeat(np.arange(len(sizes)), sizes)
+        self.lab_y = np.concatenate([y for _, _, y in self.targets])
+        labels = np.concatenate([np.asarray(labels, dtype=object) for labels in regions])
+        unknown = set(labels) - set(REGIONS)
+        if unknown:
+            raise ValueError(f"Unknown regions {sorted(unknown)}; expected {REGIONS}.")
+        self.region_of_point = np.array([REGIONS.index(label) for label in labels], dtype=int)
+        self.log_points = self.region_of_point == REGIONS.index("subthreshold")
+        scale = np.array([np.nanmax(np.abs(y), initial=0.0) for _, _, y in self.targets])
+        self.denominator = np.maximum(np.abs(self.lab_y), np.maximum(relative_floor * scale[self.curve_of_point],
+                                                                     floor))
+        self.lab_log = np.log10(np.maximum(np.abs(self.lab_y), floor))
+        curve_weights = np.ones(len(sizes)) if weights is None else np.asarray(weights, dtype=float)
+        region_weights = region_weights or {}
+        self.point_weights = (curve_weights[self.curve_of_point]
+                              * np.array([region_weights.get(region, 1.0) for region in REGIONS])[self.region_of_point])
+        self.point_weights[np.isnan(self.lab_y)] = 0.0
+        self.residuals = np.full(len(self.lab_y), np.nan)
+        self._operators = {}
+        # Simulated (x, y) of every lab curve at the last call (None: no simulated curve, False: never evaluated).
+        self._last = [False] * len(sizes)
+
+    def operator(self, index, sim_x):
+        """
+        :return: InterpolationMatrix from a simulation grid onto a lab curve, cached per grid.
+        """
+        sim_x = np.asarray(sim_x, dtype=float)
+        key = (index, sim_x.tobytes())
+        if key not in self._operators:
+            self._operators[key] = InterpolationMatrix(sim_x, self.targets[index][1])
+        return self._operators[key]
+
+    def _simulated_curve(self, curves, vg):
+        if vg is None:
+            return curves[0][1], curves[0][2]
+        for sim_vg, x, y in curves:
+            if sim_vg is not None and abs(sim_vg - vg) <= self.tolerance:
+                return x, y
+        return None
+
+    def _recompute(self, changes):
+        """
+        Residuals of the lab points of changed curves, from all their simulations in one gather.
+
+        :param changes: List of (curve index, simulated x, simulated y); x None when the curve has no simulation.
+        """
+        rows, left, right, weight, stacks, offset = [], [], [], [], [], 0
+        for index, x, y in changes:
+            start = self.offsets[index]
+            self.residuals[start:self.offsets[index + 1]] = np.nan
+            if x is None:
+                continue
+            matrix = self.operator(index, x)
+            rows.append(start + matrix.rows)
+            left.append(offset + matrix.left)
+            right.append(offset + matrix.right)
+            weight.append(matrix.weight)
+            stacks.append(np.asarray(y, dtype=float))
+            offset += len(stacks[-1])
+        if not rows:
+            return
+        rows, left, right, weight = (np.concatenate(a) for a in (rows, left, right, weight))
+        sim_y = np.concatenate(stacks)
+        # Subthreshold currents are interpolated in log scale, where they are close to linear.
+        log = self.log_points[rows]
+        sim_log = np.log10(np.maximum(np.abs(sim_y), self.floor))
+        with np.errstate(invalid="ignore"):
+            self.residuals[rows] = np.where(
+                log, (1.0 - weight) * sim_log[left] + weight * sim_log[right] - self.lab_log[rows],
+                ((1.0 - weight) * sim_y[left] + weight * sim_y[right] - self.lab_y[rows]) / self.denominator[rows])
+
+    def _loss(self, r):
+        """Squared residuals, or twice the Huber loss (r^2 up to the threshold, linear beyond)."""
+        if self.huber is None:
+            return r * r
+        a = np.abs(r)
+        return np.where(a <= self.huber, r * r, 2.0 * self.huber * a - self.huber ** 2)
+
+    def _result(self, recomputed):
+        valid = np.isfinite(self.residuals) & (self.point_weights > 0)
+        weighted = np.where(valid, self.point_weights * self._loss(np.where(valid, self.residuals, 0.0)), 0.0)
+        w = np.where(valid, self.point_weights, 0.0)
+
+        def errors(groups, count):
+            totals = np.bincount(groups, weights=weighted, minlength=count)
+            norms = np.bincount(groups, weights=w, minlength=count)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(norms > 0, np.sqrt(totals / np.where(norms > 0, norms, 1.0)), np.nan)
+
+        curve_errors = errors(self.curve_of_point, len(self.targets))
+        region_errors = dict(zip(REGIONS, errors(self.region_of_point, len(REGIONS))))
+        total = float(np.sqrt(weighted.sum() / w.sum())) if w.sum() > 0 else np.nan
+        return MetricResult(self.residuals.copy(), curve_errors, region_errors, total, recomputed)
+
+    def evaluate(self, curves):
+        """
+        Compare simulated curves with the lab curves. Lab curves whose simulated curve is identical to the
+        one of the previous call keep their residuals.
+
+        :param curves: Simulated curves [(vg, x, y), ...], as returned by SimulatorModel or by the curves()
+                       of a SweepResult (vg None for an ID vs VG curve).
+        :return: MetricResult.
+        """
+        changes = []
+        for index, (vg, _, _) in enumerate(self.targets):
+            simulated = self._simulated_curve(curves, vg)
+            key = None if simulated is None else tuple(np.array(a, dtype=float) for a in simulated)
+            if self._unchanged(self._last[index], key):
+                continue
+            self._last[index] = key
+            changes.append((index,) + (key if key is not None else (None, None)))
+        self._recompute(changes)
+        return self._result([index for index, _, _ in changes])
+
+    @staticmethod
+    def _unchanged(last, key):
+        if last is False:
+            # Never evaluated.
+            return False
+        if last is None or key is None:
+            return last is key
+        return all(a.shape == b.shape and np.array_equal(a, b, equal_nan=True) for a, b in zip(last, key))
+
+    def update(self, index, x, y):
+        """
+        Replace the simulation of one lab curve.
+
+        :param index: Index of the lab curve.
+        :param x: Simulated x values.
+        :param y: Simulated currents.
+        :return: MetricResult.
+        """
+        key = (np.array(x, dtype=float), np.array(y, dtype=float))
+        self._last[index] = key
+        self._recompute([(index,) + key])
+        return self._result([index])
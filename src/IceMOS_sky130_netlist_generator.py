@@ -4,12 +4,14 @@ from IceMOS_sky130_circuit_model_extractor import ModelExtractor
 
 
 class NetlistGeneratorSky130:
-    def __init__(self, original_model_file):
+    def __init__(self, original_model_file, circuit_root="circuits"):
         """
         Initialize the netlist generator with the path to the original SPICE model file.
         :param original_model_file: Path to the original SPICE model file.
+        :param circuit_root: Folder holding the <device_type>/bin_<n> circuit folders.
         """
         self.original_model_file = original_model_file
+        self.circuit_root = circuit_root
 
     def _find_bin_by_dimensions(self, W, L, device_type, tol=1e-6):
         """
@@ -30,7 +32,7 @@ class NetlistGeneratorSky130:
         Ensure that the modified model file for the given bin exists.
         If not, call the ModelExtractor to extract the bin.
         """
-        folder = os.path.join("circuits", device_type, f"bin_{bin_number}")
+        folder = os.path.join(self.circuit_root, device_type, f"bin_{bin_number}")
         model_filename = f"bin_{bin_number}_{device_type}_modified.lib"
         model_filepath = os.path.join(folder, model_filename)
         if not os.path.exists(model_filepath):
@@ -266,7 +268,7 @@ op
                 vgate_step=vgate_step,
                 temp_for_sim = -269
             )
-        output_dir = os.path.join("circuits", device_type, f"bin_{bin_number}")
+        output_dir = os.path.join(self.circuit_root, device_type, f"bin_{bin_number}")
         os.makedirs(output_dir, exist_ok=True)
         results_iv_dir = os.path.join(output_dir, "results_IV_ID_vs_VG")
         os.makedirs(results_iv_dir, exist_ok=True)
@@ -496,7 +498,7 @@ end
                 vds_prefix=vds_prefix,
                 temp_for_sim = -269
             )
-        output_dir = os.path.join("circuits", device_type, f"bin_{bin_number}")
+        output_dir = os.path.join(self.circuit_root, device_type, f"bin_{bin_number}")
         os.makedirs(output_dir, exist_ok=True)
 
         # results dir will be different for or nmos
@@ -1,5 +1,6 @@
 import re
 import os
+import shutil
 
 class ModelModifier:
     """
@@ -172,6 +173,43 @@ class ModelModifier:
                 modified_parts.append(param_match.group(0))
 
         return '+ ' + ' '.join(modified_parts)
+
+
+def write_model_cards(circuit_root, device_type, bin_number, lib_file_path, parameters):
+    """
+    Writes the '_original.lib' and '_modified.lib' cards of a bin into a circuit folder, the modified
+    card holding the given parameter values (the same card MainWindow.update_modified_lib() writes).
+
+    Parameters
+    ----------
+    circuit_root : str
+        Circuit root of the simulator (the cards go to <circuit_root>/<device_type>/bin_<bin_number>).
+    device_type : str
+        'nch' or 'pch'.
+    bin_number : int
+        The bin number of the cards.
+    lib_file_path : str
+        The bin's '_original.lib' model card.
+    parameters : dict
+        Parameter values by name (None values are left unchanged).
+
+    Returns
+    -------
+    str
+        The path of the modified card.
+    """
+    folder = os.path.join(circuit_root, device_type, f"bin_{bin_number}")
+    os.makedirs(folder, exist_ok=True)
+    base = f"bin_{bin_number}_{device_type}"
+    original = os.path.join(folder, f"{base}_original.lib")
+    modified = os.path.join(folder, f"{base}_modified.lib")
+    shutil.copyfile(lib_file_path, original)
+    shutil.copyfile(lib_file_path, modified)
+    modifier = ModelModifier(original, modified, device_type=device_type)
+    for param, value in parameters.items():
+        if value is not None:
+            modifier.modify_parameter(bin_number, param, str(value))
+    return modified
         
         
 # Uso de ejemplo
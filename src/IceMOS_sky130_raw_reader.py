@@ -0,0 +1,269 @@
+"""
+IceMOS_sky130_raw_reader.py
+
+This module reads ngspice .raw files (the output of the 'write' command in the netlist templates).
+
+A raw file is a sequence of plots. Each plot has a text header (Title, Date, Command, Plotname,
+Flags, No. Variables, No. Points, Variables) followed by either a 'Binary:' payload
+(No. Points records of No. Variables float64 values, or complex128 values when the flags say
+'complex') or a 'Values:' ASCII section.
+
+Binary payloads are not parsed: the file is memory-mapped and each plot is exposed as a
+structured NumPy array over the mapped bytes, so every vector is a named, zero-copy view.
+
+    plot = read_raw("circuits/nch/bin_40/results_IV_ID_vs_VG/IV_ID_vs_VG.raw")[0]
+    vg, ids = plot.scale, plot["i(v1_meas)"]
+"""
+
+import numpy as np
+
+
+class RawPlot:
+    """
+    One plot of a raw file.
+
+    :ivar title: Title line (the first netlist line).
+    :ivar date: Simulation date.
+    :ivar command: Simulator version line (None if absent).
+    :ivar plotname: Analysis name (e.g. 'DC transfer characteristic').
+    :ivar flags: Set of flags ('real' or 'complex', possibly 'padded').
+    :ivar variables: List of (name, type) tuples in file order, e.g. ('i(v1_meas)', 'current').
+    :ivar n_points: Number of points actually present in the file.
+    :ivar data: Structured array with one field per variable (a view of the file when memory-mapped).
+    """
+
+    def __init__(self, header, variables, data):
+        self.title = header.get("title")
+        self.date = header.get("date")
+        self.command = header.get("command")
+        self.plotname = header.get("plotname")
+        self.flags = set(header.get("flags", "real").lower().split())
+        self.variables = variables
+        self.data = data
+        self.n_points = len(data)
+        self._index = {name.lower(): field for (name, _), field in zip(variables, data.dtype.names)}
+
+    @property
+    def is_complex(self):
+        return "complex" in self.flags
+
+    @property
+    def names(self):
+        """Vector names in file order."""
+        return [name for name, _ in self.variables]
+
+    @property
+    def scale(self):
+        """The sweep (first) vector."""
+        return self.data[self.data.dtype.names[0]]
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def __getitem__(self, name):
+        """
+        Return a vector by name (case-insensitive, e.g. 'I(VDSM)' or 'i(vdsm)').
+
+        :raises KeyError: If the plot has no such vector.
+        """
+        try:
+            return self.data[self._index[name.lower()]]
+        except KeyError:
+            raise KeyError(f"Vector '{name}' not found in plot '{self.plotname}'. "
+                           f"Available vectors: {', '.join(self.names)}") from None
+
+    def vector_type(self, name):
+        """:return: The type of a vector ('voltage', 'current', ...)."""
+        for vector_name, vector_type in self.variables:
+            if vector_name.lower() == name.lower():
+                return vector_type
+        raise KeyError(name)
+
+    def columns(self, *names):
+        """
+        Stack vectors as the columns of a 2-D float array (this copies).
+
+        :return: Array of shape (n_points, len(names)).
+        """
+        return np.column_stack([self[name] for name in names])
+
+    def __repr__(self):
+        return (f"RawPlot(plotname={self.plotname!r}, points={self.n_points}, "
+                f"vectors={len(self.variables)}, flags={sorted(self.flags)})")
+
+
+def _unique_field_names(variables):
+    """Structured dtype field names (vector names, de-duplicated)."""
+    seen = {}
+    fields = []
+    for name, _ in variables:
+        field = name
+        if field in seen:
+            seen[field] += 1
+            field = f"{name}#{seen[name]}"
+        else:
+            seen[field] = 0
+        fields.append(field)
+    return fields
+
+
+def _parse_header(buffer, offset):
+    """
+    Parse a plot header starting at offset.
+
+    :return: Tuple (header dict, variables list, payload kind 'binary' or 'values', payload offset).
+    """
+    header = {}
+    variables = []
+    n_variables = None
+    position = offset
+    size = len(buffer)
+    while position < size:
+        end = buffer.find(b"\n", position)
+        if end < 0:
+            end = size
+        line = bytes(buffer[position:end]).decode("latin-1").rstrip("\r")
+        position = end + 1
+        if not line.strip():
+            continue
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if key in ("binary", "values"):
+            return header, variables, key, position
+        if key == "variables":
+            # The first variable may follow on the same line; the others are one per line.
+            entries = [value] if value.strip() else []
+            while len(entries) < (n_variables or 0):
+                end = buffer.find(b"\n", position)
+                entries.append(bytes(buffer[position:end]).decode("latin-1"))
+                position = end + 1
+            for entry in entries:
+                parts = entry.split()
+                variables.append((parts[1], parts[2] if len(parts) > 2 else ""))
+            continue
+        if key == "no. variables":
+            n_variables = int(value)
+        elif key == "no. points":
+            header["n_points"] = int(value)
+        header.setdefault(key, value.strip())
+    raise ValueError("Raw file header ended without a 'Binary:' or 'Values:' section.")
+
+
+def _parse_values(buffer, offset, n_variables, n_points, is_complex):
+    """Parse an ASCII 'Values:' section. :return: (2-D array, offset after the section)."""
+    values = []
+    position = offset
+    size = len(buffer)
+    while position < size and len(values) < n_points * n_variables:
+        end = buffer.find(b"\n", position)
+        if end < 0:
+            end = size
+        line = bytes(buffer[position:end]).decode("latin-1").strip()
+        if line.startswith("Title:") or line.startswith("Plotname:"):
+            break
+        position = end + 1
+        if not line:
+            continue
+        parts = line.split()
+        # The first variable of each point is preceded by the point index.
+        token = parts[-1]
+        if is_complex:
+            real, _, imag = token.partition(",")
+            values.append(complex(float(real), float(imag or 0.0)))
+        else:
+            values.append(float(token))
+    count = len(values) // n_variables
+    dtype = np.complex128 if is_complex else np.float64
+    return np.array(values[:count * n_variables], dtype=dtype).reshape(count, n_variables), position
+
+
+def read_raw(path, mmap=True):
+    """
+    Read every plot of an ngspice raw file.
+
+    :param path: Path to the .raw file.
+    :param mmap: Memory-map the file (zero-copy vectors). With False the file is read into memory once
+                 and the vectors are views of that buffer.
+    :return: List of RawPlot, in file order.
+    """
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        with open(path, "rb") as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+    # Header parsing needs find(); wrap the mapping without copying it.
+    view = _ByteView(memoryview(buffer))
+
+    plots = []
+    offset = 0
+    size = len(buffer)
+    while offset < size:
+        # Skip blank lines between plots.
+        while offset < size and buffer[offset] in (0x0a, 0x0d, 0x20):
+            offset += 1
+        if offset >= size:
+            break
+        header, variables, kind, offset = _parse_header(view, offset)
+        if not variables:
+            raise ValueError(f"Plot '{header.get('plotname')}' in {path} declares no variables.")
+        is_complex = "complex" in header.get("flags", "").lower()
+        n_points = header.get("n_points", 0)
+        fields = _unique_field_names(variables)
+        scalar = np.dtype("<c16") if is_complex else np.dtype("<f8")
+        record = np.dtype([(field, scalar) for field in fields])
+        if kind == "binary":
+            # A run that was interrupted leaves fewer points than the header announces.
+            available = (size - offset) // record.itemsize
+            count = min(n_points, available)
+            data = np.ndarray((count,), dtype=record, buffer=buffer, offset=offset)
+            offset += count * record.itemsize
+        else:
+            values, offset = _parse_values(view, offset, len(variables), n_points, is_complex)
+            data = np.empty(len(values), dtype=record)
+            for i, field in enumerate(fields):
+                data[field] = values[:, i]
+        plots.append(RawPlot(header, variables, data))
+    return plots
+
+
+def read_raw_plot(path, plotname=None, index=0, mmap=True):
+    """
+    Read a single plot of a raw file.
+
+    :param plotname: (Optional) Select the first plot whose name contains this text (case-insensitive).
+    :param index: Plot index used when plotname is None.
+    :return: RawPlot.
+    """
+    plots = read_raw(path, mmap=mmap)
+    if plotname is not None:
+        for plot in plots:
+            if plotname.lower() in (plot.plotname or "").lower():
+                return plot
+        raise KeyError(f"No plot named '{plotname}' in {path}.")
+    return plots[index]
+
+
+class _ByteView:
+    """Minimal find()/slice interface over a memoryview, without copying the payload."""
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def __len__(self):
+        return len(self.memory)
+
+    def __getitem__(self, item):
+        return self.memory[item]
+
+    def find(self, needle, start):
+        # Headers are short: scan in small windows so that the binary payload is never copied.
+        window = 4096
+        position = start
+        size = len(self.memory)
+        while position < size:
+            chunk = bytes(self.memory[position:min(position + window, size)])
+            found = chunk.find(needle)
+            if found >= 0:
+                return position + found
+            position += window
+        return -1
@@ -0,0 +1,250 @@
+"""
+IceMOS_sky130_result_cache.py
+
+This module implements a content-addressed cache for simulation results.
+
+A result is identified by a SHA-256 hash of everything that determines it:
+  - the canonical model card (parameters normalized and sorted, comments and layout ignored),
+  - the netlist template (comment lines and whitespace ignored),
+  - the sweep specification,
+  - the simulation temperature,
+  - the simulator version.
+
+Results are dictionaries of NumPy arrays. They are kept in a small in-memory LRU tier in
+front of an on-disk store (one .npz file per key) whose total size is bounded; the least
+recently used files are evicted first.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+
+import numpy as np
+
+
+_SIMULATOR_VERSIONS = {}
+
+_PARAM_PATTERN = re.compile(r"([\w]+)\s*=\s*(\{?[^\s\}]+\}?)")
+
+
+def simulator_version(executable="ngspice"):
+    """
+    Return the version string of the simulator (e.g. 'ngspice-44.2'), queried once per executable.
+
+    :param executable: Simulator executable.
+    :return: Version string, or 'unknown' if the simulator cannot be queried.
+    """
+    if executable not in _SIMULATOR_VERSIONS:
+        version = "unknown"
+        try:
+            output = subprocess.run([executable, "-v"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, timeout=30).stdout
+            m = re.search(r"ngspice-[\w.+-]+", output)
+            version = m.group(0) if m else output.strip().splitlines()[0] if output.strip() else "unknown"
+        except (OSError, subprocess.SubprocessError):
+            pass
+        _SIMULATOR_VERSIONS[executable] = version
+    return _SIMULATOR_VERSIONS[executable]
+
+
+def _normalize_value(value):
+    value = value.strip("{}")
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value.lower()
+
+
+def canonical_model_card(model_card):
+    """
+    Build a canonical text form of a model card so that cosmetic edits (comments, line
+    breaks, parameter order, '1e-3' vs '0.001') do not change its hash.
+
+    :param model_card: Path to a .lib model card, or the card text itself.
+    :return: Canonical text.
+    """
+    if os.path.exists(model_card):
+        with open(model_card, 'r') as f:
+            text = f.read()
+    else:
+        text = model_card
+    headers = []
+    params = {}
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("*"):
+            continue
+        if stripped.lower().startswith(".model"):
+            headers.append(" ".join(stripped.lower().rstrip("(").split()[:3]))
+            stripped = stripped.split(None, 3)[3] if len(stripped.split(None, 3)) > 3 else ""
+        for name, value in _PARAM_PATTERN.findall(stripped):
+            params[name.lower()] = _normalize_value(value)
+    body = "\n".join(f"{name}={params[name]}" for name in sorted(params))
+    return "\n".join(headers) + "\n" + body
+
+
+def canonical_netlist(netlist):
+    """
+    Canonical text form of a netlist template: comment lines dropped, whitespace collapsed.
+
+    :param netlist: Path to a netlist file, or the netlist text itself.
+    :return: Canonical text.
+    """
+    if os.path.exists(netlist):
+        with open(netlist, 'r') as f:
+            text = f.read()
+    else:
+        text = netlist
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("*"):
+            continue
+        lines.append(" ".join(stripped.lower().split()))
+    return "\n".join(lines)
+
+
+def make_cache_key(model_card, netlist_template, sweep_spec, temperature, version):
+    """
+    Hash the inputs of a simulation into a cache key.
+
+    :param model_card: Path to (or text of) the model card.
+    :param netlist_template: Path to (or text of) the netlist.
+    :param sweep_spec: JSON-serializable description of the sweep (e.g. start/stop/step per source).
+    :param temperature: Simulation temperature in °C.
+    :param version: Simulator version string (see simulator_version()).
+    :return: Hex SHA-256 digest.
+    """
+    h = hashlib.sha256()
+    for part in (canonical_model_card(model_card),
+                 canonical_netlist(netlist_template),
+                 json.dumps(sweep_spec, sort_keys=True, default=float),
+                 repr(float(temperature)),
+                 version):
+        h.update(part.encode('utf-8'))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class SimulationResultCache:
+    """
+    Two-tier (memory + disk) LRU cache of simulation results keyed by content hash.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, memory_entries=64):
+        """
+        :param cache_dir: Folder of the on-disk tier (created on first write).
+        :param max_bytes: Maximum total size of the on-disk tier.
+        :param memory_entries: Number of results kept in the in-memory tier.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """
+        Look up a result.
+
+        :param key: Cache key (see make_cache_key()).
+        :return: Tuple (arrays dict, metadata dict), or None on a miss.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files if name != "__meta__"}
+                metadata = json.loads(str(data["__meta__"])) if "__meta__" in data.files else {}
+            os.utime(path)  # mark as recently used for the disk LRU
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, (arrays, metadata))
+        return arrays, metadata
+
+    def put(self, key, arrays, metadata=None):
+        """
+        Store a result in both tiers, evicting least recently used files if the disk tier is full.
+
+        :param key: Cache key.
+        :param arrays: Dict of name -> NumPy array.
+        :param metadata: (Optional) JSON-serializable dict stored with the arrays.
+        """
+        metadata = metadata or {}
+        arrays = {name: np.asarray(value) for name, value in arrays.items()}
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, __meta__=np.array(json.dumps(metadata)), **arrays)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(key, (arrays, metadata))
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(path) - old_size
+        self._evict()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _scan(self):
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for sub in os.listdir(self.cache_dir):
+                sub_dir = os.path.join(self.cache_dir, sub)
+                if not os.path.isdir(sub_dir):
+                    continue
+                for name in os.listdir(sub_dir):
+                    if name.endswith(".npz"):
+                        st = os.stat(os.path.join(sub_dir, name))
+                        entries.append((st.st_mtime, st.st_size, os.path.join(sub_dir, name)))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            if self._disk_bytes is not None and self._disk_bytes <= self.max_bytes:
+                return
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                key = os.path.splitext(os.path.basename(path))[0]
+                self._memory.pop(key, None)
+            self._disk_bytes = total
+
+    def clear(self):
+        """Remove every cached result from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            for _, _, path in self._scan():
+                os.remove(path)
+            self._disk_bytes = 0
@@ -0,0 +1,287 @@
+"""
+IceMOS_sky130_result_store.py
+
+This module keeps sweep curves (simulated or measured) in one compressed columnar store
+instead of dozens of small per-bin files named after float-formatted gate voltages.
+
+Layout of a store folder:
+  - index.sqlite: one row per curve with its device, bin, temperature, sweep axis, fixed biases
+    (vg, vd, vs, vb), model hash, source and free-form attributes, plus where its points live.
+  - chunks/chunk_<n>.npz: compressed column arrays 'x' (sweep values) and 'y' (currents) holding
+    the points of many curves back to back.
+
+Appending writes one new chunk per batch and a row per curve into the index. Loading a subset
+queries the index and reads each needed chunk once, so no directory is ever scanned. A curve
+appended again with the same key (device, bin, temperature, sweep, biases, model hash, source and
+attrs['key'] when given) replaces the previous one; compact() rewrites the chunks without the
+replaced points.
+
+    store = ResultStore("circuits/.result_store")
+    store.append([Curve(x=vd, y=ids, device="nch", bin=40, temperature=-269, sweep="VD", vg=0.6,
+                        model_hash=h)])
+    for record, vd, ids in store.load(device="nch", bin=40, sweep="VD", vg=(0.5, 1.3)):
+        ...
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from IceMOS_sky130_result_cache import canonical_model_card
+
+
+# Index columns that can be used as query filters.
+INDEX_COLUMNS = ("device", "bin", "temperature", "sweep", "vg", "vd", "vs", "vb", "model_hash", "source")
+
+# Biases are rounded before they are stored so that 0.30000000000000004 and 0.3 are the same curve.
+_BIAS_DIGITS = 9
+
+
+def model_hash(model_card):
+    """
+    Short hash of a model card that ignores cosmetic differences (see canonical_model_card).
+
+    :param model_card: Path to a .lib model card, or its text.
+    """
+    return hashlib.sha256(canonical_model_card(model_card).encode('utf-8')).hexdigest()[:16]
+
+
+class Curve:
+    """
+    One sweep curve with its metadata.
+
+    :ivar x: Sweep values (1-D array).
+    :ivar y: Current values (1-D array, same length as x).
+    :ivar sweep: Name of the swept bias ('VG', 'VD', ...).
+    :ivar attrs: Free-form JSON-serialisable attributes (geometry, die id, file name, ...).
+    """
+
+    def __init__(self, x, y, device, bin=None, temperature=None, sweep="VD", vg=None, vd=None, vs=None,
+                 vb=None, model_hash=None, source="simulation", attrs=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        if self.x.shape != self.y.shape or self.x.ndim != 1:
+            raise ValueError(f"x and y must be 1-D arrays of the same length, got {self.x.shape} and {self.y.shape}.")
+        self.device = device
+        self.bin = bin
+        self.temperature = temperature
+        self.sweep = sweep
+        self.vg = vg
+        self.vd = vd
+        self.vs = vs
+        self.vb = vb
+        self.model_hash = model_hash
+        self.source = source
+        self.attrs = dict(attrs or {})
+
+
+class CurveRecord:
+    """
+    Index entry of a stored curve (metadata only; use ResultStore.load to get the points).
+    """
+
+    def __init__(self, row):
+        (self.id, self.device, self.bin, self.temperature, self.sweep, self.vg, self.vd, self.vs, self.vb,
+         self.model_hash, self.source, attrs, self.chunk, self.start, self.length) = row
+        self.attrs = json.loads(attrs) if attrs else {}
+
+    def __repr__(self):
+        biases = ", ".join(f"{name}={getattr(self, name):g}" for name in ("vg", "vd", "vs", "vb")
+                           if getattr(self, name) is not None)
+        return (f"CurveRecord({self.device}, bin={self.bin}, T={self.temperature}, sweep={self.sweep}, "
+                f"{biases}, points={self.length})")
+
+
+def _round_bias(value):
+    return None if value is None else round(float(value), _BIAS_DIGITS)
+
+
+class ResultStore:
+    """
+    Chunked columnar store of sweep curves with an SQLite index.
+    """
+
+    def __init__(self, folder, compress=True):
+        """
+        :param folder: Store folder (created if needed).
+        :param compress: Write chunks with np.savez_compressed (zlib) instead of np.savez.
+        """
+        self.folder = folder
+        self.compress = compress
+        self.chunk_dir = os.path.join(folder, "chunks")
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(folder, "index.sqlite"), check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS curves (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device TEXT, bin INTEGER, temperature REAL, sweep TEXT,
+                vg REAL, vd REAL, vs REAL, vb REAL,
+                model_hash TEXT, source TEXT, attrs TEXT,
+                chunk INTEGER, start INTEGER, length INTEGER,
+                curve_key TEXT UNIQUE ON CONFLICT REPLACE
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS curves_lookup ON curves "
+                                 "(device, bin, temperature, sweep, model_hash)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self._connection.execute("INSERT OR IGNORE INTO counters VALUES ('next_chunk', 0)")
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM curves").fetchone()[0]
+
+    @staticmethod
+    def _curve_key(curve):
+        key = [curve.device, curve.bin, curve.temperature, curve.sweep,
+               _round_bias(curve.vg), _round_bias(curve.vd), _round_bias(curve.vs), _round_bias(curve.vb),
+               curve.model_hash, curve.source, curve.attrs.get("key")]
+        return json.dumps(key)
+
+    def _next_chunk(self):
+        """Reserve a new chunk number (never reused, even after compaction)."""
+        chunk = self._connection.execute("SELECT value FROM counters WHERE name = 'next_chunk'").fetchone()[0]
+        self._connection.execute("UPDATE counters SET value = ? WHERE name = 'next_chunk'", (chunk + 1,))
+        return chunk
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.chunk_dir, f"chunk_{chunk:06d}.npz")
+
+    def append(self, curves):
+        """
+        Append curves as one new chunk.
+
+        :param curves: Iterable of Curve.
+        :return: List of the new curve ids.
+        """
+        curves = list(curves)
+        if not curves:
+            return []
+        with self._lock:
+            chunk = self._next_chunk()
+            x = np.concatenate([curve.x for curve in curves])
+            y = np.concatenate([curve.y for curve in curves])
+            path = self._chunk_path(chunk)
+            tmp_path = path[:-4] + ".tmp.npz"
+            (np.savez_compressed if self.compress else np.savez)(tmp_path, x=x, y=y)
+            os.replace(tmp_path, path)
+            ids = []
+            offset = 0
+            for curve in curves:
+                cursor = self._connection.execute(
+                    "INSERT INTO curves (device, bin, temperature, sweep, vg, vd, vs, vb, model_hash, source, "
+                    "attrs, chunk, start, length, curve_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (curve.device, curve.bin, curve.temperature, curve.sweep,
+                     _round_bias(curve.vg), _round_bias(curve.vd), _round_bias(curve.vs), _round_bias(curve.vb),
+                     curve.model_hash, curve.source, json.dumps(curve.attrs, sort_keys=True),
+                     chunk, offset, len(curve.x), self._curve_key(curve)))
+                ids.append(cursor.lastrowid)
+                offset += len(curve.x)
+            self._connection.commit()
+        return ids
+
+    def query(self, order_by="vg, vd, vs, vb", **filters):
+        """
+        Find curves in the index.
+
+        Filters on the index columns (device, bin, temperature, sweep, vg, vd, vs, vb, model_hash, source)
+        take a value, a list of values, or a (low, high) tuple for an inclusive range; bias values are
+        matched after rounding. Any other keyword is matched against the curve attributes.
+
+        :return: List of CurveRecord.
+        """
+        clauses = []
+        parameters = []
+        extra = {}
+        for name, value in filters.items():
+            if name not in INDEX_COLUMNS:
+                extra[name] = value
+                continue
+            if value is None:
+                clauses.append(f"{name} IS NULL")
+            elif isinstance(value, tuple):
+                clauses.append(f"{name} BETWEEN ? AND ?")
+                parameters.extend(value)
+            elif isinstance(value, (list, set)):
+                values = [_round_bias(v) if name in ("vg", "vd", "vs", "vb") else v for v in value]
+                clauses.append(f"{name} IN ({', '.join('?' * len(values))})")
+                parameters.extend(values)
+            else:
+                clauses.append(f"{name} = ?")
+                parameters.append(_round_bias(value) if name in ("vg", "vd", "vs", "vb") else value)
+        sql = ("SELECT id, device, bin, temperature, sweep, vg, vd, vs, vb, model_hash, source, attrs, "
+               "chunk, start, length FROM curves")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by}, id"
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        records = [CurveRecord(row) for row in rows]
+        if extra:
+            records = [record for record in records
+                       if all(record.attrs.get(name) == value for name, value in extra.items())]
+        return records
+
+    def load(self, records=None, **filters):
+        """
+        Load the points of curves.
+
+        :param records: (Optional) CurveRecords from query(); otherwise the filters are passed to query().
+        :return: List of (record, x, y) tuples.
+        """
+        if records is None:
+            records = self.query(**filters)
+        by_chunk = {}
+        for record in records:
+            by_chunk.setdefault(record.chunk, []).append(record)
+        loaded = {}
+        for chunk, chunk_records in by_chunk.items():
+            with np.load(self._chunk_path(chunk)) as data:
+                x, y = data["x"], data["y"]
+            for record in chunk_records:
+                end = record.start + record.length
+                loaded[record.id] = (x[record.start:end], y[record.start:end])
+        return [(record,) + loaded[record.id] for record in records]
+
+    def delete(self, records):
+        """Remove curves from the index (their points are dropped by the next compact())."""
+        with self._lock:
+            self._connection.executemany("DELETE FROM curves WHERE id = ?", [(record.id,) for record in records])
+            self._connection.commit()
+
+    def compact(self, chunk_curves=2000):
+        """
+        Rewrite the store into chunks of up to chunk_curves curves, dropping replaced and deleted points.
+
+        :return: Number of chunk files after compaction.
+        """
+        records = self.query(order_by="device, bin, temperature, model_hash, sweep, vg, vd, vs, vb")
+        curves = self.load(records)
+        with self._lock:
+            old_chunks = [name for name in os.listdir(self.chunk_dir) if name.endswith(".npz")]
+            updates = []
+            n_chunks = 0
+            for first in range(0, len(curves), chunk_curves):
+                batch = curves[first:first + chunk_curves]
+                chunk = self._next_chunk()
+                n_chunks += 1
+                path = self._chunk_path(chunk)
+                tmp_path = path[:-4] + ".tmp.npz"
+                (np.savez_compressed if self.compress else np.savez)(
+                    tmp_path, x=np.concatenate([x for _, x, _ in batch]), y=np.concatenate([y for _, _, y in batch]))
+                os.replace(tmp_path, path)
+                offset = 0
+                for record, x, _ in batch:
+                    updates.append((chunk, offset, record.id))
+                    offset += len(x)
+            self._connection.executemany("UPDATE curves SET chunk = ?, start = ? WHERE id = ?", updates)
+            self._connection.commit()
+            for name in old_chunks:
+                os.remove(os.path.join(self.chunk_dir, name))
+        return n_chunks
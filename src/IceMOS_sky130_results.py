@@ -0,0 +1,171 @@
+"""
+IceMOS_sky130_results.py
+
+Typed results returned by IceMOS_simulator_sky130 (the simulate_* methods and the cached iv_curve() and
+iv_vds_curves()) and by its in-process stand-in, IceMOS_sky130_bsim4.BSIM4Simulator.
+
+A SweepResult carries the simulated arrays with named axes and units, plus the metadata of the
+run (device, bin, geometry, model card and its hash, temperature, simulator status, ngspice
+output), so callers never have to rebuild result paths or re-read wrdata files.
+
+Sign conventions: the PMOS netlists are biased from the source, so their swept voltages are the
+source-referenced VSG and VSD and the measured current i(vdsm) flows out of the drain (ISD >= 0
+when the device conducts). Results keep these quantities and name them accordingly
+('VSG', 'VSD', 'ISD'); NMOS results use 'VGS', 'VDS' and 'IDS'. terminal() converts a result to
+the SPICE terminal convention (VGS = -VSG, VDS = -VSD, ID = -ISD for PMOS).
+
+    result = simulator.simulate_iv_vds('pch', bin_number=10)
+    result.names            # ('VSG', 'VSD', 'ISD')
+    for vsg, vsd, isd in result.curves():
+        ...
+"""
+
+import numpy as np
+
+
+# Axis names by device: (gate bias, drain sweep, current).
+AXIS_NAMES = {"nch": ("VGS", "VDS", "IDS"), "pch": ("VSG", "VSD", "ISD")}
+TERMINAL_NAMES = ("VGS", "VDS", "ID")
+
+
+class Axis:
+    """
+    Named array with a unit.
+
+    :ivar name: Quantity name, e.g. 'VGS' or 'ISD'.
+    :ivar values: NumPy array.
+    :ivar unit: Unit symbol ('V', 'A').
+    """
+
+    def __init__(self, name, values, unit):
+        self.name = name
+        self.values = np.asarray(values, dtype=float)
+        self.unit = unit
+
+    def __len__(self):
+        return len(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    @property
+    def label(self):
+        """Axis label for plots, e.g. 'VSD (V)'."""
+        return f"{self.name} ({self.unit})"
+
+    def __repr__(self):
+        return f"Axis({self.name!r}, shape={self.values.shape}, unit={self.unit!r})"
+
+
+class SweepResult:
+    """
+    Result of a DC sweep: one current curve (kind 'iv', current vs gate bias) or a family of curves
+    (kind 'iv_vds', current vs drain bias for each gate bias).
+
+    :ivar kind: 'iv' or 'iv_vds'.
+    :ivar device_type: 'nch' or 'pch'.
+    :ivar sweep: Axis of the swept voltage (VGS/VSG for 'iv', VDS/VSD for 'iv_vds').
+    :ivar bias: Axis of the gate biases of a family (None for 'iv').
+    :ivar current: Axis of the current; shape (len(sweep),) for 'iv', (len(bias), len(sweep)) for 'iv_vds'.
+    :ivar metadata: Dict with the run details (bin, W, L, model_type, temperature, netlist, model_card,
+                    model_hash, simulator, status, rung, elapsed, log_path, cache_hit).
+    :ivar stdout: Tail of the ngspice output.
+    """
+
+    def __init__(self, kind, device_type, sweep, current, bias=None, metadata=None, stdout=""):
+        self.kind = kind
+        self.device_type = device_type.lower()
+        self.sweep = sweep
+        self.bias = bias
+        self.current = current
+        expected = (len(sweep),) if bias is None else (len(bias), len(sweep))
+        if current.values.shape != expected:
+            raise ValueError(f"Current shape {current.values.shape} does not match the sweep axes {expected}.")
+        self.metadata = dict(metadata or {})
+        self.stdout = stdout
+
+    @property
+    def axes(self):
+        """The independent axes, outermost first."""
+        return (self.sweep,) if self.bias is None else (self.bias, self.sweep)
+
+    @property
+    def names(self):
+        """Names of the axes and of the current, e.g. ('VSG', 'VSD', 'ISD')."""
+        return tuple(axis.name for axis in self.axes) + (self.current.name,)
+
+    @property
+    def ok(self):
+        return self.metadata.get("status") == "ok"
+
+    @property
+    def failed_points(self):
+        """Number of sweep points that could not be simulated (NaN currents)."""
+        return int(np.count_nonzero(np.isnan(self.current.values)))
+
+    def __getitem__(self, name):
+        """Return the values of an axis or of the current by name (case-insensitive)."""
+        for axis in self.axes + (self.current,):
+            if axis.name.lower() == name.lower():
+                return axis.values
+        raise KeyError(f"No axis '{name}' in {self.names}.")
+
+    def curves(self):
+        """
+        :return: List of (bias, x, y) tuples; bias is None for an 'iv' result.
+        """
+        if self.bias is None:
+            return [(None, self.sweep.values, self.current.values)]
+        return [(bias, self.sweep.values, self.current.values[i]) for i, bias in enumerate(self.bias.values)]
+
+    def curve(self, bias, tolerance=1e-9):
+        """
+        Return the (x, y) arrays of the family curve at a gate bias.
+
+        :raises KeyError: If no curve was simulated at that bias.
+        """
+        if self.bias is None:
+            raise KeyError("An 'iv' result has a single curve; use sweep.values and current.values.")
+        matches = np.flatnonzero(np.abs(self.bias.values - bias) <= tolerance)
+        if not len(matches):
+            raise KeyError(f"No curve at {self.bias.name} = {bias:g} {self.bias.unit}.")
+        return self.sweep.values, self.current.values[matches[0]]
+
+    def terminal(self):
+        """
+        Return the result in the SPICE terminal convention (gate and drain referred to the source,
+        current into the drain). NMOS results are returned unchanged.
+        """
+        if self.device_type == "nch":
+            return self
+        sign = -1.0
+        gate, drain, current = TERMINAL_NAMES
+        if self.bias is None:
+            sweep = Axis(gate, sign * self.sweep.values, self.sweep.unit)
+            bias = None
+        else:
+            sweep = Axis(drain, sign * self.sweep.values, self.sweep.unit)
+            bias = Axis(gate, sign * self.bias.values, self.bias.unit)
+        return SweepResult(self.kind, self.device_type, sweep, Axis(current, sign * self.current.values,
+                                                                       self.current.unit),
+                           bias=bias, metadata=dict(self.metadata, convention="terminal"), stdout=self.stdout)
+
+    def __repr__(self):
+        shape = "x".join(str(len(axis)) for axis in self.axes)
+        return (f"SweepResult({self.kind}, {self.device_type}, bin={self.metadata.get('bin')}, "
+                f"{'/'.join(self.names)}, points={shape}, status={self.metadata.get('status')})")
+
+
+def make_iv_result(device_type, vg, current, metadata=None, stdout=""):
+    """Build an 'iv' result (current vs gate bias) with the device's axis names."""
+    gate, _, current_name = AXIS_NAMES[device_type.lower()]
+    return SweepResult("iv", device_type, Axis(gate, vg, "V"), Axis(current_name, current, "A"),
+                       metadata=metadata, stdout=stdout)
+
+
+def make_family_result(device_type, vg_values, vd, currents, metadata=None, stdout=""):
+    """Build an 'iv_vds' result (one current row per gate bias) with the device's axis names."""
+    gate, drain, current_name = AXIS_NAMES[device_type.lower()]
+    currents = np.vstack(currents) if len(currents) else np.empty((0, len(vd)))
+    return SweepResult("iv_vds", device_type, Axis(drain, vd, "V"), Axis(current_name, currents, "A"),
+                       bias=Axis(gate, vg_values, "V"), metadata=metadata, stdout=stdout)
@@ -0,0 +1,271 @@
+"""
+IceMOS_sky130_run_history.py
+
+This module keeps every calibration run as an immutable snapshot, so that an old fit can be
+overlaid on the current one without simulating its parameter set again.
+
+A snapshot holds the model card text, the sweep specification (kind, sweep arguments, model
+type, temperature) and the resulting curves. Everything is content-addressed:
+  - objects/<2 hex>/<sha256>: blobs (model card text, arrays saved in .npy format). An array or a
+    model card that appears in several runs is stored once.
+  - runs/<run id>.json: the run manifest, which refers to its blobs by hash. The run id is the
+    hash of the manifest content (timestamp excluded), so recording the same result again
+    returns the existing run instead of creating a new one. Manifests and blobs are written once
+    and made read-only.
+
+    history = RunHistory()
+    run = history.record("nch", 40, "iv", {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                         [(None, vg, ids)], "circuits/nch/bin_40/bin_40_nch_modified.lib", temperature=-269)
+    for old in history.runs(device="nch", bin=40, kind="iv"):
+        for vg, x, y in history.load(old.run_id):
+            ...
+"""
+
+import hashlib
+import io
+import json
+import os
+import stat
+import threading
+import time
+
+import numpy as np
+
+from IceMOS_sky130_result_store import model_hash
+
+
+class RunSnapshot:
+    """
+    Manifest of a recorded run (metadata only; use RunHistory.load to get the curves).
+
+    :ivar run_id: Content hash of the run.
+    :ivar created: Time the run was first recorded (seconds since the epoch).
+    :ivar kind: 'iv' (ID vs VG) or 'iv_vds' (ID vs VD family).
+    :ivar sweep: Sweep arguments of the simulator call.
+    :ivar curves: List of {"vg": gate bias or None, "x": blob hash, "y": blob hash}.
+    """
+
+    def __init__(self, manifest):
+        self.run_id = manifest["run_id"]
+        self.created = manifest["created"]
+        self.device = manifest["device"]
+        self.bin = manifest["bin"]
+        self.kind = manifest["kind"]
+        self.sweep = manifest["sweep"]
+        self.model_type = manifest["model_type"]
+        self.temperature = manifest["temperature"]
+        self.model_hash = manifest["model_hash"]
+        self.model_card_object = manifest["model_card"]
+        self.curves = manifest["curves"]
+        self.note = manifest.get("note", "")
+
+    def describe(self):
+        """One-line description for pickers and logs."""
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created))
+        temperature = "" if self.temperature is None else f", T={self.temperature:g} C"
+        note = f" - {self.note}" if self.note else ""
+        return (f"{when}  {self.device} bin {self.bin} {self.kind} ({self.model_type}{temperature}, "
+                f"model {self.model_hash[:8]}, {len(self.curves)} curves){note}")
+
+    def __repr__(self):
+        return f"RunSnapshot({self.run_id}, {self.describe()})"
+
+
+class RunHistory:
+    """
+    Content-addressed, append-only history of simulation runs.
+    """
+
+    def __init__(self, folder=os.path.join("circuits", ".run_history")):
+        """
+        :param folder: History folder (created if needed).
+        """
+        self.folder = folder
+        self.object_dir = os.path.join(folder, "objects")
+        self.run_dir = os.path.join(folder, "runs")
+        os.makedirs(self.object_dir, exist_ok=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._manifests = {}
+
+    # --- blobs -------------------------------------------------------------------------------
+
+    def _object_path(self, digest):
+        return os.path.join(self.object_dir, digest[:2], digest)
+
+    def put_object(self, data):
+        """
+        Store a blob (once) and return its SHA-256 hash.
+
+        :param data: Bytes.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get_object(self, digest):
+        with open(self._object_path(digest), "rb") as f:
+            return f.read()
+
+    def put_array(self, array):
+        """Store an array in .npy format (once) and return its hash."""
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array, dtype=float), allow_pickle=False)
+        return self.put_object(buffer.getvalue())
+
+    def get_array(self, digest):
+        """Return a stored array (memory-mapped, read-only)."""
+        return np.load(self._object_path(digest), mmap_mode="r", allow_pickle=False)
+
+    # --- runs --------------------------------------------------------------------------------
+
+    def record(self, device, bin_number, kind, sweep, curves, model_card, temperature=None,
+               model_type="modified", note=""):
+        """
+        Record a run.
+
+        :param device: 'nch' or 'pch'.
+        :param bin_number: Bin number.
+        :param kind: 'iv' or 'iv_vds'.
+        :param sweep: Dict of the sweep arguments (JSON-serialisable).
+        :param curves: List of (vg, x, y) tuples; vg is None for an ID vs VG curve.
+        :param model_card: Path to the model card that was simulated, or its text.
+        :param temperature: Simulation temperature in °C.
+        :param model_type: 'modified' or 'original'.
+        :param note: Free text shown in the picker.
+        :return: RunSnapshot (the existing one if the same run was recorded before).
+        """
+        if os.path.exists(model_card):
+            with open(model_card, "r") as f:
+                model_card = f.read()
+        manifest = {
+            "device": device.lower(),
+            "bin": bin_number,
+            "kind": kind,
+            "sweep": {name: sweep[name] for name in sorted(sweep)},
+            "model_type": model_type,
+            "temperature": None if temperature is None else float(temperature),
+            "model_hash": model_hash(model_card),
+            "model_card": self.put_object(model_card.encode("utf-8")),
+            "curves": [{"vg": None if vg is None else float(vg), "x": self.put_array(x), "y": self.put_array(y)}
+                       for vg, x, y in curves],
+            "note": note,
+        }
+        run_id = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+        path = os.path.join(self.run_dir, f"{run_id}.json")
+        with self._lock:
+            if not os.path.exists(path):
+                manifest["run_id"] = run_id
+                manifest["created"] = time.time()
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(manifest, f, indent=1, sort_keys=True)
+                os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(tmp_path, path)
+        return self.get(run_id)
+
+    def get(self, run_id):
+        """
+        Return the snapshot of a run.
+
+        :param run_id: Run id, or an unambiguous prefix of it.
+        :raises KeyError: If no run (or several runs) match.
+        """
+        path = os.path.join(self.run_dir, f"{run_id}.json")
+        if not os.path.exists(path):
+            matches = [name[:-5] for name in os.listdir(self.run_dir)
+                       if name.endswith(".json") and name.startswith(run_id)]
+            if len(matches) != 1:
+                raise KeyError(f"{'No' if not matches else 'Ambiguous'} run id '{run_id}'.")
+            run_id = matches[0]
+            path = os.path.join(self.run_dir, f"{run_id}.json")
+        if run_id not in self._manifests:
+            with open(path, "r") as f:
+                self._manifests[run_id] = RunSnapshot(json.load(f))
+        return self._manifests[run_id]
+
+    def runs(self, device=None, bin=None, kind=None, model_type=None, model_hash=None, since=None, until=None):
+        """
+        List the recorded runs, newest first.
+
+        :param since: (Optional) Only runs recorded at or after this time (seconds since the epoch).
+        :param until: (Optional) Only runs recorded before this time.
+        :return: List of RunSnapshot.
+        """
+        snapshots = [self.get(name[:-5]) for name in os.listdir(self.run_dir) if name.endswith(".json")]
+        selected = []
+        for snapshot in snapshots:
+            if device is not None and snapshot.device != device.lower():
+                continue
+            if bin is not None and snapshot.bin != bin:
+                continue
+            if kind is not None and snapshot.kind != kind:
+                continue
+            if model_type is not None and snapshot.model_type != model_type:
+                continue
+            if model_hash is not None and snapshot.model_hash != model_hash:
+                continue
+            if since is not None and snapshot.created < since:
+                continue
+            if until is not None and snapshot.created >= until:
+                continue
+            selected.append(snapshot)
+        return sorted(selected, key=lambda snapshot: snapshot.created, reverse=True)
+
+    def load(self, run_id):
+        """
+        Return the curves of a run.
+
+        :return: List of (vg, x, y) tuples (arrays are read-only memory maps).
+        """
+        snapshot = run_id if isinstance(run_id, RunSnapshot) else self.get(run_id)
+        return [(curve["vg"], self.get_array(curve["x"]), self.get_array(curve["y"])) for curve in snapshot.curves]
+
+    def model_card(self, run_id):
+        """Return the model card text of a run."""
+        snapshot = run_id if isinstance(run_id, RunSnapshot) else self.get(run_id)
+        return self.get_object(snapshot.model_card_object).decode("utf-8")
+
+    def delete(self, run_id):
+        """Forget a run (its blobs are removed by gc() once no other run refers to them)."""
+        snapshot = self.get(run_id)
+        with self._lock:
+            os.remove(os.path.join(self.run_dir, f"{snapshot.run_id}.json"))
+            self._manifests.pop(snapshot.run_id, None)
+
+    def gc(self):
+        """
+        Remove the blobs no run refers to.
+
+        :return: Number of blobs removed.
+        """
+        referenced = set()
+        for snapshot in self.runs():
+            referenced.add(snapshot.model_card_object)
+            for curve in snapshot.curves:
+                referenced.update((curve["x"], curve["y"]))
+        removed = 0
+        with self._lock:
+            for prefix in os.listdir(self.object_dir):
+                for digest in os.listdir(os.path.join(self.object_dir, prefix)):
+                    if digest not in referenced:
+                        os.remove(os.path.join(self.object_dir, prefix, digest))
+                        removed += 1
+        return removed
+
+    def disk_usage(self):
+        """:return: Tuple (number of blobs, bytes used by blobs)."""
+        count = 0
+        size = 0
+        for prefix in os.listdir(self.object_dir):
+            for digest in os.listdir(os.path.join(self.object_dir, prefix)):
+                count += 1
+                size += os.path.getsize(os.path.join(self.object_dir, prefix, digest))
+        return count, size
@@ -0,0 +1,416 @@
+"""
+IceMOS_sky130_scheduler.py
+
+This module schedules simulation jobs from several clients (the GUI sliders, the optimizers
+and batch campaigns) on a bounded number of concurrent ngspice runs.
+
+Jobs are queued by priority class:
+  - 'interactive': GUI requests, a user is waiting for the plot,
+  - 'optimizer':   parameter fitting loops,
+  - 'batch':       long campaigns (corners, Monte Carlo, reports).
+A higher class is always dispatched first. Inside a class, every owner (e.g. one optimizer run
+or one campaign) has its own queue and the owner that used the least run time so far goes next,
+so one client cannot starve the others of its class.
+
+When an interactive job arrives and every slot is busy, the scheduler suspends (SIGSTOP) the
+process group of the lowest-priority running ngspice job and gives its slot to the interactive
+job; suspended jobs are resumed (SIGCONT) once higher-priority work has drained. Jobs declaring
+the same resource (for example the circuit folder whose netlists and output files they rewrite)
+never run at the same time.
+
+Queue depths, running/suspended counts and wait times per class are available from metrics().
+"""
+
+import collections
+import itertools
+import os
+import signal
+import threading
+import time
+from concurrent.futures import CancelledError
+
+from IceMOS_sky130_sim_runner import set_process_observer
+
+
+PRIORITY_CLASSES = ("interactive", "optimizer", "batch")
+
+# Number of recent wait times kept per class for the metrics.
+_WAIT_HISTORY = 256
+
+
+class ScheduledJob:
+    """
+    A callable submitted to the SimulationScheduler, with a future-like interface.
+
+    It is also the process observer of the worker thread while it runs, so the ngspice processes
+    it launches can be suspended, resumed and cancelled.
+
+    :ivar priority: Priority class.
+    :ivar owner: Fair-share key of the client that submitted the job.
+    :ivar resource: (Optional) Key of the exclusive resource the job uses.
+    :ivar state: 'queued', 'running', 'suspended', 'done', 'failed' or 'cancelled'.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, fn, args, kwargs, priority, owner, resource):
+        self.id = next(self._ids)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.owner = owner
+        self.resource = resource
+        self.state = "queued"
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self._result = None
+        self._exception = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._suspended = False
+        self._suspended_since = None
+        self._suspended_total = 0.0
+        self._cancel_requested = False
+
+    @property
+    def wait_time(self):
+        """Time spent in the queue (up to now if the job has not started)."""
+        end = self.started if self.started is not None else time.monotonic()
+        return end - self.submitted
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """:return: True if the job finished within the timeout."""
+        return self._event.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the job and return the value of its callable.
+
+        :raises TimeoutError: If the job did not finish in time.
+        :raises CancelledError: If the job was cancelled.
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"Job {self.id} did not finish within {timeout} s.")
+        if self.state == "cancelled":
+            raise CancelledError()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def cancel(self):
+        """
+        Cancel the job. A queued job is dropped; a running job has its ngspice processes terminated
+        and its result discarded.
+        """
+        with self._lock:
+            self._cancel_requested = True
+            processes = list(self._processes)
+        for process in processes:
+            _signal_group(process, signal.SIGTERM)
+            _signal_group(process, signal.SIGCONT)
+
+    @property
+    def cancelled(self):
+        return self._cancel_requested
+
+    # -- process observer interface (called from the worker thread) --
+
+    def process_started(self, process):
+        with self._lock:
+            self._processes.add(process)
+            suspended = self._suspended
+            cancelled = self._cancel_requested
+        if cancelled:
+            _signal_group(process, signal.SIGTERM)
+        elif suspended:
+            _signal_group(process, signal.SIGSTOP)
+
+    def process_finished(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def suspended_seconds(self):
+        with self._lock:
+            total = self._suspended_total
+            if self._suspended_since is not None:
+                total += time.monotonic() - self._suspended_since
+            return total
+
+    # -- called by the scheduler --
+
+    def _suspend(self):
+        """Stop the ngspice processes of the job. :return: False if it had none to stop."""
+        with self._lock:
+            if self._suspended or not self._processes:
+                return False
+            self._suspended = True
+            self._suspended_since = time.monotonic()
+            processes = list(self._processes)
+        for process in processes:
+            _signal_group(process, signal.SIGSTOP)
+        return True
+
+    def _resume(self):
+        with self._lock:
+            if not self._suspended:
+                return
+            self._suspended = False
+            self._suspended_total += time.monotonic() - self._suspended_since
+            self._suspended_since = None
+            processes = list(self._processes)
+        for process in processes:
+            _signal_group(process, signal.SIGCONT)
+
+    def __repr__(self):
+        return f"ScheduledJob(id={self.id}, priority={self.priority!r}, owner={self.owner!r}, state={self.state!r})"
+
+
+def _signal_group(process, sig):
+    if os.name != "posix":
+        if sig == signal.SIGTERM:
+            process.terminate()
+        return
+    try:
+        os.killpg(os.getpgid(process.pid), sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class SimulationScheduler:
+    """
+    Priority and fair-share scheduler for simulation jobs.
+    """
+
+    def __init__(self, max_workers=None, preempt=True):
+        """
+        :param max_workers: Number of jobs allowed to run at once (suspended jobs do not count).
+                            Defaults to the number of CPUs.
+        :param preempt: Suspend lower-priority ngspice processes when an interactive job is waiting.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.preempt = preempt
+        self._condition = threading.Condition()
+        self._queues = {priority: collections.OrderedDict() for priority in PRIORITY_CLASSES}
+        self._usage = collections.defaultdict(float)
+        self._running = []
+        self._suspended = []
+        self._completed = collections.Counter()
+        self._waits = {priority: collections.deque(maxlen=_WAIT_HISTORY) for priority in PRIORITY_CLASSES}
+        self._shutdown = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="SimulationScheduler", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, fn, *args, priority="batch", owner="default", resource=None, **kwargs):
+        """
+        Queue a job.
+
+        :param fn: Callable running the simulation(s), called as fn(*args, **kwargs) on a worker thread.
+        :param priority: 'interactive', 'optimizer' or 'batch'.
+        :param owner: Fair-share key of the submitting client.
+        :param resource: (Optional) Hashable key; jobs with the same key never run concurrently.
+        :return: ScheduledJob.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{priority}'. Expected one of {PRIORITY_CLASSES}.")
+        job = ScheduledJob(fn, args, kwargs, priority, owner, resource)
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("The scheduler has been shut down.")
+            self._queues[priority].setdefault(owner, collections.deque()).append(job)
+            self._condition.notify_all()
+        return job
+
+    def cancel_owner(self, owner, priority=None):
+        """
+        Cancel every queued and running job of an owner (optionally only in one class).
+
+        :return: Number of jobs cancelled.
+        """
+        with self._condition:
+            jobs = []
+            for cls in PRIORITY_CLASSES if priority is None else (priority,):
+                jobs.extend(self._queues[cls].pop(owner, ()))
+            for job in jobs:
+                self._finish(job, "cancelled")
+            active = [job for job in self._running + self._suspended
+                      if job.owner == owner and (priority is None or job.priority == priority)]
+            self._condition.notify_all()
+        for job in jobs + active:
+            job.cancel()
+        return len(jobs) + len(active)
+
+    def metrics(self):
+        """
+        Snapshot of the scheduler state.
+
+        :return: Dict {class: {"queued", "running", "suspended", "completed", "mean_wait",
+                 "max_wait", "p95_wait"}}; waits are in seconds and cover the last dispatched jobs
+                 plus the jobs still queued.
+        """
+        with self._condition:
+            snapshot = {}
+            for priority in PRIORITY_CLASSES:
+                queued = [job for queue in self._queues[priority].values() for job in queue]
+                waits = list(self._waits[priority]) + [job.wait_time for job in queued]
+                waits.sort()
+                snapshot[priority] = {
+                    "queued": len(queued),
+                    "running": sum(1 for job in self._running if job.priority == priority),
+                    "suspended": sum(1 for job in self._suspended if job.priority == priority),
+                    "completed": self._completed[priority],
+                    "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+                    "max_wait": waits[-1] if waits else 0.0,
+                    "p95_wait": waits[min(len(waits) - 1, int(0.95 * len(waits)))] if waits else 0.0,
+                }
+            return snapshot
+
+    def shutdown(self, cancel_pending=True):
+        """Stop dispatching; queued jobs are cancelled unless cancel_pending is False."""
+        with self._condition:
+            self._shutdown = True
+            if cancel_pending:
+                for priority in PRIORITY_CLASSES:
+                    for queue in self._queues[priority].values():
+                        for job in queue:
+                            self._finish(job, "cancelled")
+                    self._queues[priority].clear()
+            for job in self._suspended:
+                job._resume()
+            self._running.extend(self._suspended)
+            self._suspended = []
+            self._condition.notify_all()
+
+    # -- internals (called with the condition held unless stated otherwise) --
+
+    def _busy_resources(self):
+        return {job.resource for job in self._running + self._suspended if job.resource is not None}
+
+    def _next_job(self, priority, busy):
+        """Pop the next job of a class: the owner with the least usage, skipping busy resources."""
+        owners = sorted(self._queues[priority], key=lambda owner: self._usage[owner])
+        for owner in owners:
+            queue = self._queues[priority][owner]
+            for job in queue:
+                if job.resource is None or job.resource not in busy:
+                    queue.remove(job)
+                    if not queue:
+                        del self._queues[priority][owner]
+                    return job
+        return None
+
+    def _has_startable(self, priority, busy):
+        return any(job.resource is None or job.resource not in busy
+                   for queue in self._queues[priority].values() for job in queue)
+
+    def _dispatch_loop(self):
+        with self._condition:
+            while True:
+                if self._shutdown and not any(self._queues[p] for p in PRIORITY_CLASSES):
+                    return
+                self._dispatch_once()
+                self._condition.wait(0.1)
+
+    def _dispatch_once(self):
+        for priority in PRIORITY_CLASSES:
+            rank = PRIORITY_CLASSES.index(priority)
+            while True:
+                busy = self._busy_resources()
+                if not self._has_startable(priority, busy):
+                    break
+                # Suspended jobs of this class (or a higher one) take their slot back first.
+                resumable = [job for job in self._suspended
+                             if PRIORITY_CLASSES.index(job.priority) <= rank]
+                if len(self._running) < self.max_workers and resumable:
+                    self._resume_job(resumable[0])
+                    continue
+                if len(self._running) >= self.max_workers:
+                    if not (self.preempt and priority == "interactive" and self._preempt_one(rank)):
+                        break
+                job = self._next_job(priority, busy)
+                if job is None:
+                    break
+                self._start(job)
+        # Free slots and nothing queued that could use them: resume suspended work.
+        while self._suspended and len(self._running) < self.max_workers:
+            waiting = any(self._has_startable(p, self._busy_resources()) for p in PRIORITY_CLASSES
+                          if PRIORITY_CLASSES.index(p) < PRIORITY_CLASSES.index(self._suspended[0].priority))
+            if waiting:
+                break
+            self._resume_job(self._suspended[0])
+
+    def _preempt_one(self, rank):
+        """Suspend the lowest-priority running job below the given rank. :return: True on success."""
+        candidates = [job for job in self._running if PRIORITY_CLASSES.index(job.priority) > rank]
+        candidates.sort(key=lambda job: (-PRIORITY_CLASSES.index(job.priority), -(job.started or 0.0)))
+        for job in candidates:
+            if job._suspend():
+                self._running.remove(job)
+                self._suspended.append(job)
+                job.state = "suspended"
+                print(f"Scheduler: suspended {job} for an interactive request.")
+                return True
+        return False
+
+    def _resume_job(self, job):
+        job._resume()
+        self._suspended.remove(job)
+        self._running.append(job)
+        job.state = "running"
+
+    def _start(self, job):
+        job.state = "running"
+        job.started = time.monotonic()
+        self._waits[job.priority].append(job.wait_time)
+        self._running.append(job)
+        threading.Thread(target=self._work, args=(job,), name=f"SimulationJob-{job.id}", daemon=True).start()
+
+    def _work(self, job):
+        """Worker thread body (runs without the condition held)."""
+        set_process_observer(job)
+        try:
+            if not job.cancelled:
+                job._result = job.fn(*job.args, **job.kwargs)
+        except BaseException as e:
+            job._exception = e
+        finally:
+            set_process_observer(None)
+        with self._condition:
+            if job in self._running:
+                self._running.remove(job)
+            if job in self._suspended:
+                self._suspended.remove(job)
+            self._usage[job.owner] += time.monotonic() - job.started - job.suspended_seconds()
+            if job.cancelled:
+                state = "cancelled"
+            else:
+                state = "failed" if job._exception is not None else "done"
+            self._finish(job, state)
+            self._condition.notify_all()
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = time.monotonic()
+        if state != "cancelled":
+            self._completed[job.priority] += 1
+        job._event.set()
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """
+    The process-wide scheduler shared by the GUI windows and the optimizers (created on first use).
+    """
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = SimulationScheduler()
+        return _default_scheduler
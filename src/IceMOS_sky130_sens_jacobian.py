@@ -0,0 +1,227 @@
+"""
+IceMOS_sky130_sens_jacobian.py
+
+This module computes the Jacobian of a fit from ngspice DC sensitivity analyses ('sens') instead of
+finite differences.
+
+SensitivityJacobian writes the model card at the current point, takes the fit's sweep netlist and
+replaces its control block by one operating point and one 'sens' analysis per sweep point:
+
+    set appendwrite
+    alter VGATE_src dc = 0.1
+    op
+    write sens_jacobian.raw
+    sens I(V1_meas)
+    write sens_jacobian.raw
+    ...
+
+so that a single ngspice launch gives the current and its derivatives with respect to every model
+parameter at every sweep point. The derivatives of the fitted parameters are looked up in the
+sensitivity plots as '<model>:<param>' (or '<model>_<param>', or the same with the instance name),
+and the residual Jacobian follows from CurveResiduals.jacobian() by the chain rule.
+
+The first Jacobian is checked against the fallback provider (by default a BatchedJacobian, i.e.
+finite differences): when they disagree by more than `tolerance`, or when ngspice does not report
+the sensitivity of a fitted parameter, the fallback is used for the rest of the fit.
+
+    jacobian = SensitivityJacobian(model, residuals, names)
+    result = fit_parameters(model, residuals, parameters, names=names, jacobian=jacobian)
+    print(jacobian.check_error, jacobian.active)
+"""
+
+import os
+import re
+
+import numpy as np
+
+from IceMOS_sky130_batch_jacobian import BatchedJacobian
+from IceMOS_sky130_param_handler import write_model_cards
+from IceMOS_sky130_raw_reader import read_raw
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+
+def sens_netlist(netlist_text, output_file, gate_values=None):
+    """
+    Rewrite a generated sweep netlist to run an operating point and a DC sensitivity analysis at each
+    point of its sweep, all plots being appended to one raw file.
+
+    :param netlist_text: Text of a netlist generated by NetlistGeneratorSky130.
+    :param output_file: Raw file the plots are written to (relative to the netlist folder).
+    :param gate_values: Gate voltages of a gate-sweep netlist (the values its 'alter' loop visits);
+                        None for an IV netlist.
+    :return: Tuple (netlist text, points, instance name, model name, measured source name), where points
+             is the list of (gate value or None, swept source value) in the order of the analyses.
+    :raises ValueError: If the netlist has no MOSFET, no saved current or no dc sweep.
+    """
+    m = re.search(r"^([Mm]\S*)\s+\S+\s+\S+\s+\S+\s+\S+\s+(\S+)", netlist_text, re.MULTILINE)
+    if m is None:
+        raise ValueError("No MOSFET instance in the netlist.")
+    instance, model = m.group(1), m.group(2)
+    m = re.search(r"^\.save\s+i\((\S+?)\)", netlist_text, re.MULTILINE | re.IGNORECASE)
+    if m is None:
+        raise ValueError("The netlist saves no measured current.")
+    source = m.group(1)
+    m = re.search(r"^\.control\s*$(.*?)^\.endc", netlist_text, re.MULTILINE | re.DOTALL | re.IGNORECASE)
+    if m is None:
+        raise ValueError("The netlist has no control block.")
+    control = m.group(1)
+    dc = re.search(r"^\s*dc\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)", control, re.MULTILINE | re.IGNORECASE)
+    if dc is None:
+        raise ValueError("The netlist has no dc sweep.")
+    sweep_source = dc.group(1)
+    values = IceMOS_simulator_sky130.sweep_values(float(dc.group(2)), float(dc.group(3)), float(dc.group(4)))
+    gate_source = None
+    if gate_values is not None:
+        alter = re.search(r"^\s*alter\s+(\S+?)\s*(?:dc\s*)?=", control, re.MULTILINE | re.IGNORECASE)
+        if alter is None:
+            raise ValueError("The gate-sweep netlist has no 'alter' of its gate source.")
+        gate_source = alter.group(1)
+
+    points = [(vg, value) for vg in (gate_values if gate_values is not None else [None]) for value in values]
+    commands = ["set appendwrite"]
+    for vg, value in points:
+        if gate_source is not None:
+            commands.append(f"alter {gate_source} dc = {vg:.12g}")
+        commands.append(f"alter {sweep_source} dc = {value:.12g}")
+        commands.extend(["op", f"write {output_file}", f"sens I({source})", f"write {output_file}"])
+    text = netlist_text[:m.start(1)] + "\n" + "\n".join(commands) + "\n" + netlist_text[m.end(1):]
+    return text, points, instance, model, source
+
+
+def jacobian_error(jacobian, reference):
+    """Relative (Frobenius norm) difference between two Jacobians."""
+    return float(np.linalg.norm(jacobian - reference) / max(np.linalg.norm(reference), 1e-300))
+
+
+class SensitivityJacobian:
+    """
+    Jacobian of a SimulatorModel fit from ngspice DC sensitivities, one ngspice launch per Jacobian.
+
+    Called by least_squares_fit like FiniteDifferenceJacobian. `nfev` counts the sensitivity runs and
+    the evaluations of the fallback, `launches` the sensitivity runs.
+
+    :ivar active: False once the fit has switched to the fallback for good.
+    :ivar check_error: Relative difference from the fallback found by the check (None before it).
+    """
+
+    def __init__(self, model, residuals, names, fallback=None, check=True, tolerance=0.05,
+                 tag="sens_jacobian"):
+        """
+        :param model: SimulatorModel of the fit.
+        :param residuals: CurveResiduals of the fit.
+        :param names: Names of the fitted parameters, in the order of the parameter vector.
+        :param fallback: (Optional) Jacobian provider used for the check and when the sensitivities are not
+                         available. Defaults to BatchedJacobian(model, residuals, names).
+        :param check: Compare the first Jacobian with the fallback's.
+        :param tolerance: Largest relative difference accepted by the check.
+        :param tag: Name of the sensitivity netlist and raw file.
+        """
+        self.model = model
+        self.residuals = residuals
+        self.names = list(names)
+        self.fallback = fallback if fallback is not None else BatchedJacobian(model, residuals, names)
+        self.checked = not check
+        self.tolerance = tolerance
+        self.tag = tag
+        self.active = True
+        self.check_error = None
+        self.launches = 0
+
+    @property
+    def nfev(self):
+        return self.launches + getattr(self.fallback, "nfev", 0)
+
+    def __call__(self, fun, x, r0, lower, upper):
+        """
+        :param fun: Residual function of the parameter vector (for the fallback).
+        :param x: Point (inside the bounds).
+        :param r0: Residuals at x.
+        :return: Jacobian matrix (len(r0) x len(x)) with respect to x.
+        """
+        if not self.active:
+            return self.fallback(fun, x, r0, lower, upper)
+        try:
+            curves, derivatives = self.simulate(x)
+            jacobian = self.residuals.jacobian(curves, derivatives)
+        except ValueError as e:
+            print(f"DC sensitivities not available ({e}); using {type(self.fallback).__name__} instead.")
+            self.active = False
+            return self.fallback(fun, x, r0, lower, upper)
+        except RuntimeError as e:
+            print(f"Sensitivity run failed ({e}); using {type(self.fallback).__name__} for this iteration.")
+            return self.fallback(fun, x, r0, lower, upper)
+        if jacobian.shape != (len(r0), len(x)) or not np.all(np.isfinite(jacobian)):
+            print(f"Incomplete sensitivities; using {type(self.fallback).__name__} for this iteration.")
+            return self.fallback(fun, x, r0, lower, upper)
+        if not self.checked:
+            reference = self.fallback(fun, x, r0, lower, upper)
+            self.checked = True
+            self.check_error = jacobian_error(jacobian, reference)
+            if self.check_error > self.tolerance:
+                print(f"DC sensitivities differ from {type(self.fallback).__name__} by "
+                      f"{self.check_error:.3g}; using it instead.")
+                self.active = False
+                return reference
+        return jacobian
+
+    def simulate(self, x):
+        """
+        Run the sensitivity analyses at a parameter vector.
+
+        :return: Tuple (curves, derivatives): the simulated curves [(vg, x, current)] and the matching
+                 [(vg, x, d current / d parameters)] with one column per fitted parameter.
+        :raises ValueError: If the netlist cannot be rewritten or a fitted parameter has no sensitivity.
+        :raises RuntimeError: If the run failed.
+        """
+        model = self.model
+        simulator = model.simulator
+        write_model_cards(model.sandbox_root, model.device_type, model.bin_number, model.lib_file_path,
+                          dict(model.base_parameters, **dict(zip(self.names, x))))
+        sweep = dict(model.sweep)
+        W, L = sweep.pop("W", None), sweep.pop("L", None)
+        if model.kind == "iv":
+            netlists = simulator.generator.generate_iv_netlists(device_type=model.device_type,
+                                                                bin_number=model.bin_number, W=W, L=L, **sweep)
+            gate_values = None
+        else:
+            netlists, _ = simulator.generate_family_netlists(model.device_type, model.bin_number, W, L, **sweep)
+            gate_values = simulator.sweep_values(sweep["vg_start"], sweep["vg_stop"], sweep["vg_step"], loop=True)
+        netlist_path = os.path.abspath(netlists["modified"])
+        netlist_dir = os.path.dirname(netlist_path)
+        with open(netlist_path, "r") as f:
+            netlist_text = f.read()
+        output_file = f"{self.tag}.raw"
+        text, points, instance, model_name, source = sens_netlist(netlist_text, output_file, gate_values)
+        sens_path = os.path.join(netlist_dir, f"{os.path.splitext(os.path.basename(netlist_path))[0]}_{self.tag}.spice")
+        with open(sens_path, "w") as f:
+            f.write(text)
+        raw_path = os.path.join(netlist_dir, output_file)
+        # 'appendwrite' appends to the file: a stale copy would shift the plots.
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        self.launches += 1
+        simulator.simulate_netlist(sens_path)
+        if not os.path.exists(raw_path):
+            raise RuntimeError(f"The sensitivity run wrote no {output_file}.")
+
+        plots = read_raw(raw_path, mmap=False)
+        op_plots = [plot for plot in plots if "sens" not in (plot.plotname or "").lower()]
+        sens_plots = [plot for plot in plots if "sens" in (plot.plotname or "").lower()]
+        if len(op_plots) != len(points) or len(sens_plots) != len(points):
+            raise RuntimeError(f"{len(sens_plots)} of {len(points)} sensitivity analyses completed.")
+        current = np.array([float(np.real(plot[f"i({source})"][0])) for plot in op_plots])
+        derivative = np.empty((len(points), len(self.names)))
+        for j, name in enumerate(self.names):
+            candidates = [f"{prefix}{separator}{name}" for prefix in (model_name, instance) for separator in (":", "_")]
+            vector = next((candidate for candidate in candidates if candidate in sens_plots[0]), None)
+            if vector is None:
+                raise ValueError(f"ngspice reports no sensitivity to '{name}'")
+            derivative[:, j] = [float(np.real(plot[vector][0])) for plot in sens_plots]
+
+        curves, derivatives = [], []
+        for vg in (gate_values if gate_values is not None else [None]):
+            rows = [i for i, (point_vg, _) in enumerate(points) if point_vg == vg]
+            x_values = np.array([points[i][1] for i in rows])
+            curves.append((vg, x_values, current[rows]))
+            derivatives.append((vg, x_values, derivative[rows]))
+        return curves, derivatives
@@ -0,0 +1,389 @@
+"""
+IceMOS_sky130_sensitivity.py
+
+This module ranks the parameters of a bin's model card by their effect on the fit error, per operating
+region, so that the tuner starts from the few parameters that matter at 4 K instead of a guess among the
+hundreds of names in the card.
+
+The error of a parameter set is the RMS residual (decades, with the default log residuals) of the
+simulated curves against the lab curves, taken separately over the target points in subthreshold, in
+the linear region and in saturation.
+
+The pieces:
+  - parameter_box: the names and min/max ranges of the numeric parameters of a card, with the tuner's
+    default range (value +/- 50 %) and fixed spans for the temperature coefficients that are zero in
+    the cards.
+  - operating_regions: the region of every target point, from the target curves themselves.
+  - RegionErrors: region errors of many parameter sets. The sets are split into chunks simulated as
+    one batch netlist each (a device copy per set, see IceMOS_sky130_batch_jacobian), and the chunks
+    run in parallel as scheduler jobs, each in its own sandbox folder. Models evaluated in-process
+    (IceMOS_sky130_bsim4.BSIM4Model) are called directly.
+  - morris: elementary effects screening (mu*, mu, sigma) from random one-at-a-time trajectories.
+  - sobol: first-order and total Sobol indices (Saltelli sampling, Jansen estimators).
+  - SensitivityResult: the indices per region, ranking() per region or across regions.
+
+    names, lower, upper = parameter_box(extract_parameters_with_values(lib_file_path))
+    evaluator = RegionErrors(model, CurveResiduals(targets), names, operating_regions(targets, W, L))
+    result = morris(evaluator, lower, upper, trajectories=10, seed=0)
+    print(result.ranking("subthreshold", top=8), result.ranking(top=8))
+"""
+
+import os
+import threading
+import warnings
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+from IceMOS_sky130_batch_jacobian import BatchedJacobian
+from IceMOS_sky130_fitting import SimulatorModel
+from IceMOS_sky130_global_opt import latin_hypercube
+
+REGIONS = ("subthreshold", "linear", "saturation")
+
+# Card entries that are switches, bin limits or bookkeeping rather than fit parameters.
+SKIPPED = {"level", "version", "binunit", "paramchk", "tnom", "lmin", "lmax", "wmin", "wmax", "capmod", "mobmod",
+           "rdsmod", "igcmod", "igbmod", "rbodymod", "trnqsmod", "acnqsmod", "fnoimod", "tnoimod", "diomod",
+           "tempmod", "permod", "geomod", "rgatemod", "mtrlmod", "gidlmod", "type", "toxref", "dmcg", "dmci",
+           "dmdg", "dmcgt", "xgw", "xgl", "ngcon"}
+
+# Ranges of temperature coefficients that the calibrated cards set to zero (their natural scale is
+# unrelated to their value).
+ZERO_SPANS = {"ute": 1.0, "kt1": 0.2, "kt1l": 1e-8, "kt2": 0.05, "at": 5e4, "ua1": 2e-9, "ub1": 2e-18,
+              "uc1": 1e-10, "ud1": 1e-10, "prt": 100.0, "tvoff": 1e-3}
+
+
+def parameter_box(values, names=None, relative=0.5, spans=None):
+    """
+    Ranges of the numeric parameters of a card.
+
+    A non-zero parameter ranges over value * (1 -/+ relative), as in the tuner. A zero parameter is kept
+    only if it has a span (ZERO_SPANS, or the given spans), and ranges over [-span, +span].
+
+    :param values: Dict {name: value} (extract_parameters_with_values(); non-numeric values are skipped).
+    :param names: (Optional) Names to keep; defaults to all the parameters of the card.
+    :param relative: Relative half-width of the ranges.
+    :param spans: (Optional) Dict {name: half-width} overriding ZERO_SPANS.
+    :return: Tuple (names, lower, upper).
+    """
+    spans = dict(ZERO_SPANS, **(spans or {}))
+    kept, lower, upper = [], [], []
+    for name in (names if names is not None else sorted(values)):
+        value = values.get(name)
+        if name.lower() in SKIPPED or isinstance(value, str) or value is None:
+            continue
+        value = float(value)
+        if value != 0.0:
+            low, high = sorted((value * (1.0 - relative), value * (1.0 + relative)))
+        elif name in spans:
+            low, high = -spans[name], spans[name]
+        else:
+            continue
+        kept.append(name)
+        lower.append(low)
+        upper.append(high)
+    return kept, np.array(lower), np.array(upper)
+
+
+def operating_regions(targets, W, L, current_threshold=None, linear_ratio=0.5):
+    """
+    Operating region of every target point.
+
+    A point is in subthreshold below the constant-current threshold criterion (every point of an output
+    curve whose largest current stays below it). Above threshold, ID vs VG points (drain at 1.8 V) are in
+    saturation, and output curve points are linear where the drain conductance still carries the current
+    (gds * VD / ID >= linear_ratio) and in saturation beyond.
+
+    :param targets: List of (vg, x, y) target curves, vg None for ID vs VG curves.
+    :param W: Device width in µm.
+    :param L: Device length in µm.
+    :param current_threshold: Threshold current in A; defaults to 100 nA * W / L.
+    :param linear_ratio: Boundary of gds * VD / ID between the linear region and saturation.
+    :return: List of arrays of region names, one per target curve.
+    """
+    if current_threshold is None:
+        current_threshold = 1e-7 * W / L
+    regions = []
+    for vg, x, y in targets:
+        x = np.asarray(x, dtype=float)
+        current = np.abs(np.asarray(y, dtype=float))
+        labels = np.full(len(x), "saturation", dtype=object)
+        if vg is None:
+            labels[current < current_threshold] = "subthreshold"
+        elif np.nanmax(current, initial=0.0) < current_threshold:
+            labels[:] = "subthreshold"
+        elif len(x) > 1:
+            order = np.argsort(x)
+            gds = np.empty(len(x))
+            gds[order] = np.gradient(current[order], x[order])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = gds * x / current
+            labels[(ratio >= linear_ratio) | (x <= 0.0)] = "linear"
+        regions.append(labels)
+    return regions
+
+
+class RegionErrors:
+    """
+    Region errors of parameter sets, simulated in parallel batches.
+    """
+
+    def __init__(self, model, residuals, names, regions, scheduler=None, slots=None, chunk=25, priority="batch",
+                 owner=None):
+        """
+        :param model: SimulatorModel of the fit (its settings are copied for every slot), or a model
+                      evaluated in-process (parameters -> curves).
+        :param residuals: CurveResiduals of the target curves.
+        :param names: Names of the parameters, in the order of the parameter vectors.
+        :param regions: Region names of the target points (operating_regions()).
+        :param scheduler: (Optional) SimulationScheduler; defaults to the shared one.
+        :param slots: Number of sandbox folders; defaults to the scheduler's number of workers.
+        :param chunk: Parameter sets per batch netlist.
+        :param priority: Scheduler priority class of the jobs.
+        :param owner: Scheduler owner of the jobs (one per analysis by default).
+        """
+        self.model = model
+        self.residuals = residuals
+        self.names = list(names)
+        self.regions = [np.asarray(labels, dtype=object) for labels in regions]
+        self.chunk = max(int(chunk), 1)
+        self.priority = priority
+        self.owner = owner or f"sensitivity-{id(self)}"
+        self.evaluations = 0
+        self._indices = None
+        self.models = []
+        if isinstance(model, SimulatorModel):
+            from IceMOS_sky130_scheduler import default_scheduler
+            self.scheduler = scheduler or default_scheduler()
+            slots = slots or self.scheduler.max_workers
+            self.models = [SimulatorModel(model.original_model_file, model.device_type, model.bin_number,
+                                          model.lib_file_path, model.kind, model.sweep,
+                                          base_parameters=model.base_parameters,
+                                          sandbox_root=os.path.join(model.sandbox_root, f"slot_{k}"),
+                                          simulator_options=model.simulator_options)
+                           for k in range(slots)]
+            self.batches = [BatchedJacobian(slot, residuals, self.names, tag="sensitivity") for slot in self.models]
+        self._lock = threading.Lock()
+
+    def _simulate(self, slot, points):
+        try:
+            return self.batches[slot].simulate(points)
+        except ValueError as e:
+            print(f"Batch simulation not possible ({e}); simulating the parameter sets one by one.")
+            return [self.models[slot](dict(zip(self.names, x))) for x in points]
+
+    def _errors(self, curves):
+        with self._lock:
+            r = np.asarray(self.residuals(curves), dtype=float)
+            if self._indices is None:
+                masks = self.residuals.target_masks(curves)
+                labels = np.concatenate([labels[mask] for labels, mask in zip(self.regions, masks)])
+                self._indices = [np.flatnonzero(labels == region) for region in REGIONS]
+        return np.array([np.sqrt(np.mean(r[index] ** 2)) if len(index) else np.nan for index in self._indices])
+
+    def __call__(self, points):
+        """
+        :param points: Parameter vectors (parameter units).
+        :return: Array (number of points x len(REGIONS)) of RMS residuals; NaN where a simulation failed
+                 or a region has no target point.
+        """
+        points = [np.asarray(x, dtype=float) for x in points]
+        errors = np.full((len(points), len(REGIONS)), np.nan)
+        if not self.models:
+            for i, x in enumerate(points):
+                try:
+                    errors[i] = self._errors(self.model(dict(zip(self.names, x))))
+                except (RuntimeError, ValueError, OSError) as e:
+                    print(f"Parameter set evaluation failed: {e!r}")
+            self.evaluations += len(points)
+            return errors
+        starts = range(0, len(points), self.chunk)
+        jobs = [self.scheduler.submit(self._simulate, k % len(self.models), points[start:start + self.chunk],
+                                      priority=self.priority, owner=self.owner,
+                                      resource=(self.owner, k % len(self.models)))
+                for k, start in enumerate(starts)]
+        for start, job in zip(starts, jobs):
+            try:
+                curves = job.result()
+            except (RuntimeError, ValueError, OSError, CancelledError) as e:
+                # The rows of a failed or cancelled chunk stay NaN; the analysis goes on.
+                print(f"Batch simulation failed: {e!r}")
+                continue
+            for i, candidate in enumerate(curves):
+                try:
+                    errors[start + i] = self._errors(candidate)
+                except ValueError as e:
+                    print(f"Parameter set evaluation failed: {e!r}")
+        self.evaluations += len(points)
+        return errors
+
+
+class SensitivityResult:
+    """
+    Sensitivity indices of the parameters, per region.
+
+    :ivar indices: Dict {measure: array (number of parameters x number of regions)}; 'mu_star', 'mu' and
+                   'sigma' for Morris, 'S1' and 'ST' for Sobol.
+    """
+
+    def __init__(self, method, names, indices, evaluations, regions=REGIONS):
+        self.method = method
+        self.names = list(names)
+        self.indices = indices
+        self.evaluations = evaluations
+        self.regions = tuple(regions)
+
+    @property
+    def measure(self):
+        """Measure used for ranking: mu* for Morris, the total index for Sobol."""
+        return "mu_star" if self.method == "morris" else "ST"
+
+    def scores(self, region=None):
+        """
+        :param region: Region name, or None for all regions: the largest index of each parameter over the
+                       regions, every region normalised by its largest index.
+        :return: Array of scores, one per parameter (NaN for an empty region).
+        """
+        values = self.indices[self.measure]
+        if region is not None:
+            return values[:, self.regions.index(region)]
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            normalised = values / np.nanmax(values, axis=0)
+        normalised = normalised[:, np.any(np.isfinite(normalised), axis=0)]
+        if normalised.shape[1] == 0:
+            return np.full(len(self.names), np.nan)
+        return np.nanmax(np.where(np.isfinite(normalised), normalised, -np.inf), axis=1)
+
+    def ranking(self, region=None, top=None):
+        """
+        :param region: Region name, or None to rank across the regions (see scores()).
+        :param top: (Optional) Number of names to return.
+        :return: Parameter names, most influential first.
+        """
+        scores = np.nan_to_num(self.scores(region), nan=-np.inf)
+        order = sorted(range(len(self.names)), key=lambda j: -scores[j])
+        return [self.names[j] for j in order[:top]]
+
+    def describe(self):
+        return f"{self.method} over {len(self.names)} parameters, {self.evaluations} simulations"
+
+    def __repr__(self):
+        return f"SensitivityResult({self.describe()})"
+
+
+def _evaluate(evaluator, points, progress, block):
+    """Evaluate in blocks, reporting progress(done, total) after each; a True return value cancels."""
+    outputs = []
+    for start in range(0, len(points), block):
+        outputs.append(np.asarray(evaluator(points[start:start + block]), dtype=float))
+        if progress is not None and progress(min(start + block, len(points)), len(points)):
+            raise RuntimeError("Sensitivity analysis cancelled.")
+    return np.concatenate(outputs)
+
+
+def _bounds(lower, upper):
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    if lower.shape != upper.shape or np.any(upper <= lower):
+        raise ValueError("Every parameter needs a range with max > min.")
+    return lower, upper
+
+
+def morris(evaluator, lower, upper, names=None, trajectories=10, levels=4, seed=None, progress=None, block=None):
+    """
+    Morris elementary effects screening.
+
+    Each trajectory starts on a random point of a grid of `levels` levels per parameter and moves the
+    parameters one at a time, in random order, by levels / (2 (levels - 1)) of their range. It costs
+    trajectories * (number of parameters + 1) evaluations.
+
+    :param evaluator: Callable (list of parameter vectors) -> array (points x outputs), e.g. RegionErrors.
+    :param lower: Lower bounds of the parameters.
+    :param upper: Upper bounds of the parameters.
+    :param names: (Optional) Parameter names; defaults to the evaluator's.
+    :param trajectories: Number of trajectories.
+    :param levels: Number of grid levels (even).
+    :param seed: Seed of the random generator.
+    :param progress: (Optional) Called as progress(done, total) after every block of evaluations;
+                     returning True cancels the analysis (RuntimeError).
+    :param block: Evaluations per evaluator call; defaults to one trajectory.
+    :return: SensitivityResult with 'mu_star', 'mu' and 'sigma' in units of the outputs per full range.
+    """
+    lower, upper = _bounds(lower, upper)
+    k = len(lower)
+    rng = np.random.default_rng(seed)
+    delta = levels / (2.0 * (levels - 1))
+    units, steps = [], []
+    for _ in range(trajectories):
+        x = rng.integers(0, levels, k) / (levels - 1)
+        step = np.where(x + delta <= 1.0 + 1e-12, delta, -delta)
+        order = rng.permutation(k)
+        path = [x.copy()]
+        for j in order:
+            x = x.copy()
+            x[j] += step[j]
+            path.append(x)
+        units.append(np.array(path))
+        steps.append((order, step[order]))
+    points = lower + np.concatenate(units) * (upper - lower)
+    outputs = _evaluate(evaluator, list(points), progress, block or k + 1)
+    effects = np.full((trajectories, k, outputs.shape[1]), np.nan)
+    for t, (order, step) in enumerate(steps):
+        f = outputs[t * (k + 1):(t + 1) * (k + 1)]
+        effects[t, order] = (f[1:] - f[:-1]) / step[:, None]
+    with warnings.catch_warnings():
+        # Empty regions give all-NaN columns.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        indices = {"mu_star": np.nanmean(np.abs(effects), axis=0), "mu": np.nanmean(effects, axis=0),
+                   "sigma": np.nanstd(effects, axis=0, ddof=1) if trajectories > 1 else np.zeros(effects.shape[1:])}
+    return SensitivityResult("morris", names if names is not None else evaluator.names, indices, len(points))
+
+
+def sobol(evaluator, lower, upper, names=None, samples=64, seed=None, progress=None, block=None):
+    """
+    First-order and total Sobol indices.
+
+    Two Latin hypercube matrices A and B of `samples` rows and, per parameter, A with that column taken
+    from B: samples * (number of parameters + 2) evaluations. S1 and ST follow Saltelli (2010) and
+    Jansen; failed evaluations are left out of each estimate.
+
+    :param evaluator: Callable (list of parameter vectors) -> array (points x outputs), e.g. RegionErrors.
+    :param lower: Lower bounds of the parameters.
+    :param upper: Upper bounds of the parameters.
+    :param names: (Optional) Parameter names; defaults to the evaluator's.
+    :param samples: Rows of A and B.
+    :param seed: Seed of the random generator.
+    :param progress: (Optional) Called as progress(done, total) after every block of evaluations;
+                     returning True cancels the analysis (RuntimeError).
+    :param block: Evaluations per evaluator call; defaults to `samples`.
+    :return: SensitivityResult with 'S1' and 'ST'.
+    """
+    lower, upper = _bounds(lower, upper)
+    k = len(lower)
+    rng = np.random.default_rng(seed)
+    A = latin_hypercube(samples, k, rng)
+    B = latin_hypercube(samples, k, rng)
+    blocks = [A, B]
+    for j in range(k):
+        AB = A.copy()
+        AB[:, j] = B[:, j]
+        blocks.append(AB)
+    points = lower + np.concatenate(blocks) * (upper - lower)
+    outputs = _evaluate(evaluator, list(points), progress, block or samples).reshape(k + 2, samples, -1)
+    fA, fB = outputs[0], outputs[1]
+    S1 = np.full((k, fA.shape[1]), np.nan)
+    ST = np.full((k, fA.shape[1]), np.nan)
+    for m in range(fA.shape[1]):
+        both = np.isfinite(fA[:, m]) & np.isfinite(fB[:, m])
+        variance = np.var(np.concatenate([fA[both, m], fB[both, m]])) if both.sum() > 1 else 0.0
+        if variance <= 0.0:
+            continue
+        for j in range(k):
+            fAB = outputs[2 + j, :, m]
+            valid = both & np.isfinite(fAB)
+            if valid.any():
+                S1[j, m] = np.mean(fB[valid, m] * (fAB[valid] - fA[valid, m])) / variance
+                ST[j, m] = 0.5 * np.mean((fA[valid, m] - fAB[valid]) ** 2) / variance
+    return SensitivityResult("sobol", names if names is not None else evaluator.names, {"S1": S1, "ST": ST},
+                             len(points))
+
@@ -0,0 +1,231 @@
+"""
+IceMOS_sky130_shm_transport.py
+
+This module moves simulation results between worker processes and the GUI through
+multiprocessing.shared_memory instead of pickling the arrays.
+
+The parent allocates a block for every result in a SharedArrayPool and sends the worker
+a SharedArrayHandle (block name, shape, dtype and metadata, a few hundred bytes). The worker
+writes its result straight into the block and returns the handle. The parent then maps the
+same buffer as a NumPy array without copying it. The pool counts the references to each
+block and unlinks it when the last one is released.
+
+This is the transport for a process pool; the SimulationScheduler runs its jobs on threads,
+which share the results directly, so nothing in the package uses it yet.
+
+Typical use, every worker simulating in its own circuit root:
+
+    pool = SharedArrayPool()
+    handle = pool.allocate((n_vg, n_vd), metadata={"device": "nch", "bin": 40})
+    handle = executor.submit(iv_vds_worker, handle, model_file, "nch", sweep_kwargs, worker_root).result()
+    with pool.borrow(handle) as currents:
+        plot(currents)
+    pool.release(handle)
+"""
+
+import contextlib
+import sys
+import threading
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrayHandle:
+    """
+    Picklable description of an array stored in a shared memory block.
+
+    :ivar name: Name of the shared memory block.
+    :ivar shape: Array shape.
+    :ivar dtype: Array dtype string (e.g. '<f8').
+    :ivar metadata: Dict of small JSON-like values describing the result (axes, units, device, ...).
+    """
+
+    def __init__(self, name, shape, dtype, metadata=None):
+        self.name = name
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype).str
+        self.metadata = dict(metadata or {})
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+    def __repr__(self):
+        return f"SharedArrayHandle(name={self.name!r}, shape={self.shape}, dtype={self.dtype!r})"
+
+
+def _attach_block(name):
+    """
+    Attach to an existing block without registering it with this process's resource tracker,
+    so a worker exiting does not unlink a block the parent still owns.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, "shared_memory")
+    except Exception:
+        pass
+    return block
+
+
+@contextlib.contextmanager
+def open_shared_array(handle):
+    """
+    Map the array of a handle in the current process (typically a worker) for writing.
+
+    The block stays owned by the pool that allocated it; closing the mapping here does not free it.
+
+    :param handle: SharedArrayHandle received from the parent.
+    :return: Context manager yielding the NumPy array view.
+    """
+    block = _attach_block(handle.name)
+    try:
+        array = np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf)
+        yield array
+        del array
+    finally:
+        block.close()
+
+
+class SharedArrayPool:
+    """
+    Reference-counted set of shared memory blocks owned by the current (parent) process.
+    """
+
+    def __init__(self, prefix="icemos"):
+        """
+        :param prefix: Prefix of the block names (helps to spot leaked blocks in /dev/shm).
+        """
+        self.prefix = prefix
+        self._blocks = {}
+        self._refcounts = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, shape, dtype=np.float64, metadata=None, fill=np.nan):
+        """
+        Create a block for an array and hold one reference to it.
+
+        :param shape: Array shape.
+        :param dtype: Array dtype.
+        :param metadata: (Optional) Dict stored in the handle.
+        :param fill: Initial value (NaN by default, so unfinished points are visible as such).
+        :return: SharedArrayHandle.
+        """
+        name = f"{self.prefix}_{uuid.uuid4().hex[:16]}"
+        handle = SharedArrayHandle(name, shape, dtype, metadata)
+        block = shared_memory.SharedMemory(name=name, create=True, size=max(handle.nbytes, 1))
+        if fill is not None:
+            np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf).fill(fill)
+        with self._lock:
+            self._blocks[name] = block
+            self._refcounts[name] = 1
+        return handle
+
+    def attach(self, handle):
+        """
+        Map the array of a handle without copying it and take a reference.
+
+        :return: NumPy array backed by the shared block. Call release() when done with it.
+        """
+        with self._lock:
+            if handle.name not in self._blocks:
+                raise KeyError(f"Shared block {handle.name} is not owned by this pool (or was released).")
+            self._refcounts[handle.name] += 1
+            block = self._blocks[handle.name]
+        return np.ndarray(handle.shape, dtype=handle.dtype, buffer=block.buf)
+
+    @contextlib.contextmanager
+    def borrow(self, handle):
+        """
+        Context manager around attach()/release().
+        """
+        array = self.attach(handle)
+        try:
+            yield array
+        finally:
+            del array
+            self.release(handle)
+
+    def retain(self, handle):
+        """Take an extra reference (e.g. when a second window shows the same result)."""
+        with self._lock:
+            self._refcounts[handle.name] += 1
+
+    def release(self, handle):
+        """
+        Drop a reference; the block is unlinked when no reference is left.
+
+        Arrays returned by attach() must not be used after their reference is released.
+        """
+        with self._lock:
+            if handle.name not in self._refcounts:
+                return
+            self._refcounts[handle.name] -= 1
+            if self._refcounts[handle.name] > 0:
+                return
+            del self._refcounts[handle.name]
+            block = self._blocks.pop(handle.name)
+        try:
+            block.close()
+        except BufferError:
+            # A view is still alive somewhere; the mapping goes away with it.
+            pass
+        block.unlink()
+
+    def refcount(self, handle):
+        with self._lock:
+            return self._refcounts.get(handle.name, 0)
+
+    def close(self):
+        """Unlink every block still owned by the pool."""
+        with self._lock:
+            blocks = list(self._blocks.values())
+            self._blocks.clear()
+            self._refcounts.clear()
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass
+            block.unlink()
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+def iv_vds_worker(handle, original_model_file, device_type, sweep_kwargs, circuit_root, simulator_options=None):
+    """
+    Worker entry point: simulate a gate-sweep family and write the currents into a shared block.
+
+    The block must have shape (number of gate values, number of drain points). Only the handle
+    travels back to the parent; its metadata is updated with the gate and drain axes.
+
+    :param handle: SharedArrayHandle allocated by the parent.
+    :param original_model_file: Path to the original SPICE model file.
+    :param device_type: 'nch' or 'pch'.
+    :param sweep_kwargs: Keyword arguments of IceMOS_simulator_sky130.iv_vds_curves().
+    :param circuit_root: Circuit root of this worker, holding the model card of the bin. Workers running
+                         at the same time need different roots, or they overwrite each other's netlists
+                         and results.
+    :param simulator_options: (Optional) Extra keyword arguments for IceMOS_simulator_sky130.
+    :return: The handle, with metadata {"vg": [...], "vd": [...], "run_status": ...}.
+    :raises ValueError: If the simulated family does not have the shape of the block.
+    """
+    from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+    simulator = IceMOS_simulator_sky130(original_model_file, circuit_root=circuit_root, **(simulator_options or {}))
+    result = simulator.iv_vds_curves(device_type, **sweep_kwargs)
+    current = result.current.values
+    if current.shape != handle.shape:
+        raise ValueError(f"Simulated currents of shape {current.shape} do not fit the shared block of shape "
+                         f"{handle.shape}.")
+    with open_shared_array(handle) as out:
+        out[...] = current
+    handle.metadata["vg"] = result.bias.values.tolist()
+    handle.metadata["vd"] = result.sweep.values.tolist()
+    handle.metadata["run_status"] = "cached" if result.metadata.get("cache_hit") else result.metadata.get("status")
+    return handle
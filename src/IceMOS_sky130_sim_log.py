@@ -0,0 +1,203 @@
+"""
+IceMOS_sky130_sim_log.py
+
+This module captures the output of an ngspice job while it runs.
+
+Every line is streamed to a rotating per-job log file, only a bounded tail is kept in
+memory, and progress markers are parsed on the fly:
+  - the 'Sweeping VGS = ...' echo lines of the gate-sweep netlists (one per curve),
+  - the 'Reference value : ...' lines ngspice prints while a dc sweep advances,
+  - the 'No. of Data Rows : N' line ngspice prints when an analysis finishes.
+
+The parsed state is exposed as a SimulationProgress (fraction done and ETA) that the GUI
+and the batch loops can show.
+"""
+
+import collections
+import os
+import re
+import threading
+import time
+
+
+SWEEP_ECHO_PATTERN = re.compile(r"Sweeping\s+(V\w+)\s*=\s*([-+\d.eE]+)")
+REFERENCE_VALUE_PATTERN = re.compile(r"Reference value\s*:\s*([-+\d.eE]+)")
+DATA_ROWS_PATTERN = re.compile(r"No\. of Data Rows\s*:\s*(\d+)")
+
+
+class SimulationProgress:
+    """
+    Snapshot of the progress of one simulation job.
+
+    :ivar completed_analyses: Number of analyses (dc sweeps) that have finished.
+    :ivar total_analyses: Expected number of analyses (None if unknown).
+    :ivar points_done: Sweep points finished in the analysis currently running.
+    :ivar points_per_analysis: Expected points per analysis (None if unknown).
+    :ivar label: Last progress marker seen (e.g. "VGS = 0.6").
+    :ivar elapsed: Seconds since the job started.
+    """
+
+    def __init__(self, completed_analyses=0, total_analyses=None, points_done=0,
+                 points_per_analysis=None, label="", elapsed=0.0):
+        self.completed_analyses = completed_analyses
+        self.total_analyses = total_analyses
+        self.points_done = points_done
+        self.points_per_analysis = points_per_analysis
+        self.label = label
+        self.elapsed = elapsed
+
+    @property
+    def fraction(self):
+        """Fraction of the job completed (0..1), or None if the job size is unknown."""
+        if not self.total_analyses:
+            return None
+        partial = 0.0
+        if self.points_per_analysis:
+            partial = min(self.points_done / self.points_per_analysis, 1.0)
+        done = (self.completed_analyses + partial) / self.total_analyses
+        return min(done, 1.0)
+
+    @property
+    def eta(self):
+        """Estimated seconds remaining, or None until some progress has been made."""
+        fraction = self.fraction
+        if not fraction:
+            return None
+        return self.elapsed * (1.0 - fraction) / fraction
+
+    def describe(self):
+        """Short human readable summary, e.g. '42% (VGS = 0.6) ETA 3.1 s'."""
+        parts = []
+        fraction = self.fraction
+        if fraction is not None:
+            parts.append(f"{100 * fraction:.0f}%")
+        else:
+            parts.append(f"{self.completed_analyses} analyses")
+        if self.label:
+            parts.append(f"({self.label})")
+        eta = self.eta
+        if eta is not None:
+            parts.append(f"ETA {eta:.1f} s")
+        return " ".join(parts)
+
+    def __repr__(self):
+        return f"SimulationProgress({self.describe()})"
+
+
+class SimulationLogCapture:
+    """
+    Stream the lines of a simulation job to a rotating log file, keep a bounded tail in
+    memory and parse progress markers.
+
+    feed() may be called from the threads reading stdout and stderr; progress() and the
+    tail accessors are safe to call from any thread.
+    """
+
+    def __init__(self, log_path, max_bytes=5 * 1024 * 1024, backup_count=3, tail_lines=200,
+                 total_analyses=None, points_per_analysis=None, error_pattern=None):
+        """
+        :param log_path: Path of the per-job log file (its folder is created if needed).
+        :param max_bytes: Size at which the log file is rotated to log_path.1, log_path.2, ...
+        :param backup_count: Number of rotated files to keep.
+        :param tail_lines: Number of lines kept in memory.
+        :param total_analyses: Expected number of analyses in the job (for the fraction and ETA).
+        :param points_per_analysis: Expected sweep points in each analysis.
+        :param error_pattern: (Optional) Compiled regex; matching lines are counted in error_lines.
+        """
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.error_pattern = error_pattern
+        self.error_lines = []
+        self._tail = {"stdout": collections.deque(maxlen=tail_lines),
+                      "stderr": collections.deque(maxlen=tail_lines)}
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._progress = SimulationProgress(total_analyses=total_analyses,
+                                            points_per_analysis=points_per_analysis)
+        self._version = 0
+
+        log_dir = os.path.dirname(log_path)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self._file = open(log_path, 'a')
+        self._bytes = self._file.tell()
+
+    def write_header(self, text):
+        with self._lock:
+            self._write(f"==== {text} ({time.strftime('%Y-%m-%d %H:%M:%S')}) ====\n")
+
+    def feed(self, stream, line):
+        """
+        Record one line of output.
+
+        :param stream: 'stdout' or 'stderr'.
+        :param line: The line (with or without its trailing newline).
+        """
+        line = line.rstrip("\r\n")
+        with self._lock:
+            self._write(f"[{stream}] {line}\n")
+            self._tail[stream].append(line)
+            if self.error_pattern is not None and self.error_pattern.search(line):
+                if len(self.error_lines) < 100:
+                    self.error_lines.append(line)
+            self._parse_progress(line)
+
+    def _parse_progress(self, line):
+        m = SWEEP_ECHO_PATTERN.search(line)
+        if m:
+            self._progress.label = f"{m.group(1)} = {m.group(2)}"
+            self._progress.points_done = 0
+            self._version += 1
+            return
+        m = REFERENCE_VALUE_PATTERN.search(line)
+        if m:
+            self._progress.points_done += 1
+            self._version += 1
+            return
+        m = DATA_ROWS_PATTERN.search(line)
+        if m:
+            self._progress.completed_analyses += 1
+            self._progress.points_done = 0
+            self._version += 1
+
+    def _write(self, text):
+        data_len = len(text.encode('utf-8', errors='replace'))
+        if self.max_bytes and self._bytes + data_len > self.max_bytes and self._bytes > 0:
+            self._rotate()
+        self._file.write(text)
+        self._bytes += data_len
+
+    def _rotate(self):
+        self._file.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = f"{self.log_path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.log_path}.{i + 1}")
+            os.replace(self.log_path, f"{self.log_path}.1")
+            self._file = open(self.log_path, 'w')
+        else:
+            self._file = open(self.log_path, 'w')
+        self._bytes = 0
+
+    def progress(self):
+        """
+        :return: Tuple (version, SimulationProgress copy). The version increases whenever a marker is parsed.
+        """
+        with self._lock:
+            p = self._progress
+            snapshot = SimulationProgress(p.completed_analyses, p.total_analyses, p.points_done,
+                                          p.points_per_analysis, p.label, time.monotonic() - self._start)
+            return self._version, snapshot
+
+    def tail(self, stream="stdout"):
+        """:return: The last lines of the given stream, joined with newlines."""
+        with self._lock:
+            return "\n".join(self._tail[stream])
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._file.close()
@@ -0,0 +1,450 @@
+"""
+IceMOS_sky130_sim_runner.py
+
+This module runs ngspice batch jobs under a watchdog.
+
+Every job is started in its own process group so that a hung simulation (and any
+child it spawned) can be killed cleanly once it exceeds its wall-clock budget.
+An optional address-space limit protects the host from runaway memory use.
+
+When a run fails to converge (or hangs), the runner walks a retry ladder: each rung
+re-writes the netlist next to the original with extra convergence options (gmin
+stepping, source stepping, relaxed tolerances and finally a smaller sweep step) and
+tries again. The rung that succeeded is recorded in the returned SimulationRunResult.
+
+A process observer can be installed for the current thread (see set_process_observer); it is
+told when each ngspice process starts and ends, which lets a scheduler suspend and resume the
+process group of a low-priority job. Time spent suspended does not count towards the timeout.
+"""
+
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from IceMOS_sky130_sim_log import SimulationLogCapture
+
+try:
+    import resource
+except ImportError:  # resource is POSIX only
+    resource = None
+
+
+# Messages printed by ngspice when an analysis did not converge. ngspice also prints most of them on its way
+# to a solution found by a later homotopy (e.g. 'gmin stepping failed' before source stepping succeeds), so
+# they only make a run a convergence failure when the analysis was aborted (see ANALYSIS_ABORTED_PATTERN).
+CONVERGENCE_ERROR_PATTERN = re.compile(
+    r"(no convergence|timestep too small|gmin stepping failed|source stepping failed|"
+    r"singular matrix|iteration limit reached|simulation\(s\) aborted)",
+    re.IGNORECASE,
+)
+
+# Messages printed by ngspice when it gave up on an analysis.
+ANALYSIS_ABORTED_PATTERN = re.compile(r"(simulation\(s\) aborted|doAnalyses\b.*\bno convergence)", re.IGNORECASE)
+
+# Messages that mean an allocation failed, whatever the exit status.
+MEMORY_ERROR_PATTERN = re.compile(r"(out of memory|cannot allocate|can't allocate|bad_alloc)", re.IGNORECASE)
+
+# Allocation errors that only mean the memory limit was hit when the process was killed by SIGKILL or SIGSEGV.
+ALLOCATION_ERROR_PATTERN = re.compile(r"\b[mcr]?alloc\w*\b.*\b(fail\w*|error)\b", re.IGNORECASE)
+
+# Matches the dc analysis lines of the control blocks: dc <source> <start> <stop> <step>
+DC_COMMAND_PATTERN = re.compile(
+    r"^(\s*dc\s+\S+\s+)(\S+)(\s+)(\S+)(\s+)(\S+)(.*)$",
+    re.IGNORECASE,
+)
+
+# Each rung is cumulative: it keeps the options of the rungs before it.
+RETRY_LADDER = [
+    {"name": "default", "options": [], "step_scale": 1.0},
+    {"name": "gmin_stepping",
+     "options": [".option gminsteps=100 gmin=1e-10"],
+     "step_scale": 1.0},
+    {"name": "source_stepping",
+     "options": [".option gminsteps=100 gmin=1e-10",
+                 ".option srcsteps=100"],
+     "step_scale": 1.0},
+    {"name": "relaxed_reltol",
+     "options": [".option gminsteps=100 gmin=1e-10",
+                 ".option srcsteps=100",
+                 ".option reltol=1e-2 abstol=1e-10 vntol=1e-4 itl1=500 itl2=200"],
+     "step_scale": 1.0},
+    {"name": "smaller_step",
+     "options": [".option gminsteps=100 gmin=1e-10",
+                 ".option srcsteps=100",
+                 ".option reltol=1e-2 abstol=1e-10 vntol=1e-4 itl1=500 itl2=200"],
+     "step_scale": 0.5},
+]
+
+
+_observer_state = threading.local()
+
+
+def set_process_observer(observer):
+    """
+    Install the process observer of the current thread (None removes it).
+
+    The observer must provide process_started(process), process_finished(process) and
+    suspended_seconds() (total time its processes spent suspended, in seconds).
+    """
+    _observer_state.observer = observer
+
+
+def current_process_observer():
+    """:return: The process observer of the current thread, or None."""
+    return getattr(_observer_state, "observer", None)
+
+
+class SimulationRunResult:
+    """
+    Outcome of one ngspice job (after the retry ladder, if any).
+
+    :ivar netlist_path: Absolute path of the netlist that was requested.
+    :ivar status: 'ok', 'convergence', 'timeout', 'memory' or 'failed'.
+    :ivar returncode: Exit code of the last attempt (None if it was killed by the watchdog).
+    :ivar stdout: Tail of the stdout of the last attempt (the full output is in log_path).
+    :ivar stderr: Tail of the stderr of the last attempt.
+    :ivar log_path: Rotating log file holding the complete output of every attempt.
+    :ivar elapsed: Total wall-clock time spent on all attempts, in seconds.
+    :ivar rung: Name of the retry rung that succeeded (None if every rung failed).
+    :ivar attempts: List of (rung name, status, elapsed) tuples, one per attempt.
+    """
+
+    def __init__(self, netlist_path):
+        self.netlist_path = netlist_path
+        self.status = "failed"
+        self.returncode = None
+        self.stdout = ""
+        self.stderr = ""
+        self.log_path = None
+        self.elapsed = 0.0
+        self.rung = None
+        self.attempts = []
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+    def __repr__(self):
+        return (f"SimulationRunResult(status={self.status!r}, rung={self.rung!r}, "
+                f"returncode={self.returncode}, elapsed={self.elapsed:.2f}s)")
+
+
+class NgspiceRunner:
+    """
+    Run ngspice in batch mode with a wall-clock timeout, a memory limit and a convergence retry ladder.
+    """
+
+    def __init__(self, executable="ngspice", timeout=600, max_memory_mb=None,
+                 retry_ladder=None, retry_on_timeout=True, kill_grace=2.0, verbose=True,
+                 log_dir=None, log_max_bytes=5 * 1024 * 1024, log_backup_count=3, tail_lines=200):
+        """
+        :param executable: ngspice executable to launch.
+        :param timeout: Wall-clock limit in seconds for every attempt (None disables it).
+        :param max_memory_mb: Address-space limit in MiB for the ngspice process (None disables it, POSIX only).
+        :param retry_ladder: List of rungs (see RETRY_LADDER). Pass [RETRY_LADDER[0]] to disable retries.
+        :param retry_on_timeout: If True, an attempt that hits the timeout moves on to the next rung.
+        :param kill_grace: Seconds to wait after SIGTERM before the process group is sent SIGKILL.
+        :param verbose: Print a progress line and the tail of the ngspice output.
+        :param log_dir: Folder for the per-job log files (default: a 'logs' folder next to the netlist).
+        :param log_max_bytes: Size at which a job's log file is rotated.
+        :param log_backup_count: Number of rotated log files kept per job.
+        :param tail_lines: Number of stdout/stderr lines kept in memory per attempt.
+        """
+        self.executable = executable
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.retry_ladder = RETRY_LADDER if retry_ladder is None else retry_ladder
+        self.retry_on_timeout = retry_on_timeout
+        self.kill_grace = kill_grace
+        self.verbose = verbose
+        self.log_dir = log_dir
+        self.log_max_bytes = log_max_bytes
+        self.log_backup_count = log_backup_count
+        self.tail_lines = tail_lines
+
+    def log_path_for(self, netlist_path):
+        """:return: Path of the rotating log file used for the given netlist."""
+        log_dir = self.log_dir or os.path.join(os.path.dirname(os.path.abspath(netlist_path)), "logs")
+        base = os.path.splitext(os.path.basename(netlist_path))[0]
+        return os.path.join(log_dir, f"{base}.log")
+
+    def run(self, netlist_path, progress_callback=None, total_analyses=None, points_per_analysis=None,
+            expected_outputs=None):
+        """
+        Simulate a netlist, climbing the retry ladder until one rung succeeds.
+
+        An attempt that exits cleanly is a convergence failure only if ngspice reports an aborted analysis
+        or an expected output is missing or short; convergence warnings it recovered from are ignored.
+
+        :param netlist_path: Path to the netlist file to simulate.
+        :param progress_callback: (Optional) Called with a SimulationProgress whenever a progress marker
+                                  is parsed. It is called from the thread that called run().
+        :param total_analyses: (Optional) Number of dc analyses the netlist runs (used for the ETA).
+        :param points_per_analysis: (Optional) Number of sweep points in each analysis.
+        :param expected_outputs: (Optional) List of dicts {"path", "sweep", "columns"} describing the wrdata
+                                 CSV files the netlist writes (path relative to the netlist folder). Stale
+                                 copies are removed before each attempt.
+        :return: SimulationRunResult describing the last attempt and the rung that succeeded.
+        """
+        netlist_path = os.path.abspath(netlist_path)
+        netlist_dir = os.path.dirname(netlist_path)
+        result = SimulationRunResult(netlist_path)
+        result.log_path = self.log_path_for(netlist_path)
+        for index, rung in enumerate(self.retry_ladder):
+            if index == 0 and not rung["options"] and rung.get("step_scale", 1.0) == 1.0:
+                attempt_path = netlist_path
+            else:
+                attempt_path = self._write_rung_netlist(netlist_path, rung)
+            capture = SimulationLogCapture(result.log_path, max_bytes=self.log_max_bytes,
+                                           backup_count=self.log_backup_count, tail_lines=self.tail_lines,
+                                           total_analyses=total_analyses, points_per_analysis=points_per_analysis,
+                                           error_pattern=CONVERGENCE_ERROR_PATTERN)
+            capture.write_header(f"attempt '{rung['name']}': {attempt_path}")
+            for output in expected_outputs or []:
+                output_path = os.path.join(netlist_dir, output["path"])
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            try:
+                status, returncode, elapsed = self.run_once(attempt_path, capture, progress_callback,
+                                                            expected_outputs)
+            finally:
+                capture.close()
+                if attempt_path != netlist_path and os.path.exists(attempt_path):
+                    os.remove(attempt_path)
+
+            result.attempts.append((rung["name"], status, elapsed))
+            result.elapsed += elapsed
+            result.status = status
+            result.returncode = returncode
+            result.stdout = capture.tail("stdout")
+            result.stderr = capture.tail("stderr")
+            if status == "ok":
+                result.rung = rung["name"]
+                if index > 0:
+                    print(f"Simulation converged on retry rung '{rung['name']}'.")
+                break
+            if status == "memory" or (status == "timeout" and not self.retry_on_timeout):
+                break
+            if status == "failed":
+                # Not a convergence problem (e.g. a syntax error); retrying will not help.
+                break
+            if index + 1 < len(self.retry_ladder):
+                print(f"Simulation attempt '{rung['name']}' ended with status '{status}'; "
+                      f"retrying with '{self.retry_ladder[index + 1]['name']}'.")
+        return result
+
+    def run_once(self, netlist_path, capture, progress_callback=None, expected_outputs=None):
+        """
+        Launch a single ngspice attempt under the watchdog.
+
+        The working directory is the netlist's folder so that all output files are generated there.
+        stdout and stderr are read line by line on two threads and fed to the capture, so the
+        pipes never fill up and memory use stays bounded whatever the verbosity of the netlist.
+
+        :param netlist_path: Absolute path to the netlist to simulate.
+        :param capture: SimulationLogCapture receiving the output of the job.
+        :param progress_callback: (Optional) Called with a SimulationProgress when progress is parsed.
+        :param expected_outputs: (Optional) Expected wrdata files (see run()).
+        :return: Tuple (status, returncode, elapsed).
+        """
+        cmd = [self.executable, "-b", netlist_path]
+        netlist_dir = os.path.dirname(netlist_path)
+        if self.verbose:
+            print(f"Running simulation with command: {' '.join(cmd)}")
+            print(f"Simulation working directory: {netlist_dir}")
+            print(f"Simulation log: {capture.log_path}")
+
+        popen_kwargs = {}
+        if os.name == "posix":
+            popen_kwargs["start_new_session"] = True
+            if self.max_memory_mb is not None and resource is not None:
+                popen_kwargs["preexec_fn"] = self._make_memory_limiter(self.max_memory_mb)
+
+        observer = current_process_observer()
+        suspended_at_start = observer.suspended_seconds() if observer is not None else 0.0
+        start = time.monotonic()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True, errors='replace', cwd=netlist_dir,
+                                   **popen_kwargs)
+        if observer is not None:
+            observer.process_started(process)
+        readers = [threading.Thread(target=self._pump, args=(process.stdout, "stdout", capture), daemon=True),
+                   threading.Thread(target=self._pump, args=(process.stderr, "stderr", capture), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        spinner = ['-', '\\', '|', '/']
+        i = 0
+        timed_out = False
+        last_version = 0
+        while True:
+            try:
+                process.wait(timeout=0.05)
+                break
+            except subprocess.TimeoutExpired:
+                running_time = time.monotonic() - start
+                if observer is not None:
+                    running_time -= observer.suspended_seconds() - suspended_at_start
+                if self.timeout is not None and running_time > self.timeout:
+                    timed_out = True
+                    self._kill_process_group(process)
+                    process.wait()
+                    break
+            version, progress = capture.progress()
+            if version != last_version:
+                last_version = version
+                if progress_callback is not None:
+                    progress_callback(progress)
+            if self.verbose:
+                sys.stdout.write("\rSimulating... " + spinner[i % len(spinner)] + " " + progress.describe() + "   ")
+                sys.stdout.flush()
+            i += 1
+        if observer is not None:
+            observer.process_finished(process)
+        for reader in readers:
+            reader.join(timeout=self.kill_grace)
+        elapsed = time.monotonic() - start
+        version, progress = capture.progress()
+        if progress_callback is not None and version != last_version:
+            progress_callback(progress)
+        if self.verbose:
+            sys.stdout.write("\rSimulation complete.                                        \n")
+            sys.stdout.flush()
+
+        status = self._classify(process.returncode, capture, timed_out,
+                                self._outputs_complete(netlist_dir, expected_outputs))
+        if self.verbose:
+            if status == "ok":
+                print("ngspice stdout (tail):")
+                print(capture.tail("stdout"))
+                print("ngspice stderr (tail):")
+                print(capture.tail("stderr"))
+            elif status == "timeout":
+                print(f"Simulation killed after {elapsed:.1f} s (timeout {self.timeout} s).")
+            else:
+                print(f"Simulation error ({status}):")
+                print(capture.tail("stderr"))
+        return status, (None if timed_out else process.returncode), elapsed
+
+    @staticmethod
+    def _pump(pipe, stream, capture):
+        try:
+            for line in iter(pipe.readline, ''):
+                capture.feed(stream, line)
+        finally:
+            pipe.close()
+
+    @staticmethod
+    def _outputs_complete(netlist_dir, expected_outputs):
+        """
+        :return: True if every expected wrdata file holds at least one complete row per sweep point.
+        """
+        for output in expected_outputs or []:
+            output_path = os.path.join(netlist_dir, output["path"])
+            if not os.path.exists(output_path):
+                return False
+            with open(output_path, 'r') as f:
+                rows = sum(1 for line in f if len(line.split()) == 2 * output["columns"])
+            if rows < len(output["sweep"]):
+                return False
+        return True
+
+    def _classify(self, returncode, capture, timed_out, outputs_complete=True):
+        if timed_out:
+            return "timeout"
+        stderr = capture.tail("stderr")
+        if MEMORY_ERROR_PATTERN.search(stderr):
+            return "memory"
+        if (self.max_memory_mb is not None and returncode in (-signal.SIGKILL, -signal.SIGSEGV)
+                and ALLOCATION_ERROR_PATTERN.search(stderr)):
+            # Killed by a signal after an allocation failed under the address-space limit.
+            return "memory"
+        if returncode != 0:
+            return "convergence" if capture.error_lines else "failed"
+        # A clean exit: convergence warnings only count if the analysis gave up or left points unwritten.
+        aborted = any(ANALYSIS_ABORTED_PATTERN.search(text) for text in
+                      capture.error_lines + [capture.tail("stdout"), stderr])
+        if aborted or not outputs_complete:
+            return "convergence"
+        return "ok"
+
+    def _kill_process_group(self, process):
+        """
+        Terminate the whole process group of the given process (SIGTERM, then SIGKILL after the grace period).
+        """
+        if os.name != "posix":
+            process.kill()
+            return
+        try:
+            pgid = os.getpgid(process.pid)
+        except ProcessLookupError:
+            return
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+            # A suspended group only sees the SIGTERM once it runs again.
+            os.killpg(pgid, signal.SIGCONT)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout=self.kill_grace)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    @staticmethod
+    def _make_memory_limiter(max_memory_mb):
+        limit = int(max_memory_mb * 1024 * 1024)
+
+        def limiter():
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        return limiter
+
+    @staticmethod
+    def _write_rung_netlist(netlist_path, rung):
+        """
+        Write a copy of the netlist with the rung's options inserted before the control block
+        and its dc steps scaled. The copy is placed in the same folder so relative includes still resolve.
+
+        :return: Path of the copy.
+        """
+        with open(netlist_path, 'r') as f:
+            lines = f.read().splitlines()
+
+        step_scale = rung.get("step_scale", 1.0)
+        out_lines = []
+        inserted = False
+        in_control = False
+        for line in lines:
+            stripped = line.strip().lower()
+            if stripped.startswith(".control") and not inserted:
+                out_lines.append(f"* retry rung: {rung['name']}")
+                out_lines.extend(rung["options"])
+                inserted = True
+                in_control = True
+            elif stripped.startswith(".endc"):
+                in_control = False
+            if in_control and step_scale != 1.0:
+                m = DC_COMMAND_PATTERN.match(line)
+                if m:
+                    try:
+                        step = float(m.group(6)) * step_scale
+                        line = f"{m.group(1)}{m.group(2)}{m.group(3)}{m.group(4)}{m.group(5)}{step:g}{m.group(7)}"
+                    except ValueError:
+                        pass
+            out_lines.append(line)
+        if not inserted:
+            # No control block: put the options just before .end (the first line is the title).
+            end_index = next((k for k, l in enumerate(out_lines) if l.strip().lower() == ".end"), len(out_lines))
+            out_lines[end_index:end_index] = rung["options"]
+
+        base, ext = os.path.splitext(netlist_path)
+        rung_path = f"{base}.retry_{rung['name']}{ext}"
+        with open(rung_path, 'w') as f:
+            f.write("\n".join(out_lines) + "\n")
+        return rung_path
@@ -1,9 +1,21 @@
 import os
-import os
-import subprocess
-import sys
-import time
+import re
+import numpy as np
 from IceMOS_sky130_netlist_generator import NetlistGeneratorSky130
+from IceMOS_sky130_raw_reader import read_raw_plot
+from IceMOS_sky130_sim_runner import NgspiceRunner
+from IceMOS_sky130_result_cache import SimulationResultCache, make_cache_key, simulator_version
+from IceMOS_sky130_result_store import Curve, model_hash
+from IceMOS_sky130_results import AXIS_NAMES, make_family_result, make_iv_result
+from IceMOS_sky130_sweep_planner import CurveStore, family_key
+
+
+# Vectors saved by the wrdata line of each template, as named in the .raw file written next to it.
+IV_VECTORS = {"nch": ["i(v1_meas)"], "pch": ["i(vdsm)"]}
+FAMILY_VECTORS = {"nch": ["v(vds)", "i(vdrain)", "i(vdsm)"],
+                  "pch": ["v(vgate)", "i(vsource)", "i(vdsm)"]}
+# Run statuses after which the points that were simulated are kept and the others reported as NaN.
+PARTIAL_STATUSES = ("convergence", "timeout")
 
 
 class IceMOS_simulator_sky130:
@@ -18,58 +30,196 @@ class IceMOS_simulator_sky130:
     All simulations use the 'modified' netlist generated by the netlist generator.
     """
 
-    def __init__(self, original_model_file):
+    def __init__(self, original_model_file, timeout=600, max_memory_mb=None, retry_ladder=None,
+                 progress_callback=None, result_cache=None, circuit_root="circuits", result_store=None,
+                 run_history=None):
         """
         Initialize the simulator with the path to the original SPICE model file.
         
         :param original_model_file: Path to the original SPICE model file (e.g., "sky130_fd_pr__nfet_01v8.pm3.spice").
+        :param timeout: Wall-clock limit in seconds for each ngspice attempt (None disables it).
+        :param max_memory_mb: Memory limit in MiB for each ngspice process (None disables it).
+        :param retry_ladder: (Optional) Convergence retry ladder; defaults to RETRY_LADDER.
+        :param progress_callback: (Optional) Called with a SimulationProgress (fraction done, ETA)
+                                  while ngspice runs. The full ngspice output goes to a rotating
+                                  log file in the 'logs' folder next to the netlist.
+        :param result_cache: (Optional) SimulationResultCache used by iv_curve() and iv_vds_curves().
+                             Defaults to a cache in <circuit_root>/.sim_cache, private to the circuit root;
+                             simulators working in sandboxes (other circuit roots) share results with the
+                             interactive one only when they are given its cache explicitly. Pass False to
+                             disable caching.
+        :param circuit_root: Folder where the netlists and results of each bin are written.
+        :param result_store: (Optional) ResultStore where iv_curve() and iv_vds_curves() record their curves,
+                             indexed by device, bin, temperature, biases and model hash.
+        :param run_history: (Optional) RunHistory where every iv_curve() and iv_vds_curves() result is
+                            kept as an immutable snapshot (model card, sweep and curves).
         """
         self.original_model_file = original_model_file
-        self.generator = NetlistGeneratorSky130(original_model_file)
+        self.generator = NetlistGeneratorSky130(original_model_file, circuit_root=circuit_root)
+        self.runner = NgspiceRunner(timeout=timeout, max_memory_mb=max_memory_mb, retry_ladder=retry_ladder)
+        self.progress_callback = progress_callback
+        if result_cache is None:
+            result_cache = SimulationResultCache(os.path.join(circuit_root, ".sim_cache"))
+        self.cache = result_cache or None
+        self.result_store = result_store
+        self.run_history = run_history
+        self.last_snapshot = None
+        self.last_run = None
+        self.last_cache_hit = False
+
+    @staticmethod
+    def sweep_values(start, stop, step, loop=False):
+        """
+        Reproduce the values visited by the netlists' sweeps, accumulating the step the same way ngspice does.
 
-    def _simulate_netlist(self, netlist_path):
+        A dc sweep includes the stop value within a small tolerance, while the control-block
+        'while' loop (loop=True) compares exactly.
+        """
+        values = []
+        value = start
+        if step <= 0:
+            return [start]
+        tolerance = 0.0 if loop else abs(step) * 1e-9
+        while value <= stop + tolerance:
+            values.append(value)
+            value = value + step
+        return values
+
+    def simulate_netlist(self, netlist_path, expected_outputs=None):
         """
         Simulate the given netlist using ngspice in batch mode.
         
         This method converts the provided netlist path to an absolute path and sets the 
         working directory to the netlist's folder so that all output files (e.g., .raw, .csv)
         are generated in that folder.
+
+        The run is supervised by an NgspiceRunner: it is killed (with its whole process group)
+        if it exceeds the timeout or memory limit, and convergence failures are retried with
+        gmin stepping, source stepping, relaxed tolerances and a smaller step. The outcome
+        (including the rung that succeeded) is stored in self.last_run.
+
+        When expected_outputs is given, stale copies of those files are removed before the run
+        and the files are brought back to the requested sweep points: extra points (from the smaller
+        step of the last retry rung) are dropped and any point that could not be simulated is written
+        as NaN, so a convergence failure or timeout on some points does not abort the whole sweep.
+        Other failures (netlist errors, missing includes or ngspice, memory limit) still raise.
         
         :param netlist_path: Path to the netlist file to simulate.
-        :return: The stdout output of the simulation.
-        :raises RuntimeError: If the simulation fails.
+        :param expected_outputs: (Optional) List of dicts {"path", "sweep", "columns"} describing the
+                                 wrdata CSV files the netlist writes (path relative to the netlist folder,
+                                 the sweep values and the number of saved vectors). An optional "vectors"
+                                 entry names the saved vectors in the .raw file written next to the CSV.
+        :return: The tail of the stdout output of the simulation (the full output is in self.last_run.log_path).
+        :raises RuntimeError: If the simulation fails, unless expected outputs were given and the failure
+                              is a convergence failure or a timeout.
         """
         # Convert netlist_path to an absolute path
         netlist_path = os.path.abspath(netlist_path)
-        cmd = ["ngspice", "-b", netlist_path]
         netlist_dir = os.path.dirname(netlist_path)
-        print(f"Running simulation with command: {' '.join(cmd)}")
-        print(f"Simulation working directory: {netlist_dir}")
-        
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                   universal_newlines=True, cwd=netlist_dir)
-        
-        spinner = ['-', '\\', '|', '/']
-        i = 0
-        while process.poll() is None:
-            sys.stdout.write("\rSimulating... " + spinner[i % len(spinner)])
-            sys.stdout.flush()
-            time.sleep(0.05)
-            i += 1
-        sys.stdout.write("\rSimulation complete.            \n")
-        sys.stdout.flush()
-        
-        stdout, stderr = process.communicate()
-        if process.returncode != 0:
-            print("Simulation error:")
-            print(stderr)
-            raise RuntimeError("Netlist simulation failed.")
+        if expected_outputs:
+            for output in expected_outputs:
+                output_path = os.path.join(netlist_dir, output["path"])
+                for path in (output_path, os.path.splitext(output_path)[0] + ".raw"):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        if expected_outputs:
+            total_analyses = len(expected_outputs)
+            points_per_analysis = len(expected_outputs[0]["sweep"])
         else:
-            print("ngspice stdout:")
-            print(stdout)
-            print("ngspice stderr:")
-            print(stderr)
-        return stdout
+            total_analyses, points_per_analysis = None, None
+        result = self.runner.run(netlist_path, progress_callback=self.progress_callback,
+                                 total_analyses=total_analyses, points_per_analysis=points_per_analysis,
+                                 expected_outputs=expected_outputs)
+        self.last_run = result
+
+        if not result.ok and (not expected_outputs or result.status not in PARTIAL_STATUSES):
+            raise RuntimeError(f"Netlist simulation failed ({result.status}); see {result.log_path}.")
+        if expected_outputs:
+            failed = self._conform_outputs(netlist_dir, expected_outputs)
+            if failed:
+                print(f"Warning: {failed} sweep point(s) failed ({result.status}) and were reported as NaN.")
+        return result.stdout
+
+    @staticmethod
+    def _conform_outputs(netlist_dir, expected_outputs, tolerance=1e-6):
+        """
+        Bring the expected wrdata CSV files to exactly the requested sweep points.
+
+        Rows are matched to the sweep by their scale value: rows at other points (e.g. the extra points
+        of a retry rung that ran a smaller step) are dropped, and sweep points without a row (failed or
+        missing points) are written as NaN. wrdata writes one (scale, value) column pair per saved
+        vector, so the padded rows keep the sweep value in every scale column and NaN in every value
+        column.
+
+        :param tolerance: Matching tolerance, as a fraction of the smallest sweep step.
+        :return: Number of sweep points that were filled with NaN.
+        """
+        failed = 0
+        for output in expected_outputs:
+            output_path = os.path.join(netlist_dir, output["path"])
+            sweep = np.asarray(output["sweep"], dtype=float)
+            lines = []
+            if os.path.exists(output_path):
+                with open(output_path, 'r') as f:
+                    lines = [line for line in f if line.strip()]
+            if len(lines) == len(sweep):
+                continue
+            # Parse the scale of every complete row (the last one may have been cut short by a kill).
+            rows, scales = [], []
+            for line in lines:
+                fields = line.split()
+                if len(fields) != 2 * output["columns"]:
+                    continue
+                try:
+                    scales.append(float(fields[0]))
+                except ValueError:
+                    continue
+                rows.append(line if line.endswith("\n") else line + "\n")
+            steps = np.diff(np.unique(sweep))
+            tol = tolerance * (steps.min() if len(steps) else 1.0)
+            scales = np.asarray(scales, dtype=float)
+            order = np.argsort(scales, kind="stable")
+            position = np.clip(np.searchsorted(scales[order], sweep), 0, max(len(scales) - 1, 0))
+            out = []
+            for x, k in zip(sweep, position):
+                candidates = [order[j] for j in (k - 1, k) if 0 <= j < len(scales)]
+                match = next((j for j in candidates if abs(scales[j] - x) <= tol), None)
+                if match is None:
+                    out.append(" ".join(f"{x: .8e}  nan" for _ in range(output["columns"])) + " \n")
+                    failed += 1
+                else:
+                    out.append(rows[match])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w') as f:
+                f.writelines(out)
+        return failed
+
+    @staticmethod
+    def _netlist_bin(netlist_path):
+        """Bin number of a generated netlist, from its 'bin_<n>' folder (None if unknown)."""
+        m = re.search(r"bin_(\d+)", os.path.basename(os.path.dirname(os.path.abspath(netlist_path))))
+        return int(m.group(1)) if m else None
+
+    def _result_metadata(self, netlist_path, W, L, model_type="modified", cache_hit=False):
+        """
+        Metadata of a result: bin, geometry, model card, temperature and run outcome.
+
+        :param cache_hit: True when the result was served entirely from the result cache (only
+                          successful runs are cached, and no ngspice run belongs to it).
+        """
+        _, model_card, temperature = self._netlist_inputs(netlist_path)
+        metadata = {"bin": self._netlist_bin(netlist_path), "W": W, "L": L, "model_type": model_type,
+                    "temperature": temperature, "netlist": os.path.abspath(netlist_path),
+                    "model_card": model_card if os.path.exists(model_card) else None,
+                    "model_hash": model_hash(model_card),
+                    "simulator": simulator_version(self.runner.executable), "cache_hit": cache_hit}
+        run = self.last_run
+        if cache_hit:
+            metadata.update(status="ok", rung=None, elapsed=0.0, log_path=None)
+        elif run is not None:
+            metadata.update(status=run.status, rung=run.rung, elapsed=run.elapsed, log_path=run.log_path)
+        return metadata
 
     def simulate_iv(self, device_type, bin_number=None, W=None, L=None,
                     vgate_start=0, vgate_stop=1.8, vgate_step=0.1):
@@ -83,18 +233,37 @@ class IceMOS_simulator_sky130:
         :param bin_number: (Optional) The bin number to simulate.
         :param W: (Optional) Transistor width in µm.
         :param L: (Optional) Transistor length in µm.
-        :param vgate_start: Starting voltage for the VGATE sweep.
+        :param vgate_start: Starting voltage for the VGATE sweep (VGS for NMOS, VSG for PMOS).
         :param vgate_stop: Ending voltage for the VGATE sweep.
         :param vgate_step: Voltage step for the VGATE sweep.
-        :return: The stdout output from the simulation.
+        :return: SweepResult of kind 'iv' (VGS/IDS for NMOS, VSG/ISD for PMOS) with the ngspice output
+                 in its stdout attribute.
         """
+        device_type = device_type.lower()
         netlists = self.generator.generate_iv_netlists(
             device_type=device_type, bin_number=bin_number, W=W, L=L,
             vgate_start=vgate_start, vgate_stop=vgate_stop, vgate_step=vgate_step)
         netlist_path = netlists["modified"]
         print(f"Simulating IV netlist: {netlist_path}")
-        return self._simulate_netlist(netlist_path)
-    
+        expected_outputs = [{"path": os.path.join("results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"),
+                             "sweep": self.sweep_values(vgate_start, vgate_stop, vgate_step),
+                             "columns": 1, "vectors": IV_VECTORS[device_type]}]
+        stdout = self.simulate_netlist(netlist_path, expected_outputs)
+        data = self._load_output(os.path.dirname(os.path.abspath(netlist_path)), expected_outputs[0])
+        return make_iv_result(device_type, data[:, 0], data[:, 1],
+                              metadata=self._result_metadata(netlist_path, W, L), stdout=stdout)
+
+    def _simulate_family(self, device_type, netlist_path, pattern, vg_values, vd_sweep, W, L):
+        """Simulate a gate-sweep netlist and collect its curves into an 'iv_vds' SweepResult."""
+        expected_outputs = [{"path": pattern.format(vg), "sweep": vd_sweep, "columns": 3,
+                             "vectors": FAMILY_VECTORS[device_type]} for vg in vg_values]
+        stdout = self.simulate_netlist(netlist_path, expected_outputs)
+        netlist_dir = os.path.dirname(os.path.abspath(netlist_path))
+        # wrdata columns: sweep, V/I of the first vector, sweep, second vector, sweep, measured current.
+        currents = [self._load_output(netlist_dir, output)[:, 5] for output in expected_outputs]
+        return make_family_result(device_type, vg_values, vd_sweep, currents,
+                                  metadata=self._result_metadata(netlist_path, W, L), stdout=stdout)
+
     def simulate_id_vs_vds_sweep_vg(self, device_type, bin_number=None, W=None, L=None,
                           vgs_start=0, vgs_stop=1.8, vgs_step=0.6,
                           vds_start=0, vds_stop=1.8, vds_step=0.1):
@@ -114,7 +283,7 @@ class IceMOS_simulator_sky130:
         :param vds_start: Starting voltage for the VDS sweep (within the VGS loop).
         :param vds_stop: Ending voltage for the VDS sweep.
         :param vds_step: Voltage step for the VDS sweep.
-        :return: The stdout output from the simulation.
+        :return: SweepResult of kind 'iv_vds' with axes VGS, VDS and current IDS.
         """
         netlists = self.generator.generate_iv_vds_netlists(
             device_type=device_type, bin_number=bin_number, W=W, L=L,
@@ -122,14 +291,16 @@ class IceMOS_simulator_sky130:
             vds_start=vds_start, vds_stop=vds_stop, vds_step=vds_step)
         netlist_path = netlists["modified"]
         print(f"Simulating IV VDS netlist: {netlist_path}")
-        return self._simulate_netlist(netlist_path)
+        pattern = os.path.join("results_IV_IDS_vs_VDS_for_VG_sweep", "n_mosfet_id_vs_vsd_{:g}.csv")
+        return self._simulate_family("nch", netlist_path, pattern,
+                                     self.sweep_values(vgs_start, vgs_stop, vgs_step, loop=True),
+                                     self.sweep_values(vds_start, vds_stop, vds_step), W, L)
 
-## TODO: fix vgs for vsg
     def simulate_is_vs_vsd_sweep_vg(self, device_type, bin_number=None, W=None, L=None,
                         vsg_start=0, vsg_stop=1.8, vsg_step=0.2,
                         vsd_start=0, vsd_stop=1.8, vsd_step=0.1):
         """
-        Generate and simulate an IV_VSD netlist (IDRAIN vs. VSOURCE with a VGATE sweep) for the specified device.
+        Generate and simulate an IV_VSD netlist (ISD vs. VSD with a VSG sweep) for the specified device.
 
         The bin is determined either by an explicit bin number or by the provided transistor dimensions (W, L).
         Always uses the 'modified' netlist.
@@ -141,61 +312,326 @@ class IceMOS_simulator_sky130:
         :param vsg_start: Starting voltage for the VSG sweep.
         :param vsg_stop: Ending voltage for the VSG sweep.
         :param vsg_step: Voltage step for the VSG sweep.
-        :param vsg_start: Starting voltage for the VSD sweep (within the VSG loop).
-        :param vsd_stop: Ending voltage for the VDS sweep.
+        :param vsd_start: Starting voltage for the VSD sweep (within the VSG loop).
+        :param vsd_stop: Ending voltage for the VSD sweep.
         :param vsd_step: Voltage step for the VSD sweep.
-        :return: The stdout output from the simulation.
+        :return: SweepResult of kind 'iv_vds' with axes VSG, VSD and current ISD (see terminal() for
+                 VGS, VDS and ID).
         """
-
+        # The PMOS template takes the VSG sweep through its vgs_* arguments.
         netlists = self.generator.generate_iv_vds_netlists(
             device_type=device_type, bin_number=bin_number, W=W, L=L,
             vgs_start=vsg_start, vgs_stop=vsg_stop, vgs_step=vsg_step,
             vsd_start=vsd_start, vsd_stop=vsd_stop, vsd_step=vsd_step)
         netlist_path = netlists["modified"]
         print(f"Simulating IV VSD netlist: {netlist_path}")
-        return self._simulate_netlist(netlist_path)
+        pattern = os.path.join("results_IV_ISD_vs_VSD_for_VG_sweep", "p_mosfet_id_vs_vsd_{:g}.csv")
+        return self._simulate_family("pch", netlist_path, pattern,
+                                     self.sweep_values(vsg_start, vsg_stop, vsg_step, loop=True),
+                                     self.sweep_values(vsd_start, vsd_stop, vsd_step), W, L)
+
+    def simulate_iv_vds(self, device_type, bin_number=None, W=None, L=None,
+                        vgs_start=0, vgs_stop=1.8, vgs_step=0.6,
+                        vds_start=0, vds_stop=1.8, vds_step=0.1):
+        """
+        Simulate the output characteristics of either device: simulate_id_vs_vds_sweep_vg() for NMOS,
+        simulate_is_vs_vsd_sweep_vg() for PMOS (the vgs_*/vds_* values are then VSG and VSD).
+
+        :return: SweepResult of kind 'iv_vds'.
+        """
+        if device_type.lower() == 'nch':
+            return self.simulate_id_vs_vds_sweep_vg(device_type, bin_number=bin_number, W=W, L=L,
+                                                    vgs_start=vgs_start, vgs_stop=vgs_stop, vgs_step=vgs_step,
+                                                    vds_start=vds_start, vds_stop=vds_stop, vds_step=vds_step)
+        return self.simulate_is_vs_vsd_sweep_vg(device_type, bin_number=bin_number, W=W, L=L,
+                                                vsg_start=vgs_start, vsg_stop=vgs_stop, vsg_step=vgs_step,
+                                                vsd_start=vds_start, vsd_stop=vds_stop, vsd_step=vds_step)
+
+    @staticmethod
+    def load_wrdata(csv_path):
+        """
+        Load a wrdata CSV file (whitespace separated, no header) as a 2-D float array.
+        """
+        return np.loadtxt(csv_path, ndmin=2)
+
+    def _load_output(self, netlist_dir, output):
+        """
+        Load the data of an expected output in wrdata column order (scale, vector, scale, vector, ...).
+
+        The binary .raw file written next to the CSV is memory-mapped and its named vectors are used
+        when it holds every sweep point; otherwise (no raw file, unknown vectors, or failed points that
+        were padded with NaN in the CSV) the CSV is read.
+        """
+        csv_path = os.path.join(netlist_dir, output["path"])
+        raw_path = os.path.splitext(csv_path)[0] + ".raw"
+        vectors = output.get("vectors")
+        if vectors and os.path.exists(raw_path):
+            try:
+                plot = read_raw_plot(raw_path)
+                if plot.n_points == len(output["sweep"]):
+                    return np.column_stack([column for name in vectors for column in (plot.scale, plot[name])])
+            except (KeyError, ValueError) as e:
+                print(f"Could not use {raw_path} ({e}); reading {csv_path}.")
+        return self.load_wrdata(csv_path)
+
+    @staticmethod
+    def _netlist_inputs(netlist_path):
+        """
+        Read a generated netlist and find the inputs that determine its results.
+
+        :return: Tuple (netlist text, model card path, temperature in °C).
+        """
+        netlist_dir = os.path.dirname(os.path.abspath(netlist_path))
+        with open(netlist_path, 'r') as f:
+            netlist_text = f.read()
+        m = re.search(r'^\.include\s+"?\./(\S+?\.lib)"?\s*$', netlist_text, re.MULTILINE)
+        model_card = os.path.join(netlist_dir, m.group(1)) if m else netlist_text
+        m = re.search(r'^\.temp\s+(\S+)', netlist_text, re.MULTILINE | re.IGNORECASE)
+        temperature = float(m.group(1)) if m else 27.0
+        return netlist_text, model_card, temperature
+
+    def _cached_run(self, netlist_path, sweep_spec, expected_outputs):
+        """
+        Return the arrays written by a netlist, simulating it only if the result cache has no entry
+        for the same model card, netlist, sweep, temperature and simulator version.
+
+        :param netlist_path: Path to the netlist to simulate.
+        :param sweep_spec: Dict describing the sweep (part of the cache key).
+        :param expected_outputs: Expected wrdata files (see simulate_netlist).
+        :return: List of 2-D arrays, one per expected output, in wrdata column order.
+        """
+        netlist_path = os.path.abspath(netlist_path)
+        netlist_dir = os.path.dirname(netlist_path)
+        netlist_text, model_card, temperature = self._netlist_inputs(netlist_path)
+
+        key = None
+        if self.cache is not None:
+            key = make_cache_key(model_card, netlist_text, sweep_spec, temperature,
+                                 simulator_version(self.runner.executable))
+            hit = self.cache.get(key)
+            if hit is not None:
+                self.last_cache_hit = True
+                arrays, _ = hit
+                return [arrays[f"output_{i}"] for i in range(len(expected_outputs))]
+        self.last_cache_hit = False
+
+        self.simulate_netlist(netlist_path, expected_outputs)
+        results = [self._load_output(netlist_dir, output) for output in expected_outputs]
+        if key is not None and self.last_run is not None and self.last_run.ok:
+            self.cache.put(key, {f"output_{i}": data for i, data in enumerate(results)},
+                           {"netlist": os.path.basename(netlist_path), "temperature": temperature,
+                            "rung": self.last_run.rung})
+        return results
+
+    def iv_curve(self, device_type, bin_number=None, W=None, L=None,
+                 vgate_start=0, vgate_stop=1.8, vgate_step=0.1, model_type="modified"):
+        """
+        Return the IV curve (IDRAIN vs. VGATE), served from the result cache when possible.
+
+        :param device_type: 'nch' for NMOS or 'pch' for PMOS.
+        :param bin_number: (Optional) The bin number to simulate.
+        :param W: (Optional) Transistor width in µm.
+        :param L: (Optional) Transistor length in µm.
+        :param vgate_start: Starting voltage for the VGATE sweep.
+        :param vgate_stop: Ending voltage for the VGATE sweep.
+        :param vgate_step: Voltage step for the VGATE sweep.
+        :param model_type: 'modified' (calibrated model at 4 K) or 'original' (reference model at 27 °C).
+        :return: SweepResult of kind 'iv' (VGS/IDS for NMOS, VSG/ISD for PMOS); its metadata tells
+                 whether it was served from the cache.
+        """
+        netlists = self.generator.generate_iv_netlists(
+            device_type=device_type, bin_number=bin_number, W=W, L=L,
+            vgate_start=vgate_start, vgate_stop=vgate_stop, vgate_step=vgate_step)
+        expected_outputs = [{"path": os.path.join("results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"),
+                             "sweep": self.sweep_values(vgate_start, vgate_stop, vgate_step),
+                             "columns": 1, "vectors": IV_VECTORS[device_type.lower()]}]
+        sweep_spec = {"vgate": [vgate_start, vgate_stop, vgate_step]}
+        data, = self._cached_run(netlists[model_type], sweep_spec, expected_outputs)
+        self._store_curves(netlists[model_type], device_type, "VG", [({}, data[:, 0], data[:, 1])])
+        self._record_run(netlists[model_type], device_type, bin_number, "iv", model_type,
+                         [(None, data[:, 0], data[:, 1])], W=W, L=L,
+                         vgate_start=vgate_start, vgate_stop=vgate_stop, vgate_step=vgate_step)
+        return make_iv_result(device_type, data[:, 0], data[:, 1],
+                              metadata=self._result_metadata(netlists[model_type], W, L, model_type,
+                                                             cache_hit=self.last_cache_hit))
+
+    def _store_curves(self, netlist_path, device_type, sweep, curves):
+        """
+        Record curves in the result store (if any).
 
+        Biases follow the netlists: VG/VD for NMOS, and the source-referenced VSG/VSD magnitudes for PMOS.
+        Results served entirely from the result cache were recorded when they were simulated and are skipped.
 
-    def plot_iv_results_qt(self, device_type, bin_number, csv_filename=None):
+        :param netlist_path: Netlist that produced the curves (gives the bin, model card and temperature).
+        :param sweep: Swept bias, 'VG' or 'VD'.
+        :param curves: List of (fixed biases dict, x, y) tuples.
+        """
+        if self.result_store is None or self.last_cache_hit:
+            return
+        _, model_card, temperature = self._netlist_inputs(netlist_path)
+        bin_number = self._netlist_bin(netlist_path)
+        card_hash = model_hash(model_card)
+        self.result_store.append([Curve(x, y, device_type.lower(), bin=bin_number, temperature=temperature,
+                                        sweep=sweep, model_hash=card_hash,
+                                        attrs={"netlist": os.path.basename(netlist_path)}, **biases)
+                                  for biases, x, y in curves])
+
+    def _record_run(self, netlist_path, device_type, bin_number, kind, model_type, curves, **sweep):
+        """
+        Keep a run in the run history (if any). Results served from the result cache are recorded too:
+        the history deduplicates identical runs.
+
+        :param curves: List of (vg, x, y) tuples; vg is None for an ID vs VG curve.
+        """
+        self.last_snapshot = None
+        if self.run_history is None:
+            return
+        _, model_card, temperature = self._netlist_inputs(netlist_path)
+        self.last_snapshot = self.run_history.record(device_type, bin_number, kind, sweep, curves, model_card,
+                                                     temperature=temperature, model_type=model_type)
+
+    def generate_family_netlists(self, device_type, bin_number, W, L,
+                                 vg_start, vg_stop, vg_step, vd_start, vd_stop, vd_step):
+        """
+        Generate the gate-sweep netlists of a device and return them with the wrdata file name pattern.
+
+        :return: Tuple (netlists, pattern): the {'original', 'modified'} netlist paths, and the path of the
+                 wrdata file of a gate voltage relative to the netlist folder (pattern.format(vg)).
+        """
+        if device_type == 'nch':
+            netlists = self.generator.generate_iv_vds_netlists(
+                device_type=device_type, bin_number=bin_number, W=W, L=L,
+                vgs_start=vg_start, vgs_stop=vg_stop, vgs_step=vg_step,
+                vds_start=vd_start, vds_stop=vd_stop, vds_step=vd_step)
+            pattern = os.path.join("results_IV_IDS_vs_VDS_for_VG_sweep", "n_mosfet_id_vs_vsd_{:g}.csv")
+        else:
+            netlists = self.generator.generate_iv_vds_netlists(
+                device_type=device_type, bin_number=bin_number, W=W, L=L,
+                vgs_start=vg_start, vgs_stop=vg_stop, vgs_step=vg_step,
+                vsd_start=vd_start, vsd_stop=vd_stop, vsd_step=vd_step)
+            pattern = os.path.join("results_IV_ISD_vs_VSD_for_VG_sweep", "p_mosfet_id_vs_vsd_{:g}.csv")
+        return netlists, pattern
+
+    def iv_vds_curves(self, device_type, bin_number=None, W=None, L=None,
+                      vg_start=0, vg_stop=1.8, vg_step=0.6,
+                      vd_start=0, vd_stop=1.8, vd_step=0.1, model_type="modified"):
+        """
+        Return the output characteristics (IDS vs. VDS for NMOS, ISD vs. VSD for PMOS) for a gate sweep.
+
+        With a result cache, curves are cached one gate voltage at a time: only the gate voltages and
+        drain points that were never simulated for the current model are simulated, and they are
+        merged into the stored curves. The existing result files are left in place.
+
+        :param device_type: 'nch' for NMOS or 'pch' for PMOS.
+        :param bin_number: (Optional) The bin number to simulate.
+        :param W: (Optional) Transistor width in µm.
+        :param L: (Optional) Transistor length in µm.
+        :param vg_start: Starting voltage for the VGS (VSG) sweep.
+        :param vg_stop: Ending voltage for the VGS (VSG) sweep.
+        :param vg_step: Voltage step for the VGS (VSG) sweep.
+        :param vd_start: Starting voltage for the VDS (VSD) sweep.
+        :param vd_stop: Ending voltage for the VDS (VSD) sweep.
+        :param vd_step: Voltage step for the VDS (VSD) sweep.
+        :param model_type: 'modified' or 'original'.
+        :return: SweepResult of kind 'iv_vds' with one current row per gate voltage.
+        """
+        device_type = device_type.lower()
+        history_sweep = dict(W=W, L=L, vg_start=vg_start, vg_stop=vg_stop, vg_step=vg_step,
+                             vd_start=vd_start, vd_stop=vd_stop, vd_step=vd_step)
+        vd_sweep = self.sweep_values(vd_start, vd_stop, vd_step)
+        vg_values = self.sweep_values(vg_start, vg_stop, vg_step, loop=True)
+        netlists, pattern = self.generate_family_netlists(device_type, bin_number, W, L,
+                                                          vg_start, vg_stop, vg_step,
+                                                          vd_start, vd_stop, vd_step)
+        if self.cache is None:
+            expected_outputs = [{"path": pattern.format(vg), "sweep": vd_sweep, "columns": 3,
+                                 "vectors": FAMILY_VECTORS[device_type]} for vg in vg_values]
+            sweep_spec = {"vg": [vg_start, vg_stop, vg_step], "vd": [vd_start, vd_stop, vd_step]}
+            results = self._cached_run(netlists[model_type], sweep_spec, expected_outputs)
+            # wrdata columns: sweep, V/I of the first vector, sweep, second vector, sweep, measured current.
+            curves = [(vg, data[:, 0], data[:, 5]) for vg, data in zip(vg_values, results)]
+            self._store_curves(netlists[model_type], device_type, "VD",
+                               [({"vg": vg}, vd, current) for vg, vd, current in curves])
+            self._record_run(netlists[model_type], device_type, bin_number, "iv_vds", model_type, curves,
+                             **history_sweep)
+            return make_family_result(device_type, vg_values, vd_sweep, [current for _, _, current in curves],
+                                      metadata=self._result_metadata(netlists[model_type], W, L, model_type,
+                                                                     cache_hit=self.last_cache_hit))
+
+        netlist_text, model_card, temperature = self._netlist_inputs(netlists[model_type])
+        family = family_key(model_card, netlist_text, temperature, simulator_version(self.runner.executable))
+        store = CurveStore(self.cache)
+        tasks = store.plan(family, vg_values, vd_sweep)
+        self.last_cache_hit = not tasks
+        for task in tasks:
+            print(f"Simulating missing curves: {task}")
+            args = task.sweep_arguments()
+            task_netlists, _ = self.generate_family_netlists(device_type, bin_number, W, L, **args)
+            task_vgs = self.sweep_values(args["vg_start"], args["vg_stop"], args["vg_step"], loop=True)
+            task_vds = self.sweep_values(args["vd_start"], args["vd_stop"], args["vd_step"])
+            expected_outputs = [{"path": pattern.format(vg), "sweep": task_vds, "columns": 3,
+                                 "vectors": FAMILY_VECTORS[device_type]} for vg in task_vgs]
+            self.simulate_netlist(task_netlists[model_type], expected_outputs)
+            netlist_dir = os.path.dirname(os.path.abspath(task_netlists[model_type]))
+            for vg, output in zip(task_vgs, expected_outputs):
+                data = self._load_output(netlist_dir, output)
+                store.merge(family, vg, data[:, 0], data[:, 5])
+
+        current, _ = store.assemble(family, vg_values, vd_sweep)
+        vd = np.asarray(vd_sweep, dtype=float)
+        curves = [(vg, vd, current[i]) for i, vg in enumerate(vg_values)]
+        self._store_curves(netlists[model_type], device_type, "VD",
+                           [({"vg": vg}, vd, current) for vg, vd, current in curves])
+        self._record_run(netlists[model_type], device_type, bin_number, "iv_vds", model_type, curves,
+                         **history_sweep)
+        return make_family_result(device_type, vg_values, vd, current,
+                                  metadata=self._result_metadata(netlists[model_type], W, L, model_type,
+                                                                 cache_hit=self.last_cache_hit))
+
+    def plot_iv_results_qt(self, device_type, bin_number, csv_filename=None, result=None):
         """
         Plot the IV simulation results (IDRAIN vs. VGATE) using PyQtGraph for interactive plotting.
 
-        Reads the CSV file (assumed to be space-delimited with no header) generated by the IV simulation,
-        assigns column names ("VG" and "ID" for NMOS, "VG" and "IS" for PMOS), and displays an interactive plot
-        using PyQtGraph. This method does not block execution.
+        Reads the binary .raw file written by the IV simulation (memory-mapped, vectors looked up by
+        name) and displays the measured current against the gate sweep in an interactive PyQtGraph plot.
+        This method does not block execution.
 
         :param device_type: 'nch' for NMOS or 'pch' for PMOS.
         :param bin_number: The bin number used in the simulation.
-        :param csv_filename: (Optional) CSV filename; defaults to "IV_ID_vs_VG.csv".
+        :param csv_filename: (Optional) Result filename; defaults to "IV_ID_vs_VG.raw". A ".csv" name
+                             selects the .raw file written next to it.
+        :param result: (Optional) SweepResult returned by simulate_iv(); when given, no file is read.
         :return: The PyQtGraph window object.
         """
-        import pandas as pd
         import pyqtgraph as pg
         from PyQt5 import QtWidgets
         import sys
 
         device_type = device_type.lower()
         if csv_filename is None:
-            csv_filename = "IV_ID_vs_VG.csv"
+            csv_filename = "IV_ID_vs_VG.raw"
 
-        folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_ID_vs_VG")
-        csv_path = os.path.join(folder, csv_filename)
-        if not os.path.exists(csv_path):
-            print(f"CSV file {csv_path} not found. Please run the simulation first.")
-            return
+        if result is not None:
+            vg, current = result.sweep.values, result.current.values
+        else:
+            folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_ID_vs_VG")
+            raw_path = os.path.join(folder, os.path.splitext(csv_filename)[0] + ".raw")
+            if not os.path.exists(raw_path):
+                print(f"Raw file {raw_path} not found. Please run the simulation first.")
+                return
 
-        try:
-            df = pd.read_csv(csv_path, delim_whitespace=True, header=None)
-        except Exception as e:
-            print(f"Error reading CSV file {csv_path}: {e}")
-            return
+            try:
+                plot = read_raw_plot(raw_path)
+                vg = plot.scale
+                current = plot[IV_VECTORS[device_type][0]]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error reading raw file {raw_path}: {e}")
+                return
 
         if device_type == "nch":
-            df.columns = ["VG", "ID"]
             y_label = "Drain Current (IDS)"
             title = f"NMOS IDS vs VGS (Bin {bin_number})"
         else:
-            df.columns = ["VG", "ID"]  ## ID here is actually ISD (todo: fix this)
             y_label = "Source-Drain Current (ISD)"
             title = f"PMOS ISD vs VSG (Bin {bin_number})"
 
@@ -214,7 +650,7 @@ class IceMOS_simulator_sky130:
         if device_type == 'nch': p.setLabel('bottom', "Gate Voltage (VGS)")
         else: p.setLabel('bottom', "Gate Voltage (VSG)")
         p.showGrid(x=True, y=True)
-        p.plot(df["VG"].values, df.iloc[:, 1].values,
+        p.plot(vg, current,
                pen=pg.mkPen(color='b', width=2),
                symbol='o', symbolSize=5)
         win.show()
@@ -224,63 +660,45 @@ class IceMOS_simulator_sky130:
             QtWidgets.QApplication.processEvents()
         return win
 
-    def plot_iv_vds_results_qt(self, device_type, bin_number, csv_folder=None):
+    def plot_iv_vds_results_qt(self, device_type, bin_number, csv_folder=None, result=None):
         """
         Plot the IV VDS simulation results using PyQtGraph in a non-blocking manner.
 
-        This method searches for CSV files in the sweep results folder (default:
-        circuits/<device_type>/bin_<bin_number>/sweep_IV_results). Each CSV file is assumed to be
-        space-delimited with no header and to contain six columns.
-
-        For NMOS (nch), columns are assigned as:
-          ["V(VDS)", "V(VGS)", "V(VDS)_dup", "I(IDS)", "V(VDS)_dup2", "I(VDSM)"]
-        For PMOS (pch), columns are assigned as:
-          ["V(VSD)", "V(VGS)", "V(VSD)_dup", "I(SD)", "V(VSD)_dup2", "I(VSDM)"]
-
-        The VGS value is extracted from the filename (the text after the last '_' and before '.csv').
-        For each file, the curve of current vs. voltage is plotted:
-          - NMOS: I(VDSM) vs. V(VDS)
-          - PMOS: I(VSDM) vs. V(VSD)
+        This method searches for the .raw files written by the gate-sweep simulation in the sweep
+        results folder (default: circuits/<device_type>/bin_<bin_number>/results_IV_IDS_vs_VDS_for_VG_sweep
+        for NMOS, results_IV_ISD_vs_VSD_for_VG_sweep for PMOS). Each file is memory-mapped and the
+        measured current i(vdsm) is plotted against the sweep vector:
+          - NMOS: IDS vs. VDS
+          - PMOS: ISD vs. VSD
 
+        The VGS value is extracted from the filename (the text after the last '_' and before '.raw').
         All curves are added to a single interactive plot with a legend.
 
         :param device_type: 'nch' for NMOS or 'pch' for PMOS.
         :param bin_number: The bin number used in the simulation.
-        :param csv_folder: (Optional) Folder where CSV files are located. Defaults to:
-                           circuits/<device_type>/bin_<bin_number>/sweep_IV_results
+        :param csv_folder: (Optional) Folder where the result files are located.
+        :param result: (Optional) SweepResult returned by simulate_iv_vds() (or the device-specific
+                       methods); when given, no file is read.
         :return: The PyQtGraph window object.
         """
-        import os
-        import re
-        import pandas as pd
         import pyqtgraph as pg
         from PyQt5 import QtWidgets
         import sys
 
         device_type = device_type.lower()
-        if csv_folder is None:
-            if device_type == 'nch': csv_folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_IDS_vs_VDS_for_VG_sweep")
-            else: csv_folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_ISD_vs_VSD_for_VG_sweep")
-        if not os.path.exists(csv_folder):
-            print(f"CSV folder {csv_folder} not found. Please run the IV VDS simulation first.")
-            return
-
-        csv_files = [f for f in os.listdir(csv_folder) if f.endswith(".csv")]
-        csv_files.sort()
-        if not csv_files:
-            print(f"No CSV files found in {csv_folder}. Please run the simulation first.")
-            return
+        if result is not None:
+            curves = [(f"{bias:g}", x, y) for bias, x, y in result.curves()]
+        else:
+            curves = self._read_family_raw_files(device_type, bin_number, csv_folder)
+            if curves is None:
+                return
 
-        # For NMOS and PMOS, set appropriate column names.
+        gate, drain, current = AXIS_NAMES[device_type]
+        x_col = f"{drain} (V)"
+        y_col = f"{current} (A)"
         if device_type == "nch":
-            col_names = ["V(VDS)", "V(VGS)", "V(VDS)_dup", "I(IDS)", "V(VDS)_dup2", "I(VDSM)"]
-            x_col = "V(VDS)"
-            y_col = "I(VDSM)"
             plot_title = f"NMOS IDS vs VDS Curves (Bin {bin_number})"
         else:
-            col_names = ["V(VSD)", "V(VG)", "V(VSD)_dup", "I(ISD)", "V(VSD)_dup", "I(VSDM)"]
-            x_col = "V(VSD)"
-            y_col = "I(VSDM)"
             plot_title = f"PMOS ISD vs VSD Curves (Bin {bin_number})"
 
         # Get or create the QApplication.
@@ -299,28 +717,10 @@ class IceMOS_simulator_sky130:
         p.showGrid(x=True, y=True)
         legend = p.addLegend(offset=(10, 10))
 
-        # Process each CSV file.
-        for csv_file in csv_files:
-            # Extract VGS value: text after the last underscore before ".csv"
-            try:
-                vgs_str = csv_file.rsplit('_', 1)[-1].replace('.csv', '')
-            except Exception as e:
-                print(f"Error extracting VGS from {csv_file}: {e}")
-                continue
-
-            csv_path = os.path.join(csv_folder, csv_file)
-            try:
-                df = pd.read_csv(csv_path, sep=r'\s+', header=None)
-                df.columns = col_names
-
-            except Exception as e:
-                print(f"Error reading CSV file {csv_path}: {e}")
-                continue
-
+        for vgs_str, x_values, y_values in curves:
             # Plot current vs. voltage.
-            if device_type == 'nch': plot_name = f"VGS = {vgs_str} V"
-            else: plot_name = f"VSG = {vgs_str} V"
-            curve = p.plot(df[x_col].values, df[y_col].values,
+            plot_name = f"{gate} = {vgs_str} V"
+            curve = p.plot(x_values, y_values,
                            pen=pg.mkPen(width=2),
                            symbol='o', symbolSize=5)
             legend.addItem(curve, plot_name)
@@ -329,3 +729,41 @@ class IceMOS_simulator_sky130:
         if created_app:
             QtWidgets.QApplication.processEvents()
         return win
+
+    @staticmethod
+    def _read_family_raw_files(device_type, bin_number, csv_folder=None):
+        """
+        Read the gate-sweep .raw files of a bin (default folder under circuits/).
+
+        The VGS value is extracted from the filename (the text after the last '_' and before '.raw').
+
+        :return: List of (VGS text, x, y) tuples, or None if there is nothing to read.
+        """
+        if csv_folder is None:
+            if device_type == 'nch': csv_folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_IDS_vs_VDS_for_VG_sweep")
+            else: csv_folder = os.path.join("circuits", device_type, f"bin_{bin_number}", "results_IV_ISD_vs_VSD_for_VG_sweep")
+        if not os.path.exists(csv_folder):
+            print(f"Results folder {csv_folder} not found. Please run the IV VDS simulation first.")
+            return None
+
+        raw_files = [f for f in os.listdir(csv_folder) if f.endswith(".raw")]
+        raw_files.sort()
+        if not raw_files:
+            print(f"No raw files found in {csv_folder}. Please run the simulation first.")
+            return None
+
+        y_vector = FAMILY_VECTORS[device_type][2]
+        curves = []
+        for raw_file in raw_files:
+            vgs_str = raw_file.rsplit('_', 1)[-1].replace('.raw', '')
+            raw_path = os.path.join(csv_folder, raw_file)
+            try:
+                plot = read_raw_plot(raw_path)
+            except (OSError, ValueError) as e:
+                print(f"Error reading raw file {raw_path}: {e}")
+                continue
+            try:
+                curves.append((vgs_str, plot.scale, plot[y_vector]))
+            except KeyError as e:
+                print(f"Error reading raw file {raw_path}: {e}")
+        return curves
@@ -0,0 +1,231 @@
+"""
+IceMOS_sky130_speculative.py
+
+This module pre-simulates the values a parameter slider is likely to reach next, so that the
+curve is already in the result cache when the slider lands there.
+
+SliderMotionPredictor extrapolates the slider position from its recent motion (direction and
+speed) and proposes a few candidate values on the slider grid, plus the neighbours of the
+current value when the slider is at rest. SpeculativeExecutor writes, for each candidate, a
+model card equal to what 'Update Modified LIB' would produce for that value into a sandbox
+circuit folder, and simulates the active sweep there as low-priority (batch) jobs on the
+scheduler. The sandbox netlists and model cards are identical in content to the real ones, so
+the results are stored under the same cache keys the real simulation will look up.
+
+Every parameter or sweep change bumps a generation counter: jobs of an older generation are
+cancelled (queued jobs are dropped, running ngspice processes are terminated).
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from IceMOS_sky130_param_handler import write_model_cards
+from IceMOS_sky130_scheduler import default_scheduler
+
+
+class SliderMotionPredictor:
+    """
+    Predicts the next slider values from the recent slider events.
+    """
+
+    def __init__(self, horizons=(0.1, 0.25, 0.5), window=0.5, history=8):
+        """
+        :param horizons: Look-ahead times in seconds at which the position is extrapolated.
+        :param window: Only the events of the last `window` seconds are used to estimate the speed.
+        :param history: Maximum number of events kept.
+        """
+        self.horizons = horizons
+        self.window = window
+        self.history = history
+        self.events = []
+
+    def reset(self):
+        self.events = []
+
+    def observe(self, value, timestamp=None):
+        """Record a slider event."""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self.events.append((timestamp, float(value)))
+        del self.events[:-self.history]
+
+    def velocity(self):
+        """Least-squares slope of the recent events, in value units per second (0 if unknown)."""
+        if len(self.events) < 2:
+            return 0.0
+        now = self.events[-1][0]
+        recent = [(t, v) for t, v in self.events if now - t <= self.window]
+        if len(recent) < 2:
+            return 0.0
+        n = len(recent)
+        t_mean = sum(t for t, _ in recent) / n
+        v_mean = sum(v for _, v in recent) / n
+        denominator = sum((t - t_mean) ** 2 for t, _ in recent)
+        if denominator <= 0.0:
+            return 0.0
+        return sum((t - t_mean) * (v - v_mean) for t, v in recent) / denominator
+
+    def predict(self, count=3, scale=None, minimum=None, maximum=None):
+        """
+        Propose the values to pre-simulate, most likely first.
+
+        :param count: Maximum number of values.
+        :param scale: Slider scale (slider positions per value unit). Candidates are snapped to the
+                      slider grid as position / scale, the exact value the slider will report.
+        :param minimum: (Optional) Lowest allowed value.
+        :param maximum: (Optional) Highest allowed value.
+        :return: List of candidate values (never includes the current value).
+        """
+        if not self.events:
+            return []
+        current = self.events[-1][1]
+        last_step = abs(current - self.events[-2][1]) if len(self.events) > 1 else 0.0
+        grid = 1.0 / scale if scale else (last_step or abs(current) * 0.01 or 1e-3)
+        step = max(last_step, grid)
+        speed = self.velocity()
+
+        raw = []
+        if speed != 0.0:
+            direction = 1.0 if speed > 0 else -1.0
+            raw.append(current + direction * step)
+            raw.extend(current + speed * horizon for horizon in self.horizons)
+            # The user may overshoot and come back by one step.
+            raw.append(current - direction * step)
+        else:
+            for k in range(1, count + 1):
+                raw.extend([current + k * step, current - k * step])
+
+        candidates = []
+        for value in raw:
+            if scale:
+                value = round(value * scale) / scale
+            if minimum is not None:
+                value = max(value, minimum)
+            if maximum is not None:
+                value = min(value, maximum)
+            if value != current and value not in candidates:
+                candidates.append(value)
+        return candidates[:count]
+
+
+class SpeculativeExecutor:
+    """
+    Pre-simulates predicted parameter values on idle scheduler slots.
+    """
+
+    def __init__(self, original_model_file, device_type, bin_number, lib_file_path,
+                 scheduler=None, result_cache=None, sandbox_root=os.path.join("circuits", ".speculative"),
+                 max_candidates=3, simulator_options=None):
+        """
+        :param original_model_file: Path to the original SPICE model file (used by the netlist generator).
+        :param device_type: 'nch' or 'pch'.
+        :param bin_number: Bin being calibrated.
+        :param lib_file_path: Path of the bin's '_original.lib' model card (the base of the modified card).
+        :param scheduler: (Optional) SimulationScheduler; defaults to the shared one.
+        :param result_cache: (Optional) SimulationResultCache shared with the interactive simulator.
+        :param sandbox_root: Folder holding one circuit root per speculative slot.
+        :param max_candidates: Number of values pre-simulated per slider move.
+        :param simulator_options: (Optional) Extra keyword arguments for IceMOS_simulator_sky130.
+        """
+        self.original_model_file = original_model_file
+        self.device_type = device_type.lower()
+        self.bin_number = bin_number
+        self.lib_file_path = lib_file_path
+        self.scheduler = scheduler or default_scheduler()
+        self.result_cache = result_cache
+        self.sandbox_root = sandbox_root
+        self.max_candidates = max_candidates
+        self.simulator_options = simulator_options or {}
+        self.owner = f"speculative-{id(self)}"
+        self.generation = 0
+        self.parameters = {}
+        self.sweep = None
+        self.predictor = SliderMotionPredictor()
+        self.active_parameter = None
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def set_parameters(self, parameters):
+        """
+        Set the full parameter state ({name: value or {"value": ...}}) the modified card is built from.
+        """
+        self.parameters = {name: (entry["value"] if isinstance(entry, dict) else entry)
+                           for name, entry in parameters.items()}
+
+    def set_sweep(self, kind, **sweep_kwargs):
+        """
+        Set the sweep the simulation window is showing.
+
+        :param kind: 'iv' (iv_curve arguments) or 'iv_vds' (iv_vds_curves arguments).
+        """
+        sweep = (kind, tuple(sorted(sweep_kwargs.items())))
+        if sweep != self.sweep:
+            self.sweep = sweep
+            self.cancel()
+
+    def on_parameter_changed(self, param, value, scale=None, minimum=None, maximum=None):
+        """
+        Slider hook: record the move, cancel stale speculation and pre-simulate the predicted values.
+
+        :return: List of the values being pre-simulated.
+        """
+        if param != self.active_parameter:
+            self.active_parameter = param
+            self.predictor.reset()
+        self.predictor.observe(value)
+        self.parameters[param] = value
+        self.cancel()
+        if self.sweep is None:
+            return []
+        candidates = self.predictor.predict(self.max_candidates, scale=scale, minimum=minimum, maximum=maximum)
+        generation = self.generation
+        jobs = []
+        for slot, candidate in enumerate(candidates):
+            parameters = dict(self.parameters)
+            parameters[param] = candidate
+            jobs.append(self.scheduler.submit(self._speculate, generation, slot, parameters, self.sweep,
+                                              priority="batch", owner=self.owner,
+                                              resource=(self.owner, slot)))
+        with self._lock:
+            self.jobs = jobs
+        return candidates
+
+    def cancel(self):
+        """Drop every speculation of the current generation."""
+        with self._lock:
+            self.generation += 1
+            jobs, self.jobs = self.jobs, []
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        shutil.rmtree(self.sandbox_root, ignore_errors=True)
+
+    def _speculate(self, generation, slot, parameters, sweep):
+        """Scheduler job: simulate the sweep for one candidate parameter set in its sandbox slot."""
+        if generation != self.generation:
+            return None
+        from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+        circuit_root = os.path.join(self.sandbox_root, f"slot_{slot}")
+        self._write_model_card(circuit_root, parameters)
+        options = dict(self.simulator_options)
+        if self.result_cache is not None:
+            options["result_cache"] = self.result_cache
+        simulator = IceMOS_simulator_sky130(self.original_model_file, circuit_root=circuit_root, **options)
+        simulator.runner.verbose = False
+        kind, sweep_kwargs = sweep
+        sweep_kwargs = dict(sweep_kwargs)
+        sweep_kwargs.setdefault("bin_number", self.bin_number)
+        if kind == "iv":
+            return simulator.iv_curve(self.device_type, **sweep_kwargs)
+        return simulator.iv_vds_curves(self.device_type, **sweep_kwargs)
+
+    def _write_model_card(self, circuit_root, parameters):
+        """
+        Write the sandbox '_original.lib' and '_modified.lib' cards the same way
+        MainWindow.update_modified_lib() writes the real ones.
+        """
+        write_model_cards(circuit_root, self.device_type, self.bin_number, self.lib_file_path, parameters)
@@ -0,0 +1,450 @@
+"""
+IceMOS_sky130_surrogate.py
+
+This module previews the simulated curves of a slider move in milliseconds, with a cheap model of
+the simulator fitted over the slider ranges, while the real simulation runs in the background.
+
+The pieces:
+  - RadialBasisModel: radial basis interpolation (cubic, thin-plate or Gaussian kernel with a
+    linear polynomial tail) of vector outputs over the unit cube.
+  - LegendreChaos: polynomial chaos expansion (total-degree Legendre polynomials, least squares),
+    the polynomial alternative for smooth responses.
+  - CurveSurrogate: maps parameter vectors to simulated curves. It models log10 of the current
+    magnitude at every sweep point, so decades of subthreshold current weigh as much as the on
+    current, and can be refined with every confirmed simulation.
+  - build_surrogate: Latin hypercube sample of the parameter box, simulated in one ngspice launch
+    (a device copy per sample, see IceMOS_sky130_batch_jacobian), fitted into a CurveSurrogate.
+  - SurrogatePreview: the calibrator hook. It trains the surrogate for the selected parameters and
+    sweep as a batch job on the scheduler, answers preview() from it, and confirm() simulates the
+    current values for real in a sandbox folder and adds the result to the surrogate.
+
+    surrogate = build_surrogate(model, ["vth0", "u0"], [0.3, 0.01], [0.7, 0.06], seed=0)
+    for vg, x, y in surrogate.predict({"vth0": 0.52, "u0": 0.033}):
+        print(vg, y[-1])
+"""
+
+import itertools
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from IceMOS_sky130_batch_jacobian import BatchedJacobian
+from IceMOS_sky130_fitting import SimulatorModel
+from IceMOS_sky130_global_opt import latin_hypercube
+from IceMOS_sky130_scheduler import default_scheduler
+
+
+def _distances(a, b):
+    return np.sqrt(np.maximum(np.sum(a ** 2, axis=1)[:, None] + np.sum(b ** 2, axis=1)[None, :] - 2.0 * a @ b.T,
+                              0.0))
+
+
+class RadialBasisModel:
+    """
+    Radial basis interpolation of vector values over points of the unit cube.
+    """
+
+    kernels = {
+        "cubic": lambda r, epsilon: r ** 3,
+        "thin_plate": lambda r, epsilon: np.where(r > 0, r ** 2 * np.log(np.where(r > 0, r, 1.0)), 0.0),
+        "gaussian": lambda r, epsilon: np.exp(-(epsilon * r) ** 2),
+    }
+
+    def __init__(self, points, values, kernel="cubic", epsilon=1.0, smoothing=0.0):
+        """
+        :param points: Array (n, d) of sample points in [0, 1]^d.
+        :param values: Array (n, m) of sample values.
+        :param kernel: 'cubic', 'thin_plate' or 'gaussian'.
+        :param epsilon: Shape parameter of the Gaussian kernel.
+        :param smoothing: Added to the kernel diagonal (0 interpolates the samples exactly).
+        :raises ValueError: If the kernel is unknown or there are too few samples for the linear tail.
+        """
+        if kernel not in self.kernels:
+            raise ValueError(f"Unknown kernel '{kernel}'; expected one of {sorted(self.kernels)}.")
+        self.points = np.asarray(points, dtype=float)
+        values = np.asarray(values, dtype=float)
+        n, d = self.points.shape
+        if n < d + 1:
+            raise ValueError(f"A radial basis model of {d} parameters needs at least {d + 1} samples, got {n}.")
+        self.kernel = kernel
+        self.epsilon = epsilon
+        A = self.kernels[kernel](_distances(self.points, self.points), epsilon) + smoothing * np.eye(n)
+        P = np.hstack([np.ones((n, 1)), self.points])
+        system = np.block([[A, P], [P.T, np.zeros((d + 1, d + 1))]])
+        rhs = np.vstack([values, np.zeros((d + 1, values.shape[1]))])
+        try:
+            coefficients = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            # Repeated samples make the system singular.
+            coefficients = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        self.weights, self.tail = coefficients[:n], coefficients[n:]
+
+    def __call__(self, points):
+        """:return: Array (k, m) of values at the points (k, d)."""
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        K = self.kernels[self.kernel](_distances(points, self.points), self.epsilon)
+        return K @ self.weights + np.hstack([np.ones((len(points), 1)), points]) @ self.tail
+
+
+class LegendreChaos:
+    """
+    Polynomial chaos expansion of vector values over the unit cube: least-squares fit of the
+    Legendre polynomials of total degree <= `degree` (orthogonal for uniformly distributed parameters).
+    """
+
+    def __init__(self, points, values, degree=2):
+        """
+        :param points: Array (n, d) of sample points in [0, 1]^d.
+        :param values: Array (n, m) of sample values.
+        :param degree: Total degree of the expansion.
+        :raises ValueError: If there are fewer samples than polynomials.
+        """
+        points = np.asarray(points, dtype=float)
+        d = points.shape[1]
+        self.degree = degree
+        self.indices = [index for index in itertools.product(range(degree + 1), repeat=d) if sum(index) <= degree]
+        if len(points) < len(self.indices):
+            raise ValueError(f"A degree {degree} expansion of {d} parameters needs at least {len(self.indices)} "
+                             f"samples, got {len(points)}.")
+        self.coefficients = np.linalg.lstsq(self._basis(points), np.asarray(values, dtype=float), rcond=None)[0]
+
+    def _basis(self, points):
+        t = 2.0 * np.atleast_2d(points) - 1.0
+        # legendre[k][:, j] = P_k(t_j)
+        legendre = [np.ones_like(t), t]
+        for k in range(1, self.degree):
+            legendre.append(((2 * k + 1) * t * legendre[k] - k * legendre[k - 1]) / (k + 1))
+        return np.column_stack([np.prod([legendre[k][:, j] for j, k in enumerate(index)], axis=0)
+                                for index in self.indices])
+
+    def __call__(self, points):
+        """:return: Array (k, m) of values at the points (k, d)."""
+        return self._basis(np.asarray(points, dtype=float)) @ self.coefficients
+
+
+SURROGATES = {"rbf": RadialBasisModel, "chaos": LegendreChaos}
+
+
+class CurveSurrogate:
+    """
+    Surrogate of a SimulatorModel: the simulated curves as a function of the parameter vector.
+    """
+
+    def __init__(self, names, lower, upper, method="rbf", floor=1e-15, **options):
+        """
+        :param names: Names of the parameters, in the order of the parameter vectors.
+        :param lower: Lower end of every parameter range.
+        :param upper: Upper end of every parameter range.
+        :param method: 'rbf' (RadialBasisModel) or 'chaos' (LegendreChaos).
+        :param floor: Current magnitudes are clipped to this value before taking logarithms (A).
+        :param options: Keyword arguments of the model (kernel, smoothing, degree, ...).
+        :raises ValueError: If the method is unknown or a range is empty.
+        """
+        if method not in SURROGATES:
+            raise ValueError(f"Unknown surrogate '{method}'; expected one of {sorted(SURROGATES)}.")
+        self.names = list(names)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        if np.any(self.upper <= self.lower):
+            raise ValueError("Every parameter range of the surrogate must have max > min.")
+        self.method = method
+        self.floor = floor
+        self.options = options
+        self.layout = None  # [(vg, x), ...] of the modelled curves
+        self.points = np.empty((0, len(self.names)))
+        self.values = None
+        self.signs = None
+        self.model = None
+
+    @property
+    def samples(self):
+        return len(self.points)
+
+    def _vector(self, parameters):
+        if isinstance(parameters, dict):
+            parameters = [parameters[name] for name in self.names]
+        return np.asarray(parameters, dtype=float)
+
+    def _unit(self, x):
+        return (np.atleast_2d(x) - self.lower) / (self.upper - self.lower)
+
+    def _flatten(self, curves):
+        """Currents of curves with the surrogate's layout, concatenated (None if the layout differs)."""
+        if len(curves) != len(self.layout):
+            return None
+        for (vg, x, _), (layout_vg, layout_x) in zip(curves, self.layout):
+            if (vg is None) != (layout_vg is None) or len(x) != len(layout_x) or \
+                    (vg is not None and abs(vg - layout_vg) > 1e-9):
+                return None
+        return np.concatenate([np.asarray(y, dtype=float) for _, _, y in curves])
+
+    def fit(self, points, curves):
+        """
+        Fit the surrogate to simulated samples. Failed samples (non-finite currents) are skipped.
+
+        :param points: Parameter vectors (or dicts) of the samples.
+        :param curves: Simulated curves of every sample, as SimulatorModel returns them.
+        :return: self
+        :raises ValueError: If no sample can be used.
+        """
+        kept_points, currents = [], []
+        for point, sample in zip(points, curves):
+            if self.layout is None and sample:
+                self.layout = [(vg, np.asarray(x, dtype=float)) for vg, x, _ in sample]
+            y = self._flatten(sample) if self.layout is not None else None
+            if y is None or not np.all(np.isfinite(y)):
+                continue
+            kept_points.append(self._vector(point))
+            currents.append(y)
+        if not currents:
+            raise ValueError("No usable sample to fit the surrogate.")
+        self.points = np.array(kept_points)
+        currents = np.array(currents)
+        # The sign of each current (PMOS currents are negative) is taken from the samples; the
+        # model works on the magnitude in decades.
+        self.signs = np.sign(np.median(currents, axis=0))
+        self.signs[self.signs == 0] = 1.0
+        self.values = np.log10(np.maximum(np.abs(currents), self.floor))
+        self._refit()
+        return self
+
+    def _refit(self):
+        self.model = SURROGATES[self.method](self._unit(self.points), self.values, **self.options)
+
+    def add(self, parameters, curves):
+        """
+        Refine the surrogate with one more simulated sample.
+
+        :return: True if the sample was used.
+        """
+        y = self._flatten(curves)
+        if y is None or not np.all(np.isfinite(y)):
+            return False
+        self.points = np.vstack([self.points, self._vector(parameters)])
+        self.values = np.vstack([self.values, np.log10(np.maximum(np.abs(y), self.floor))])
+        self._refit()
+        return True
+
+    def predict(self, parameters):
+        """
+        :param parameters: Parameter vector or dict {name: value}.
+        :return: Predicted curves, as SimulatorModel returns them.
+        """
+        y = self.signs * 10.0 ** self.model(self._unit(self._vector(parameters)))[0]
+        curves, start = [], 0
+        for vg, x in self.layout:
+            curves.append((vg, x, y[start:start + len(x)]))
+            start += len(x)
+        return curves
+
+    def error(self, parameters, curves):
+        """:return: Largest difference in decades between the prediction and simulated curves."""
+        y = self._flatten(curves)
+        if y is None:
+            raise ValueError("The curves do not have the layout of the surrogate.")
+        predicted = np.concatenate([p for _, _, p in self.predict(parameters)])
+        return float(np.max(np.abs(np.log10(np.maximum(np.abs(predicted), self.floor)) -
+                                   np.log10(np.maximum(np.abs(y), self.floor)))))
+
+
+def build_surrogate(model, names, lower, upper, samples=None, method="rbf", seed=None, **options):
+    """
+    Sample the parameter box with a Latin hypercube, simulate the samples and fit a CurveSurrogate.
+
+    The samples are simulated in one ngspice launch as one multi-device netlist, or one by one if
+    the sweep netlist cannot be batched.
+
+    :param model: SimulatorModel of the sweep (the other parameters are taken from its base parameters).
+    :param samples: Number of samples; defaults to 10 per parameter.
+    :param seed: (Optional) Seed of the sample.
+    :param options: Keyword arguments of CurveSurrogate (floor, kernel, degree, ...).
+    :return: CurveSurrogate.
+    """
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    samples = samples or 10 * len(names)
+    points = lower + latin_hypercube(samples, len(names), np.random.default_rng(seed)) * (upper - lower)
+    try:
+        curves = BatchedJacobian(model, None, names, tag="surrogate").simulate(points)
+    except ValueError as e:
+        print(f"Surrogate samples simulated one by one: {e}")
+        curves = [model(dict(zip(names, p))) for p in points]
+    return CurveSurrogate(names, lower, upper, method=method, **options).fit(points, curves)
+
+
+class SurrogatePreview:
+    """
+    Surrogate previews of the calibrator's slider moves, trained and confirmed on the scheduler.
+    """
+
+    def __init__(self, original_model_file, device_type, bin_number, lib_file_path, scheduler=None,
+                 sandbox_root=os.path.join("circuits", ".surrogate"), samples=None, method="rbf",
+                 simulator_options=None, **options):
+        """
+        :param original_model_file: Path to the original SPICE model file (used by the netlist generator).
+        :param device_type: 'nch' or 'pch'.
+        :param bin_number: Bin being calibrated.
+        :param lib_file_path: Path of the bin's '_original.lib' model card.
+        :param scheduler: (Optional) SimulationScheduler; defaults to the shared one.
+        :param sandbox_root: Folder of the training and confirmation circuit roots.
+        :param samples: Number of training samples; defaults to 10 per parameter.
+        :param method: 'rbf' or 'chaos'.
+        :param simulator_options: (Optional) Extra keyword arguments for IceMOS_simulator_sky130.
+        :param options: Keyword arguments of CurveSurrogate.
+        """
+        self.original_model_file = original_model_file
+        self.device_type = device_type.lower()
+        self.bin_number = bin_number
+        self.lib_file_path = lib_file_path
+        self.scheduler = scheduler or default_scheduler()
+        self.sandbox_root = sandbox_root
+        self.samples = samples
+        self.method = method
+        self.simulator_options = simulator_options or {}
+        self.options = options
+        self.owner = f"surrogate-{id(self)}"
+        self.parameters = {}
+        self.sweep = None
+        self.surrogate = None
+        self.last_error = None
+        self._surrogate_key = None
+        self._train_job = None
+        self._confirm_job = None
+        self._lock = threading.Lock()
+
+    def set_parameters(self, parameters):
+        """Set the parameter state {name: {"value": ..., "min": ..., "max": ...}} of the tuner."""
+        self.parameters = {name: dict(entry) for name, entry in parameters.items()}
+
+    def set_sweep(self, kind, **sweep_kwargs):
+        """
+        Set the sweep the simulation window is showing.
+
+        :param kind: 'iv' (iv_curve arguments) or 'iv_vds' (iv_vds_curves arguments).
+        """
+        self.sweep = (kind, tuple(sorted(sweep_kwargs.items())))
+
+    def _free(self):
+        """Names of the parameters with a non-empty slider range."""
+        return [name for name, entry in self.parameters.items() if float(entry["max"]) > float(entry["min"])]
+
+    def _key(self):
+        """What a surrogate depends on: the sweep, the free parameters and their ranges, and the fixed values."""
+        free = self._free()
+        if self.sweep is None or not free:
+            return None
+        return (self.sweep, tuple((name, float(self.parameters[name]["min"]), float(self.parameters[name]["max"]))
+                                  for name in free),
+                tuple(sorted((name, float(entry["value"])) for name, entry in self.parameters.items()
+                             if name not in free)))
+
+    def _model(self, key, folder):
+        (kind, sweep), ranges, fixed = key
+        return SimulatorModel(self.original_model_file, self.device_type, self.bin_number, self.lib_file_path,
+                              kind, dict(sweep), base_parameters=dict(fixed),
+                              sandbox_root=os.path.join(self.sandbox_root, folder),
+                              simulator_options=self.simulator_options)
+
+    @property
+    def ready(self):
+        """True if the surrogate matches the current parameters and sweep."""
+        return self.surrogate is not None and self._surrogate_key == self._key()
+
+    def train(self):
+        """
+        Train a surrogate for the current parameters and sweep as a batch job (nothing is done if
+        one is ready or being trained).
+
+        :return: The training job, or None.
+        """
+        key = self._key()
+        if key is None:
+            return None
+        with self._lock:
+            if self._surrogate_key == key and (self.surrogate is not None or self._train_job is not None):
+                return self._train_job
+            self.surrogate, self._surrogate_key, old_job = None, key, self._train_job
+            self._train_job = self.scheduler.submit(self._train, key, priority="batch", owner=self.owner,
+                                                    resource=(self.owner, "train"))
+            job = self._train_job
+        if old_job is not None:
+            old_job.cancel()
+        return job
+
+    def _train(self, key):
+        """Scheduler job: sample, simulate and fit the surrogate of `key`."""
+        names = [name for name, _, _ in key[1]]
+        try:
+            surrogate = build_surrogate(self._model(key, "train"), names, [low for _, low, _ in key[1]],
+                                        [high for _, _, high in key[1]], samples=self.samples, method=self.method,
+                                        **self.options)
+        except (RuntimeError, ValueError):
+            # Let the next train() call try again.
+            with self._lock:
+                if self._surrogate_key == key:
+                    self._surrogate_key, self._train_job = None, None
+            raise
+        with self._lock:
+            if self._surrogate_key == key:
+                self.surrogate = surrogate
+                self._train_job = None
+        print(f"Surrogate of {', '.join(names)} trained on {surrogate.samples} samples.")
+        return surrogate
+
+    def preview(self):
+        """:return: Surrogate curves at the current values, or None if no surrogate is ready."""
+        with self._lock:
+            if not self.ready:
+                return None
+            surrogate = self.surrogate
+            return surrogate.predict({name: float(self.parameters[name]["value"]) for name in surrogate.names})
+
+    def confirm(self):
+        """
+        Simulate the current values for real as a batch job, which then refines the surrogate with
+        the result. A pending confirmation of older values is cancelled.
+
+        :return: The job, whose result is (curves, error of the surrogate in decades or None); None if
+                 there is nothing to simulate.
+        """
+        key = self._key()
+        if key is None:
+            return None
+        values = {name: float(entry["value"]) for name, entry in self.parameters.items()}
+        with self._lock:
+            old_job = self._confirm_job
+            self._confirm_job = self.scheduler.submit(self._confirm, key, values, priority="batch",
+                                                      owner=self.owner, resource=(self.owner, "confirm"))
+            job = self._confirm_job
+        if old_job is not None:
+            old_job.cancel()
+        return job
+
+    def _confirm(self, key, values):
+        """Scheduler job: simulate `values` and add them to the surrogate of `key`."""
+        names = [name for name, _, _ in key[1]]
+        curves = self._model(key, "confirm")({name: values[name] for name in names})
+        error = None
+        with self._lock:
+            if self.surrogate is not None and self._surrogate_key == key:
+                x = [values[name] for name in names]
+                error = self.surrogate.error(x, curves)
+                self.surrogate.add(x, curves)
+                self.last_error = error
+        return curves, error
+
+    def cancel(self):
+        """Drop the pending training and confirmation."""
+        with self._lock:
+            jobs = [self._train_job, self._confirm_job]
+            self._train_job = self._confirm_job = None
+            if self.surrogate is None:
+                self._surrogate_key = None
+        for job in jobs:
+            if job is not None:
+                job.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        shutil.rmtree(self.sandbox_root, ignore_errors=True)
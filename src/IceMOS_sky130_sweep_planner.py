@@ -0,0 +1,182 @@
+"""
+IceMOS_sky130_sweep_planner.py
+
+This module caches gate-sweep families (IDS vs. VDS for several VGS, or ISD vs. VSD for
+several VSG) one curve at a time and plans the smallest set of simulations needed to
+complete a requested family.
+
+A curve is identified by the hash of its sweep-independent inputs (model card, netlist
+template without its sweep lines, temperature, simulator version) and its gate voltage. The
+stored curve keeps every drain-voltage point simulated so far, so:
+  - widening the VG range only simulates the new gate values,
+  - refining the VD step only simulates the new drain points,
+and the new points are merged into the stored curve.
+"""
+
+import hashlib
+
+import numpy as np
+
+from IceMOS_sky130_result_cache import canonical_netlist, make_cache_key
+
+
+# Control-block lines that only describe the sweep; dropped from the template hash.
+_SWEEP_LINE_PREFIXES = ("let vgsval", "let step", "while ", "dc ", "wrdata ", "write ", "echo ")
+
+
+def sweep_independent_template(netlist_text):
+    """
+    Canonical netlist text with the sweep lines (loop bounds, dc ranges, output files) removed.
+    """
+    lines = [line for line in canonical_netlist(netlist_text).splitlines()
+             if not line.startswith(_SWEEP_LINE_PREFIXES)]
+    return "\n".join(lines)
+
+
+def family_key(model_card, netlist_text, temperature, version):
+    """
+    Hash of everything that determines a family except its sweep ranges.
+    """
+    return make_cache_key(model_card, sweep_independent_template(netlist_text), "per-curve", temperature, version)
+
+
+def curve_key(family, vg):
+    """
+    Cache key of the curve of a family at one gate voltage (rounded so that accumulated
+    sweep values such as 0.30000000000000004 map to the same curve as 0.3).
+    """
+    return hashlib.sha256(f"{family}:vg={round(float(vg), 9)!r}".encode('utf-8')).hexdigest()
+
+
+def arithmetic_runs(values, rel_tol=1e-6):
+    """
+    Split sorted values into maximal arithmetic progressions.
+
+    :param values: Sorted list of floats.
+    :return: List of (start, stop, step, count) tuples; single values get step 0.
+    """
+    runs = []
+    i = 0
+    n = len(values)
+    while i < n:
+        if i + 1 >= n:
+            runs.append((values[i], values[i], 0.0, 1))
+            break
+        step = values[i + 1] - values[i]
+        j = i + 1
+        while j + 1 < n and abs((values[j + 1] - values[j]) - step) <= rel_tol * max(abs(step), 1e-12):
+            j += 1
+        runs.append((values[i], values[j], step, j - i + 1))
+        i = j + 1
+    return runs
+
+
+class SweepTask:
+    """
+    One simulation to run: a gate-voltage progression crossed with a drain-voltage progression.
+    """
+
+    def __init__(self, vg_values, vd_values):
+        self.vg_values = list(vg_values)
+        self.vd_values = list(vd_values)
+
+    def sweep_arguments(self):
+        """
+        Start/stop/step arguments for the netlist generator.
+
+        The gate loop in the netlists compares 'vgsval <= stop' exactly after accumulating the step,
+        so the stop value is put half a step beyond the last gate voltage.
+        """
+        vg_step = self.vg_values[1] - self.vg_values[0] if len(self.vg_values) > 1 else 1.0
+        vd_step = self.vd_values[1] - self.vd_values[0] if len(self.vd_values) > 1 else 1.0
+        return {"vg_start": self.vg_values[0], "vg_stop": self.vg_values[-1] + 0.5 * vg_step, "vg_step": vg_step,
+                "vd_start": self.vd_values[0], "vd_stop": self.vd_values[-1], "vd_step": vd_step}
+
+    def __repr__(self):
+        return f"SweepTask(vg={self.vg_values}, vd={len(self.vd_values)} points)"
+
+
+class CurveStore:
+    """
+    Per-curve view over a SimulationResultCache.
+    """
+
+    def __init__(self, cache):
+        """
+        :param cache: SimulationResultCache holding the curves.
+        """
+        self.cache = cache
+
+    def load(self, family, vg):
+        """:return: Tuple (vd, current) of the stored curve, or None."""
+        hit = self.cache.get(curve_key(family, vg))
+        if hit is None:
+            return None
+        arrays, _ = hit
+        return arrays["vd"], arrays["current"]
+
+    def merge(self, family, vg, vd, current):
+        """
+        Merge newly simulated points into the stored curve. NaN points (failed simulations) are not
+        stored so that they are retried next time.
+        """
+        vd = np.asarray(vd, dtype=float)
+        current = np.asarray(current, dtype=float)
+        keep = np.isfinite(current)
+        vd, current = vd[keep], current[keep]
+        stored = self.load(family, vg)
+        if stored is not None:
+            vd = np.concatenate([vd, stored[0]])
+            current = np.concatenate([current, stored[1]])
+        # New points come first, so np.unique's first occurrence keeps the fresh value.
+        _, index = np.unique(np.round(vd, 9), return_index=True)
+        self.cache.put(curve_key(family, vg), {"vd": vd[index], "current": current[index]},
+                       {"vg": float(vg)})
+
+    def assemble(self, family, vg_values, vd_values):
+        """
+        Assemble the requested family from stored curves.
+
+        :return: Tuple (current array of shape (len(vg_values), len(vd_values)), boolean mask of
+                 the points that were found).
+        """
+        vd_values = np.asarray(vd_values, dtype=float)
+        current = np.full((len(vg_values), len(vd_values)), np.nan)
+        found = np.zeros(current.shape, dtype=bool)
+        for i, vg in enumerate(vg_values):
+            stored = self.load(family, vg)
+            if stored is None or len(stored[0]) == 0:
+                continue
+            stored_vd, stored_current = stored
+            pos = np.searchsorted(stored_vd, vd_values)
+            pos = np.clip(pos, 0, len(stored_vd) - 1)
+            # Also consider the left neighbour: the closest stored point may be either side.
+            left = np.clip(pos - 1, 0, len(stored_vd) - 1)
+            pick = np.where(np.abs(stored_vd[left] - vd_values) < np.abs(stored_vd[pos] - vd_values), left, pos)
+            match = np.abs(stored_vd[pick] - vd_values) <= 1e-9 + 1e-9 * np.abs(vd_values)
+            current[i, match] = stored_current[pick[match]]
+            found[i] = match
+        return current, found
+
+    def plan(self, family, vg_values, vd_values):
+        """
+        Plan the simulations needed to complete a family.
+
+        Gate voltages missing the same drain points are grouped, and both gate and drain values are
+        split into arithmetic progressions so that each task maps onto one gate-loop netlist.
+
+        :return: List of SweepTask (empty if the family is fully cached).
+        """
+        _, found = self.assemble(family, vg_values, vd_values)
+        groups = {}
+        for i, vg in enumerate(vg_values):
+            missing = tuple(float(v) for v, ok in zip(vd_values, found[i]) if not ok)
+            if missing:
+                groups.setdefault(missing, []).append(float(vg))
+        tasks = []
+        for missing_vd, vgs in groups.items():
+            for vg_start, _, vg_step, vg_count in arithmetic_runs(sorted(vgs)):
+                vg_run = [vg_start + k * vg_step for k in range(vg_count)]
+                for vd_start, _, vd_step, vd_count in arithmetic_runs(list(missing_vd)):
+                    tasks.append(SweepTask(vg_run, [vd_start + k * vd_step for k in range(vd_count)]))
+        return tasks
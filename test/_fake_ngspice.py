@@ -0,0 +1,185 @@
+"""
+A stand-in for ngspice shared by the tests that run the simulator without the real one.
+
+The stand-in simulates the IV netlists (dc sweep of VGATE_src for NMOS, VGATE for PMOS) and the gate-sweep
+netlists (a 'while vgsval' loop around a dc sweep of the drain) holding one or more devices: each
+measurement source listed by wrdata gets current(vg, value) (current(vg, value, vd) in a gate sweep) of the
+device whose drain it feeds, where value(name) reads a parameter of that device's model card; the other
+vectors are written as 0. When the netlist has no sweep (a sensitivity netlist of
+IceMOS_sky130_sens_jacobian), its 'op' and 'sens' commands write ASCII plots of the current and of the
+derivatives returned by sensitivities(vg, value).
+
+Each test supplies only the source of its current function (and of its sensitivities):
+
+    with sandbox() as folder:
+        executable = write_fake(folder, TRANSFER_CURRENT)
+        ...
+        assert len(launches(folder)) == 1
+"""
+
+import contextlib
+import os
+import stat
+import sys
+import tempfile
+
+import numpy as np
+
+
+# current(vg, value, vd) of transfer_current().
+TRANSFER_CURRENT = """
+def current(vg, value, vd=None):
+    s = 0.05 * math.log1p(math.exp((vg - value("vth0")) / 0.05))
+    return 0.1 * value("u0") * s ** 2 * (1.0 if vd is None else math.tanh(vd / 0.2)) + 1e-13
+"""
+
+SCRIPT = r"""
+import math, re, sys
+if sys.argv[1] == "-v":
+    print("ngspice-44.2")
+    sys.exit(0)
+text = open(sys.argv[2]).read()
+library = open(re.search(r'\.include "\./(\S+)"', text).group(1)).read()
+cards = {re.match(r"\.model\s+(\S+)", chunk).group(1).lower(): chunk
+         for chunk in re.split(r"(?m)^(?=\.model)", library) if chunk.startswith(".model")}
+devices = {}
+for line in text.splitlines():
+    if line[:1] in ("M", "m"):
+        fields = line.split()
+        devices[fields[1].lower()] = (fields[0], fields[5])
+sources = {}
+for line in text.splitlines():
+    fields = line.split()
+    if line[:1] in ("V", "v") and len(fields) >= 3:
+        for node in fields[1:3]:
+            if node.lower() in devices:
+                sources[fields[0].lower()] = devices[node.lower()]
+
+
+def parameter(model, name):
+    return float(re.search(r"(?<!\w)" + name + r"\s*=\s*([^\s}]+)", cards[model.lower()]).group(1))
+
+
+def measured(vector, vg, vd=None):
+    device = sources.get(vector[2:-1].lower()) if vector.lower().startswith("i(") else None
+    if device is None:
+        return 0.0
+    value = lambda name: parameter(device[1], name)
+    return current(vg, value) if vd is None else current(vg, value, vd)
+
+
+def dc_values(start, stop, step):
+    values, x = [], start
+    while x <= stop + step * 1e-9:
+        values.append(x)
+        x += step
+    return values
+
+
+with open(LAUNCHES, "a") as f:
+    f.write(" ".join([sys.argv[2]] + [f"{name}={parameter(model, name)}" for _, model in devices.values()
+                                      for name in LOGGED]) + "\n")
+wrdata = re.search(r"wrdata (.*)", text)
+path, *vectors = wrdata.group(1).split() if wrdata else [None]
+loop = re.search(r"while vgsval <= (\S+)", text)
+if loop:
+    # The gate loop compares exactly, as ngspice does; the dc sweep inside it runs the drain.
+    vg = float(re.search(r"let vgsval = (\S+)", text).group(1))
+    step = float(re.search(r"let step = (\S+)", text).group(1))
+    vds = dc_values(*map(float, re.search(r"dc \S+ (\S+) (\S+) (\S+)", text).groups()))
+    while vg <= float(loop.group(1)):
+        with open(path.replace("{$&vgsval}", f"{vg:g}"), "w") as f:
+            for vd in vds:
+                f.write(" ".join(f" {vd:.12e} {measured(vector, vg, vd):.12e}" for vector in vectors) + " \n")
+        vg = vg + step
+    sys.exit(0)
+sweep = re.search(r"dc VGATE(?:_src)? (\S+) (\S+) (\S+)", text)
+if sweep:
+    with open(path, "w") as f:
+        for vg in dc_values(*map(float, sweep.groups())):
+            f.write(" ".join(f" {vg:.12e} {measured(vector, vg):.12e}" for vector in vectors) + " \n")
+    sys.exit(0)
+source = re.search(r"sens I\((\S+)\)", text).group(1)
+instance, model = sources[source.lower()]
+value = lambda name: parameter(model, name)
+vg, vd, plot = 0.0, None, None
+for line in text.split(".control")[1].split(".endc")[0].splitlines():
+    fields = line.split()
+    if fields[:1] == ["alter"] and fields[1].lower().startswith("vgate"):
+        vg = float(fields[-1])
+    elif fields[:1] == ["alter"]:
+        vd = float(fields[-1])
+    elif fields[:1] == ["op"]:
+        plot = ("Operating Point", [(f"i({source})", "current", measured(f"i({source})", vg, vd))])
+    elif fields[:1] == ["sens"]:
+        plot = ("Sensitivity Analysis", [(f"{instance}:w", "unknown", 1.0)] +
+                [(f"{model}:{name}", "unknown", d) for name, d in sensitivities(vg, value).items()])
+    elif fields[:1] == ["write"]:
+        with open(fields[1], "a") as f:
+            f.write(f"Title: fake\nPlotname: {plot[0]}\nFlags: real\nNo. Variables: {len(plot[1])}\n")
+            f.write("No. Points: 1\nVariables:\n")
+            for i, (name, kind, _) in enumerate(plot[1]):
+                f.write(f"\t{i}\t{name}\t{kind}\n")
+            f.write("Values:\n")
+            for i, (_, _, d) in enumerate(plot[1]):
+                f.write(f" {'0' if i == 0 else ''}\t{d:.15e}\n")
+"""
+
+
+def transfer_current(vg, vth0, u0, vd=None):
+    """
+    Smooth subthreshold-to-square-law transfer curve (the current of TRANSFER_CURRENT); with a drain
+    voltage vd, the output curve at gate voltage vg.
+    """
+    saturation = 1.0 if vd is None else np.tanh(np.asarray(vd) / 0.2)
+    return 0.1 * u0 * (0.05 * np.log1p(np.exp((vg - vth0) / 0.05))) ** 2 * saturation + 1e-13
+
+
+def write_fake(folder, current, sensitivities="", logged=(), name="ngspice"):
+    """
+    Write the stand-in to folder/name and return its path. Every launch is logged to
+    folder/launches.txt (see launches()).
+
+    :param current: Source of 'def current(vg, value)' (the math and re modules are imported).
+    :param sensitivities: Source of 'def sensitivities(vg, value)', returning {parameter: dI/dparameter}.
+    :param logged: Parameters whose card values are logged with each launch.
+    :param name: File name; 'ngspice' runs it when the folder is first on PATH.
+    """
+    executable = os.path.join(folder, name)
+    with open(executable, "w") as f:
+        f.write(f"#!{sys.executable}\n")
+        f.write(f"LAUNCHES = {os.path.join(folder, 'launches.txt')!r}\nLOGGED = {tuple(logged)!r}\n")
+        f.write(f"import math\n{current}\n{sensitivities}\n{SCRIPT}")
+    os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+    return executable
+
+
+def launches(folder):
+    """
+    :return: One line per launch: the netlist path, then 'name=value' for each logged parameter of each device.
+    """
+    path = os.path.join(folder, "launches.txt")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+@contextlib.contextmanager
+def sandbox(on_path=False):
+    """
+    Run in a fresh temporary folder, restoring the working directory (and PATH) afterwards.
+
+    :param on_path: Put the folder first on PATH, so that a stand-in named 'ngspice' is the one launched.
+    :return: Context manager yielding the folder.
+    """
+    cwd, path = os.getcwd(), os.environ["PATH"]
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        if on_path:
+            os.environ["PATH"] = folder + os.pathsep + path
+        try:
+            yield folder
+        finally:
+            os.environ["PATH"] = path
+            os.chdir(cwd)
@@ -0,0 +1,132 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_batch_jacobian import BatchedJacobian, batch_netlist
+from IceMOS_sky130_fitting import CurveResiduals, FiniteDifferenceJacobian, SimulatorModel, fit_parameters
+from _fake_ngspice import TRANSFER_CURRENT, launches, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+pch_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                              "../pdk_original_models/sky130_fd_pr__pfet_01v8.pm3.spice"))
+bin_1_pch_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), "circuits", "pch", "bin_1"))
+
+NETLIST = """.include "./bin_40_nch_modified.lib"
+.temp -269
+M1 net2 net1 0 0 sky130_fd_pr__nfet_01v8__model.40 L=0.15 W=0.42 nf=1 ad='int((nf+1)/2)*w/nf*0.29'
++pd='2*int((nf+1)/2)*(w/nf+0.29)' sa=0 sb=0 sd=0
+VGATE_src net1 GND 0
+V1 V1 GND 1.8
+V1_meas V1 net2 0
+.save i(V1_meas)
+.control
+dc VGATE_src 0.0 1.8 0.01
+wrdata results_IV_ID_vs_VG/IV_ID_vs_VG.csv I(V1_meas)
+write results_IV_ID_vs_VG/IV_ID_vs_VG.raw
+.endc
+.include /foss/pdks/sky130A/libs.tech/ngspice/corners/tt.spice
+.GLOBAL GND
+.end
+"""
+
+
+def test_batch_netlist_adds_device_copies():
+    text, sources, models = batch_netlist(NETLIST, 2, "bin_40_nch_jacobian.lib")
+    assert sources == ["V1_meas", "V1_meas_jacobian1", "V1_meas_jacobian2"]
+    assert models[2] == "sky130_fd_pr__nfet_01v8__model_jacobian2.40"
+    assert '.include "./bin_40_nch_jacobian.lib"' in text and "tt.spice" in text
+    assert "M1_jacobian2 net2_jacobian2 net1 0 0 sky130_fd_pr__nfet_01v8__model_jacobian2.40 L=0.15" in text
+    assert text.count("+pd=") == 3 and "V1_meas_jacobian1 V1 net2_jacobian1 0" in text
+    assert ("wrdata results_IV_ID_vs_VG/IV_ID_vs_VG_jacobian.csv I(V1_meas) I(V1_meas_jacobian1) "
+            "I(V1_meas_jacobian2)") in text
+    assert ".raw" not in text
+    # The copies go before the control block.
+    assert text.index("V1_meas_jacobian2 V1") < text.index(".control")
+
+
+def test_batched_jacobian_matches_finite_differences():
+    with sandbox() as folder:
+        executable = write_fake(folder, TRANSFER_CURRENT)
+        model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv",
+                               {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                               simulator_options={"result_cache": False})
+        model.simulator.runner.executable = executable
+        vg = np.linspace(0.1, 1.7, 17)
+        residuals = CurveResiduals([(None, vg, transfer_current(vg, 0.5, 0.035))])
+        names = ["vth0", "u0"]
+        x = np.array([0.45, 0.03])
+        lower, upper = np.array([0.3, 0.01]), np.array([0.7, 0.06])
+
+        def fun(p):
+            return residuals(model(dict(zip(names, p))))
+
+        r0 = fun(x)
+        jacobian = BatchedJacobian(model, residuals, names)
+        J = jacobian(fun, x, r0, lower, upper)
+        assert J.shape == (len(r0), 2) and jacobian.launches == 1 and jacobian.nfev == 2
+        assert len(launches(folder)) == 2
+        reference = FiniteDifferenceJacobian(step=1e-4)(fun, x, r0, lower, upper)
+        np.testing.assert_allclose(J, reference, rtol=2e-2, atol=1e-3)
+        # Steps follow the parameter scale.
+        np.testing.assert_allclose(jacobian.steps(x, lower, upper), [0.45e-3, 0.03e-3])
+        np.testing.assert_allclose(jacobian.steps([0.7, 0.0], lower, upper), [-0.7e-3, 0.05e-5])
+
+        parameters = {"vth0": {"value": 0.42664, "min": 0.3, "max": 0.7},
+                      "u0": {"value": 0.029497, "min": 0.01, "max": 0.06}}
+        jacobian = BatchedJacobian(model, residuals, names)
+        result = fit_parameters(model, residuals, parameters, max_nfev=40, jacobian=jacobian)
+        assert result.success, result.message
+        assert abs(result.parameters["vth0"] - 0.5) < 1e-3 and abs(result.parameters["u0"] - 0.035) < 1e-4
+        assert jacobian.launches == result.njev
+
+
+def test_batched_family_jacobian_matches_finite_differences():
+    # In a gate-sweep netlist the wrdata line sits inside the 'while vgsval' loop.
+    with open(os.path.join(bin_1_pch_folder, "netlist_IV_VSD_bin_1_modified.spice")) as f:
+        text, sources, _ = batch_netlist(f.read(), 2, "bin_1_pch_jacobian.lib")
+    assert sources == ["vdsM", "vdsM_jacobian1", "vdsM_jacobian2"]
+    assert ("    wrdata results_IV_ISD_vs_VSD_for_VG_sweep/p_mosfet_id_vs_vsd_{$&vgsval}_jacobian.csv I(vdsM) "
+            "I(vdsM_jacobian1) I(vdsM_jacobian2)\n    let vgsval") in text
+
+    with sandbox() as folder:
+        executable = write_fake(folder, TRANSFER_CURRENT)
+        sweep = {"vg_start": 0.6, "vg_stop": 1.8, "vg_step": 0.6, "vd_start": 0, "vd_stop": 1.8, "vd_step": 0.1}
+        model = SimulatorModel(pch_model_file, "pch", 1, os.path.join(bin_1_pch_folder, "bin_1_pch_original.lib"),
+                               "iv_vds", sweep, simulator_options={"result_cache": False})
+        model.simulator.runner.executable = executable
+        vd = np.linspace(0.1, 1.7, 17)
+        residuals = CurveResiduals([(vg, vd, transfer_current(vg, -0.95, 0.003, vd)) for vg in (0.6, 1.2, 1.8)])
+        names = ["vth0", "u0"]
+        x = np.array([-1.02, 0.0024424])
+        lower, upper = np.array([-1.3, 0.001]), np.array([-0.7, 0.005])
+
+        def fun(p):
+            return residuals(model(dict(zip(names, p))))
+
+        r0 = fun(x)
+        jacobian = BatchedJacobian(model, residuals, names)
+        J = jacobian(fun, x, r0, lower, upper)
+        assert J.shape == (3 * len(vd), 2) and jacobian.launches == 1 and len(launches(folder)) == 2
+        # Column 2k+1 of every gate voltage's file is copy k: each column follows its own parameter.
+        reference = FiniteDifferenceJacobian(step=1e-4)(fun, x, r0, lower, upper)
+        np.testing.assert_allclose(J, reference, rtol=2e-2, atol=1e-3)
+        assert np.all(np.abs(J) > 1e-3)
+
+
+def main():
+    test_batch_netlist_adds_device_copies()
+    test_batched_jacobian_matches_finite_differences()
+    test_batched_family_jacobian_matches_finite_differences()
+    print("All batched Jacobian tests passed.")
+
+
+if __name__ == '__main__':
+    main()
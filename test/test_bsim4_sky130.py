@@ -0,0 +1,90 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_bsim4 import BSIM4Device, BSIM4Model, BSIM4Simulator, load_model_card, parse_model_card
+
+# Reference results of ngspice-44.2 for the modified cards at -269 °C.
+circuits = os.path.join(os.path.dirname(__file__), "circuits")
+
+
+def reference(device_type, bin_number, *path):
+    return np.loadtxt(os.path.join(circuits, device_type, f"bin_{bin_number}", *path))
+
+
+def test_transfer_curves_match_ngspice():
+    # 0.1 % over the whole sweep: leakage floor (gmin, GIDL), 4 K subthreshold and strong inversion.
+    simulator = BSIM4Simulator(circuits)
+    for device_type, bin_number in (("nch", 40), ("pch", 1)):
+        data = reference(device_type, bin_number, "results_IV_ID_vs_VG", "IV_ID_vs_VG.csv")
+        result = simulator.iv_curve(device_type, bin_number, vgate_start=0, vgate_stop=1.8, vgate_step=0.01)
+        assert result.names == (("VGS", "IDS") if device_type == "nch" else ("VSG", "ISD"))
+        assert result.metadata["bin"] == bin_number and result.metadata["temperature"] == -269.0
+        np.testing.assert_allclose(result.sweep.values, data[:, 0], atol=1e-12)
+        np.testing.assert_allclose(result.current.values, data[:, 1], rtol=1e-3)
+
+
+def test_output_curves_match_ngspice():
+    # The ISD vs VSD reference is 2.6 % below ngspice's own ID vs VG result at the same bias
+    # (VSG = VSD = 1.8 V; it was simulated before the card's last edit), hence 4 %.
+    data = reference("pch", 1, "results_IV_ISD_vs_VSD_for_VG_sweep", "p_mosfet_id_vs_vsd_1.8.csv")
+    transfer = reference("pch", 1, "results_IV_ID_vs_VG", "IV_ID_vs_VG.csv")
+    assert abs(data[-1, 5] / transfer[-1, 1] - 1) > 0.02
+    family = BSIM4Simulator(circuits).iv_vds_curves("pch", 1, vg_start=1.6, vg_stop=1.8, vg_step=0.2, vd_step=0.01)
+    assert family.names == ("VSG", "VSD", "ISD")
+    np.testing.assert_allclose(family.bias.values, [1.6, 1.8])
+    for vg, vd, current in family.curves():
+        data = reference("pch", 1, "results_IV_ISD_vs_VSD_for_VG_sweep", f"p_mosfet_id_vs_vsd_{round(vg, 6):g}.csv")
+        np.testing.assert_allclose(vd, data[:, 0], atol=1e-12)
+        assert current[0] == 0.0
+        np.testing.assert_allclose(current[1:], data[1:, 5], rtol=0.04)
+
+
+def test_device_and_model():
+    lib_file_path = os.path.join(circuits, "nch", "bin_40", "bin_40_nch_original.lib")
+    name, polarity, parameters = parse_model_card(".model test nmos (\n* comment\n+ vth0 = 0.5 toxe=4n\n+ u0=2meg )\n")
+    assert (name, polarity, parameters) == ("test", "nmos", {"vth0": 0.5, "toxe": 4e-9, "u0": 2e6})
+    device = BSIM4Device(load_model_card(lib_file_path), 0.42, 0.15)
+    # Grids broadcast; a grid point equals its scalar evaluation.
+    vg, vd = np.meshgrid(np.linspace(0, 1.8, 7), np.linspace(-0.5, 1.8, 5))
+    grid = device.current(vg, vd)
+    assert grid.shape == (5, 7) and np.all(np.isfinite(grid))
+    assert grid[3, 4] == device.current(vg[3, 4], vd[3, 4])
+    # Source and drain swap for negative VDS: the channel current reverses.
+    assert device.current(1.8, -0.1) < 0 < device.current(1.8, 0.1)
+    try:
+        BSIM4Device(load_model_card(lib_file_path), 0.42, 0.01)
+        assert False, "Expected a ValueError."
+    except ValueError:
+        pass
+
+    model = BSIM4Model("nch", 40, lib_file_path, "iv_vds", {"vg_start": 0.6, "vg_stop": 1.8, "vg_step": 0.6},
+                       base_parameters={"u0": 0.03})
+    curves = model({"vth0": "0.5"})
+    assert [round(vg, 6) for vg, _, _ in curves] == [0.6, 1.2, 1.8] and model.evaluations == 1
+    assert len(curves[0][1]) == 19 and np.all(np.diff(curves[-1][2][1:]) > 0)
+    (_, x, low), = BSIM4Model("nch", 40, lib_file_path, "iv", {"vgate_step": 0.1})({"vth0": 0.5})
+    (_, _, high), = BSIM4Model("nch", 40, lib_file_path, "iv", {"vgate_step": 0.1})({"vth0": 0.6})
+    # Raising vth0 by 0.1 V delays the turn-on by one 0.1 V step.
+    assert len(x) == 19 and np.argmax(high > 1e-9) == np.argmax(low > 1e-9) + 1
+    try:
+        BSIM4Model("nch", 40, lib_file_path, "cv", {})
+        assert False, "Expected a ValueError."
+    except ValueError:
+        pass
+
+
+def main():
+    test_transfer_curves_match_ngspice()
+    test_output_curves_match_ngspice()
+    test_device_and_model()
+    print("All BSIM4 tests passed.")
+
+
+if __name__ == '__main__':
+    main()
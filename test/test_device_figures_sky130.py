@@ -0,0 +1,125 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_bsim4 import BSIM4Simulator
+from IceMOS_sky130_device_figures import (derivative_matrix, extract_figures, simulated_curves, stack_curves,
+                                          subthreshold_slope, threshold_constant_current, threshold_max_gm)
+from IceMOS_sky130_lab_catalog import LabCatalog
+from IceMOS_sky130_result_store import Curve
+
+circuits = os.path.join(os.path.dirname(__file__), "circuits")
+lab_pch = os.path.join(os.path.dirname(__file__), "mdm_proc_pch_bin_1")
+
+
+def test_stack_figures():
+    grid = np.linspace(0, 1.8, 181)
+    # Savitzky-Golay derivatives are exact for quadratics, including at the ends of the grid.
+    np.testing.assert_allclose(derivative_matrix(len(grid), 0.01) @ (3 * grid ** 2 - grid), 6 * grid - 1, atol=1e-9)
+    # 50 and 80 mV/decade exponentials reach 100 nA at 0.5 and 0.6 V.
+    current = np.vstack([1e-7 * 10 ** ((grid - 0.5) / 0.05), 1e-7 * 10 ** ((grid - 0.6) / 0.08)])
+    np.testing.assert_allclose(threshold_constant_current(grid, current, 1e-7), [0.5, 0.6])
+    np.testing.assert_allclose(threshold_constant_current(grid, current, [1e-7, 1e-9]), [0.5, 0.44])
+    np.testing.assert_allclose(subthreshold_slope(grid, current, 1e-3, noise_floor=1e-12), [50, 80])
+    # Curves already above the criterion at their first point have no threshold.
+    assert np.isnan(threshold_constant_current(grid, current, 1e-30)).all()
+    # Linear region: ID = k (VG - Vth - VD / 2) VD; saturation: ID = k (VG - Vth)^2.
+    linear = np.where(grid > 0.45, 1e-3 * (grid - 0.45) * 0.1, 0.0)
+    saturated = np.where(grid > 0.4, 1e-4 * (grid - 0.4) ** 2, 0.0)
+    assert np.isclose(threshold_max_gm(grid, linear[None], vd=0.1)[0], 0.4)
+    assert np.isclose(threshold_max_gm(grid, saturated[None], saturation=True)[0], 0.4)
+    # PMOS curves in the terminal convention and coarser grids give their own stacks of magnitudes.
+    stacks = stack_curves([(-grid, -current[0]), (grid, current[1]), (grid[::10], current[0, ::10])])
+    assert [indices for _, _, indices in stacks] == [[0, 1], [2]]
+    np.testing.assert_allclose(stacks[0][1], current)
+
+
+def transistor(vg, vth, k=1e-3, ss=0.05, W=1.0, L=0.1, vd=0.1):
+    """Exponential below 100 nA * W / L, linear-region current above (continuous at threshold)."""
+    criterion = 1e-7 * W / L
+    return np.where(vg < vth, criterion * 10 ** ((vg - vth) / ss), criterion + k * (vg - vth) * vd)
+
+
+def test_extract_figures_of_curves():
+    grid = np.linspace(0, 1.8, 181)
+    fields = dict(bin=None, temperature=-269.15, source="lab", attrs={"W": 1.0, "L": 0.1, "die": "d1"})
+    curves = [Curve(-grid, -transistor(grid, 0.5, vd=0.1), "pch", sweep="VG", vd=-0.1, vb=0.0, **fields),
+              Curve(-grid, -transistor(grid, 0.45, vd=1.8), "pch", sweep="VG", vd=-1.8, vb=0.0, **fields)]
+    for vg in (-1.2, -1.8):
+        curves.append(Curve(-grid, -(1e-4 * abs(vg) + 2e-6 * grid), "pch", sweep="VD", vg=vg, vb=0.0, **fields))
+    # Other currents, and another die at another body bias with its saturation curve only.
+    curves.append(Curve(-grid, -1e-9 * grid, "pch", sweep="VG", vd=-0.1, vb=0.0,
+                        **dict(fields, attrs={"W": 1.0, "L": 0.1, "die": "d1", "quantity": "IG"})))
+    other = Curve(-grid, -transistor(grid, 0.6, vd=1.8), "pch", sweep="VG", vd=-1.8, vb=1.5,
+                  **dict(fields, attrs={"W": 1.0, "L": 0.1, "die": "d2"}))
+    curves.append((other, other.x, other.y))
+
+    table = extract_figures(curves)
+    assert len(table) == 2
+    first, second = table.rows
+    assert first["die"] == "d1" and first["vb"] == 0.0 and second["die"] == "d2"
+    assert np.isclose(first["vth_lin"], 0.5) and np.isclose(first["vth_sat"], 0.45)
+    assert np.isclose(first["dibl"], 1e3 * 0.05 / 1.7)
+    assert np.isclose(first["ss"], 50) and np.isclose(first["gds"], 2e-6)
+    assert np.isclose(first["gm_lin"], 1e-3 * 0.1) and np.isclose(first["gm_sat"], 1e-3 * 1.8)
+    assert np.isclose(first["vth_gm_lin"], 0.5 - 1e-6 / 1e-4 - 0.05)
+    assert np.isclose(first["ion"], transistor(1.8, 0.45, vd=1.8))
+    assert np.isclose(first["on_off"], first["ion"] / first["ioff"])
+    assert np.isclose(second["vth_sat"], 0.6) and np.isnan(second["vth_lin"]) and np.isnan(second["dibl"])
+    assert np.isnan(second["gds"])
+
+    row_keys, column_keys, values = table.comparison("vth_sat", rows="die", columns=("source", "temperature"))
+    assert row_keys == [("d1",), ("d2",)] and column_keys == [("lab", -269)]
+    np.testing.assert_allclose(values, [[0.45], [0.6]])
+    assert len(table.select(vb=1.5)) == 1 and len(table.select(temperature=-269.0)) == 2
+    text = table.compare("dibl", rows="die")
+    assert text.splitlines()[0].split()[:3] == ["dibl", "(mV/V)", "temperature=-269"]
+    assert "-" in text.splitlines()[2].split()
+
+
+def test_lab_catalog_against_bsim4():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "mdm_proc_pch_bin_1")
+        shutil.copytree(lab_pch, root)
+        catalog = LabCatalog(root)
+        catalog.scan()
+        curves = catalog.load(sweep="IDVG") + catalog.load(sweep="IDVD")
+        simulator = BSIM4Simulator(circuits)
+        for model_type in ("modified", "original"):
+            curves += simulated_curves(simulator, "pch", 1, model_type)
+        table = extract_figures(curves)
+
+    lab = table.select(source="lab", vb=0.0).rows
+    assert len(lab) == 1 and lab[0]["bin"] == 1 and lab[0]["W"] == 1.68
+    # The low-drain threshold is higher at 4 K, the saturation one lowered by DIBL.
+    assert lab[0]["vth_lin"] > lab[0]["vth_sat"] > 0.9 and 100 < lab[0]["dibl"] < 200
+    assert lab[0]["ss"] < 40 and lab[0]["gds"] > 0 and lab[0]["on_off"] > 1e7
+    assert abs(lab[0]["vth_gm_lin"] - lab[0]["vth_lin"]) < 0.1
+    cold, warm = table.select(source="simulation", temperature=-269.0).rows[0], \
+        table.select(source="simulation", temperature=27.0).rows[0]
+    assert np.isnan(cold["dibl"]) and cold["vth_sat"] > warm["vth_sat"] and cold["ss"] < warm["ss"]
+    # The calibrated card reproduces the measured threshold within 0.1 V.
+    assert abs(cold["vth_sat"] - lab[0]["vth_sat"]) < 0.1
+    row_keys, column_keys, values = table.comparison("vth_sat", rows="source", columns="temperature",
+                                                     vb=(None, 0.0))
+    assert row_keys == [("lab",), ("simulation",)] and column_keys == [(-269,), (27,)]
+    assert np.isnan(values[0, 1]) and np.isclose(values[1, 0], cold["vth_sat"])
+    assert len(table.format().splitlines()) == len(table) + 1
+
+
+def main():
+    test_stack_figures()
+    test_extract_figures_of_curves()
+    test_lab_catalog_against_bsim4()
+    print("All device figure tests passed.")
+
+
+if __name__ == '__main__':
+    main()
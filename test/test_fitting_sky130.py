@@ -0,0 +1,149 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_fitting import (CurveResiduals, FiniteDifferenceJacobian, SimulatorModel, fit_parameters,
+                                   least_squares_fit)
+from _fake_ngspice import TRANSFER_CURRENT, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+pch_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                              "../pdk_original_models/sky130_fd_pr__pfet_01v8.pm3.spice"))
+bin_1_pch_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                  "circuits", "pch", "bin_1", "bin_1_pch_original.lib"))
+
+
+def fixture_current(vg, vth0, u0, nfactor):
+    """Transfer curve of FIXTURE_CURRENT, with a subthreshold slope set by nfactor."""
+    n = 0.03 * nfactor
+    return 0.1 * u0 * (n * np.log1p(np.exp((vg - abs(vth0)) / n))) ** 2 + 1e-13
+
+
+# The current of the stand-in for the IV netlists of both devices: fixture_current(vg, vth0, u0, nfactor).
+FIXTURE_CURRENT = """
+def current(vg, value):
+    n = 0.03 * value("nfactor")
+    return 0.1 * value("u0") * (n * math.log1p(math.exp((vg - abs(value("vth0"))) / n))) ** 2 + 1e-13
+"""
+
+
+def test_solver_recovers_parameters_within_bounds():
+    vg = np.linspace(0, 1.8, 37)
+    target = transfer_current(vg, 0.55, 0.04)
+    residuals = CurveResiduals([(None, vg, target)])
+    model = lambda p: [(None, vg, transfer_current(vg, p["vth0"], p["u0"]))]
+    # The compared target points are fixed by the first simulated curves (here a narrower sweep).
+    try:
+        residuals.target_masks()
+        assert False, "Expected a ValueError."
+    except ValueError:
+        pass
+    narrow = CurveResiduals([(None, vg, target)])
+    mask, = narrow.target_masks([(None, vg[:-2], target[:-2])])
+    assert mask.sum() == len(vg) - 2 and len(narrow(model({"vth0": 0.55, "u0": 0.04}))) == len(vg) - 2
+    parameters = {"vth0": {"value": 0.42, "min": 0.2, "max": 0.8}, "u0": {"value": 0.03, "min": 0.01, "max": 0.1}}
+    reports = []
+    result = fit_parameters(model, residuals, parameters, max_nfev=80, progress=reports.append)
+    assert result.success, result.message
+    assert abs(result.parameters["vth0"] - 0.55) < 1e-4 and abs(result.parameters["u0"] - 0.04) < 1e-5
+    assert result.rms < 1e-4 and result.nfev <= 80 and reports[-1].nfev <= result.nfev
+    assert all(cost_b <= cost_a for (_, cost_a), (_, cost_b) in zip(result.history, result.history[1:]))
+
+    # The optimum lies outside the bounds: the fit stops on the bound.
+    bounded = dict(parameters, vth0={"value": 0.42, "min": 0.2, "max": 0.5})
+    result = fit_parameters(model, residuals, bounded, max_nfev=80)
+    assert result.parameters["vth0"] == 0.5
+
+    # Evaluation budget and cancellation.
+    result = fit_parameters(model, residuals, parameters, max_nfev=7)
+    assert not result.success and result.nfev <= 7 and result.message.startswith("Maximum")
+    result = fit_parameters(model, residuals, parameters, progress=lambda progress: True)
+    assert result.message == "Cancelled" and result.iterations == 1
+
+
+def test_failed_evaluations_are_rejected():
+    calls = []
+
+    def fun(x):
+        calls.append(x[0])
+        # The "simulation" fails beyond 1.5.
+        return np.array([np.nan]) if x[0] > 1.5 else np.array([x[0] - 2.0])
+
+    jacobian = FiniteDifferenceJacobian()
+    result = least_squares_fit(fun, [0.0], [-5.0], [5.0], max_nfev=50, jacobian=jacobian)
+    assert result.x[0] <= 1.5 and result.cost < 0.5 * 2.0 ** 2
+    assert result.nfev == len(calls) and jacobian.nfev > 0 and abs(result.x[0] - 1.5) < 0.05
+
+
+def test_fit_through_simulator():
+    with sandbox() as folder:
+        executable = write_fake(folder, TRANSFER_CURRENT)
+        model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv",
+                               {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                               simulator_options={"result_cache": False})
+        model.simulator.runner.executable = executable
+        vg = np.linspace(0.1, 1.7, 17)
+        residuals = CurveResiduals([(None, vg, transfer_current(vg, 0.5, 0.035))])
+        parameters = {"vth0": {"value": 0.42664, "min": 0.3, "max": 0.7},
+                      "u0": {"value": 0.029497, "min": 0.01, "max": 0.06}}
+        result = fit_parameters(model, residuals, parameters, max_nfev=40)
+        assert result.success, result.message
+        assert abs(result.parameters["vth0"] - 0.5) < 1e-3 and abs(result.parameters["u0"] - 0.035) < 1e-4
+        assert model.evaluations == result.nfev
+        card = os.path.join("circuits", ".fitting", "nch", "bin_40", "bin_40_nch_modified.lib")
+        assert os.path.exists(card)
+
+
+def test_broyden_updates_on_fixtures():
+    # The bin 40 NMOS and bin 1 PMOS fixtures, fitted with a new Jacobian every iteration and with Broyden
+    # updates; the simulator calls of both are compared.
+    fixtures = [("nch", 40, original_model_file, bin_40_original, {"vth0": 0.5, "u0": 0.035, "nfactor": 1.4},
+                 {"vth0": {"value": 0.42664, "min": 0.3, "max": 0.7},
+                  "u0": {"value": 0.029497, "min": 0.01, "max": 0.06},
+                  "nfactor": {"value": 1.612, "min": 1.0, "max": 2.5}}),
+                ("pch", 1, pch_model_file, bin_1_pch_original, {"vth0": -0.95, "u0": 0.003, "nfactor": 2.1},
+                 {"vth0": {"value": -1.02, "min": -1.3, "max": -0.7},
+                  "u0": {"value": 0.0024424, "min": 0.001, "max": 0.005},
+                  "nfactor": {"value": 1.9, "min": 1.0, "max": 2.5}})]
+    with sandbox() as folder:
+        executable = write_fake(folder, FIXTURE_CURRENT)
+        calls = {}
+        for device, bin_number, model_file, lib, truth, parameters in fixtures:
+            vg = np.linspace(0.1, 1.7, 17)
+            for update in ("full", "broyden"):
+                model = SimulatorModel(model_file, device, bin_number, lib, "iv",
+                                       {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                                       simulator_options={"result_cache": False})
+                model.simulator.runner.executable = executable
+                residuals = CurveResiduals([(None, vg, fixture_current(vg, **truth))])
+                result = fit_parameters(model, residuals, parameters, max_nfev=150, jacobian_update=update)
+                assert result.success, (device, update, result.message)
+                assert result.rms < 1e-4, (device, update, result.describe())
+                for name, value in truth.items():
+                    assert abs(result.parameters[name] - value) < 1e-3 * abs(value), (device, update, name)
+                assert model.evaluations == result.nfev
+                calls[device, update] = result
+                print(f"{device} bin {bin_number} {update}: {result.describe()}")
+            full, broyden = calls[device, "full"], calls[device, "broyden"]
+            assert broyden.jacobian_updates > 0 and broyden.njev < full.njev
+            assert broyden.nfev < full.nfev
+
+
+def main():
+    test_solver_recovers_parameters_within_bounds()
+    test_failed_evaluations_are_rejected()
+    test_fit_through_simulator()
+    test_broyden_updates_on_fixtures()
+    print("All fitting tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_fitting import CurveResiduals, SimulatorModel
+from IceMOS_sky130_global_opt import (CMAES, DifferentialEvolution, PoolEvaluator, PopulationNetlistEvaluator,
+                                      global_fit, latin_hypercube, session_checkpoint)
+from IceMOS_sky130_scheduler import SimulationScheduler
+from _fake_ngspice import TRANSFER_CURRENT, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+
+
+def rastrigin(points):
+    """Multimodal test cost, global minimum 0 at (0.3, -0.2)."""
+    x = np.asarray(points) - np.array([0.3, -0.2])
+    return 10 * x.shape[1] + np.sum(x ** 2 - 10 * np.cos(2 * np.pi * x), axis=1)
+
+
+def test_latin_hypercube_strata():
+    sample = latin_hypercube(10, 3, np.random.default_rng(0))
+    for column in sample.T:
+        assert sorted(np.floor(column * 10).astype(int)) == list(range(10))
+
+
+def test_optimizers_find_global_minimum():
+    lower, upper = [-2.0, -2.0], [2.0, 2.0]
+    result = global_fit(rastrigin, lower, upper, method="de", max_evaluations=3000, seed=3, popsize=20)
+    assert result.cost < 1e-6 and np.allclose(result.x, [0.3, -0.2], atol=1e-3)
+    assert result.message == "Population converged" and result.evaluations <= 3000
+    sphere = lambda points: np.sum((np.asarray(points) - np.array([0.1, 0.7, -0.4])) ** 2, axis=1)
+    result = global_fit(sphere, [-1] * 3, [1] * 3, method="cmaes", max_evaluations=2000, seed=1)
+    assert result.cost < 1e-10 and result.history[-1][1] == result.cost
+    assert all(b <= a for (_, a), (_, b) in zip(result.history, result.history[1:]))
+    # Failed evaluations (NaN) never become the best point.
+    failing = lambda points: np.where(np.asarray(points)[:, 0] > 0, np.nan, sphere(points))
+    result = global_fit(failing, [-1] * 3, [1] * 3, method="cmaes", max_evaluations=600, seed=1)
+    assert result.x[0] <= 0 and np.isfinite(result.cost)
+
+
+def test_budgets_and_resume():
+    with tempfile.TemporaryDirectory() as folder:
+        checkpoint = session_checkpoint(os.path.join(folder, "bin_40_session.json"))
+        assert checkpoint.endswith("bin_40_session_global.json")
+        for method in ("cmaes", "de"):
+            reference = global_fit(rastrigin, [-2, -2], [2, 2], method=method, max_evaluations=400, seed=5)
+            # The same search, stopped twice and resumed from its checkpoint.
+            first = global_fit(rastrigin, [-2, -2], [2, 2], method=method, max_evaluations=100, seed=5,
+                               checkpoint=checkpoint)
+            assert first.message == "Evaluation budget reached" and os.path.exists(checkpoint[:-5] + ".npz")
+            second = global_fit(rastrigin, [-2, -2], [2, 2], method=method, max_evaluations=250,
+                                checkpoint=checkpoint)
+            assert second.generations > first.generations
+            resumed = global_fit(rastrigin, [-2, -2], [2, 2], method=method, max_evaluations=400,
+                                 checkpoint=checkpoint)
+            assert resumed.evaluations == reference.evaluations and resumed.history == reference.history
+            np.testing.assert_array_equal(resumed.x, reference.x)
+            try:
+                global_fit(rastrigin, [-2, -2], [3, 3], method=method, checkpoint=checkpoint)
+                assert False, "A checkpoint of other bounds must not be resumed."
+            except ValueError:
+                pass
+            os.remove(checkpoint)
+        # The wall-clock budget and cancellation stop between generations.
+        result = global_fit(rastrigin, [-2, -2], [2, 2], max_seconds=0.0)
+        assert result.message == "Time budget reached" and result.evaluations == 0
+        result = global_fit(rastrigin, [-2, -2], [2, 2], progress=lambda progress: progress.iteration == 3)
+        assert result.message == "Cancelled" and result.generations == 3
+        # State round trip.
+        optimizer = CMAES(2, seed=2)
+        optimizer.tell(optimizer.ask(), np.arange(optimizer.popsize))
+        meta, arrays = optimizer.state()
+        restored = CMAES.from_state(meta, arrays)
+        np.testing.assert_array_equal(restored.ask(), optimizer.ask())
+        de = DifferentialEvolution(2, seed=2)
+        de.tell(de.ask(), np.arange(de.popsize))
+        restored = DifferentialEvolution.from_state(*de.state())
+        np.testing.assert_array_equal(restored.ask(), de.ask())
+
+
+def test_parallel_and_population_evaluators():
+    with sandbox() as folder:
+        scheduler = SimulationScheduler(max_workers=3)
+        try:
+            executable = write_fake(folder, TRANSFER_CURRENT)
+            model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv",
+                                   {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                                   simulator_options={"result_cache": False})
+            model.simulator.runner.executable = executable
+            vg = np.linspace(0.1, 1.7, 17)
+            target = transfer_current(vg, 0.5, 0.035)
+            names = ["vth0", "u0"]
+            points = [np.array([0.45, 0.03]), np.array([0.5, 0.035]), np.array([0.6, 0.02]), np.array([0.4, 0.05])]
+            pool = PoolEvaluator(model, CurveResiduals([(None, vg, target)]), names, scheduler=scheduler)
+            for slot in pool.models:
+                slot.simulator.runner.executable = executable
+            costs = pool(points)
+            assert len(pool.models) == 3 and pool.evaluations == 4 and costs[1] < 1e-12 < costs[0]
+            assert os.path.exists(os.path.join("circuits", ".fitting", "slot_2", "nch", "bin_40",
+                                               "bin_40_nch_modified.lib"))
+            # A candidate whose evaluation raises (here the largest current) costs inf; the others are kept.
+            residuals = CurveResiduals([(None, vg, target)])
+
+            def strict(curves):
+                if np.max(curves[0][2]) > 9e-3:
+                    raise ValueError("Simulated grid does not match the targets.")
+                return residuals(curves)
+
+            failing = PoolEvaluator(model, strict, names, scheduler=scheduler)
+            for slot in failing.models:
+                slot.simulator.runner.executable = executable
+            failed_costs = failing(points)
+            assert np.isinf(failed_costs[3]) and np.allclose(failed_costs[:3], costs[:3], rtol=1e-9, atol=1e-15)
+            population = PopulationNetlistEvaluator(model, CurveResiduals([(None, vg, target)]), names)
+            np.testing.assert_allclose(population(points), costs, rtol=1e-6, atol=1e-15)
+            assert population.launches == 1
+
+            result = global_fit(population, [0.3, 0.01], [0.7, 0.06], method="cmaes", names=names,
+                                x0=[0.42664, 0.029497], max_evaluations=300, seed=0)
+            assert abs(result.parameters["vth0"] - 0.5) < 1e-3 and abs(result.parameters["u0"] - 0.035) < 1e-4
+            # One launch per generation (after the one of the points above).
+            assert population.launches == result.generations + 1
+        finally:
+            scheduler.shutdown()
+
+
+def test_population_evaluator_on_family():
+    # A gate-sweep family: every candidate's curves come from the wrdata files written inside the gate loop.
+    with sandbox() as folder:
+        executable = write_fake(folder, TRANSFER_CURRENT)
+        sweep = {"vg_start": 0.6, "vg_stop": 1.8, "vg_step": 0.6, "vd_start": 0, "vd_stop": 1.8, "vd_step": 0.1}
+        model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv_vds", sweep,
+                               simulator_options={"result_cache": False})
+        model.simulator.runner.executable = executable
+        vd = np.linspace(0.1, 1.7, 17)
+        residuals = CurveResiduals([(vg, vd, transfer_current(vg, 0.5, 0.035, vd)) for vg in (0.6, 1.2, 1.8)])
+        names = ["vth0", "u0"]
+        points = [np.array([0.45, 0.03]), np.array([0.5, 0.035]), np.array([0.6, 0.02])]
+        population = PopulationNetlistEvaluator(model, residuals, names)
+        costs = population(points)
+        assert population.launches == 1 and costs[1] < 1e-12 < costs[0]
+        serial = [0.5 * np.sum(residuals(model(dict(zip(names, p)))) ** 2) for p in points]
+        np.testing.assert_allclose(costs, serial, rtol=1e-6, atol=1e-15)
+
+
+def main():
+    test_latin_hypercube_strata()
+    test_optimizers_find_global_minimum()
+    test_budgets_and_resume()
+    test_parallel_and_population_evaluators()
+    test_population_evaluator_on_family()
+    print("All global optimizer tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_lab_aggregate import ReferenceSet, RunningStats, aggregate_catalog, aggregate_curves
+from IceMOS_sky130_lab_catalog import LabCatalog
+from IceMOS_sky130_result_store import ResultStore
+
+VD = np.linspace(0, -1.8, 19)
+
+
+def write_wafer(root, dies, vg_values=(-1.2, -1.8)):
+    """One IDVD file per die and gate bias; each die has its own current scale."""
+    scales = {}
+    for die in range(dies):
+        scale = 1.0 + 0.01 * ((die * 37) % dies - dies / 2)
+        scales[die] = scale
+        for vg in vg_values:
+            name = (f"sky130_fd_pr__pfet_01v8_w1p68u_l0p15u_m1(8397_{die}_3_IDVD)_4K"
+                    f"_VS_0.0_VB_0.0_VG_{vg}.csv")
+            ids = -1e-4 * scale * (-vg - 0.4) * np.tanh(-VD / 0.3)
+            # Some dies stopped their sweep early.
+            points = len(VD) if die % 5 else len(VD) - 4
+            with open(os.path.join(root, name), "w") as f:
+                f.write("VD,ID,IB\n")
+                for vd, i in zip(VD[:points], ids[:points]):
+                    f.write(f"{vd},{i:.9e},0\n")
+    return scales
+
+
+def test_running_stats_match_numpy():
+    grid = np.linspace(0, 1, 11)
+    rng = np.random.default_rng(1)
+    curves = rng.normal(size=(50, 11))
+    curves[rng.random(curves.shape) < 0.1] = np.nan
+    stats = RunningStats(grid, reservoir_size=64)
+    for y in curves:
+        stats.update(y)
+    np.testing.assert_allclose(stats.mean, np.nanmean(curves, axis=0))
+    np.testing.assert_allclose(stats.variance, np.nanvar(curves, axis=0, ddof=1))
+    np.testing.assert_allclose(stats.percentiles([50])[50], np.nanmedian(curves, axis=0))
+    # Beyond the reservoir size the percentiles come from a sample of the curves.
+    small = RunningStats(grid, reservoir_size=10)
+    for y in curves:
+        small.update(y)
+    assert (~np.isnan(small.reservoir)).any(axis=1).all() and small.curves == 50
+    np.testing.assert_allclose(small.mean, stats.mean)
+
+
+def test_aggregate_curves_on_common_grid():
+    reference = aggregate_curves([(np.array([0.0, 1.0]), np.array([0.0, 2.0])),
+                                  (np.array([1.0, 0.0, 0.5]), np.array([1.0, 0.0, 0.5]))],
+                                 grid=np.array([0.0, 0.5, 1.0, 1.5]))
+    np.testing.assert_allclose(reference.mean[:3], [0.0, 0.75, 1.5])
+    assert np.isnan(reference.mean[3]) and list(reference.count) == [2, 2, 2, 0]
+    assert aggregate_curves([]) is None
+
+
+def test_reference_set_from_catalog():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "wafer_pch_bin_1")
+        os.makedirs(root)
+        scales = write_wafer(root, dies=40)
+        catalog = LabCatalog(root)
+        assert catalog.scan() == (80, 0)
+        reference = aggregate_catalog(catalog, "IDVD", device="pch", VB=0.0, batch_size=7)
+        assert len(reference) == 2 and reference.sweep == "VD" and reference.metadata["device"] == "pch"
+        curve = reference.find(vg=-1.2)
+        assert curve.devices == 40 and curve.biases == {"vg": -1.2, "vd": None, "vs": 0.0, "vb": 0.0}
+        expected = np.array([-1e-4 * s * 0.8 * np.tanh(-np.sort(VD) / 0.3) for s in scales.values()])
+        # The last points were only measured on the dies that completed their sweep.
+        assert curve.count[0] == 32 and curve.count[-1] == 40
+        common = np.sort(VD) >= VD[-5]
+        np.testing.assert_allclose(curve.median[common], np.median(expected[:, common], axis=0), rtol=1e-6)
+        np.testing.assert_allclose(curve.mean[common], expected[:, common].mean(axis=0), rtol=1e-6)
+        np.testing.assert_allclose(curve.std[-1], expected[:, -1].std(ddof=1), rtol=1e-5)
+        assert (curve.percentiles[10] <= curve.median).all() and (curve.median <= curve.percentiles[90]).all()
+
+        path = os.path.join(folder, "reference.npz")
+        reference.save(path)
+        loaded = ReferenceSet.load(path)
+        np.testing.assert_array_equal(loaded.find(vg=-1.8).percentiles[90], reference.find(vg=-1.8).percentiles[90])
+        assert loaded.find(vg=-1.8).devices == 40
+
+        store = ResultStore(os.path.join(folder, "store"))
+        store.append(reference.to_curves("median", bin=1, temperature=-269.15))
+        assert len(store.query(source="reference", device="pch", vg=-1.2, statistic="median")) == 1
+
+
+def main():
+    test_running_stats_match_numpy()
+    test_aggregate_curves_on_common_grid()
+    test_reference_set_from_catalog()
+    print("All lab aggregation tests passed.")
+
+
+if __name__ == '__main__':
+    main()
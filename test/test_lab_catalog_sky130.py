@@ -0,0 +1,78 @@
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_lab_catalog import LabCatalog, parse_measurement_name, read_measurement
+
+lab_pch = os.path.join(os.path.dirname(__file__), "mdm_proc_pch_bin_1")
+lab_nch = os.path.join(os.path.dirname(__file__), "mdm_proc_nch_bin_40")
+
+
+def test_parse_measurement_name():
+    conditions = parse_measurement_name(
+        "IDVD/sky130_fd_pr__pfet_01v8_w1p68u_l0p15u_m1(8397_4_3_IDVD)_4K_VS_0.0_VB_1.5_VG_-1.2.csv")
+    assert conditions == {"device_name": "sky130_fd_pr__pfet_01v8", "device": "pch", "W": 1.68, "L": 0.15,
+                          "m": 1, "die": "8397_4_3", "sweep_type": "IDVD", "sweep": "VD", "temperature_k": 4.0,
+                          "temperature": -269.15, "VS": 0.0, "VB": 1.5, "VG": -1.2}
+    conditions = parse_measurement_name(
+        "sky130_fd_pr__nfet_01v8_lvt_w0p42u_l0p15u_m1(8391_9_10_IDVG)_4K_VS_0.0_VD_1.8_VB_0.0.csv")
+    assert conditions["device_name"] == "sky130_fd_pr__nfet_01v8_lvt" and conditions["device"] == "nch"
+    assert conditions["sweep"] == "VG" and conditions["VD"] == 1.8
+    assert parse_measurement_name("calibration.csv") is None
+
+
+def test_header_with_commas_inside_parentheses():
+    path = [os.path.join(lab_nch, "IDVG", name) for name in os.listdir(os.path.join(lab_nch, "IDVG"))
+            if name.endswith(".csv")][0]
+    columns = read_measurement(path)
+    assert list(columns)[:3] == ["VG", "IG", "ID"] and "R:beta(1,1)" in columns
+
+
+def test_catalog_query_and_incremental_scan():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "mdm_proc_pch_bin_1")
+        shutil.copytree(lab_pch, root)
+        catalog = LabCatalog(root)
+        assert catalog.scan() == (24, 0)
+
+        records = catalog.query(sweep="IDVD", VB=1.5)
+        assert len(records) == 9
+        assert all(record.device == "pch" and record.bin == 1 and record.sweep == "VD" for record in records)
+        assert catalog.values("VG", sweep="IDVD", VB=1.5)[:2] == [-1.8, -1.7]
+        assert catalog.values("VB", sweep="IDVG") == [0.0, 0.75, 1.5]
+        record, vd, ids = catalog.load(sweep="IDVD", VB=1.5, VG=-1.2)[0]
+        data = np.loadtxt(os.path.join(root, record.attrs["file"]), delimiter=",", skiprows=1)
+        np.testing.assert_array_equal(vd, data[:, 0])
+        np.testing.assert_array_equal(ids, data[:, 1])
+        assert len(catalog.query(sweep="IDVD", quantity="IB", VB=1.5, VG=-1.2)) == 1
+        assert len(catalog.query(sweep="IDVG", VD=-1.8, VB=(0.5, 2.0))) == 2
+
+        # A second scan (even from a new catalog object) reads nothing; changes are picked up.
+        assert LabCatalog(root).scan() == (0, 0)
+        path = os.path.join(root, record.attrs["file"])
+        with open(path, "a") as f:
+            f.write("-1.825,-1.0e-4,0.0\n")
+        os.remove(os.path.join(root, catalog.query(sweep="IDVD", VB=0.0, VG=0.0)[0].attrs["file"]))
+        catalog = LabCatalog(root)
+        assert catalog.scan() == (1, 0)
+        assert len(catalog.query(sweep="IDVD")) == 17
+        _, vd, ids = catalog.load(sweep="IDVD", VB=1.5, VG=-1.2)[0]
+        assert len(vd) == len(data) + 1 and ids[-1] == -1.0e-4
+
+
+def main():
+    test_parse_measurement_name()
+    test_header_with_commas_inside_parentheses()
+    test_catalog_query_and_incremental_scan()
+    print("All lab catalog tests passed.")
+
+
+if __name__ == '__main__':
+    main()
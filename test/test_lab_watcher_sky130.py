@@ -0,0 +1,105 @@
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_lab_catalog import LabCatalog
+from IceMOS_sky130_lab_watcher import LabFolderWatcher
+
+lab_pch = os.path.join(os.path.dirname(__file__), "mdm_proc_pch_bin_1")
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def measurement_files():
+    folder = os.path.join(lab_pch, "IDVD")
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".csv"))
+
+
+def test_ingest_only_reads_the_given_files():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "mdm_proc_pch_bin_1")
+        os.makedirs(root)
+        first, second = measurement_files()[:2]
+        shutil.copy(first, root)
+        catalog = LabCatalog(root)
+        assert catalog.scan() == (1, 0)
+        path = shutil.copy(second, root)
+        records = catalog.ingest([path])
+        assert {record.attrs["file"] for record in records} == {os.path.basename(second)}
+        assert {record.attrs["quantity"] for record in records} == {"ID", "IB"}
+        assert catalog.ingest([path]) == []
+        os.remove(path)
+        assert catalog.ingest([path]) == [] and len(catalog.query(quantity=None)) == 2
+
+
+def run_watcher(use_inotify):
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "mdm_proc_pch_bin_1")
+        os.makedirs(root)
+        files = measurement_files()
+        shutil.copy(files[0], root)
+        catalog = LabCatalog(root)
+        batches = []
+        watcher = LabFolderWatcher(catalog, batches.append, settle=0.2, poll_interval=0.1, use_inotify=use_inotify)
+        watcher.start()
+        try:
+            # The file present before start is picked up by the initial scan.
+            assert wait_for(lambda: len(batches) == 1)
+            # A sweep written in two steps (as by the measurement software) is read once, complete.
+            subfolder = os.path.join(root, "IDVD")
+            os.makedirs(subfolder)
+            with open(files[1], "r") as f:
+                lines = f.readlines()
+            path = os.path.join(subfolder, os.path.basename(files[1]))
+            with open(path, "w") as f:
+                f.writelines(lines[:5])
+            time.sleep(0.05)
+            with open(path, "a") as f:
+                f.writelines(lines[5:])
+            assert wait_for(lambda: len(batches) == 2)
+            record = [r for r in batches[1] if r.attrs["quantity"] == "ID"][0]
+            assert record.attrs["file"] == os.path.join("IDVD", os.path.basename(files[1]))
+            assert len(catalog.load([record])[0][1]) == len(lines) - 1
+            # Files the catalog cannot read are not retried until they change.
+            with open(os.path.join(root, "notes.csv"), "w") as f:
+                f.write("free text\n")
+            time.sleep(0.6)
+            assert len(batches) == 2
+        finally:
+            watcher.stop()
+        assert not watcher.running
+        assert len(catalog.query(quantity="ID")) == 2
+        return watcher.mode
+
+
+def test_watcher_polling():
+    assert run_watcher(use_inotify=False) == "polling"
+
+
+def test_watcher_inotify():
+    # Falls back to polling where inotify is not available.
+    assert run_watcher(use_inotify=True) in ("inotify", "polling")
+
+
+def main():
+    test_ingest_only_reads_the_given_files()
+    test_watcher_polling()
+    test_watcher_inotify()
+    print("All lab watcher tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_lab_catalog import LabCatalog
+from IceMOS_sky130_mdm_reader import iter_mdm, read_mdm
+
+VD = np.linspace(0, -1.8, 73)
+VG = np.linspace(0, -1.8, 7)
+VB = [0.0, 1.5]
+
+
+def current(vb, vg, vd):
+    # Synthetic PMOS output characteristic (terminal convention: negative drain current).
+    return -1e-4 * max(-vg - 0.4 + 0.1 * vb, 0.0) * np.tanh(-vd / 0.3)
+
+
+def write_mdm(path, skip=(), truncate=False):
+    """Write an IDVD sweep (vd inner, vg outer, vb outermost) as IC-CAP would."""
+    with open(path, "w") as f:
+        f.write("! VERSION = 6.00\nBEGIN_HEADER\n ICCAP_INPUTS\n"
+                "  vd  V  D GROUND SMU1 0.1 LIN 1 0 -1.8 73 -0.025\n"
+                "  vg  V  G GROUND SMU2 0.1 LIN 2 0 -1.8 7 -0.3\n"
+                "  vb  V  B GROUND SMU3 0.1 LIST 3 2 0 1.5\n"
+                "  vs  V  S GROUND SMU4 0.1 CON 0\n"
+                " ICCAP_OUTPUTS\n  id  I  D GROUND SMU1 B\n  ib  I  B GROUND SMU3 B\n"
+                " ICCAP_VALUES\n  W \"1.68u\"\n  L \"0.15u\"\nEND_HEADER\n\n")
+        for vb in VB:
+            for vg in VG:
+                if (vb, round(vg, 3)) in skip:
+                    continue
+                f.write(f"BEGIN_DB\n ICCAP_VAR vg {vg:g}\n ICCAP_VAR vb {vb:g}\n\n #vd id ib\n")
+                for vd in VD:
+                    f.write(f" {vd:.6e} {current(vb, vg, vd):.6e} {1e-12 * vb:.6e}\n")
+                if truncate and vb == VB[-1] and vg == VG[-1]:
+                    f.write(" -1.9 -1.0e-4")
+                    return
+                f.write("END_DB\n\n")
+
+
+def test_nested_sweeps_into_nd_arrays():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "idvd.mdm")
+        write_mdm(path, skip={(1.5, -0.6)})
+        data = read_mdm(path)
+        assert [name for name, _ in data.axes] == ["vb", "vg", "vd"] and data.shape == (2, 7, 73)
+        assert data.constants == {"vs": 0.0} and data.header == {"W": "1.68u", "L": "0.15u"}
+        expected = np.array([[current(vb, vg, VD) for vg in VG] for vb in VB])
+        # The block that was not measured stays NaN and is not listed as a curve.
+        assert np.isnan(data["ID"][1, 2]).all() and not data.measured[1, 2]
+        expected[1, 2] = np.nan
+        np.testing.assert_allclose(data["id"], expected, rtol=1e-6, atol=1e-16, equal_nan=True)
+        curves = list(data.curves("id"))
+        assert len(curves) == 13
+        conditions, vd, ids = curves[-1]
+        assert conditions == {"vs": 0.0, "vb": 1.5, "vg": -1.8}
+        np.testing.assert_allclose(vd, VD, atol=1e-12)
+
+        # The same result memory-mapped on disk.
+        mapped = read_mdm(path, memmap_folder=os.path.join(folder, "arrays"))
+        assert isinstance(mapped["id"], np.memmap)
+        np.testing.assert_array_equal(np.load(os.path.join(folder, "arrays", "id.npy")), mapped["id"])
+
+
+def test_streaming_blocks_and_truncated_dump():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "idvd.mdm")
+        write_mdm(path, truncate=True)
+        header, inputs, outputs, blocks = iter_mdm(path)
+        assert [i.sweep_type for i in inputs] == ["LIN", "LIN", "LIST", "CON"]
+        assert [o.name for o in outputs] == ["id", "ib"]
+        first_outer, columns, block = next(blocks)
+        assert first_outer == {"vg": 0.0, "vb": 0.0} and columns == ["vd", "id", "ib"] and block.shape == (73, 3)
+        assert sum(1 for _ in blocks) == 13
+        # The last block lost its END_DB and its incomplete row is dropped.
+        data = read_mdm(path)
+        np.testing.assert_allclose(data["id"][1, 6], current(1.5, -1.8, VD), rtol=1e-6, atol=1e-16)
+
+
+def test_catalog_reads_mdm_without_csv_stage():
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "mdm_pch_bin_1")
+        os.makedirs(root)
+        write_mdm(os.path.join(root, "sky130_fd_pr__pfet_01v8_w1p68u_l0p15u_m1(8397_4_3_IDVD)_4K.mdm"))
+        catalog = LabCatalog(root)
+        assert catalog.scan() == (1, 0)
+        assert len(catalog.query(sweep="IDVD")) == 14
+        record, vd, ids = catalog.load(sweep="IDVD", VB=1.5, VG=-1.2)[0]
+        assert record.bin == 1 and record.vs == 0.0 and record.attrs["W"] == 1.68
+        np.testing.assert_allclose(ids, current(1.5, -1.2, VD), rtol=1e-6, atol=1e-16)
+        assert catalog.values("VB", sweep="IDVD", quantity="IB") == [0.0, 1.5]
+
+
+def main():
+    test_nested_sweeps_into_nd_arrays()
+    test_streaming_blocks_and_truncated_dump()
+    test_catalog_reads_mdm_without_csv_stage()
+    print("All MDM reader tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_bsim4 import BSIM4Simulator
+from IceMOS_sky130_metrics import InterpolationMatrix, MetricEngine
+from IceMOS_sky130_sensitivity import operating_regions
+
+circuits = os.path.join(os.path.dirname(__file__), "circuits")
+
+
+def pch_lab_curves():
+    """The ngspice results of pch bin 1 (10 mV steps) as lab curves."""
+    folder = os.path.join(circuits, "pch", "bin_1")
+    transfer = np.loadtxt(os.path.join(folder, "results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"))
+    targets = [(None, transfer[:, 0], transfer[:, 1])]
+    for vg in (1.6, 1.8):
+        data = np.loadtxt(os.path.join(folder, "results_IV_ISD_vs_VSD_for_VG_sweep", f"p_mosfet_id_vs_vsd_{vg}.csv"))
+        targets.append((vg, data[:, 0], data[:, 5]))
+    return targets
+
+
+def test_interpolation_matrix():
+    sim_x = np.array([0.3, 0.0, 0.1, 0.2])
+    sim_y = sim_x ** 2
+    lab_x = np.array([-0.05, 0.0, 0.05, 0.17, 0.3, 0.31])
+    matrix = InterpolationMatrix(sim_x, lab_x)
+    expected = np.interp(lab_x, np.sort(sim_x), np.sort(sim_x) ** 2)
+    expected[[0, 5]] = np.nan
+    np.testing.assert_allclose(matrix @ sim_y, expected)
+    dense = matrix.toarray()
+    assert dense.shape == (6, 4) and np.count_nonzero(dense[1:5]) <= 8 and not dense[[0, 5]].any()
+    np.testing.assert_allclose(dense[1:5] @ sim_y, expected[1:5])
+    # A stack of curves on the same grid in one product.
+    stack = np.column_stack([sim_y, 2 * sim_y])
+    np.testing.assert_allclose((matrix @ stack)[1:5], np.column_stack([expected, 2 * expected])[1:5])
+
+
+def test_engine_errors_and_huber():
+    lab_x = np.concatenate([np.linspace(0, 0.4, 41), np.linspace(0.5, 1, 51)])
+    lab_y = np.where(lab_x < 0.45, 1e-9 * 10 ** (8 * lab_x), 1e-5 * lab_x)
+    targets = [(None, lab_x, lab_y)]
+    regions = [np.where(lab_x < 0.45, "subthreshold", "saturation")]
+    engine = MetricEngine(targets, regions)
+    sim_x = np.linspace(0, 1, 11)
+    # One decade high up to 0.4 V (exact in log scale between the grid points), 2 % high from 0.5 V.
+    sim_y = np.where(sim_x < 0.45, 1e-8 * 10 ** (8 * sim_x), 1.02e-5 * sim_x)
+    result = engine.evaluate([(None, sim_x, sim_y)])
+    assert np.isclose(result.region_errors["subthreshold"], 1.0)
+    assert np.isclose(result.region_errors["saturation"], 0.02)
+    assert np.isnan(result.region_errors["linear"]) and result.recomputed == [0]
+    assert result.describe() == "subthreshold 1.000 dec, saturation 2.0 %"
+    # Region weights; the Huber loss caps the influence of the one-decade points.
+    weighted = MetricEngine(targets, regions, region_weights={"subthreshold": 0.0}).evaluate([(None, sim_x, sim_y)])
+    assert np.isclose(weighted.total, 0.02)
+    robust = MetricEngine(targets, regions, huber=0.1).evaluate([(None, sim_x, sim_y)])
+    assert np.isclose(robust.region_errors["subthreshold"], np.sqrt(0.2 - 0.01))
+    assert robust.total < result.total
+    try:
+        MetricEngine(targets, [regions[0][:10]])
+        assert False, "Expected a ValueError."
+    except ValueError:
+        pass
+
+
+def test_engine_against_bsim4_and_incremental_updates():
+    targets = pch_lab_curves()
+    engine = MetricEngine(targets, operating_regions(targets, 1.68, 0.15))
+    simulator = BSIM4Simulator(circuits)
+
+    def simulate(step):
+        transfer = simulator.iv_curve("pch", 1, vgate_step=step)
+        family = simulator.iv_vds_curves("pch", 1, vg_start=1.6, vg_stop=1.8, vg_step=0.2, vd_step=step)
+        return transfer.curves() + [(round(v, 6), x, y) for v, x, y in family.curves()]
+
+    # On the 10 mV grid of the references: the model accuracy (see test_bsim4_sky130.py).
+    fine = MetricEngine(targets, operating_regions(targets, 1.68, 0.15)).evaluate(simulate(0.01))
+    assert fine.curve_errors[0] < 1e-3 and np.all(fine.curve_errors[1:] < 0.03)
+    # On a 0.1 V grid the interpolation between simulated points adds its own error (steepest near VSD = 0
+    # and at turn-on).
+    curves = simulate(0.1)
+    (_, vg, current), family = curves[0], curves[1:]
+    result = engine.evaluate(curves)
+    assert result.recomputed == [0, 1, 2] and len(result.residuals) == sum(len(x) for _, x, _ in targets)
+    assert np.all(result.curve_errors > fine.curve_errors) and np.all(result.curve_errors < 0.1)
+    assert result.region_errors["subthreshold"] < 0.05 and len(engine._operators) == 3
+
+    # Only the changed curve is recomputed; the result equals a full evaluation.
+    changed = (1.8, family[1][1], family[1][2] * 1.1)
+    partial = engine.evaluate([(None, vg, current), family[0], changed])
+    assert partial.recomputed == [2]
+    fresh = MetricEngine(targets, operating_regions(targets, 1.68, 0.15)).evaluate([(None, vg, current), family[0],
+                                                                                    changed])
+    np.testing.assert_allclose(partial.residuals, fresh.residuals, equal_nan=True)
+    assert np.isclose(partial.total, fresh.total)
+    assert engine.update(2, *family[1][1:]).total == result.total
+    # A missing family curve leaves its lab points out.
+    missing = engine.evaluate([(None, vg, current), family[0]])
+    assert missing.recomputed == [2] and np.isnan(missing.curve_errors[2])
+
+
+def main():
+    test_interpolation_matrix()
+    test_engine_errors_and_huber()
+    test_engine_against_bsim4_and_incremental_updates()
+    print("All metric tests passed.")
+
+
+if __name__ == '__main__':
+    main()
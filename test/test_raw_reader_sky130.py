@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_raw_reader import read_raw, read_raw_plot
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130, FAMILY_VECTORS, IV_VECTORS
+
+circuits = os.path.join(os.path.dirname(__file__), "circuits")
+
+
+def raw_header(plotname, flags, variables, n_points, section="Binary:"):
+    lines = ["Title: synthetic", "Date: Thu Jan  1 00:00:00  2025", f"Plotname: {plotname}",
+             f"Flags: {flags}", f"No. Variables: {len(variables)}", f"No. Points: {n_points}", "Variables:"]
+    lines += [f"\t{i}\t{name}\t{kind}" for i, (name, kind) in enumerate(variables)]
+    lines.append(section)
+    return ("\n".join(lines) + "\n").encode("latin-1")
+
+
+def test_fixtures_match_wrdata_csv():
+    folder = os.path.join(circuits, "nch", "bin_40", "results_IV_ID_vs_VG")
+    plot = read_raw_plot(os.path.join(folder, "IV_ID_vs_VG.raw"))
+    assert plot.plotname == "DC transfer characteristic" and plot.command.startswith("ngspice-44.2")
+    assert plot.n_points == 181 and len(plot.names) == 10
+    assert plot.vector_type("I(V1_MEAS)") == "current"
+    # Vectors are views of the memory-mapped file, not copies.
+    assert not plot["i(v1_meas)"].flags.owndata
+    csv = np.loadtxt(os.path.join(folder, "IV_ID_vs_VG.csv"))
+    np.testing.assert_allclose(plot.scale, csv[:, 0], atol=1e-12)
+    np.testing.assert_allclose(plot[IV_VECTORS["nch"][0]], csv[:, 1], rtol=1e-6, atol=1e-15)
+
+    # The simulator reads the raw file in wrdata column order.
+    folder = os.path.join(circuits, "pch", "bin_1")
+    output = {"path": os.path.join("results_IV_ISD_vs_VSD_for_VG_sweep", "p_mosfet_id_vs_vsd_1.6.csv"),
+              "sweep": list(range(181)), "columns": 3, "vectors": FAMILY_VECTORS["pch"]}
+    data = IceMOS_simulator_sky130("unused.spice", result_cache=False)._load_output(folder, output)
+    csv = np.loadtxt(os.path.join(folder, output["path"]))
+    np.testing.assert_allclose(data, csv, rtol=1e-6, atol=1e-15)
+
+
+def test_multiple_plots_complex_ascii_and_truncated():
+    real = np.array([[0.0, 1.0], [0.5, 2.0], [1.0, 3.0]])
+    freq = np.array([1.0, 10.0])
+    gain = np.array([1 + 2j, 3 - 4j])
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "multi.raw")
+        with open(path, "wb") as f:
+            f.write(raw_header("DC transfer characteristic", "real", [("v(v-sweep)", "voltage"),
+                                                                       ("i(vdsm)", "current")], 3))
+            f.write(real.astype("<f8").tobytes())
+            f.write(raw_header("AC Analysis", "complex", [("frequency", "frequency"), ("v(out)", "voltage")], 2))
+            f.write(np.column_stack([freq.astype(complex), gain]).astype("<c16").tobytes())
+            f.write(raw_header("Operating Point", "real", [("v(a)", "voltage"), ("v(b)", "voltage")], 1,
+                               section="Values:"))
+            f.write(b" 0\t1.5\n\t-2.5\n")
+        plots = read_raw(path)
+        assert [p.plotname for p in plots] == ["DC transfer characteristic", "AC Analysis", "Operating Point"]
+        np.testing.assert_array_equal(plots[0]["I(VDSM)"], real[:, 1])
+        assert plots[1].is_complex
+        np.testing.assert_array_equal(plots[1]["v(out)"], gain)
+        assert plots[2]["v(b)"][0] == -2.5
+        assert read_raw_plot(path, plotname="AC Analysis")["frequency"].real.tolist() == [1.0, 10.0]
+
+        # An interrupted run leaves fewer points than announced.
+        truncated = os.path.join(folder, "truncated.raw")
+        with open(truncated, "wb") as f:
+            f.write(raw_header("DC transfer characteristic", "real", [("v(v-sweep)", "voltage"),
+                                                                       ("i(vdsm)", "current")], 5))
+            f.write(real.astype("<f8").tobytes())
+        assert read_raw_plot(truncated, mmap=False).n_points == 3
+
+
+def main():
+    test_fixtures_match_wrdata_csv()
+    test_multiple_plots_complex_ascii_and_truncated()
+    print("All raw reader tests passed.")
+
+
+if __name__ == '__main__':
+    main()
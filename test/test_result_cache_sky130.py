@@ -0,0 +1,100 @@
+import os
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_result_cache import SimulationResultCache, make_cache_key
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+bin_40_modified = os.path.join(os.path.dirname(__file__), "circuits", "nch", "bin_40", "bin_40_nch_modified.lib")
+
+
+# A stand-in for ngspice that writes one wrdata file and counts its launches.
+FAKE_NGSPICE = """#!/bin/sh
+if [ "$1" = "-v" ]; then echo "ngspice-44.2 : Circuit level simulation program"; exit 0; fi
+echo run >> launches.txt
+mkdir -p results
+printf " 0.0 1.0e-9 \\n 0.1 2.0e-9 \\n 0.2 3.0e-9 \\n" > results/out.csv
+"""
+
+
+def test_key_ignores_cosmetic_model_changes():
+    with open(bin_40_modified) as f:
+        card = f.read()
+    reformatted = "* a comment\n" + card.replace("lmin=1.45e-07", "lmin=0.000000145").replace("+ ", "+   ")
+    key = make_cache_key(card, "dc VG 0 1.8 0.1", {"vg": [0, 1.8, 0.1]}, -269, "ngspice-44.2")
+    assert key == make_cache_key(reformatted, "* comment\ndc  VG 0 1.8 0.1", {"vg": [0, 1.8, 0.1]}, -269.0,
+                                 "ngspice-44.2")
+    assert key != make_cache_key(card.replace("lmin=1.45e-07", "lmin=1.46e-07"), "dc VG 0 1.8 0.1",
+                                 {"vg": [0, 1.8, 0.1]}, -269, "ngspice-44.2")
+    assert key != make_cache_key(card, "dc VG 0 1.8 0.1", {"vg": [0, 1.8, 0.1]}, 27, "ngspice-44.2")
+    assert key != make_cache_key(card, "dc VG 0 1.8 0.1", {"vg": [0, 1.8, 0.1]}, -269, "ngspice-43")
+
+
+def test_memory_and_disk_tiers_with_lru_eviction():
+    with tempfile.TemporaryDirectory() as folder:
+        payload = np.arange(1000, dtype=float)
+        cache = SimulationResultCache(folder, max_bytes=3 * payload.nbytes, memory_entries=2)
+        for i in range(4):
+            cache.put(f"{i:064x}", {"data": payload + i}, {"index": i})
+        # The oldest file was evicted from disk and memory.
+        assert cache.get(f"{0:064x}") is None
+        # A fresh cache (empty memory tier) reads the others back from disk.
+        fresh = SimulationResultCache(folder, max_bytes=3 * payload.nbytes)
+        arrays, metadata = fresh.get(f"{3:064x}")
+        assert metadata == {"index": 3}
+        np.testing.assert_array_equal(arrays["data"], payload + 3)
+
+
+def test_cache_hit_does_not_launch_simulator():
+    with tempfile.TemporaryDirectory() as folder:
+        executable = os.path.join(folder, "fake_ngspice")
+        with open(executable, "w") as f:
+            f.write(FAKE_NGSPICE)
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        with open(os.path.join(folder, "bin_40_nch_modified.lib"), "w") as f, open(bin_40_modified) as src:
+            f.write(src.read())
+        netlist = os.path.join(folder, "netlist.spice")
+        with open(netlist, "w") as f:
+            f.write('.include "./bin_40_nch_modified.lib"\n.temp -269\n.control\ndc VG 0 0.2 0.1\n.endc\n.end\n')
+
+        simulator = IceMOS_simulator_sky130("unused.spice",
+                                            result_cache=SimulationResultCache(os.path.join(folder, "cache")))
+        simulator.runner.executable = executable
+        simulator.runner.verbose = False
+        outputs = [{"path": os.path.join("results", "out.csv"), "sweep": [0.0, 0.1, 0.2], "columns": 1}]
+        first, = simulator._cached_run(netlist, {"vg": [0, 0.2, 0.1]}, outputs)
+        assert not simulator.last_cache_hit
+        second, = simulator._cached_run(netlist, {"vg": [0, 0.2, 0.1]}, outputs)
+        assert simulator.last_cache_hit
+        np.testing.assert_array_equal(first, second)
+        with open(os.path.join(folder, "launches.txt")) as f:
+            assert len(f.readlines()) == 1
+
+
+def test_default_cache_follows_circuit_root():
+    with tempfile.TemporaryDirectory() as folder:
+        sandbox = os.path.join(folder, "circuits", ".fitting")
+        simulator = IceMOS_simulator_sky130("unused.spice", circuit_root=sandbox)
+        assert simulator.cache.cache_dir == os.path.join(sandbox, ".sim_cache")
+        # A shared cache is passed explicitly.
+        shared = SimulationResultCache(os.path.join(folder, "shared"))
+        assert IceMOS_simulator_sky130("unused.spice", circuit_root=sandbox, result_cache=shared).cache is shared
+
+
+def main():
+    test_key_ignores_cosmetic_model_changes()
+    test_memory_and_disk_tiers_with_lru_eviction()
+    test_cache_hit_does_not_launch_simulator()
+    test_default_cache_follows_circuit_root()
+    print("All result cache tests passed.")
+
+
+if __name__ == '__main__':
+    main()
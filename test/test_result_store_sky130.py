@@ -0,0 +1,89 @@
+import os
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_result_cache import SimulationResultCache
+from IceMOS_sky130_result_store import Curve, ResultStore, model_hash
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+from test_sweep_planner_sky130 import FAKE_NGSPICE, original_model_file
+
+
+def family(vg_values, vd, scale=1.0, temperature=-269, bin_number=40):
+    return [Curve(vd, scale * vg * vd, "nch", bin=bin_number, temperature=temperature, sweep="VD", vg=vg,
+                  model_hash="abc") for vg in vg_values]
+
+
+def test_append_query_replace_and_compact():
+    vd = np.linspace(0, 1.8, 19)
+    with tempfile.TemporaryDirectory() as folder:
+        store = ResultStore(folder)
+        store.append(family([0.0, 0.6, 1.2, 1.8], vd))
+        store.append(family([0.6, 1.2], vd, temperature=27))
+        store.append(family([0.9], vd, bin_number=41))
+        assert len(store) == 7
+
+        records = store.query(device="nch", bin=40, temperature=-269, vg=(0.5, 1.3))
+        assert [record.vg for record in records] == [0.6, 1.2]
+        for record, x, y in store.load(records):
+            np.testing.assert_array_equal(x, vd)
+            np.testing.assert_allclose(y, record.vg * vd)
+        # Accumulated sweep values map onto the stored bias.
+        assert len(store.query(vg=0.6000000000000001, temperature=-269)) == 1
+
+        # Appending the same curve again replaces it.
+        store.append(family([0.6], vd, scale=2.0))
+        assert len(store) == 7
+        _, _, y = store.load(bin=40, temperature=-269, vg=0.6)[0]
+        np.testing.assert_allclose(y, 1.2 * vd)
+
+        # Compaction keeps every live curve and drops the replaced points.
+        assert store.compact(chunk_curves=4) == 2
+        assert len(os.listdir(store.chunk_dir)) == 2
+        reopened = ResultStore(folder)
+        loaded = reopened.load(device="nch")
+        assert len(loaded) == 7
+        _, _, y = reopened.load(bin=40, temperature=-269, vg=0.6)[0]
+        np.testing.assert_allclose(y, 1.2 * vd)
+
+
+def test_simulator_records_curves_with_model_hash():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            executable = os.path.join(folder, "fake_ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_NGSPICE.format(python=sys.executable))
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            store = ResultStore(os.path.join(folder, "store"))
+            simulator = IceMOS_simulator_sky130(original_model_file, result_store=store,
+                                                result_cache=SimulationResultCache(os.path.join(folder, "cache")))
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            simulator.iv_vds_curves('nch', bin_number=40, vg_start=0, vg_stop=1.2, vg_step=0.6,
+                                    vd_start=0, vd_stop=1.8, vd_step=0.2)
+            card = os.path.join("circuits", "nch", "bin_40", "bin_40_nch_modified.lib")
+            records = store.query(device="nch", bin=40, sweep="VD", model_hash=model_hash(card))
+            assert [round(record.vg, 9) for record in records] == [0.0, 0.6, 1.2]
+            assert records[0].temperature == -269
+            _, vd, current = store.load(records[2:])[0]
+            np.testing.assert_allclose(current, 1.2 * vd)
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    test_append_query_replace_and_compact()
+    test_simulator_records_curves_with_model_hash()
+    print("All result store tests passed.")
+
+
+if __name__ == '__main__':
+    main()
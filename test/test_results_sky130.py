@@ -0,0 +1,95 @@
+import os
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_results import make_family_result, make_iv_result
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+pfet_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "../pdk_original_models/sky130_fd_pr__pfet_01v8.pm3.spice"))
+
+
+# A stand-in for ngspice that runs the VSG loop of the PMOS IV VSD netlist with ISD = VSG * VSD.
+# The wrdata columns are V(VGATE), I(VSOURCE) (negative) and I(vdsM) (positive).
+FAKE_PMOS_NGSPICE = """#!{python}
+import re, sys
+if sys.argv[1] == "-v":
+    print("ngspice-44.2")
+    sys.exit(0)
+text = open(sys.argv[2]).read()
+vg = float(re.search(r"let vgsval = (\\S+)", text).group(1))
+step = float(re.search(r"let step = (\\S+)", text).group(1))
+stop = float(re.search(r"while vgsval <= (\\S+)", text).group(1))
+start_d, stop_d, step_d = map(float, re.search(r"dc VSOURCE (\\S+) (\\S+) (\\S+)", text).groups())
+vsd = []
+v = start_d
+while v <= stop_d + step_d * 1e-9:
+    vsd.append(v)
+    v += step_d
+while vg <= stop:
+    with open(f"results_IV_ISD_vs_VSD_for_VG_sweep/p_mosfet_id_vs_vsd_{{vg:g}}.csv", "w") as f:
+        for vd in vsd:
+            f.write(f" {{vd:e}} {{vg:e}} {{vd:e}} {{-vg * vd:e}} {{vd:e}} {{vg * vd:e}} \\n")
+    vg = vg + step
+"""
+
+
+def test_named_axes_and_sign_conventions():
+    vd = np.linspace(0, 1.8, 10)
+    result = make_family_result("pch", [0.6, 1.2], vd, [0.6 * vd, 1.2 * vd], metadata={"bin": 10})
+    assert result.names == ("VSG", "VSD", "ISD")
+    assert result.current.values.shape == (2, 10) and result.sweep.label == "VSD (V)"
+    x, y = result.curve(1.2)
+    np.testing.assert_allclose(y, 1.2 * vd)
+    np.testing.assert_array_equal(result["isd"], result.current.values)
+
+    terminal = result.terminal()
+    assert terminal.names == ("VGS", "VDS", "ID") and terminal.metadata["bin"] == 10
+    np.testing.assert_allclose(terminal.bias.values, [-0.6, -1.2])
+    np.testing.assert_allclose(terminal["ID"][1], -1.2 * vd)
+
+    iv = make_iv_result("nch", vd, vd ** 2)
+    assert iv.names == ("VGS", "IDS") and iv.terminal() is iv
+    assert [bias for bias, _, _ in iv.curves()] == [None]
+
+
+def test_simulate_returns_arrays_and_metadata():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            executable = os.path.join(folder, "fake_ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_PMOS_NGSPICE.format(python=sys.executable))
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            simulator = IceMOS_simulator_sky130(pfet_model_file, result_cache=False)
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            result = simulator.simulate_iv_vds('pch', bin_number=10, vgs_start=0.6, vgs_stop=1.8, vgs_step=0.6,
+                                               vds_start=0, vds_stop=1.8, vds_step=0.2)
+            assert result.kind == "iv_vds" and result.names == ("VSG", "VSD", "ISD")
+            np.testing.assert_allclose(result.bias.values, [0.6, 1.2, 1.8])
+            np.testing.assert_allclose(result.current.values, np.outer([0.6, 1.2, 1.8], result.sweep.values))
+            assert result.ok and result.failed_points == 0
+            assert result.metadata["bin"] == 10 and result.metadata["temperature"] == -269
+            assert result.metadata["model_card"].endswith("bin_10_pch_modified.lib")
+            assert len(result.metadata["model_hash"]) == 16
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    test_named_axes_and_sign_conventions()
+    test_simulate_returns_arrays_and_metadata()
+    print("All result tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_result_cache import SimulationResultCache
+from IceMOS_sky130_run_history import RunHistory
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+from test_sweep_planner_sky130 import FAKE_NGSPICE, original_model_file
+
+bin_40_modified = os.path.join(os.path.dirname(__file__), "circuits", "nch", "bin_40", "bin_40_nch_modified.lib")
+
+
+def test_snapshots_are_deduplicated_and_immutable():
+    vd = np.linspace(0, 1.8, 19)
+    sweep = {"vg_start": 0, "vg_stop": 1.2, "vg_step": 0.6}
+    with tempfile.TemporaryDirectory() as folder:
+        history = RunHistory(folder)
+        first = history.record("nch", 40, "iv_vds", sweep, [(0.6, vd, 0.6 * vd), (1.2, vd, 1.2 * vd)],
+                               bin_40_modified, temperature=-269)
+        blobs, _ = history.disk_usage()
+        # The same result recorded again is the same run; nothing new is written.
+        again = history.record("nch", 40, "iv_vds", sweep, [(0.6, vd, 0.6 * vd), (1.2, vd, 1.2 * vd)],
+                               bin_40_modified, temperature=-269)
+        assert again.run_id == first.run_id and history.disk_usage()[0] == blobs
+        # A new run shares the arrays and model card that did not change.
+        second = history.record("nch", 40, "iv_vds", sweep, [(0.6, vd, 0.6 * vd), (1.2, vd, 2.4 * vd)],
+                                bin_40_modified, temperature=-269, note="retuned")
+        assert second.run_id != first.run_id
+        assert history.disk_usage()[0] == blobs + 1
+        manifest = os.path.join(folder, "runs", f"{first.run_id}.json")
+        assert not os.stat(manifest).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+        fresh = RunHistory(folder)
+        assert [run.run_id for run in fresh.runs(device="nch", bin=40, kind="iv_vds")] == \
+            sorted([first.run_id, second.run_id], key=lambda run_id: fresh.get(run_id).created, reverse=True)
+        assert fresh.runs(bin=41) == [] and fresh.runs(kind="iv") == []
+        vg, x, y = fresh.load(first.run_id[:8])[1]
+        assert vg == 1.2
+        np.testing.assert_array_equal(x, vd)
+        np.testing.assert_allclose(y, 1.2 * vd)
+        with open(bin_40_modified) as f:
+            assert fresh.model_card(second.run_id) == f.read()
+        assert fresh.get(second.run_id).note == "retuned"
+
+        # Deleting a run frees only the blobs no other run uses.
+        fresh.delete(second.run_id)
+        assert fresh.gc() == 1
+        assert [run.run_id for run in fresh.runs()] == [first.run_id]
+        np.testing.assert_allclose(fresh.load(first.run_id)[1][2], 1.2 * vd)
+
+
+def test_simulator_records_runs_including_cache_hits():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            executable = os.path.join(folder, "fake_ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_NGSPICE.format(python=sys.executable))
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            history = RunHistory(os.path.join(folder, "history"))
+            simulator = IceMOS_simulator_sky130(original_model_file, run_history=history,
+                                                result_cache=SimulationResultCache(os.path.join(folder, "cache")))
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            sweep = dict(bin_number=40, vg_start=0, vg_stop=1.2, vg_step=0.6, vd_start=0, vd_stop=1.8, vd_step=0.2)
+            simulator.iv_vds_curves('nch', **sweep)
+            snapshot = simulator.last_snapshot
+            simulator.iv_vds_curves('nch', **sweep)
+            assert simulator.last_cache_hit and simulator.last_snapshot.run_id == snapshot.run_id
+            assert len(history.runs()) == 1
+            assert snapshot.kind == "iv_vds" and snapshot.temperature == -269 and snapshot.bin == 40
+            assert snapshot.sweep["vd_step"] == 0.2
+            vg, vd, current = history.load(snapshot.run_id)[2]
+            np.testing.assert_allclose(current, vg * vd)
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    test_snapshots_are_deduplicated_and_immutable()
+    test_simulator_records_runs_including_cache_hits()
+    print("All run history tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import stat
+import tempfile
+import threading
+import time
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_scheduler import SimulationScheduler
+from IceMOS_sky130_sim_runner import NgspiceRunner, RETRY_LADDER
+
+
+# A stand-in for ngspice that takes 0.8 s of run time.
+FAKE_NGSPICE = """#!/bin/sh
+sleep 0.8
+echo "dc analysis done"
+"""
+
+
+def test_interactive_job_suspends_batch_simulation():
+    with tempfile.TemporaryDirectory() as folder:
+        executable = os.path.join(folder, "fake_ngspice")
+        with open(executable, "w") as f:
+            f.write(FAKE_NGSPICE)
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        netlist = os.path.join(folder, "netlist.spice")
+        with open(netlist, "w") as f:
+            f.write("* title\n.control\n  dc VGATE 0 1.8 0.1\n.endc\n.end\n")
+        # The timeout is shorter than the wall-clock time of the batch job, but time spent
+        # suspended does not count.
+        runner = NgspiceRunner(executable=executable, timeout=1.0, retry_ladder=[RETRY_LADDER[0]], verbose=False)
+
+        scheduler = SimulationScheduler(max_workers=1)
+        batch = scheduler.submit(runner.run, netlist, priority="batch", owner="campaign")
+        deadline = time.monotonic() + 5
+        while not batch._processes and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        submitted = time.monotonic()
+        interactive = scheduler.submit(time.sleep, 1.0, priority="interactive", owner="gui")
+        while interactive.state == "queued" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert batch.state == "suspended"
+        assert scheduler.metrics()["batch"]["suspended"] == 1
+        interactive.result(timeout=5)
+        assert time.monotonic() - submitted < 1.5
+
+        result = batch.result(timeout=5)
+        assert result.ok, result.status
+        assert batch.suspended_seconds() > 0.5
+        metrics = scheduler.metrics()
+        assert metrics["interactive"]["completed"] == 1 and metrics["batch"]["completed"] == 1
+        assert metrics["interactive"]["max_wait"] < 0.5
+        scheduler.shutdown()
+
+
+def test_priority_and_fair_share_order():
+    scheduler = SimulationScheduler(max_workers=1)
+    gate = threading.Event()
+    order = []
+    blocker = scheduler.submit(gate.wait, 5, priority="batch", owner="gate")
+    while blocker.state == "queued":
+        time.sleep(0.01)
+    jobs = [scheduler.submit(order.append, f"A{i}", priority="batch", owner="A") for i in range(3)]
+    jobs.append(scheduler.submit(order.append, "B0", priority="batch", owner="B"))
+    jobs.append(scheduler.submit(order.append, "opt", priority="optimizer", owner="fit"))
+    assert scheduler.metrics()["batch"]["queued"] == 4
+    gate.set()
+    for job in jobs:
+        job.result(timeout=5)
+    assert order[0] == "opt"
+    # B gets its turn after A's first job instead of waiting behind all of A's jobs.
+    assert order.index("B0") < order.index("A2")
+    scheduler.shutdown()
+
+
+def main():
+    test_interactive_job_suspends_batch_simulation()
+    test_priority_and_fair_share_order()
+    print("All scheduler tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_fitting import CurveResiduals, FiniteDifferenceJacobian, SimulatorModel, fit_parameters
+from IceMOS_sky130_sens_jacobian import SensitivityJacobian, jacobian_error, sens_netlist
+from _fake_ngspice import TRANSFER_CURRENT, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+
+
+# Derivatives of TRANSFER_CURRENT reported by the 'sens' command (the vth0 one multiplied by {vth0_scale}).
+SENSITIVITIES = """
+def sensitivities(vg, value):
+    s = 0.05 * math.log1p(math.exp((vg - value("vth0")) / 0.05))
+    sigmoid = 1.0 / (1.0 + math.exp(-(vg - value("vth0")) / 0.05))
+    return {{"vth0": -0.2 * value("u0") * s * sigmoid * {vth0_scale}, "u0": 0.1 * s ** 2}}
+"""
+
+FAMILY_NETLIST = """.include "./bin_40_nch_modified.lib"
+M1 net1 VGS GND GND sky130_fd_pr__nfet_01v8__model.40 L=0.15 W=0.42 nf=1
+VGATE VGS GND 0
+VDRAIN VDS GND 0
+vdsM VDS net1 0
+.save i(vdsm)
+.control
+save all
+let vgsval = 0
+while vgsval <= 1.8
+    alter VGATE = $&vgsval
+    dc VDRAIN 0 1.8 0.6
+    wrdata results_IV_IDS_vs_VDS_for_VG_sweep/n_mosfet_id_vs_vsd_{$&vgsval}.csv V(VDS) I(VDRAIN) I(VDSM)
+    let vgsval = $&vgsval + 0.9
+end
+.endc
+.GLOBAL GND
+.end
+"""
+
+
+def test_sens_netlist_runs_every_sweep_point():
+    text, points, instance, model, source = sens_netlist(FAMILY_NETLIST, "sens.raw", gate_values=[0.0, 0.9, 1.8])
+    assert (instance, model, source) == ("M1", "sky130_fd_pr__nfet_01v8__model.40", "vdsm")
+    assert len(points) == 12 and points[5] == (0.9, 0.6)
+    control = text.split(".control")[1].split(".endc")[0]
+    assert control.count("sens I(vdsm)") == 12 and control.count("write sens.raw") == 24
+    assert "alter VGATE dc = 0.9\nalter VDRAIN dc = 0.6\nop\n" in control and "wrdata" not in control
+    assert text.startswith('.include "./bin_40_nch_modified.lib"\nM1 net1') and text.rstrip().endswith(".end")
+
+
+def run_sensitivity_fit(vth0_scale):
+    with sandbox() as folder:
+        model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv",
+                               {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                               simulator_options={"result_cache": False})
+        model.simulator.runner.executable = write_fake(folder, TRANSFER_CURRENT,
+                                                       SENSITIVITIES.format(vth0_scale=vth0_scale))
+        vg = np.linspace(0.1, 1.7, 17)
+        residuals = CurveResiduals([(None, vg, transfer_current(vg, 0.5, 0.035))])
+        names = ["vth0", "u0"]
+        x = np.array([0.45, 0.03])
+        lower, upper = np.array([0.3, 0.01]), np.array([0.7, 0.06])
+
+        def fun(p):
+            return residuals(model(dict(zip(names, p))))
+
+        r0 = fun(x)
+        jacobian = SensitivityJacobian(model, residuals, names, fallback=FiniteDifferenceJacobian(step=1e-5))
+        J = jacobian(fun, x, r0, lower, upper)
+        reference = FiniteDifferenceJacobian(step=1e-5)(fun, x, r0, lower, upper)
+        parameters = {"vth0": {"value": 0.42664, "min": 0.3, "max": 0.7},
+                      "u0": {"value": 0.029497, "min": 0.01, "max": 0.06}}
+        fit_jacobian = SensitivityJacobian(model, residuals, names, fallback=FiniteDifferenceJacobian())
+        result = fit_parameters(model, residuals, parameters, max_nfev=40, jacobian=fit_jacobian)
+        return jacobian, J, reference, fit_jacobian, result
+
+
+def test_sensitivity_jacobian_matches_finite_differences():
+    jacobian, J, reference, fit_jacobian, result = run_sensitivity_fit(vth0_scale=1.0)
+    assert jacobian.active and jacobian.launches == 1 and jacobian.check_error < 1e-3
+    assert jacobian_error(J, reference) < 1e-3
+    assert result.success, result.message
+    assert abs(result.parameters["vth0"] - 0.5) < 1e-3 and abs(result.parameters["u0"] - 0.035) < 1e-4
+    # One sensitivity run per Jacobian; only the first one is checked with finite differences.
+    assert fit_jacobian.active and fit_jacobian.launches == result.njev
+    assert fit_jacobian.nfev == result.njev + 2
+
+
+def test_wrong_sensitivities_fall_back():
+    jacobian, J, reference, fit_jacobian, result = run_sensitivity_fit(vth0_scale=-1.0)
+    assert not jacobian.active and jacobian.check_error > 0.05
+    assert not fit_jacobian.active and fit_jacobian.launches == 1
+    assert result.success and abs(result.parameters["vth0"] - 0.5) < 1e-3
+
+
+def main():
+    test_sens_netlist_runs_every_sweep_point()
+    test_sensitivity_jacobian_matches_finite_differences()
+    test_wrong_sensitivities_fall_back()
+    print("All sensitivity Jacobian tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import os
+import sys
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_bsim4 import BSIM4Model
+from IceMOS_sky130_fitting import CurveResiduals, SimulatorModel
+from IceMOS_sky130_param_extractor import extract_parameters_with_values
+from IceMOS_sky130_scheduler import SimulationScheduler
+from IceMOS_sky130_sensitivity import REGIONS, RegionErrors, morris, operating_regions, parameter_box, sobol
+from _fake_ngspice import TRANSFER_CURRENT, launches, sandbox, transfer_current, write_fake
+
+circuits = os.path.join(os.path.dirname(__file__), "circuits")
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(circuits, "nch", "bin_40", "bin_40_nch_original.lib"))
+
+
+class Analytic:
+    """Region outputs of known sensitivities: x0 drives the first, x1 the second, x2 nothing; no third region."""
+
+    names = ["x0", "x1", "x2"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, points):
+        self.calls += 1
+        x = np.asarray(points)
+        return np.column_stack([4 * x[:, 0] + 0.1 * x[:, 1], x[:, 1] ** 2, np.full(len(x), np.nan)])
+
+
+class FlakyRegionErrors(RegionErrors):
+    """Cancels the chunks whose first parameter set has vth0 above 0.55."""
+
+    def _simulate(self, slot, points):
+        if points[0][0] > 0.55:
+            raise CancelledError()
+        return super()._simulate(slot, points)
+
+
+def test_parameter_box_and_regions():
+    values = extract_parameters_with_values(os.path.join(circuits, "nch", "bin_40", "bin_40_nch_modified.lib"))
+    names, lower, upper = parameter_box(values)
+    assert "level" not in names and "lmin" not in names and "mobmod" not in names
+    # The zeroed temperature coefficients get their spans; other zero parameters are left out.
+    assert values["ute"] == 0 and "ute" in names and values["cit"] == 0 and "cit" not in names
+    j = names.index("vth0")
+    assert np.isclose(lower[j], 0.5 * values["vth0"]) and np.isclose(upper[j], 1.5 * values["vth0"])
+    assert np.all(upper > lower)
+
+    transfer = np.loadtxt(os.path.join(circuits, "pch", "bin_1", "results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"))
+    family = np.loadtxt(os.path.join(circuits, "pch", "bin_1", "results_IV_ISD_vs_VSD_for_VG_sweep",
+                                     "p_mosfet_id_vs_vsd_1.8.csv"))
+    iv, vds = operating_regions([(None, transfer[:, 0], transfer[:, 1]), (1.8, family[:, 0], family[:, 5])],
+                                1.68, 0.15)
+    # Threshold current 100 nA * W / L = 1.12 µA, crossed between VSG = 1.05 and 1.1 V.
+    assert set(iv[transfer[:, 0] < 1.05]) == {"subthreshold"} and set(iv[transfer[:, 0] > 1.1]) == {"saturation"}
+    assert set(vds[family[:, 0] < 0.05]) == {"linear"} and set(vds[family[:, 0] > 0.5]) == {"saturation"}
+    low, = operating_regions([(0.2, family[:, 0], family[:, 5] * 1e-6)], 1.68, 0.15)
+    assert set(low) == {"subthreshold"}
+
+
+def test_morris_and_sobol():
+    evaluator = Analytic()
+    result = morris(evaluator, [0, 0, 0], [1, 1, 1], trajectories=20, seed=0)
+    assert result.evaluations == 80 and evaluator.calls == 20
+    mu_star = result.indices["mu_star"]
+    np.testing.assert_allclose(mu_star[:, 0], [4, 0.1, 0])
+    assert mu_star[2, 1] == 0 and mu_star[1, 1] > 0.5 and np.all(np.isnan(mu_star[:, 2]))
+    assert result.ranking("subthreshold") == ["x0", "x1", "x2"] and result.ranking("linear", top=1) == ["x1"]
+    # Across regions every region counts: x1 leads the second one.
+    assert result.ranking(top=2) == ["x0", "x1"]
+
+    result = sobol(Analytic(), [0, 0, 0], [1, 1, 1], samples=512, seed=1)
+    assert result.evaluations == 512 * 5
+    S1, ST = result.indices["S1"], result.indices["ST"]
+    # Additive outputs: S1 = ST = share of the variance (16 / 16.01 for x0 in the first output).
+    np.testing.assert_allclose(S1[:, 0], [16 / 16.01, 0.01 / 16.01, 0], atol=0.03)
+    np.testing.assert_allclose(ST[:, 1], [0, 1, 0], atol=0.03)
+    assert result.ranking("linear", top=1) == ["x1"]
+    try:
+        morris(Analytic(), [0, 0, 0], [1, 0, 1], progress=lambda done, total: False)
+        assert False, "Expected a ValueError."
+    except ValueError:
+        pass
+    try:
+        morris(Analytic(), [0, 0, 0], [1, 1, 1], progress=lambda done, total: done >= 8)
+        assert False, "Expected the analysis to be cancelled."
+    except RuntimeError:
+        pass
+
+
+def test_ranking_in_process_model():
+    # The 4 K transfer curve of nch bin 40, screened over every parameter of the card with the NumPy BSIM4 core.
+    lib_file_path = os.path.join(circuits, "nch", "bin_40", "bin_40_nch_modified.lib")
+    data = np.loadtxt(os.path.join(circuits, "nch", "bin_40", "results_IV_ID_vs_VG", "IV_ID_vs_VG.csv"))
+    targets = [(None, data[:, 0], data[:, 1])]
+    names, lower, upper = parameter_box(extract_parameters_with_values(lib_file_path))
+    model = BSIM4Model("nch", 40, lib_file_path, "iv", {"vgate_step": 0.01})
+    evaluator = RegionErrors(model, CurveResiduals(targets), names, operating_regions(targets, 0.42, 0.15))
+    result = morris(evaluator, lower, upper, trajectories=4, seed=0)
+    assert result.evaluations == 4 * (len(names) + 1) and model.evaluations == result.evaluations
+    assert result.ranking("subthreshold", top=1) == ["vth0"] and "vth0" in result.ranking("saturation", top=3)
+    # Parameters the DC model does not use (noise, capacitances) have no effect.
+    mu_star = dict(zip(names, result.indices["mu_star"][:, 0]))
+    assert mu_star["noia"] == 0 and mu_star["cgso"] == 0
+
+
+def test_region_errors_batched():
+    with sandbox(on_path=True) as folder:
+        scheduler = SimulationScheduler(max_workers=2)
+        try:
+            write_fake(folder, TRANSFER_CURRENT)
+            vg = np.linspace(0, 1.8, 19)
+            targets = [(None, vg, transfer_current(vg, 0.5, 0.035))]
+            model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv",
+                                   {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1},
+                                   simulator_options={"result_cache": False})
+            names = ["vth0", "u0", "k1"]
+            regions = operating_regions(targets, 0.42, 0.15)
+            evaluator = RegionErrors(model, CurveResiduals(targets), names, regions, scheduler=scheduler, chunk=4)
+            points = [np.array([0.5, 0.035, 0.6]), np.array([0.6, 0.035, 0.6])] * 5
+            errors = evaluator(points)
+            assert len(launches(folder)) == 3
+            assert errors.shape == (10, len(REGIONS)) and np.all(np.isnan(errors[:, 1]))
+            assert np.all(errors[0::2, [0, 2]] < 1e-6) and np.all(errors[1::2, [0, 2]] > 0.1)
+            assert os.path.isdir(os.path.join("circuits", ".fitting", "slot_1", "nch", "bin_40"))
+            # A cancelled chunk leaves its rows NaN; the other chunks are kept.
+            flaky = FlakyRegionErrors(model, CurveResiduals(targets), names, regions, scheduler=scheduler, chunk=1)
+            partial = flaky(points[:4])
+            assert np.all(np.isnan(partial[1::2])) and np.all(partial[0::2, [0, 2]] < 1e-6)
+            result = morris(evaluator, [0.4, 0.02, 0.5], [0.6, 0.05, 0.7], trajectories=3, seed=2)
+            # k1 does not enter the stand-in's current.
+            assert result.ranking(top=2) == ["vth0", "u0"] and result.indices["mu_star"][2, 0] == 0
+        finally:
+            scheduler.shutdown()
+
+
+def test_region_errors_on_family():
+    # Output curves of a gate sweep, batched through the wrdata files written inside the gate loop.
+    with sandbox(on_path=True) as folder:
+        scheduler = SimulationScheduler(max_workers=2)
+        try:
+            write_fake(folder, TRANSFER_CURRENT)
+            vd = np.linspace(0.1, 1.7, 17)
+            targets = [(vg, vd, transfer_current(vg, 0.5, 0.035, vd)) for vg in (0.6, 1.2, 1.8)]
+            sweep = {"vg_start": 0.6, "vg_stop": 1.8, "vg_step": 0.6, "vd_start": 0, "vd_stop": 1.8, "vd_step": 0.1}
+            model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv_vds", sweep,
+                                   simulator_options={"result_cache": False})
+            names = ["vth0", "u0"]
+            regions = operating_regions(targets, 0.42, 0.15)
+            evaluator = RegionErrors(model, CurveResiduals(targets), names, regions, scheduler=scheduler, chunk=2)
+            points = [np.array([0.5, 0.035]), np.array([0.6, 0.035]), np.array([0.5, 0.02])]
+            errors = evaluator(points)
+            assert len(launches(folder)) == 2
+            # The same errors as the curves simulated one parameter set at a time.
+            serial = RegionErrors(lambda p: model(p), CurveResiduals(targets), names, regions)(points)
+            np.testing.assert_allclose(errors, serial, rtol=1e-6, atol=1e-12)
+            assert np.all(errors[0][np.isfinite(errors[0])] < 1e-6) and np.nanmin(errors[1:]) > 0
+        finally:
+            scheduler.shutdown()
+
+
+def main():
+    test_parameter_box_and_regions()
+    test_morris_and_sobol()
+    test_ranking_in_process_model()
+    test_region_errors_batched()
+    test_region_errors_on_family()
+    print("All sensitivity tests passed.")
+
+
+if __name__ == '__main__':
+    main()
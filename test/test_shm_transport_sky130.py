@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import shutil
+import sys
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_shm_transport import SharedArrayPool, _attach_block, iv_vds_worker, open_shared_array
+from _fake_ngspice import TRANSFER_CURRENT, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+
+
+def fill_bias_temperature_block(handle, temperature_index):
+    # Worker: writes one temperature slice of a (bias x temperature x monte carlo) block in place.
+    with open_shared_array(handle) as out:
+        vg = np.linspace(0, 1.8, out.shape[0])
+        out[:, temperature_index, :] = vg[:, None] * (temperature_index + 1) + np.arange(out.shape[2])
+    handle.metadata["filled"] = temperature_index
+    return handle
+
+
+def test_workers_write_into_shared_block():
+    pool = SharedArrayPool(prefix="icemos_test")
+    handle = pool.allocate((19, 3, 8), metadata={"axes": ["VG", "T", "MC"]})
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(3) as workers:
+            returned = workers.starmap(fill_bias_temperature_block, [(handle, t) for t in range(3)])
+        assert sorted(h.metadata["filled"] for h in returned) == [0, 1, 2]
+        assert all(h.name == handle.name for h in returned)
+
+        with pool.borrow(handle) as data:
+            expected = np.linspace(0, 1.8, 19)[:, None, None] * np.arange(1, 4)[None, :, None] + np.arange(8)
+            np.testing.assert_allclose(data, expected)
+            # A second mapping sees the same memory: no copy was made.
+            with pool.borrow(handle) as again:
+                data[0, 0, 0] = 42.0
+                assert again[0, 0, 0] == 42.0
+            assert pool.refcount(handle) == 2
+    finally:
+        pool.release(handle)
+    assert pool.refcount(handle) == 0 and len(pool) == 0
+    try:
+        _attach_block(handle.name)
+        assert False, "block should have been unlinked"
+    except FileNotFoundError:
+        pass
+
+
+def test_iv_vds_workers_simulate_in_their_own_roots():
+    with sandbox(on_path=True) as folder:
+        write_fake(folder, TRANSFER_CURRENT)
+        roots = []
+        for k in range(2):
+            roots.append(os.path.join(folder, f"worker_{k}"))
+            os.makedirs(os.path.join(roots[-1], "nch", "bin_40"))
+            for model_type in ("original", "modified"):
+                shutil.copyfile(bin_40_original,
+                                os.path.join(roots[-1], "nch", "bin_40", f"bin_40_nch_{model_type}.lib"))
+        sweeps = [{"bin_number": 40, "vg_start": 0.6, "vg_stop": 1.8, "vg_step": 0.6,
+                   "vd_start": 0, "vd_stop": 1.8, "vd_step": 0.1},
+                  {"bin_number": 40, "vg_start": 0.9, "vg_stop": 1.8, "vg_step": 0.9,
+                   "vd_start": 0, "vd_stop": 1.8, "vd_step": 0.2}]
+        pool = SharedArrayPool(prefix="icemos_test")
+        handles = [pool.allocate((3, 19)), pool.allocate((2, 10))]
+        try:
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(2) as workers:
+                returned = workers.starmap(iv_vds_worker, [(handle, original_model_file, "nch", sweep, root)
+                                                           for handle, sweep, root in zip(handles, sweeps, roots)])
+            for handle, result in zip(handles, returned):
+                vg, vd = np.array(result.metadata["vg"]), np.array(result.metadata["vd"])
+                assert result.metadata["run_status"] == "ok" and result.name == handle.name
+                with pool.borrow(handle) as currents:
+                    np.testing.assert_allclose(currents, transfer_current(vg[:, None], 0.42664, 0.029497, vd),
+                                               rtol=1e-9)
+            # Each worker wrote its netlists and results under its own root.
+            for root, pattern in zip(roots, ["n_mosfet_id_vs_vsd_1.2.csv", "n_mosfet_id_vs_vsd_0.9.csv"]):
+                assert os.path.exists(os.path.join(root, "nch", "bin_40", "results_IV_IDS_vs_VDS_for_VG_sweep",
+                                                   pattern))
+            assert not os.path.exists(os.path.join(folder, "circuits"))
+            # A family that does not fit the block is an error, not a truncated copy.
+            try:
+                iv_vds_worker(handles[1], original_model_file, "nch", sweeps[0], roots[0])
+                assert False, "Expected a ValueError."
+            except ValueError:
+                pass
+        finally:
+            for handle in handles:
+                pool.release(handle)
+        assert len(pool) == 0
+
+
+def main():
+    test_workers_write_into_shared_block()
+    test_iv_vds_workers_simulate_in_their_own_roots()
+    print("All shared memory transport tests passed.")
+
+
+if __name__ == '__main__':
+    main()
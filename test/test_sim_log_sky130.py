@@ -0,0 +1,81 @@
+import os
+import sys
+import stat
+import tempfile
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_sim_log import SimulationLogCapture
+from IceMOS_sky130_sim_runner import NgspiceRunner, RETRY_LADDER
+
+
+# A stand-in for ngspice that echoes a gate sweep with verbose output.
+FAKE_NGSPICE = """#!/bin/sh
+for vg in 0 0.6 1.2 1.8; do
+    echo "Sweeping VGS = $vg"
+    i=0
+    while [ $i -lt 500 ]; do
+        echo "verbose line $i for VGS $vg"
+        i=$((i+1))
+    done
+    echo "Reference value :  1.00000e-01" 1>&2
+    echo "No. of Data Rows : 19"
+done
+"""
+
+
+def test_tail_rotation_and_progress():
+    with tempfile.TemporaryDirectory() as folder:
+        log_path = os.path.join(folder, "logs", "job.log")
+        capture = SimulationLogCapture(log_path, max_bytes=2000, backup_count=2, tail_lines=10,
+                                       total_analyses=2, points_per_analysis=4)
+        capture.feed("stdout", "Sweeping VGS = 0.6\n")
+        for i in range(3):
+            capture.feed("stderr", "Reference value :  1.0e-01\n")
+        version, progress = capture.progress()
+        assert progress.label == "VGS = 0.6"
+        assert abs(progress.fraction - 3 / 8) < 1e-12
+        capture.feed("stdout", "No. of Data Rows : 4\n")
+        _, progress = capture.progress()
+        assert progress.completed_analyses == 1 and progress.fraction == 0.5
+
+        for i in range(500):
+            capture.feed("stdout", f"line {i}")
+        capture.close()
+        assert capture.tail("stdout").splitlines() == [f"line {i}" for i in range(490, 500)]
+        assert os.path.exists(log_path + ".1") and os.path.exists(log_path + ".2")
+        assert not os.path.exists(log_path + ".3")
+        assert os.path.getsize(log_path) <= 2000
+
+
+def test_runner_streams_and_reports_progress():
+    with tempfile.TemporaryDirectory() as folder:
+        executable = os.path.join(folder, "fake_ngspice")
+        with open(executable, "w") as f:
+            f.write(FAKE_NGSPICE)
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        netlist = os.path.join(folder, "sweep.spice")
+        with open(netlist, "w") as f:
+            f.write("* title\n.end\n")
+
+        updates = []
+        runner = NgspiceRunner(executable=executable, timeout=30, retry_ladder=[RETRY_LADDER[0]],
+                               tail_lines=5, verbose=False)
+        result = runner.run(netlist, progress_callback=updates.append, total_analyses=4)
+        assert result.ok
+        assert len(result.stdout.splitlines()) == 5
+        assert updates and updates[-1].fraction == 1.0
+        with open(result.log_path) as f:
+            assert sum(1 for _ in f) > 2000
+
+
+def main():
+    test_tail_rotation_and_progress()
+    test_runner_streams_and_reports_progress()
+    print("All log capture tests passed.")
+
+
+if __name__ == '__main__':
+    main()
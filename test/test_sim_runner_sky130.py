@@ -0,0 +1,259 @@
+import os
+import signal
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_sim_runner import NgspiceRunner, RETRY_LADDER
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+
+
+# A stand-in for ngspice: it fails to converge unless the netlist enables source stepping,
+# and hangs forever when the netlist asks it to.
+FAKE_NGSPICE = """#!/bin/sh
+netlist="$2"
+if grep -q "HANG" "$netlist"; then
+    sleep 60
+fi
+if grep -q "srcsteps" "$netlist"; then
+    echo "dc analysis done"
+    exit 0
+fi
+echo "doAnalyses: no convergence" 1>&2
+exit 1
+"""
+
+
+# A stand-in for ngspice for IV netlists that only converges with the smaller-step rung, where it writes
+# ID = VG^2 at every point of the halved dc step. It fails outright while the 'broken' file says so.
+FAKE_NGSPICE_SMALL_STEP = """#!{python}
+import re, sys
+if sys.argv[1] == "-v":
+    print("ngspice-44.2")
+    sys.exit(0)
+text = open(sys.argv[2]).read()
+if "BROKEN" in open("{broken}").read():
+    sys.stderr.write("Error on line 12: unknown subckt\\n")
+    sys.exit(1)
+if "retry rung: smaller_step" not in text:
+    sys.stderr.write("doAnalyses: no convergence\\n")
+    sys.exit(1)
+start, stop, step = map(float, re.search(r"dc VGATE_src (\\S+) (\\S+) (\\S+)", text).groups())
+path = re.search(r"wrdata (\\S+)", text).group(1)
+with open(path, "w") as f:
+    vg = start
+    while vg <= stop + step * 1e-9:
+        f.write(f" {{vg:.8e}}  {{vg * vg:.8e}} \\n")
+        vg += step
+"""
+
+
+# A stand-in for ngspice for IV netlists that prints the convergence warnings of a run rescued by source
+# stepping and exits cleanly with ID = VG at every point. The 'mode' file makes it stop after two points
+# ('short') or report the analysis as aborted ('aborted').
+FAKE_NGSPICE_WARNINGS = """#!{python}
+import re, sys
+if sys.argv[1] == "-v":
+    print("ngspice-44.2")
+    sys.exit(0)
+mode = open("{mode}").read()
+text = open(sys.argv[2]).read()
+sys.stderr.write("Warning: singular matrix:  check nodes net1 and net1\\n")
+sys.stderr.write("Warning: gmin stepping failed\\n")
+print("Note: Starting source stepping")
+if mode == "aborted":
+    sys.stderr.write("doAnalyses: DC transfer characteristic:  no convergence\\nrun simulation(s) aborted\\n")
+start, stop, step = map(float, re.search(r"dc VGATE_src (\\S+) (\\S+) (\\S+)", text).groups())
+path = re.search(r"wrdata (\\S+)", text).group(1)
+with open(path, "w") as f:
+    vg, points = start, 0
+    while vg <= stop + step * 1e-9 and not (mode == "short" and points == 2):
+        f.write(f" {{vg:.8e}}  {{vg:.8e}} \\n")
+        vg += step
+        points += 1
+"""
+
+
+def make_fake_ngspice(folder):
+    path = os.path.join(folder, "fake_ngspice")
+    with open(path, "w") as f:
+        f.write(FAKE_NGSPICE)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def write_netlist(folder, body=""):
+    path = os.path.join(folder, "netlist.spice")
+    with open(path, "w") as f:
+        f.write("* title\n" + body + "\n.control\n  dc VGATE 0 1.8 0.1\n.endc\n.end\n")
+    return path
+
+
+def test_retry_ladder_records_rung():
+    with tempfile.TemporaryDirectory() as folder:
+        runner = NgspiceRunner(executable=make_fake_ngspice(folder), timeout=10, verbose=False)
+        result = runner.run(write_netlist(folder))
+        assert result.ok
+        assert result.rung == "source_stepping"
+        assert [a[0] for a in result.attempts] == ["default", "gmin_stepping", "source_stepping"]
+        # The rung netlists are cleaned up after each attempt.
+        assert sorted(os.listdir(folder)) == ["fake_ngspice", "logs", "netlist.spice"]
+
+
+def test_timeout_kills_process_group():
+    with tempfile.TemporaryDirectory() as folder:
+        runner = NgspiceRunner(executable=make_fake_ngspice(folder), timeout=0.5,
+                               retry_ladder=[RETRY_LADDER[0]], kill_grace=0.5, verbose=False)
+        result = runner.run(write_netlist(folder, "* HANG"))
+        assert result.status == "timeout"
+        assert result.rung is None
+        assert result.elapsed < 10
+
+
+def test_smaller_step_rung_rewrites_dc():
+    with tempfile.TemporaryDirectory() as folder:
+        netlist = write_netlist(folder)
+        rung_path = NgspiceRunner._write_rung_netlist(netlist, RETRY_LADDER[-1])
+        with open(rung_path) as f:
+            text = f.read()
+        assert "dc VGATE 0 1.8 0.05" in text
+        assert text.index("reltol") < text.index(".control")
+
+
+class Capture:
+    """The parts of a SimulationLogCapture used to classify a run."""
+
+    def __init__(self, stderr, error_lines=()):
+        self.stderr = stderr
+        self.error_lines = list(error_lines)
+
+    def tail(self, stream):
+        return self.stderr
+
+
+def test_classify_memory_failures():
+    runner = NgspiceRunner(max_memory_mb=100, verbose=False)
+    assert runner._classify(-signal.SIGKILL, Capture("malloc: allocation failed"), False) == "memory"
+    assert runner._classify(1, Capture("Fatal error: out of memory"), False) == "memory"
+    # Cancellation, crashes without an allocation error and harmless mentions of malloc are not memory failures.
+    assert runner._classify(-signal.SIGTERM, Capture("malloc: allocation failed"), False) == "failed"
+    assert runner._classify(-signal.SIGSEGV, Capture(""), False) == "failed"
+    assert runner._classify(0, Capture("Note: using malloc arena 2"), False) == "ok"
+    # Convergence messages only count when the run failed, gave up or left outputs incomplete.
+    warning = Capture("Warning: gmin stepping failed", ["Warning: gmin stepping failed"])
+    assert runner._classify(0, warning, False) == "ok"
+    assert runner._classify(0, warning, False, outputs_complete=False) == "convergence"
+    assert runner._classify(1, warning, False) == "convergence"
+    aborted = Capture("run simulation(s) aborted", ["run simulation(s) aborted"])
+    assert runner._classify(0, aborted, False) == "convergence"
+    assert NgspiceRunner(verbose=False)._classify(-signal.SIGKILL, Capture("malloc failed"), False) == "failed"
+
+
+def test_failed_points_reported_as_nan():
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, "results"))
+        with open(os.path.join(folder, "results", "partial.csv"), "w") as f:
+            f.write(" 0.00000000e+00  1.0e-06 \n")
+        sweep = IceMOS_simulator_sky130.sweep_values(0, 0.2, 0.1)
+        outputs = [{"path": os.path.join("results", "partial.csv"), "sweep": sweep, "columns": 1},
+                   {"path": os.path.join("results", "missing.csv"), "sweep": sweep, "columns": 1}]
+        failed = IceMOS_simulator_sky130._conform_outputs(folder, outputs)
+        assert failed == 2 + 3
+        with open(os.path.join(folder, "results", "missing.csv")) as f:
+            rows = [line.split() for line in f]
+        assert len(rows) == 3 and all(row[1] == "nan" for row in rows)
+        with open(os.path.join(folder, "results", "partial.csv")) as f:
+            rows = [line.split() for line in f]
+        assert [float(row[0]) for row in rows] == sweep and rows[0][1] == "1.0e-06" and rows[2][1] == "nan"
+
+
+def test_smaller_step_rung_returns_requested_grid():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            executable = os.path.join(folder, "ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_NGSPICE_SMALL_STEP.format(python=sys.executable,
+                                                       broken=os.path.join(folder, "broken")))
+            with open(os.path.join(folder, "broken"), "w") as f:
+                f.write("")
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            simulator = IceMOS_simulator_sky130(original_model_file, retry_ladder=[RETRY_LADDER[0], RETRY_LADDER[-1]],
+                                                result_cache=False)
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            sweep = IceMOS_simulator_sky130.sweep_values(0, 1.8, 0.1)
+            result = simulator.simulate_iv("nch", 40, vgate_start=0, vgate_stop=1.8, vgate_step=0.1)
+            assert simulator.last_run.rung == "smaller_step"
+            # The extra points of the halved step are dropped: the grid is the one asked for.
+            np.testing.assert_allclose(result.sweep, sweep)
+            np.testing.assert_allclose(result.current, np.asarray(sweep) ** 2, rtol=1e-6)
+            result = simulator.iv_curve("nch", 40, vgate_start=0, vgate_stop=1.8, vgate_step=0.1)
+            assert result.metadata["rung"] == "smaller_step"
+            np.testing.assert_allclose(result.sweep.values, sweep)
+            np.testing.assert_allclose(result.current.values, np.asarray(sweep) ** 2, rtol=1e-6)
+            # Hard failures are not reported as failed points.
+            with open(os.path.join(folder, "broken"), "w") as f:
+                f.write("BROKEN")
+            try:
+                simulator.simulate_iv("nch", 40, vgate_start=0, vgate_stop=1.8, vgate_step=0.1)
+                assert False, "Expected a RuntimeError."
+            except RuntimeError:
+                assert simulator.last_run.status == "failed"
+        finally:
+            os.chdir(cwd)
+
+
+def test_recovered_warnings_are_ok():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            mode = os.path.join(folder, "mode")
+            executable = os.path.join(folder, "ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_NGSPICE_WARNINGS.format(python=sys.executable, mode=mode))
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            simulator = IceMOS_simulator_sky130(original_model_file, result_cache=False)
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            sweep = IceMOS_simulator_sky130.sweep_values(0, 1.8, 0.1)
+            for name, status, attempts in (("", "ok", 1), ("short", "convergence", 5),
+                                           ("aborted", "convergence", 5)):
+                with open(mode, "w") as f:
+                    f.write(name)
+                result = simulator.iv_curve("nch", 40, vgate_start=0, vgate_stop=1.8, vgate_step=0.1)
+                assert simulator.last_run.status == status and len(simulator.last_run.attempts) == attempts
+                np.testing.assert_allclose(result.sweep.values, sweep)
+                # A complete run with warnings keeps its default-rung output; the two points of the last
+                # ('smaller_step') rung of a short run are 0 and 0.05, so only VG = 0 is kept.
+                assert result.failed_points == (18 if name == "short" else 0)
+                assert result.ok == (name == "")
+            assert simulator.last_run.rung is None
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    test_retry_ladder_records_rung()
+    test_timeout_kills_process_group()
+    test_smaller_step_rung_rewrites_dc()
+    test_classify_memory_failures()
+    test_failed_points_reported_as_nan()
+    test_smaller_step_rung_returns_requested_grid()
+    test_recovered_warnings_are_ok()
+    print("All runner tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,7 +23,7 @@ def test_iv_vds_plot_nmos():
     print(iv_vds_output)
 
     print("Plotting IV VDS results for NMOS (Bin 0) interactively using PyQtGraph:")
-    win = simulator.plot_iv_vds_results_qt(device_type='nch', bin_number=0)
+    win = simulator.plot_iv_vds_results_qt(device_type='nch', bin_number=0, result=iv_vds_output)
     return win
 
 
@@ -42,7 +42,7 @@ def test_iv_vds_plot_pmos():
     print(iv_vds_output)
 
     print("Plotting IV VDS results for PMOS (Bin 10) interactively using PyQtGraph:")
-    win = simulator.plot_iv_vds_results_qt(device_type='pch', bin_number=10)
+    win = simulator.plot_iv_vds_results_qt(device_type='pch', bin_number=10, result=iv_vds_output)
     return win
 
 
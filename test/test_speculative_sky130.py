@@ -0,0 +1,91 @@
+import os
+import sys
+import shutil
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_param_handler import ModelModifier
+from IceMOS_sky130_result_cache import SimulationResultCache
+from IceMOS_sky130_scheduler import SimulationScheduler
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+from IceMOS_sky130_speculative import SliderMotionPredictor, SpeculativeExecutor
+from _fake_ngspice import launches, sandbox, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+
+# The current of the stand-in for ngspice, I = VG * vth0.
+CURRENT = """
+def current(vg, value):
+    return vg * value("vth0")
+"""
+
+
+def test_predictor_follows_slider_motion():
+    predictor = SliderMotionPredictor()
+    for i, value in enumerate([0.40, 0.41, 0.42, 0.43]):
+        predictor.observe(value, timestamp=i * 0.05)
+    candidates = predictor.predict(count=4, scale=100, maximum=0.5)
+    # Next step first, then the extrapolated positions (speed 0.2/s), then one step back.
+    assert candidates == [0.44, 0.45, 0.48, 0.5]
+    assert all(round(c * 100) / 100 == c for c in candidates)
+
+    predictor.reset()
+    predictor.observe(0.43)
+    assert sorted(predictor.predict(count=2, scale=100)) == [0.42, 0.44]
+
+
+def test_speculation_prefills_cache():
+    with sandbox(on_path=True) as folder:
+        write_fake(folder, CURRENT, logged=["vth0"])
+
+        bin_folder = os.path.join("circuits", "nch", "bin_40")
+        os.makedirs(bin_folder)
+        lib = os.path.join(bin_folder, "bin_40_nch_original.lib")
+        shutil.copyfile(bin_40_original, lib)
+        cache = SimulationResultCache(os.path.join(folder, "cache"))
+        scheduler = SimulationScheduler(max_workers=2)
+        executor = SpeculativeExecutor(original_model_file, "nch", 40, lib, scheduler=scheduler,
+                                       result_cache=cache, max_candidates=2)
+        executor.set_parameters({"vth0": {"value": 0.42}})
+        executor.set_sweep("iv", vgate_start=0, vgate_stop=0.2, vgate_step=0.1)
+        executor.on_parameter_changed("vth0", 0.43, scale=100)
+        candidates = executor.on_parameter_changed("vth0", 0.44, scale=100)
+        assert candidates[0] == 0.45
+        for job in executor.jobs:
+            job.result(timeout=30)
+        speculated = launches(folder)
+        assert any(line.endswith(" vth0=0.45") for line in speculated)
+
+        # The slider lands on 0.45: the real modified card is written and the curve is a cache hit.
+        ModelModifier(lib, lib.replace("_original.lib", "_modified.lib")).modify_parameter(40, "vth0", "0.45")
+        simulator = IceMOS_simulator_sky130(original_model_file, result_cache=cache)
+        result = simulator.iv_curve("nch", bin_number=40, vgate_start=0, vgate_stop=0.2, vgate_step=0.1)
+        assert simulator.last_cache_hit and result.metadata["cache_hit"] and result.ok
+        np.testing.assert_allclose(result.current.values, result.sweep.values * 0.45)
+        assert launches(folder) == speculated
+
+        # A sweep change cancels the pending speculation.
+        executor.on_parameter_changed("vth0", 0.46, scale=100)
+        jobs = list(executor.jobs)
+        executor.set_sweep("iv", vgate_start=0, vgate_stop=1.8, vgate_step=0.1)
+        assert jobs and all(job.cancelled for job in jobs) and not executor.jobs
+        for job in jobs:
+            job.wait(30)
+        scheduler.shutdown()
+
+
+def main():
+    test_predictor_follows_slider_motion()
+    test_speculation_prefills_cache()
+    print("All speculative execution tests passed.")
+
+
+if __name__ == '__main__':
+    main()
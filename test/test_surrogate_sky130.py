@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_fitting import SimulatorModel
+from IceMOS_sky130_scheduler import SimulationScheduler
+from IceMOS_sky130_surrogate import (CurveSurrogate, LegendreChaos, RadialBasisModel, SurrogatePreview,
+                                     build_surrogate)
+from _fake_ngspice import TRANSFER_CURRENT, launches, sandbox, transfer_current, write_fake
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+bin_40_original = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "circuits", "nch", "bin_40", "bin_40_nch_original.lib"))
+
+
+def test_interpolation_models():
+    rng = np.random.default_rng(0)
+    points = rng.random((40, 2))
+    smooth = lambda p: np.column_stack([np.sin(3 * p[:, 0]) + p[:, 1] ** 2, np.exp(p[:, 0] - p[:, 1])])
+    probe = rng.random((200, 2))
+    for kernel in ("cubic", "thin_plate", "gaussian"):
+        model = RadialBasisModel(points, smooth(points), kernel=kernel)
+        # Exact at the samples, close in between.
+        np.testing.assert_allclose(model(points), smooth(points), atol=1e-6)
+        assert np.max(np.abs(model(probe) - smooth(probe))) < 0.1, kernel
+    # The expansion reproduces a polynomial of its degree exactly.
+    quadratic = lambda p: np.column_stack([1 + p[:, 0] - 2 * p[:, 0] * p[:, 1] + 3 * p[:, 1] ** 2])
+    chaos = LegendreChaos(points, quadratic(points), degree=2)
+    assert len(chaos.indices) == 6
+    np.testing.assert_allclose(chaos(probe), quadratic(probe), atol=1e-9)
+    for bad in (lambda: RadialBasisModel(points[:2], smooth(points[:2])),
+                lambda: LegendreChaos(points[:5], quadratic(points[:5]), degree=2),
+                lambda: CurveSurrogate(["vth0"], [0.5], [0.5])):
+        try:
+            bad()
+            assert False, "Expected a ValueError."
+        except ValueError:
+            pass
+
+
+def test_curve_surrogate_on_family():
+    # Two family curves of a PMOS-like (negative) current; a failed sample is skipped.
+    vd = np.linspace(0, 1.8, 10)
+    family = lambda p: [(vg, vd, -transfer_current(vg, p[0], p[1]) * np.tanh(4 * vd) - 1e-14) for vg in (0.9, 1.8)]
+    rng = np.random.default_rng(1)
+    points = [np.array([0.3, 0.01]) + rng.random(2) * [0.4, 0.05] for _ in range(30)]
+    curves = [family(p) for p in points]
+    curves[3] = [(vg, x, np.full_like(y, np.nan)) for vg, x, y in curves[3]]
+    surrogate = CurveSurrogate(["vth0", "u0"], [0.3, 0.01], [0.7, 0.06]).fit(points, curves)
+    assert surrogate.samples == 29
+    predicted = surrogate.predict({"vth0": 0.5, "u0": 0.035})
+    assert [vg for vg, _, _ in predicted] == [0.9, 1.8] and np.all(predicted[0][2] < 0)
+    assert surrogate.error([0.5, 0.035], family([0.5, 0.035])) < 0.05
+    # Refining at a point makes the surrogate exact there.
+    assert surrogate.add([0.5, 0.035], family([0.5, 0.035])) and surrogate.samples == 30
+    assert surrogate.error([0.5, 0.035], family([0.5, 0.035])) < 1e-6
+    assert not surrogate.add([0.5, 0.035], family([0.5, 0.035])[:1])
+
+
+def test_build_surrogate_and_preview():
+    with sandbox(on_path=True) as folder:
+        scheduler = SimulationScheduler(max_workers=2)
+        try:
+            write_fake(folder, TRANSFER_CURRENT)
+            sweep = {"vgate_start": 0, "vgate_stop": 1.8, "vgate_step": 0.1}
+            model = SimulatorModel(original_model_file, "nch", 40, bin_40_original, "iv", sweep,
+                                   simulator_options={"result_cache": False})
+            surrogate = build_surrogate(model, ["vth0", "u0"], [0.3, 0.01], [0.7, 0.06], seed=0)
+            # All 20 samples in one ngspice launch.
+            assert surrogate.samples == 20 and len(launches(folder)) == 1
+            vg = np.round(np.arange(0, 1.8 + 1e-9, 0.1), 10)
+            started = time.perf_counter()
+            (_, x, y), = surrogate.predict({"vth0": 0.5, "u0": 0.035})
+            assert time.perf_counter() - started < 0.05
+            np.testing.assert_allclose(x, vg)
+            assert np.max(np.abs(np.log10(y / transfer_current(vg, 0.5, 0.035)))) < 0.1
+
+            preview = SurrogatePreview(original_model_file, "nch", 40, bin_40_original, scheduler=scheduler,
+                                       simulator_options={"result_cache": False})
+            assert preview.train() is None and preview.preview() is None
+            parameters = {"vth0": {"value": 0.5, "min": 0.3, "max": 0.7},
+                          "u0": {"value": 0.035, "min": 0.01, "max": 0.06},
+                          "k1": {"value": 0.6, "min": 0.6, "max": 0.6}}
+            preview.set_parameters(parameters)
+            preview.set_sweep("iv", **sweep)
+            job = preview.train()
+            assert preview.train() is job
+            job.result(timeout=60)
+            assert preview.ready and preview.surrogate.names == ["vth0", "u0"] and len(launches(folder)) == 2
+            # Slider moves within the ranges reuse the surrogate.
+            parameters["vth0"]["value"] = 0.45
+            preview.set_parameters(parameters)
+            assert preview.ready and preview.train() is None
+            curves, error = preview.confirm().result(timeout=60)
+            assert error is not None and error < 0.1 and preview.surrogate.samples == 21
+            np.testing.assert_allclose(preview.preview()[0][2], curves[0][2], rtol=1e-6)
+            # The confirmation card holds the slider value and the fixed parameter.
+            with open(os.path.join("circuits", ".surrogate", "confirm", "nch", "bin_40",
+                                   "bin_40_nch_modified.lib")) as f:
+                card = f.read()
+            assert "0.45" in card and "0.6" in card
+            # A new range needs a new surrogate.
+            parameters["vth0"]["max"] = 0.8
+            preview.set_parameters(parameters)
+            assert not preview.ready and preview.preview() is None
+            preview.shutdown()
+            assert not os.path.exists(os.path.join("circuits", ".surrogate"))
+        finally:
+            scheduler.shutdown()
+
+
+def main():
+    test_interpolation_models()
+    test_curve_surrogate_on_family()
+    test_build_surrogate_and_preview()
+    print("All surrogate tests passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import os
+import sys
+import stat
+import tempfile
+
+import numpy as np
+
+# Add the 'src' directory to the Python path.
+sources_path = os.path.join(os.path.dirname(__file__), "../src")
+sys.path.insert(0, sources_path)
+
+from IceMOS_sky130_result_cache import SimulationResultCache
+from IceMOS_sky130_simulator import IceMOS_simulator_sky130
+from IceMOS_sky130_sweep_planner import CurveStore, arithmetic_runs
+
+original_model_file = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "../pdk_original_models/sky130_fd_pr__nfet_01v8.pm3.spice"))
+
+
+# A stand-in for ngspice that runs the gate loop of the IV VDS netlist with I = VG * VD
+# and logs every (VG, number of VD points) it simulates.
+FAKE_NGSPICE = """#!{python}
+import os, re, sys
+if sys.argv[1] == "-v":
+    print("ngspice-44.2")
+    sys.exit(0)
+text = open(sys.argv[2]).read()
+vg = float(re.search(r"let vgsval = (\\S+)", text).group(1))
+step = float(re.search(r"let step = (\\S+)", text).group(1))
+stop = float(re.search(r"while vgsval <= (\\S+)", text).group(1))
+start_d, stop_d, step_d = map(float, re.search(r"dc VDRAIN (\\S+) (\\S+) (\\S+)", text).groups())
+vds = []
+v = start_d
+while v <= stop_d + step_d * 1e-9:
+    vds.append(v)
+    v += step_d
+with open("launches.txt", "a") as log:
+    while vg <= stop:
+        log.write(f"{{vg:g}} {{len(vds)}}\\n")
+        with open(f"results_IV_IDS_vs_VDS_for_VG_sweep/n_mosfet_id_vs_vsd_{{vg:g}}.csv", "w") as f:
+            for vd in vds:
+                f.write(f" {{vd:e}} {{vg:e}} {{vd:e}} {{0:e}} {{vd:e}} {{vg * vd:e}} \\n")
+        vg = vg + step
+"""
+
+
+def test_arithmetic_runs():
+    runs = arithmetic_runs([0.0, 0.1, 0.2, 0.5, 0.7, 0.9, 1.5])
+    assert [(r[0], r[1], r[3]) for r in runs] == [(0.0, 0.2, 3), (0.5, 0.9, 3), (1.5, 1.5, 1)]
+
+
+def test_planner_only_requests_missing_points():
+    with tempfile.TemporaryDirectory() as folder:
+        store = CurveStore(SimulationResultCache(folder))
+        store.merge("family", 0.6, [0.0, 0.2, 0.4], [0.0, 0.12, 0.24])
+        tasks = store.plan("family", [0.0, 0.6], [0.0, 0.1, 0.2, 0.3, 0.4])
+        planned = sorted((tuple(t.vg_values), tuple(np.round(t.vd_values, 9))) for t in tasks)
+        assert planned == [((0.0,), (0.0, 0.1, 0.2, 0.3, 0.4)), ((0.6,), (0.1, 0.3))]
+
+
+def test_incremental_family_resimulation():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            executable = os.path.join(folder, "fake_ngspice")
+            with open(executable, "w") as f:
+                f.write(FAKE_NGSPICE.format(python=sys.executable))
+            os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+            simulator = IceMOS_simulator_sky130(original_model_file,
+                                                result_cache=SimulationResultCache(os.path.join(folder, "cache")))
+            simulator.runner.executable = executable
+            simulator.runner.verbose = False
+            launches = os.path.join("circuits", "nch", "bin_40", "launches.txt")
+
+            family = simulator.iv_vds_curves('nch', bin_number=40, vg_start=0, vg_stop=1.2, vg_step=0.6,
+                                             vd_start=0, vd_stop=1.8, vd_step=0.2)
+            assert family.names == ("VGS", "VDS", "IDS") and not family.metadata["cache_hit"]
+            assert [round(vg, 9) for vg in family.bias.values] == [0.0, 0.6, 1.2]
+            with open(launches) as f:
+                assert len(f.readlines()) == 3
+
+            # Widening the VG range only simulates the new gate voltage.
+            family = simulator.iv_vds_curves('nch', bin_number=40, vg_start=0, vg_stop=1.8, vg_step=0.6,
+                                             vd_start=0, vd_stop=1.8, vd_step=0.2)
+            with open(launches) as f:
+                assert [line.split()[0] for line in f.readlines()[3:]] == ["1.8"]
+            assert family.current.values.shape == (4, 10)
+
+            # Refining the VD step only simulates the interleaved drain points.
+            family = simulator.iv_vds_curves('nch', bin_number=40, vg_start=0, vg_stop=1.8, vg_step=0.6,
+                                             vd_start=0, vd_stop=1.8, vd_step=0.1)
+            with open(launches) as f:
+                new = [line.split() for line in f.readlines()[4:]]
+            assert len(new) == 4 and all(points == "9" for _, points in new)
+            for vg, vd, current in family.curves():
+                np.testing.assert_allclose(current, vg * vd, atol=1e-12)
+
+            # Nothing changed: served entirely from the cache.
+            family = simulator.iv_vds_curves('nch', bin_number=40, vg_start=0, vg_stop=1.8, vg_step=0.6,
+                                             vd_start=0, vd_stop=1.8, vd_step=0.1)
+            assert simulator.last_cache_hit and family.metadata["cache_hit"] and family.ok
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    test_arithmetic_runs()
+    test_planner_only_requests_missing_points()
+    test_incremental_family_resimulation()
+    print("All sweep planner tests passed.")
+
+
+if __name__ == '__main__':
+    main()